@@ -5,8 +5,9 @@ from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, run_sync
 from models_orm import UserORM
+from principal_cache import principal_cache
 
 import os
 SECRET_KEY = os.getenv("SECRET_KEY", "dev_secret_key_local_only")
@@ -54,6 +55,11 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
 
+
+def _load_user_by_username(db: Session, username: str) -> Optional[UserORM]:
+    return db.query(UserORM).filter(UserORM.username == username).first()
+
+
 async def get_current_user(request: Request, db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -82,13 +88,21 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
     except Exception:
         raise credentials_exception
 
-    user = db.query(UserORM).filter(UserORM.username == username).first()
-    if user is None:
-        raise credentials_exception
+    # Fast path: identity columns cached for this session id are merged into the request
+    # session without a query. Otherwise the lookup runs in the DB thread pool so a slow
+    # query doesn't stall the event loop.
+    token_sid = payload.get("sid")
+    cache_key = principal_cache.principal_key(username, token_sid)
+    cached = principal_cache.get_user(cache_key)
+    if cached is not None:
+        user = principal_cache.attach(db, cached)
+    else:
+        user = await run_sync(_load_user_by_username, db, username)
+        if user is None:
+            raise credentials_exception
 
     # Enforce single-session: if the token contains a session ID, it must match
     # the user's current active_session_id (password changes invalidate old sessions)
-    token_sid = payload.get("sid")
     if token_sid and user.active_session_id and token_sid != user.active_session_id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -96,4 +110,6 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    if cached is None:
+        principal_cache.put_user(cache_key, user)
     return user
@@ -15,9 +15,11 @@ from fastapi import Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from database import get_db
 from auth import get_current_user
+from principal_cache import principal_cache
 from models_orm import (
-    UserORM, ClientProfileORM, DataConsentORM, SensitiveDataAccessLogORM
+    UserORM, ClientProfileORM, DataConsentORM
 )
+from service_modules.audit_writer import audit_writer
 
 logger = logging.getLogger("gym_app")
 
@@ -44,10 +46,15 @@ def get_user_gym_id(user: UserORM, db: Session) -> Optional[str]:
     ):
         return user.gym_owner_id
     elif user.role == "client":
+        found, gym_id = principal_cache.get_gym(user.id, "client")
+        if found:
+            return gym_id
         profile = db.query(ClientProfileORM).filter(
             ClientProfileORM.id == user.id
         ).first()
-        return profile.gym_id if profile else None
+        gym_id = profile.gym_id if profile else None
+        principal_cache.put_gym(user.id, "client", gym_id)
+        return gym_id
     return None
 
 
@@ -137,9 +144,12 @@ def log_sensitive_access(
     request: Optional[Request] = None,
     consent_id: Optional[int] = None
 ):
-    """Record an access to sensitive data in the audit log."""
+    """
+    Record an access to sensitive data in the audit log. The entry is queued and
+    written in a batch by the audit writer; the caller's session is not touched.
+    """
     try:
-        log_entry = SensitiveDataAccessLogORM(
+        audit_writer.record(
             accessor_id=accessor.id,
             accessor_role=accessor.role if accessor.sub_role is None else accessor.sub_role,
             client_id=client_id,
@@ -151,14 +161,8 @@ def log_sensitive_access(
             user_agent=(request.headers.get("user-agent", "")[:200]
                         if request else None),
         )
-        db.add(log_entry)
-        db.commit()
     except Exception as e:
         logger.warning(f"Failed to write audit log: {e}")
-        try:
-            db.rollback()
-        except Exception:
-            pass
 
 
 # --- COMBINED AUTHORIZATION ---
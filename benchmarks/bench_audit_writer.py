@@ -0,0 +1,112 @@
+"""
+Benchmark: recording 1,000 / 5,000 sensitive-data accesses from 8 concurrent request threads.
+
+Compares the previous audit log (an INSERT and a COMMIT on the request's session for
+every access) with the buffered audit writer (entries queued, written in multi-row
+INSERTs by the background flusher). Reports the time requests spend recording,
+the total time until everything is on disk, statements and commits, and checks both
+wrote the same entries.
+
+Usage:
+    python benchmarks/bench_audit_writer.py [--sizes 1000 5000] [--threads 8]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import Base
+from models_orm import UserORM, SensitiveDataAccessLogORM
+import service_modules.audit_writer as writer_module
+from service_modules.audit_writer import AuditWriter
+
+
+def entry(i: int) -> dict:
+    return {"accessor_id": "coach", "accessor_role": "trainer", "client_id": f"member-{i % 50}",
+            "resource_type": "weight", "action": "view", "endpoint": "/api/client/{client_id}/weight",
+            "ip_address": "10.0.0.1", "user_agent": "Mozilla/5.0"}
+
+
+# --- Previous implementation ---
+
+def legacy_record(session_factory, i: int):
+    db = session_factory()
+    try:
+        db.add(SensitiveDataAccessLogORM(**entry(i)))
+        db.commit()
+    finally:
+        db.close()
+
+
+def count_queries(engine):
+    counter = {"n": 0, "commits": 0}
+
+    def before(*_):
+        counter["n"] += 1
+
+    def commit(*_):
+        counter["commits"] += 1
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "commit", commit)
+
+    def remove():
+        event.remove(engine, "before_cursor_execute", before)
+        event.remove(engine, "commit", commit)
+    return counter, remove
+
+
+def run(accesses: int, threads: int):
+    line = f"{accesses:5d} accesses"
+    written = []
+    for label in ("previous", "buffered"):
+        engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'audit.db')}", poolclass=NullPool,
+                               connect_args={"check_same_thread": False, "timeout": 60})
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(UserORM.__table__.insert(), [{"id": "coach", "username": "coach", "role": "trainer"}])
+        counter, remove = count_queries(engine)
+
+        async def measure():
+            writer_module.get_db_session = session_factory
+            writer = AuditWriter()
+            if label == "buffered":
+                await writer.start()
+            record = (lambda i: legacy_record(session_factory, i)) if label == "previous" \
+                else (lambda i: writer.record(**entry(i)))
+            loop = asyncio.get_running_loop()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                await asyncio.gather(*(loop.run_in_executor(pool, record, i) for i in range(accesses)))
+            recorded = time.perf_counter() - start
+            await writer.stop()
+            return recorded, time.perf_counter() - start
+
+        recorded, total = asyncio.run(measure())
+        remove()
+        db = session_factory()
+        written.append(sorted((r.client_id, r.endpoint) for r in db.query(SensitiveDataAccessLogORM).all()))
+        db.close()
+        line += (f" | {label} requests {recorded:6.2f} s, all written {total:6.2f} s,"
+                 f" {counter['n']:5d} statements, {counter['commits']:5d} commits")
+    assert written[0] == written[1] and len(written[0]) == accesses
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.threads)
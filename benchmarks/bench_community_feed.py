@@ -0,0 +1,151 @@
+"""
+Benchmark: community feed pages 1..50 of a gym with 100k posts.
+
+Compares the previous get_feed (posts + authors + likes + participation + latest
+comment subquery + comment authors, created_at cursor) with the precomputed
+timeline (one keyset range scan + the viewer's likes), and checks both return the
+same posts. Timestamps are unique here: the old created_at cursor skips posts that
+share one, so the two could not be compared otherwise.
+
+Usage:
+    python benchmarks/bench_community_feed.py [--posts 100000] [--pages 50]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from models_orm import (
+    UserORM, ClientProfileORM, CommunityPostORM, CommunityLikeORM, CommunityCommentORM,
+    CommunityEventParticipantORM,
+)
+import service_modules.community_service as community_module
+from service_modules.community_service import CommunityService
+
+GYM_ID = "gym-owner"
+VIEWER = "member-0"
+
+
+def seed(engine, posts: int, members: int = 500):
+    rng = random.Random(posts)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(UserORM.__table__.insert(), [{"id": GYM_ID, "username": "owner", "role": "owner", "gym_name": "Bench Gym"}]
+                     + [{"id": f"member-{i}", "username": f"member_{i}", "role": "client", "gym_name": None} for i in range(members)])
+        conn.execute(ClientProfileORM.__table__.insert(), [{"id": f"member-{i}", "gym_id": GYM_ID} for i in range(members)])
+        conn.execute(CommunityPostORM.__table__.insert(), [{
+            "id": f"post-{i:06d}", "author_id": f"member-{rng.randrange(members)}", "gym_id": GYM_ID,
+            "scope": rng.choice(["local", "local", "global"]), "post_type": rng.choice(["text", "text", "image", "event"]),
+            "content": f"Post {i}", "is_pinned": False, "is_deleted": rng.random() < 0.02,
+            "like_count": rng.randint(0, 30), "comment_count": 0, "repost_count": 0, "participant_count": 0,
+            "created_at": (start + timedelta(seconds=37 * i)).isoformat(),
+        } for i in range(posts)])
+        conn.execute(CommunityLikeORM.__table__.insert(), [
+            {"post_id": f"post-{i:06d}", "user_id": VIEWER} for i in range(0, posts, 7)
+        ])
+        conn.execute(CommunityCommentORM.__table__.insert(), [{
+            "post_id": f"post-{rng.randrange(posts):06d}", "author_id": f"member-{rng.randrange(members)}",
+            "content": f"Comment {i}", "is_deleted": False,
+        } for i in range(posts // 2)])
+
+
+# --- Previous implementation ---
+
+def legacy_feed(db, user_id, cursor, limit):
+    gym_id = CommunityService()._get_user_gym_id(user_id, db)
+    query = db.query(CommunityPostORM).filter(CommunityPostORM.gym_id == gym_id, CommunityPostORM.is_deleted == False)
+    if cursor:
+        query = query.filter(CommunityPostORM.created_at < cursor)
+    posts = query.order_by(CommunityPostORM.is_pinned.desc(), CommunityPostORM.created_at.desc()).limit(limit + 1).all()
+    has_more = len(posts) > limit
+    posts = posts[:limit]
+    post_ids = [p.id for p in posts]
+
+    authors = {u.id: u for u in db.query(UserORM).filter(UserORM.id.in_({p.author_id for p in posts})).all()}
+    liked_ids = {l.post_id for l in db.query(CommunityLikeORM.post_id).filter(
+        CommunityLikeORM.post_id.in_(post_ids), CommunityLikeORM.user_id == user_id).all()}
+    participating_ids = {p.post_id for p in db.query(CommunityEventParticipantORM.post_id).filter(
+        CommunityEventParticipantORM.post_id.in_(post_ids), CommunityEventParticipantORM.user_id == user_id).all()}
+    sub = db.query(CommunityCommentORM.post_id, func.max(CommunityCommentORM.id).label("max_id")).filter(
+        CommunityCommentORM.post_id.in_(post_ids), CommunityCommentORM.is_deleted == False
+    ).group_by(CommunityCommentORM.post_id).subquery()
+    latest = db.query(CommunityCommentORM).join(sub, CommunityCommentORM.id == sub.c.max_id).all()
+    comment_authors = {u.id: u for u in db.query(UserORM).filter(UserORM.id.in_({c.author_id for c in latest})).all()}
+    first_comments = {c.post_id: {
+        "author_username": comment_authors[c.author_id].username,
+        "author_profile_picture": comment_authors[c.author_id].profile_picture,
+        "content": c.content,
+    } for c in latest}
+
+    service = CommunityService()
+    result = []
+    for p in posts:
+        d = service._post_to_dict(p, authors.get(p.author_id), p.id in liked_ids, p.id in participating_ids)
+        d["first_comment"] = first_comments.get(p.id)
+        result.append(d)
+    return result, posts[-1].created_at if has_more else None
+
+
+def count_queries(engine):
+    counter = {"n": 0}
+
+    def before(*_):
+        counter["n"] += 1
+
+    event.listen(engine, "before_cursor_execute", before)
+    return counter, lambda: event.remove(engine, "before_cursor_execute", before)
+
+
+def run(posts: int, pages: int, limit: int = 20):
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'feed.db')}")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    seed(engine, posts)
+    community_module.get_db_session = session_factory
+    service = CommunityService()
+
+    start = time.perf_counter()
+    service.get_feed(VIEWER, limit=1)
+    print(f"{posts} posts | one-off timeline build {time.perf_counter() - start:6.1f} s")
+
+    counter, stop = count_queries(engine)
+    legacy_pages, cursor = [], None
+    start = time.perf_counter()
+    for _ in range(pages):
+        db = session_factory()
+        page, cursor = legacy_feed(db, VIEWER, cursor, limit)
+        legacy_pages.append(page)
+        db.close()
+    legacy_time, legacy_queries = time.perf_counter() - start, counter["n"]
+
+    counter["n"] = 0
+    timeline_pages, cursor = [], None
+    start = time.perf_counter()
+    for _ in range(pages):
+        page = service.get_feed(VIEWER, cursor=cursor, limit=limit)
+        timeline_pages.append(page["posts"])
+        cursor = page["next_cursor"]
+    timeline_time, timeline_queries = time.perf_counter() - start, counter["n"]
+    stop()
+
+    assert legacy_pages == timeline_pages, "feed mismatch"
+    print(f"pages 1..{pages} | previous {legacy_time * 1000 / pages:7.2f} ms/page {legacy_queries / pages:4.1f} queries"
+          f" | timeline {timeline_time * 1000 / pages:6.2f} ms/page {timeline_queries / pages:4.1f} queries"
+          f" | {legacy_time / timeline_time:5.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--pages", type=int, default=50)
+    args = parser.parse_args()
+    run(args.posts, args.pages)
@@ -0,0 +1,179 @@
+"""
+Benchmark: CRM dashboard (pipeline + at-risk list + retention analytics) for one gym.
+
+Compares the previous per-client implementation (several queries per client) with
+the set-based snapshot query in CRMService, and checks both produce the same output.
+
+Usage:
+    python benchmarks/bench_crm_pipeline.py [--sizes 100 1000 10000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from models_orm import (
+    UserORM, ClientProfileORM, ClientScheduleORM, ClientSubscriptionORM, SubscriptionPlanORM,
+)
+import service_modules.crm_service as crm_module
+from service_modules.crm_service import CRMService
+
+
+def seed(session_factory, gym_id: str, members: int):
+    rng = random.Random(members)
+    today = date.today()
+    db = session_factory()
+    plan = SubscriptionPlanORM(id=str(uuid.uuid4()), gym_id=gym_id, name="Monthly", price=49.0)
+    trainer = UserORM(id=str(uuid.uuid4()), username=f"trainer_{gym_id[:6]}", role="trainer")
+    db.add_all([plan, trainer])
+
+    for i in range(members):
+        client_id = str(uuid.uuid4())
+        created = datetime.utcnow() - timedelta(days=rng.randint(0, 400))
+        last_seen = rng.choice([None, "Today", f"{rng.randint(1, 30)} days ago",
+                                (today - timedelta(days=rng.randint(0, 60))).isoformat()])
+        db.add(UserORM(id=client_id, username=f"member_{i}_{client_id[:6]}", email=f"m{i}@example.com",
+                       role="client", created_at=created.isoformat()))
+        db.add(ClientProfileORM(id=client_id, gym_id=gym_id, trainer_id=trainer.id, last_seen=last_seen,
+                                health_score=rng.randint(0, 100), streak=rng.randint(0, 20)))
+        for _ in range(rng.randint(0, 6)):
+            db.add(ClientScheduleORM(client_id=client_id, type=rng.choice(["workout", "workout", "course"]),
+                                     title="Session", completed=rng.random() < 0.7,
+                                     date=(today - timedelta(days=rng.randint(0, 45))).isoformat()))
+        if rng.random() < 0.8:
+            db.add(ClientSubscriptionORM(id=str(uuid.uuid4()), client_id=client_id, gym_id=gym_id, plan_id=plan.id,
+                                         status=rng.choice(["active", "active", "active", "canceled", "past_due"])))
+    db.commit()
+    db.close()
+
+
+# --- Previous implementation: one client at a time ---
+
+def legacy_days_inactive(client, db, today):
+    last_workout = db.query(ClientScheduleORM).filter(
+        ClientScheduleORM.client_id == client.id,
+        ClientScheduleORM.type == "workout",
+        ClientScheduleORM.completed == True
+    ).order_by(ClientScheduleORM.date.desc()).first()
+    if last_workout and last_workout.date:
+        try:
+            return (today - datetime.fromisoformat(last_workout.date).date()).days
+        except ValueError:
+            pass
+    if client.last_seen:
+        if client.last_seen.lower() == "today":
+            return 0
+        elif "days ago" in client.last_seen.lower():
+            try:
+                return int(client.last_seen.split()[0])
+            except ValueError:
+                pass
+        else:
+            try:
+                return (today - datetime.fromisoformat(client.last_seen.replace('Z', '+00:00')).date()).days
+            except ValueError:
+                pass
+    return 999
+
+
+def legacy_status(client, db, today):
+    subscription = db.query(ClientSubscriptionORM).filter(
+        ClientSubscriptionORM.client_id == client.id,
+        ClientSubscriptionORM.gym_id == client.gym_id
+    ).first()
+    if subscription and subscription.status in ['canceled', 'past_due']:
+        return 'churning'
+    days_inactive = legacy_days_inactive(client, db, today)
+    user = db.query(UserORM).filter(UserORM.id == client.id).first()
+    if user and user.created_at:
+        created = datetime.fromisoformat(user.created_at.replace('Z', '+00:00')).date()
+        if (today - created).days <= 14 and days_inactive <= 7:
+            return 'new'
+    if days_inactive <= 5:
+        return 'active'
+    elif days_inactive <= 14:
+        return 'at_risk'
+    return 'churning'
+
+
+def legacy_dashboard(session_factory, gym_id):
+    db = session_factory()
+    try:
+        today = date.today()
+        clients = db.query(ClientProfileORM).filter(ClientProfileORM.gym_id == gym_id).all()
+        pipeline = {"new": 0, "active": 0, "at_risk": 0, "churning": 0, "total": len(clients)}
+        at_risk_ids = []
+        engaged = 0
+        for client in clients:
+            status = legacy_status(client, db, today)
+            pipeline[status] += 1
+            if status in ("at_risk", "churning"):
+                at_risk_ids.append(client.id)
+        for client in clients:
+            if legacy_days_inactive(client, db, today) <= 7:
+                engaged += 1
+        return pipeline, sorted(at_risk_ids), engaged
+    finally:
+        db.close()
+
+
+def set_based_dashboard(service, gym_id):
+    pipeline = service.get_client_pipeline(gym_id)
+    at_risk = service.get_at_risk_clients(gym_id, limit=10 ** 9)
+    analytics = service.get_retention_analytics(gym_id)
+    return pipeline, sorted(c["id"] for c in at_risk), analytics["active_count"]
+
+
+def count_queries(engine):
+    counter = {"n": 0}
+
+    def before(*_):
+        counter["n"] += 1
+
+    event.listen(engine, "before_cursor_execute", before)
+    return counter, lambda: event.remove(engine, "before_cursor_execute", before)
+
+
+def run(members: int):
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'crm.db')}")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    gym_id = str(uuid.uuid4())
+    seed(session_factory, gym_id, members)
+
+    crm_module.get_db_session = session_factory
+    service = CRMService()
+
+    counter, stop = count_queries(engine)
+    start = time.perf_counter()
+    legacy = legacy_dashboard(session_factory, gym_id)
+    legacy_time, legacy_queries = time.perf_counter() - start, counter["n"]
+
+    counter["n"] = 0
+    start = time.perf_counter()
+    current = set_based_dashboard(service, gym_id)
+    current_time, current_queries = time.perf_counter() - start, counter["n"]
+    stop()
+
+    assert legacy == current, f"output mismatch at {members} members"
+    print(f"{members:>6} members | per-client {legacy_time * 1000:9.1f} ms {legacy_queries:>6} queries"
+          f" | set-based {current_time * 1000:8.1f} ms {current_queries:>3} queries"
+          f" | {legacy_time / current_time:5.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size)
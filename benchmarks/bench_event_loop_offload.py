@@ -0,0 +1,139 @@
+"""
+Benchmark: blocking DB work inline in async handlers vs offloaded with database.run_sync.
+
+Simulates a worker serving a mix of slow DB-bound requests (50 ms query) and
+cheap requests (health check / WebSocket ping). With inline blocking calls every
+cheap request queues behind the slow ones; with run_sync they don't.
+
+The server runs in its own process; on a single-core machine the load generator
+competes with it for CPU, so keep concurrency modest there.
+
+Usage:
+    python benchmarks/bench_event_loop_offload.py [--concurrency 20] [--requests 400]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import subprocess
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from sqlalchemy import create_engine, text
+
+from database import run_sync
+
+SLOW_QUERY_SECONDS = 0.05
+
+bench_engine = create_engine(
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}",
+    connect_args={"check_same_thread": False},
+)
+
+
+def slow_query():
+    """Stand-in for a slow Postgres query: a real round trip plus server-side latency."""
+    with bench_engine.connect() as conn:
+        conn.execute(text("SELECT 1")).scalar()
+        time.sleep(SLOW_QUERY_SECONDS)
+    return {"ok": True}
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/inline")
+    async def inline():
+        return slow_query()
+
+    @app.get("/offloaded")
+    async def offloaded():
+        return await run_sync(slow_query)
+
+    @app.get("/fast")
+    async def fast():
+        return {"ok": True}
+
+    return app
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def start_server():
+    """Serve the app in a separate process (one worker, like a gunicorn process)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port)])
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{base_url}/fast")
+            return process, base_url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("benchmark server did not start")
+
+
+async def run_mode(base_url: str, slow_path: str, concurrency: int, total: int):
+    latencies = {"slow": [], "fast": []}
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def one(i):
+            kind = "slow" if i % 4 == 0 else "fast"
+            path = slow_path if kind == "slow" else "/fast"
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(path)
+                latencies[kind].append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        uvicorn.run(build_app(), host="127.0.0.1", port=args.serve, log_level="warning")
+        return
+
+    process, base_url = start_server()
+    print(f"{args.requests} requests, concurrency {args.concurrency}, 1 in 4 hits a {SLOW_QUERY_SECONDS * 1000:.0f} ms query\n")
+    print(f"{'mode':<12}{'fast p50':>10}{'fast p99':>10}{'slow p99':>10}{'req/s':>10}")
+    for label, path in (("inline", "/inline"), ("run_sync", "/offloaded")):
+        latencies, elapsed = asyncio.run(run_mode(base_url, path, args.concurrency, args.requests))
+        print(
+            f"{label:<12}"
+            f"{statistics.median(latencies['fast']):>9.1f}ms"
+            f"{percentile(latencies['fast'], 99):>9.1f}ms"
+            f"{percentile(latencies['slow'], 99):>9.1f}ms"
+            f"{args.requests / elapsed:>10.0f}"
+        )
+    process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: GDPR export peak memory for members with 10k / 100k / 300k history rows.
+
+Compares the previous export (every section loaded with .all() and returned as one
+json.dumps string) with the streamed NDJSON-in-ZIP export, measuring peak Python
+memory with tracemalloc, and checks both export the same rows.
+
+Usage:
+    python benchmarks/bench_gdpr_export.py [--sizes 10000 100000 300000]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from models_orm import UserORM, ClientExerciseLogORM, ClientDietLogORM, MessageORM
+from service_modules.gdpr_export_service import EXPORT_SECTIONS, write_export
+
+USER = "member-0"
+
+
+def seed(engine, rows: int):
+    with engine.begin() as conn:
+        conn.execute(UserORM.__table__.insert(), [{"id": USER, "username": "member_0", "role": "client",
+                                                   "hashed_password": "x"}])
+        conn.execute(ClientExerciseLogORM.__table__.insert(), [{
+            "client_id": USER, "date": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}", "exercise_name": "Bench press",
+            "set_number": i % 5 + 1, "reps": 8, "weight": 60.0 + i % 20, "metric_type": "weight_reps",
+        } for i in range(rows // 2)])
+        conn.execute(ClientDietLogORM.__table__.insert(), [{
+            "client_id": USER, "date": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}", "meal_type": "pranzo",
+            "meal_name": f"Meal {i}", "calories": 600, "time": "13:00",
+        } for i in range(rows // 4)])
+        conn.execute(MessageORM.__table__.insert(), [{
+            "id": f"msg-{i}", "conversation_id": "conv", "sender_id": USER, "sender_role": "client",
+            "content": f"Message number {i} about tomorrow's workout", "is_read": True,
+        } for i in range(rows - rows // 2 - rows // 4)])
+
+
+# --- Previous implementation ---
+
+def legacy_export(db, user_id) -> str:
+    def rows_to_list(rows):
+        return [{c.name: getattr(r, c.name) for c in r.__table__.columns if c.name != "hashed_password"} for r in rows]
+
+    data = {"export_date": "now"}
+    for section, model, criterion in EXPORT_SECTIONS:
+        data[section] = rows_to_list(db.query(model).filter(criterion(user_id)).all())
+    return json.dumps(data, indent=2, default=str)
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+
+def run(rows: int):
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'export.db')}")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    seed(engine, rows)
+
+    def previous():
+        db = session_factory()
+        try:
+            return legacy_export(db, USER)
+        finally:
+            db.close()
+
+    path = os.path.join(tempfile.mkdtemp(), "export.zip")
+
+    def streamed():
+        db = session_factory()
+        try:
+            with open(path, "wb") as f:
+                return write_export(db, USER, f)
+        finally:
+            db.close()
+
+    legacy, legacy_s, legacy_mb = measure(previous)
+    counts, streamed_s, streamed_mb = measure(streamed)
+
+    legacy = json.loads(legacy)
+    with zipfile.ZipFile(path) as archive:
+        for section, _, _ in EXPORT_SECTIONS:
+            lines = io.TextIOWrapper(archive.open(f"{section}.ndjson")).read().splitlines()
+            assert [json.loads(line) for line in lines] == json.loads(json.dumps(legacy[section], default=str)), section
+    print(f"{rows:7d} rows | previous {legacy_s:6.2f} s peak {legacy_mb:7.1f} MB"
+          f" | streamed {streamed_s:6.2f} s peak {streamed_mb:5.1f} MB, {os.path.getsize(path) / 1024 / 1024:5.1f} MB zip")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 300000])
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size)
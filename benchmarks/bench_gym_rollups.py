@@ -0,0 +1,201 @@
+"""
+Benchmark: owner dashboard and 12-month revenue chart for a gym with 2,000 / 20,000 members.
+
+Compares the previous dashboard (every load scans the gym's subscriptions, client
+profiles and this month's appointments, and a 12-month chart repeats the appointment
+and payment sums once per month) with the per-gym daily rollups (today's snapshot plus
+a sum over this month's rows; the chart groups at most ~365 rows). Reports the time per
+dashboard / chart load and the statements run, and checks both give the same figures.
+
+Usage:
+    python benchmarks/bench_gym_rollups.py [--sizes 2000 20000] [--loads 20]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import Base
+from models_orm import (
+    UserORM, ClientProfileORM, SubscriptionPlanORM, ClientSubscriptionORM, AppointmentORM,
+    NutritionistAppointmentORM, CheckInORM, PaymentORM,
+)
+import services as services_module
+import service_modules.gym_rollups as rollups_module
+from services import UserService
+
+GYM = "gym"
+STAFF = ["trainer", "staff", "nutritionist"]
+
+
+def month_starts(months: int):
+    first = date.today().replace(day=1)
+    starts = [first]
+    for _ in range(months - 1):
+        starts.insert(0, (starts[0] - timedelta(days=1)).replace(day=1))
+    return [(s.isoformat(), (s.replace(day=28) + timedelta(days=4)).replace(day=1).isoformat()) for s in starts]
+
+
+# --- Previous implementation ---
+
+def legacy_dashboard(db) -> dict:
+    staff_ids = [s[0] for s in db.query(UserORM.id).filter(UserORM.gym_owner_id == GYM, UserORM.role.in_(STAFF))]
+    active_members = db.query(ClientProfileORM).filter(ClientProfileORM.gym_id == GYM).count()
+
+    subscription_revenue, active_subscriptions, by_plan = 0.0, 0, {}
+    for sub, plan in db.query(ClientSubscriptionORM, SubscriptionPlanORM).join(
+        SubscriptionPlanORM, ClientSubscriptionORM.plan_id == SubscriptionPlanORM.id
+    ).filter(ClientSubscriptionORM.status.in_(["active", "trialing"]), ClientSubscriptionORM.gym_id == GYM):
+        monthly = plan.price / 12 if plan.billing_interval == "year" else plan.price
+        active_subscriptions += 1
+        subscription_revenue += monthly
+        by_plan[plan.name] = by_plan.get(plan.name, 0.0) + monthly
+
+    month_start, month_end = month_starts(1)[0]
+    appt = db.query(func.coalesce(func.sum(AppointmentORM.price), 0), func.count(AppointmentORM.id)).filter(
+        AppointmentORM.date >= month_start, AppointmentORM.date < month_end,
+        AppointmentORM.payment_status == "paid", AppointmentORM.trainer_id.in_(staff_ids)).first()
+    nutr = db.query(func.coalesce(func.sum(NutritionistAppointmentORM.price), 0),
+                    func.count(NutritionistAppointmentORM.id)).filter(
+        NutritionistAppointmentORM.date >= month_start, NutritionistAppointmentORM.date < month_end,
+        NutritionistAppointmentORM.payment_status == "paid",
+        NutritionistAppointmentORM.nutritionist_id.in_(staff_ids)).first()
+    return {"members": active_members, "subscriptions": active_subscriptions,
+            "subscription_revenue": round(subscription_revenue, 2),
+            "plans": {name: round(revenue, 2) for name, revenue in by_plan.items()},
+            "appointments": (round(float(appt[0]), 2), int(appt[1])),
+            "nutrition": (round(float(nutr[0]), 2), int(nutr[1]))}
+
+
+def legacy_history(db, months: int) -> list:
+    staff_ids = [s[0] for s in db.query(UserORM.id).filter(UserORM.gym_owner_id == GYM, UserORM.role.in_(STAFF))]
+    history = []
+    for start, end in month_starts(months):
+        appt = db.query(func.coalesce(func.sum(AppointmentORM.price), 0)).filter(
+            AppointmentORM.date >= start, AppointmentORM.date < end,
+            AppointmentORM.payment_status == "paid", AppointmentORM.trainer_id.in_(staff_ids)).scalar()
+        payments = db.query(func.coalesce(func.sum(PaymentORM.amount), 0)).filter(
+            PaymentORM.gym_id == GYM, PaymentORM.status == "succeeded",
+            func.coalesce(PaymentORM.paid_at, PaymentORM.created_at) >= start,
+            func.coalesce(PaymentORM.paid_at, PaymentORM.created_at) < end).scalar()
+        history.append((start[:7], round(float(appt), 2), round(float(payments), 2)))
+    return history
+
+
+# --- Rollups ---
+
+def rollup_dashboard() -> dict:
+    data = UserService().get_owner(GYM)
+    return {"members": data.active_members, "subscriptions": data.active_subscriptions,
+            "subscription_revenue": data.subscription_revenue,
+            "plans": {p["name"]: p["revenue"] for p in data.revenue_by_plan},
+            "appointments": (data.appointment_revenue, data.appointment_count),
+            "nutrition": (data.nutrition_appointment_revenue, data.nutrition_appointment_count)}
+
+
+def rollup_history(months: int) -> list:
+    return [(m["month"], round(m["appointment_revenue"], 2), round(m["subscription_payments"], 2))
+            for m in UserService().get_owner_history(GYM, months)]
+
+
+def seed(engine, members: int):
+    rng = random.Random(7)
+    now = datetime.now()
+    staff = [{"id": f"coach-{i}", "username": f"coach_{i}", "role": "trainer", "gym_owner_id": GYM} for i in range(8)]
+    staff.append({"id": "dietitian", "username": "dietitian", "role": "nutritionist", "gym_owner_id": GYM})
+
+    def when(days):
+        return (now - timedelta(days=rng.randrange(days), minutes=rng.randrange(1440))).isoformat()
+
+    with engine.begin() as conn:
+        conn.execute(UserORM.__table__.insert(), [{"id": GYM, "username": "owner", "role": "owner"}] + staff)
+        conn.execute(SubscriptionPlanORM.__table__.insert(), [
+            {"id": "base", "gym_id": GYM, "name": "Base", "price": 49.0, "currency": "eur", "billing_interval": "month"},
+            {"id": "plus", "gym_id": GYM, "name": "Plus", "price": 79.0, "currency": "eur", "billing_interval": "month"},
+            {"id": "year", "gym_id": GYM, "name": "Annuale", "price": 540.0, "currency": "eur", "billing_interval": "year"},
+        ])
+        conn.execute(UserORM.__table__.insert(), [
+            {"id": f"m{i}", "username": f"member_{i}", "role": "client", "created_at": when(700)} for i in range(members)])
+        conn.execute(ClientProfileORM.__table__.insert(), [{"id": f"m{i}", "gym_id": GYM} for i in range(members)])
+        conn.execute(ClientSubscriptionORM.__table__.insert(), [
+            {"id": f"s{i}", "client_id": f"m{i}", "gym_id": GYM, "plan_id": rng.choice(["base", "plus", "year"]),
+             "status": rng.choice(["active"] * 8 + ["canceled", "past_due"])} for i in range(members)])
+        conn.execute(PaymentORM.__table__.insert(), [
+            {"id": f"p{i}", "client_id": f"m{i % members}", "gym_id": GYM, "amount": 49.0, "status": "succeeded",
+             "paid_at": when(400)} for i in range(members * 6)])
+        conn.execute(AppointmentORM.__table__.insert(), [
+            {"id": f"a{i}", "trainer_id": f"coach-{i % 8}", "client_id": f"m{i % members}",
+             "date": when(400)[:10], "start_time": "10:00", "end_time": "11:00", "price": 40.0,
+             "payment_status": rng.choice(["paid", "paid", "pending"])} for i in range(members * 2)])
+        conn.execute(NutritionistAppointmentORM.__table__.insert(), [
+            {"id": f"n{i}", "nutritionist_id": "dietitian", "client_id": f"m{i % members}",
+             "date": when(400)[:10], "start_time": "10:00", "end_time": "11:00", "price": 60.0,
+             "payment_status": "paid"} for i in range(members // 4)])
+        conn.execute(CheckInORM.__table__.insert(), [
+            {"member_id": f"m{i % members}", "gym_owner_id": GYM, "checked_in_at": when(400)} for i in range(members * 10)])
+
+
+def timed(fn, loads: int, engine):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    start = time.perf_counter()
+    for _ in range(loads):
+        result = fn()
+    elapsed = (time.perf_counter() - start) / loads
+    event.remove(engine, "before_cursor_execute", listener)
+    return result, elapsed, len(statements) // loads
+
+
+def run(members: int, loads: int):
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'rollups.db')}", poolclass=NullPool,
+                           connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    services_module.get_db_session = session_factory
+    rollups_module.get_db_session = session_factory
+    seed(engine, members)
+
+    start = time.perf_counter()
+    rollups_module.reconcile_rollups(rollups_module.ROLLUP_BACKFILL_DAYS)
+    backfill = time.perf_counter() - start
+
+    def with_session(fn):
+        def call():
+            db = session_factory()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+        return call
+
+    old_dash, old_dash_t, old_dash_q = timed(with_session(legacy_dashboard), loads, engine)
+    new_dash, new_dash_t, new_dash_q = timed(rollup_dashboard, loads, engine)
+    old_hist, old_hist_t, old_hist_q = timed(with_session(lambda db: legacy_history(db, 12)), loads, engine)
+    new_hist, new_hist_t, new_hist_q = timed(lambda: rollup_history(12), loads, engine)
+    assert old_dash == new_dash, (old_dash, new_dash)
+    assert old_hist == new_hist, (old_hist, new_hist)
+
+    print(f"{members:6d} members | backfill {backfill:5.2f} s"
+          f" | dashboard previous {old_dash_t * 1000:7.1f} ms ({old_dash_q} statements),"
+          f" rollups {new_dash_t * 1000:6.1f} ms ({new_dash_q})"
+          f" | 12-month chart previous {old_hist_t * 1000:7.1f} ms ({old_hist_q}),"
+          f" rollups {new_hist_t * 1000:6.1f} ms ({new_hist_q})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2000, 20000])
+    parser.add_argument("--loads", type=int, default=20)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.loads)
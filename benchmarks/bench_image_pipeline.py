@@ -0,0 +1,107 @@
+"""
+Benchmark: image upload processing, before and after the CPU-pool pipeline.
+
+"inline" is the previous path: upload_helper._optimize_image called directly in the
+async handler (one JPEG, event loop blocked for the whole decode/resize/encode).
+"pool" is cpu_tasks.process_image via run_cpu: draft-mode decode, thumb/feed/full
+variants in WebP and JPEG, computed in the process pool.
+
+Each run pushes --uploads synthetic 12MP phone photos through --concurrency
+simultaneous handlers while a 10 ms heartbeat measures how long the event loop
+stalls. Storage is not included. Throughput is reported per core used.
+
+Usage:
+    python benchmarks/bench_image_pipeline.py [--uploads 40] [--concurrency 4] [--size avatar|physique|chat]
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'images.db')}"
+
+from PIL import Image
+
+from cpu_tasks import CPU_POOL_WORKERS, get_cpu_pool, process_image, run_cpu, shutdown_cpu_pool
+from service_modules.upload_helper import _optimize_image
+
+SIZES = {
+    "avatar": ((400, 400), True),
+    "physique": ((1200, 1600), False),
+    "chat": ((1200, 1200), False),
+}
+
+
+def phone_photo() -> bytes:
+    """4032x3024 JPEG with gradients and noise, roughly like a camera photo (~2-4 MB)."""
+    w, h = 4032, 3024
+    r = Image.linear_gradient("L").resize((w, h))
+    g = Image.radial_gradient("L").resize((w, h))
+    b = Image.effect_noise((w, h), 48)
+    buf = io.BytesIO()
+    Image.merge("RGB", (r, g, b)).save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
+
+async def run(handler, photos, concurrency):
+    lag = {"max": 0.0}
+    done = asyncio.Event()
+
+    async def heartbeat():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag["max"] = max(lag["max"], time.perf_counter() - start - 0.01)
+
+    queue = list(photos)
+
+    async def client():
+        while queue:
+            await handler(queue.pop())
+
+    beat = asyncio.create_task(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await beat
+    return elapsed, lag["max"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--size", choices=sorted(SIZES), default="physique")
+    args = parser.parse_args()
+
+    max_size, crop = SIZES[args.size]
+    photo = phone_photo()
+    photos = [photo] * args.uploads
+
+    async def inline(content):
+        _optimize_image(content, max_size=max_size, crop_square=crop)
+
+    async def pool(content):
+        await run_cpu(process_image, content, max_size, crop)
+
+    # Start the pool processes outside the timed run
+    get_cpu_pool().submit(process_image, photo, max_size, crop).result()
+
+    print(f"{args.uploads} uploads of a {len(photo) / 1e6:.1f} MB 12MP JPEG, {args.size} {max_size}, "
+          f"concurrency {args.concurrency}, {CPU_POOL_WORKERS} pool workers")
+    for label, handler, cores, outputs in (("inline", inline, 1, "1 JPEG"),
+                                           ("pool", pool, CPU_POOL_WORKERS, "3 sizes x WebP+JPEG")):
+        elapsed, max_lag = asyncio.run(run(handler, photos, args.concurrency))
+        rate = args.uploads / elapsed
+        print(f"  {label:<7} {rate:7.2f} uploads/s  {rate / cores:7.2f} per core  "
+              f"max loop stall {max_lag * 1000:8.1f} ms  ({outputs})")
+    shutdown_cpu_pool()
+
+
+if __name__ == "__main__":
+    main()
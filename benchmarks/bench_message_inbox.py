@@ -0,0 +1,182 @@
+"""
+Benchmark: conversation inbox and unread badge at 10 / 100 / 1,000 conversations.
+
+Compares the previous get_conversations (a user and a profile query per
+conversation) and get_unread_count (every conversation row loaded and summed in
+Python) with the joined inbox query and the maintained per-user unread total, and
+checks both return the same results. Each size seeds a trainer with that many
+clients, and a client with half trainer and half client-client conversations.
+
+Usage:
+    python benchmarks/bench_message_inbox.py [--sizes 10 100 1000] [--repeat 50]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from models_orm import UserORM, ClientProfileORM, ConversationORM
+import service_modules.message_service as message_module
+from service_modules.message_service import MessageService
+
+TRAINER = "trainer-0"
+CLIENT = "client-0"
+
+
+def seed(engine, conversations: int):
+    rng = random.Random(conversations)
+    start = datetime(2026, 1, 1)
+    stamps = iter(range(10 * conversations))
+
+    def conversation(i, **fields):
+        stamp = start + timedelta(seconds=next(stamps))
+        return {"id": f"conv-{i}", "trainer_id": None, "client_id": None, "user1_id": None, "user2_id": None,
+                "conversation_type": "trainer_client", "last_message_at": stamp.isoformat(),
+                "last_message_preview": f"Message {i}", "trainer_unread_count": rng.randint(0, 5),
+                "client_unread_count": rng.randint(0, 5), "user1_unread_count": rng.randint(0, 5),
+                "user2_unread_count": rng.randint(0, 5), "created_at": start.isoformat(), **fields}
+
+    users, profiles, rows = [], [], []
+    for i in range(conversations):
+        users.append({"id": f"trainer-{i}", "username": f"coach_{i}", "role": "trainer"})
+        users.append({"id": f"client-{i}", "username": f"member_{i}", "role": "client"})
+        profiles.append({"id": f"client-{i}", "name": f"Member {i}" if i % 3 else None})
+    # The trainer's inbox
+    for i in range(conversations):
+        rows.append(conversation(len(rows), trainer_id=TRAINER, client_id=f"client-{i}"))
+    # The client's inbox: half with trainers, half with other clients
+    for i in range(1, conversations // 2 + 1):
+        rows.append(conversation(len(rows), trainer_id=f"trainer-{i}", client_id=CLIENT))
+    for i in range(1, conversations - conversations // 2 + 1):
+        user1, user2 = sorted([CLIENT, f"client-{i}"])
+        rows.append(conversation(len(rows), conversation_type="client_client", user1_id=user1, user2_id=user2))
+    with engine.begin() as conn:
+        conn.execute(UserORM.__table__.insert(), users)
+        conn.execute(ClientProfileORM.__table__.insert(), profiles)
+        conn.execute(ConversationORM.__table__.insert(), rows)
+
+
+# --- Previous implementation ---
+
+def legacy_conversations(db, user_id):
+    user = db.query(UserORM).filter(UserORM.id == user_id).first()
+    result = []
+
+    def add(conv, other_id, other_user, display_name, unread):
+        result.append({
+            "id": conv.id,
+            "other_user_id": other_id,
+            "other_user_name": display_name,
+            "other_user_role": other_user.role if other_user else "unknown",
+            "other_user_profile_picture": other_user.profile_picture if other_user else None,
+            "last_message_preview": conv.last_message_preview,
+            "last_message_at": conv.last_message_at,
+            "unread_count": unread,
+            "created_at": conv.created_at
+        })
+
+    if user.role in ("trainer", "staff", "owner"):
+        for conv in db.query(ConversationORM).filter(ConversationORM.trainer_id == user_id).order_by(
+                ConversationORM.last_message_at.desc()).all():
+            other_user = db.query(UserORM).filter(UserORM.id == conv.client_id).first()
+            other_profile = db.query(ClientProfileORM).filter(ClientProfileORM.id == conv.client_id).first()
+            name = (other_profile.name if other_profile and other_profile.name else None) or (other_user.username if other_user else "Unknown")
+            add(conv, conv.client_id, other_user, name, conv.trainer_unread_count or 0)
+    else:
+        for conv in db.query(ConversationORM).filter(ConversationORM.client_id == user_id,
+                                                     ConversationORM.conversation_type == "trainer_client").all():
+            other_user = db.query(UserORM).filter(UserORM.id == conv.trainer_id).first()
+            add(conv, conv.trainer_id, other_user, other_user.username if other_user else "Unknown", conv.client_unread_count or 0)
+        for conv in db.query(ConversationORM).filter(
+                ((ConversationORM.user1_id == user_id) | (ConversationORM.user2_id == user_id)),
+                ConversationORM.conversation_type == "client_client").all():
+            other_id = conv.user2_id if conv.user1_id == user_id else conv.user1_id
+            other_user = db.query(UserORM).filter(UserORM.id == other_id).first()
+            other_profile = db.query(ClientProfileORM).filter(ClientProfileORM.id == other_id).first()
+            unread = (conv.user1_unread_count if conv.user1_id == user_id else conv.user2_unread_count) or 0
+            name = (other_profile.name if other_profile and other_profile.name else None) or (other_user.username if other_user else "Unknown")
+            add(conv, other_id, other_user, name, unread)
+    result.sort(key=lambda x: x["last_message_at"] or "", reverse=True)
+    return result
+
+
+def legacy_unread_count(db, user_id):
+    user = db.query(UserORM).filter(UserORM.id == user_id).first()
+    if user.role in ("trainer", "staff", "owner"):
+        return sum(c.trainer_unread_count or 0 for c in db.query(ConversationORM).filter(ConversationORM.trainer_id == user_id).all())
+    total = sum(c.client_unread_count or 0 for c in db.query(ConversationORM).filter(ConversationORM.client_id == user_id).all())
+    for conv in db.query(ConversationORM).filter(
+            ((ConversationORM.user1_id == user_id) | (ConversationORM.user2_id == user_id)),
+            ConversationORM.conversation_type == "client_client").all():
+        total += (conv.user1_unread_count if conv.user1_id == user_id else conv.user2_unread_count) or 0
+    return total
+
+
+def count_queries(engine):
+    counter = {"n": 0}
+
+    def before(*_):
+        counter["n"] += 1
+
+    event.listen(engine, "before_cursor_execute", before)
+    return counter, lambda: event.remove(engine, "before_cursor_execute", before)
+
+
+def timed(engine, func, repeat):
+    counter, stop = count_queries(engine)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = time.perf_counter() - start
+    stop()
+    return result, elapsed * 1000 / repeat, counter["n"] / repeat
+
+
+def run(conversations: int, repeat: int):
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'inbox.db')}")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    seed(engine, conversations)
+    message_module.get_db_session = session_factory
+    service = MessageService()
+
+    def legacy(func, user_id):
+        def call():
+            db = session_factory()
+            try:
+                return func(db, user_id)
+            finally:
+                db.close()
+        return call
+
+    for user_id in (TRAINER, CLIENT):
+        service.get_unread_count(user_id)  # creates the total row once
+        old, old_ms, old_q = timed(engine, legacy(legacy_conversations, user_id), repeat)
+        new, new_ms, new_q = timed(engine, lambda: service.get_conversations(user_id), repeat)
+        assert old == new, "inbox mismatch"
+        print(f"{conversations:5d} conversations | {user_id:9s} inbox  | previous {old_ms:7.2f} ms {old_q:6.1f} queries"
+              f" | joined {new_ms:6.2f} ms {new_q:4.1f} queries | {old_ms / new_ms:5.1f}x")
+
+        old, old_ms, old_q = timed(engine, legacy(legacy_unread_count, user_id), repeat)
+        new, new_ms, new_q = timed(engine, lambda: service.get_unread_count(user_id), repeat)
+        assert old == new, "unread count mismatch"
+        print(f"{conversations:5d} conversations | {user_id:9s} badge  | previous {old_ms:7.2f} ms {old_q:6.1f} queries"
+              f" | total  {new_ms:6.2f} ms {new_q:4.1f} queries | {old_ms / new_ms:5.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.repeat)
@@ -0,0 +1,91 @@
+"""
+Benchmark: delivering 50 / 200 / 1000 automated-campaign emails through a local SMTP stand-in.
+
+Compares the previous delivery (a new connection, STARTTLS and login for every
+message, sent one after another) with the pooled session path (send_many without the
+queue) and the background email queue (SMTP_SENDERS sessions in parallel). --latency
+adds a delay before every server reply to simulate the round trip to a real provider.
+Reports time, sessions opened and logins, and checks every path delivered every message.
+
+Usage:
+    python benchmarks/bench_smtp_delivery.py [--sizes 50 200 1000] [--latency 0.005] [--senders 4]
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+import service_modules.email_service as email_module
+import service_modules.smtp_delivery as delivery_module
+from service_modules.email_service import EmailService
+from service_modules.message_dispatch_service import BRANDED_EMAIL
+from service_modules.smtp_delivery import EmailQueue, SmtpPool
+from smtp_standin import SmtpStandin
+
+
+def campaign(count: int):
+    return [(f"member{i}@example.com", "Ci manchi!",
+             BRANDED_EMAIL.substitute(gym_name="Iron Temple", message=f"Ciao member {i}, torna in palestra!"))
+            for i in range(count)]
+
+
+# --- Previous implementation ---
+
+def legacy_send(service: EmailService, to_email: str, subject: str, html_body: str) -> bool:
+    try:
+        message = service.build_message(to_email, subject, html_body)
+        with smtplib.SMTP(service.smtp_host, service.smtp_port) as server:
+            server.starttls(context=email_module._tls_context())
+            server.login(service.smtp_user, service.smtp_password)
+            server.sendmail(service.from_email, to_email, message)
+        return True
+    except Exception:
+        return False
+
+
+def run(count: int, latency: float, senders: int):
+    emails = campaign(count)
+    line = f"{count:5d} emails"
+    for label in ("previous", "pooled", "queued"):
+        standin = SmtpStandin(latency=latency, password="gym-secret").start()
+        email_module._tls_context = standin.client_context
+        delivery_module.email_queue = EmailQueue(SmtpPool(), senders=senders)
+        service = EmailService(smtp_host="127.0.0.1", smtp_port=standin.port, smtp_user="gym@example.com",
+                               smtp_password="gym-secret", from_name="Iron Temple")
+        start = time.perf_counter()
+        if label == "previous":
+            results = [legacy_send(service, *e) for e in emails]
+        elif label == "pooled":
+            results = service.send_many(emails)
+        else:
+            async def queued():
+                await delivery_module.email_queue.start()
+                try:
+                    return await asyncio.to_thread(service.send_many, emails)
+                finally:
+                    await delivery_module.email_queue.stop()
+            results = asyncio.run(queued())
+        elapsed = time.perf_counter() - start
+        delivery_module.email_queue.pool.close_all()
+        standin.stop()
+
+        assert results == [True] * count, label
+        assert sorted(m["to"][0] for m in standin.received) == sorted(e[0] for e in emails), label
+        line += (f" | {label} {elapsed:6.2f} s, {standin.stats['connections']:4d} sessions,"
+                 f" {standin.stats['logins']:4d} logins")
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds before every stand-in reply")
+    parser.add_argument("--senders", type=int, default=delivery_module.SMTP_SENDERS)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.latency, args.senders)
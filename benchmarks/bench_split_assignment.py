@@ -0,0 +1,141 @@
+"""
+Benchmark: assigning a weekly split to 1 / 20 / 100 clients over 4 and 12 weeks.
+
+Compares the previous assign_split (per day: a query for the workout, a delete of the
+day, an insert and a commit; called once per client) with the bulk materialiser (one
+assignment for the whole group: workouts and existing rows prefetched, one DELETE and
+one multi-row INSERT per batch, one commit). Also times re-assigning the same split,
+which the materialiser turns into a no-op. Checks both leave the same calendars.
+
+Usage:
+    python benchmarks/bench_split_assignment.py [--clients 1 20 100] [--days 28 84]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import Base
+from models_orm import UserORM, ClientProfileORM, ClientScheduleORM, WeeklySplitORM, WorkoutORM
+from service_modules.split_service import SplitService
+
+split_module = sys.modules["service_modules.split_service"]
+
+TRAINER = "coach"
+START = date(2030, 1, 7)
+SCHEDULE = {"1": "push", "2": "pull", "3": "legs", "4": "rest", "5": "push", "6": "pull", "7": "rest"}
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+# --- Previous implementation (the client path) ---
+
+def legacy_assign(db, client_id: str, days: int):
+    schedule = {DAY_NAMES[int(k) - 1]: v for k, v in SCHEDULE.items()}
+    for offset in range(days):
+        current = START + timedelta(days=offset)
+        workout_id = schedule.get(DAY_NAMES[current.weekday()])
+        if not workout_id or workout_id == "rest":
+            continue
+        workout = db.query(WorkoutORM).filter(WorkoutORM.id == workout_id).first()
+        db.query(ClientScheduleORM).filter(
+            ClientScheduleORM.client_id == client_id, ClientScheduleORM.date == current.isoformat()
+        ).delete(synchronize_session=False)
+        db.add(ClientScheduleORM(client_id=client_id, date=current.isoformat(), title=workout.title, type="workout",
+                                 completed=False, workout_id=workout_id, details=workout.difficulty))
+        db.commit()
+    profile = db.query(ClientProfileORM).filter(ClientProfileORM.id == client_id).first()
+    profile.current_split_id = "ppl"
+    profile.split_expiry_date = (START + timedelta(days=days - 1)).isoformat()
+    db.commit()
+
+
+def seed(engine, clients: int):
+    with engine.begin() as conn:
+        conn.execute(UserORM.__table__.insert(), [{"id": TRAINER, "username": "coach", "role": "trainer"}] + [
+            {"id": f"m{i}", "username": f"member_{i}", "role": "client"} for i in range(clients)])
+        conn.execute(ClientProfileORM.__table__.insert(), [
+            {"id": f"m{i}", "trainer_id": TRAINER} for i in range(clients)])
+        conn.execute(WorkoutORM.__table__.insert(), [
+            {"id": w, "title": w.title(), "difficulty": "Medium", "owner_id": TRAINER} for w in ("push", "pull", "legs")])
+        conn.execute(WeeklySplitORM.__table__.insert(), [
+            {"id": "ppl", "name": "PPL", "owner_id": TRAINER, "schedule_json": json.dumps(SCHEDULE)}])
+        # Some clients already have a few workouts in the period
+        conn.execute(ClientScheduleORM.__table__.insert(), [
+            {"client_id": f"m{i}", "date": (START + timedelta(days=d)).isoformat(), "title": "Old", "type": "workout"}
+            for i in range(0, clients, 2) for d in range(0, 28, 4)])
+
+
+def calendars(session_factory):
+    db = session_factory()
+    try:
+        return sorted((r.client_id, r.date, r.title, r.workout_id, r.details, r.completed)
+                      for r in db.query(ClientScheduleORM).all())
+    finally:
+        db.close()
+
+
+def timed(fn, engine):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    event.remove(engine, "before_cursor_execute", listener)
+    return elapsed, len(statements)
+
+
+def run(clients: int, days: int):
+    results = []
+    for variant in ("legacy", "bulk"):
+        engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'splits.db')}", poolclass=NullPool,
+                               connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        split_module.get_db_session = session_factory
+        seed(engine, clients)
+        ids = [f"m{i}" for i in range(clients)]
+
+        if variant == "legacy":
+            def assign():
+                db = session_factory()
+                try:
+                    for client_id in ids:
+                        legacy_assign(db, client_id, days)
+                finally:
+                    db.close()
+        else:
+            def assign():
+                SplitService().assign_split({"client_ids": ids, "split_id": "ppl", "start_date": START.isoformat(),
+                                             "days": days}, TRAINER)
+
+        first = timed(assign, engine)
+        again = timed(assign, engine)
+        results.append((first, again, calendars(session_factory)))
+
+    (old_t, old_q), (old_again_t, _), old_rows = results[0]
+    (new_t, new_q), (new_again_t, new_again_q), new_rows = results[1]
+    assert old_rows == new_rows
+    print(f"{clients:4d} clients x {days:3d} days, {len(new_rows):5d} rows"
+          f" | previous {old_t * 1000:8.1f} ms, {old_q:5d} statements, again {old_again_t * 1000:8.1f} ms"
+          f" | bulk {new_t * 1000:6.1f} ms, {new_q:3d} statements, again {new_again_t * 1000:6.1f} ms"
+          f" ({new_again_q} statements)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 20, 100])
+    parser.add_argument("--days", type=int, nargs="+", default=[28, 84])
+    args = parser.parse_args()
+    for size in args.clients:
+        for horizon in args.days:
+            run(size, horizon)
@@ -0,0 +1,176 @@
+"""
+Benchmark: trainer dashboard for a trainer with 2 years of calendar and 20 / 80 / 200 clients.
+
+Compares the previous get_trainer (every schedule row the trainer ever had, five
+queries per client, one query per day of streak) with the windowed dashboard (120-day
+calendar window, client status from grouped queries, streak from one query), and a
+calendar refresh by delta sync after one edit. Reports time, statements and payload
+size, and checks both give the same clients and streak.
+
+Usage:
+    python benchmarks/bench_trainer_dashboard.py [--clients 20 80 200] [--loads 10]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import Base
+from models_orm import (
+    UserORM, ClientProfileORM, ClientScheduleORM, ClientDietSettingsORM, TrainerScheduleORM, WeeklySplitORM,
+)
+import services as services_module
+import service_modules.schedule_sync as sync_module
+from service_modules.schedule_sync import get_schedule, schedule_window
+from services import UserService
+
+TRAINER = "coach"
+
+
+# --- Previous implementation (the parts that scale) ---
+
+def legacy_dashboard(db) -> dict:
+    today = date.today()
+    schedule = [{"id": str(s.id), "date": s.date, "time": s.time, "title": s.title, "subtitle": s.subtitle or "",
+                 "type": s.type, "duration": s.duration or 60, "completed": s.completed, "course_id": s.course_id}
+                for s in db.query(TrainerScheduleORM).filter(TrainerScheduleORM.trainer_id == TRAINER).all()]
+    clients = []
+    for c in db.query(UserORM).join(ClientProfileORM, UserORM.id == ClientProfileORM.id).filter(
+        UserORM.role == "client", ClientProfileORM.trainer_id == TRAINER
+    ).all():
+        profile = db.query(ClientProfileORM).filter(ClientProfileORM.id == c.id).first()
+        last = db.query(ClientScheduleORM).filter(
+            ClientScheduleORM.client_id == c.id, ClientScheduleORM.type == "workout", ClientScheduleORM.completed == True
+        ).order_by(ClientScheduleORM.date.desc()).first()
+        days_inactive = (today - date.fromisoformat(last.date)).days if last else 99
+        split = db.query(WeeklySplitORM).filter(WeeklySplitORM.id == profile.current_split_id).first() \
+            if profile.current_split_id else None
+        upcoming = db.query(ClientScheduleORM).filter(
+            ClientScheduleORM.client_id == c.id, ClientScheduleORM.type == "workout",
+            ClientScheduleORM.date >= today.isoformat()).count()
+        diet = db.query(ClientDietSettingsORM).filter(ClientDietSettingsORM.id == c.id).first()
+        clients.append((c.id, "A Rischio" if days_inactive > 5 else "Attivo", split.name if split else None,
+                        upcoming, diet.fitness_goal if diet else None))
+
+    streak, current = 0, today
+    while True:
+        event_ = db.query(TrainerScheduleORM).filter(
+            TrainerScheduleORM.trainer_id == TRAINER, TrainerScheduleORM.date == current.isoformat(),
+            TrainerScheduleORM.workout_id != None).first()
+        if event_:
+            if event_.completed:
+                streak += 1
+            elif current < today:
+                break
+        current -= timedelta(days=1)
+        if (today - current).days > 365:
+            break
+    return {"schedule": schedule, "clients": sorted(clients), "streak": streak}
+
+
+def windowed_dashboard() -> dict:
+    data = UserService().get_trainer(TRAINER)
+    clients = [(c.id, c.status, c.assigned_split, c.upcoming_workouts, c.fitness_goal) for c in data.clients]
+    return {"schedule": data.schedule, "clients": sorted(clients), "streak": data.streak, "data": data}
+
+
+def seed(engine, clients: int):
+    today = date.today()
+    with engine.begin() as conn:
+        conn.execute(UserORM.__table__.insert(), [{"id": TRAINER, "username": "coach", "role": "trainer"}])
+        conn.execute(WeeklySplitORM.__table__.insert(), [{"id": "ppl", "name": "PPL", "owner_id": TRAINER}])
+        conn.execute(UserORM.__table__.insert(), [
+            {"id": f"m{i}", "username": f"member_{i}", "role": "client"} for i in range(clients)])
+        conn.execute(ClientProfileORM.__table__.insert(), [
+            {"id": f"m{i}", "trainer_id": TRAINER, "current_split_id": "ppl" if i % 2 else None} for i in range(clients)])
+        conn.execute(ClientDietSettingsORM.__table__.insert(), [
+            {"id": f"m{i}", "fitness_goal": "cut"} for i in range(0, clients, 3)])
+        conn.execute(ClientScheduleORM.__table__.insert(), [
+            {"client_id": f"m{i}", "date": (today + timedelta(days=d - 300)).isoformat(), "type": "workout",
+             "completed": d < 300 - (i % 9)} for i in range(clients) for d in range(0, 330, 3)])
+        # Two years back and a few months ahead: 6 sessions a day plus the trainer's own workouts
+        conn.execute(TrainerScheduleORM.__table__.insert(), [
+            {"trainer_id": TRAINER, "date": (today + timedelta(days=d)).isoformat(), "time": f"{8 + h}:00",
+             "title": "1:1", "type": "1on1_appointment", "duration": 60, "completed": d < 0}
+            for d in range(-730, 120) for h in range(6)])
+        conn.execute(TrainerScheduleORM.__table__.insert(), [
+            {"trainer_id": TRAINER, "date": (today - timedelta(days=d)).isoformat(), "time": "07:00",
+             "title": "Me", "type": "workout", "workout_id": "w1", "completed": True} for d in range(0, 200)])
+
+
+def timed(fn, loads, engine):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    start = time.perf_counter()
+    for _ in range(loads):
+        result = fn()
+    elapsed = (time.perf_counter() - start) / loads
+    event.remove(engine, "before_cursor_execute", listener)
+    return result, elapsed, len(statements) // loads
+
+
+def run(clients: int, loads: int):
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'trainer.db')}", poolclass=NullPool,
+                           connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    services_module.get_db_session = session_factory
+    sync_module.get_db_session = session_factory
+    UserService.get_workouts = lambda self, trainer_id: []
+    UserService.get_splits = lambda self, trainer_id: []
+    seed(engine, clients)
+    # Seeded through Core, so nothing is logged yet: one edit starts the change log
+    db = session_factory()
+    db.query(TrainerScheduleORM).first().title = "1:1 (moved)"
+    db.commit()
+    db.close()
+
+    def legacy():
+        db = session_factory()
+        try:
+            return legacy_dashboard(db)
+        finally:
+            db.close()
+
+    old, old_t, old_q = timed(legacy, loads, engine)
+    new, new_t, new_q = timed(windowed_dashboard, loads, engine)
+    assert old["clients"] == new["clients"] and old["streak"] == new["streak"]
+    start, end = schedule_window()
+    assert sorted(e["id"] for e in old["schedule"] if start <= e["date"] <= end) == sorted(e.id for e in new["schedule"])
+    old_kb = len(json.dumps(old["schedule"])) / 1024
+    new_kb = len(json.dumps(jsonable_encoder(new["data"]))) / 1024
+
+    # One edit, then the calendar refresh: delta since the dashboard's version
+    db = session_factory()
+    entry = db.query(TrainerScheduleORM).filter(TrainerScheduleORM.date == date.today().isoformat()).first()
+    entry.time = "21:00"
+    db.commit()
+    delta, delta_t, delta_q = timed(
+        lambda: get_schedule(db, TRAINER, start, end, since=new["data"].schedule_version), loads, engine)
+    db.close()
+    assert not delta["full"] and [e["time"] for e in delta["entries"]] == ["21:00"]
+
+    print(f"{clients:4d} clients, {len(old['schedule'])} calendar rows"
+          f" | previous {old_t * 1000:7.1f} ms, {old_q:4d} statements, calendar {old_kb:6.0f} KiB"
+          f" | windowed {new_t * 1000:6.1f} ms, {new_q:2d} statements, whole payload {new_kb:4.0f} KiB"
+          f" | delta after an edit {delta_t * 1000:4.1f} ms, {len(json.dumps(delta)) / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[20, 80, 200])
+    parser.add_argument("--loads", type=int, default=10)
+    args = parser.parse_args()
+    for size in args.clients:
+        run(size, args.loads)
@@ -0,0 +1,232 @@
+"""
+Benchmark: automated message trigger evaluation for one gym.
+
+Compares the previous per-template / per-match evaluation (one dedup query and one
+context build per match, per-client inactivity and subscription lookups) with the
+batched TriggerCheckService. Message delivery is replaced by a counter so only
+evaluation, deduplication and logging are measured.
+
+Two passes are timed: the first sends everything, the second (the steady state of
+the 15-minute job) finds every match already sent.
+
+Usage:
+    python benchmarks/bench_trigger_checks.py [--clients 5000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'triggers.db')}"
+
+from sqlalchemy import event
+
+from database import Base, engine, get_db_session
+from models_orm import (
+    UserORM, ClientProfileORM, ClientScheduleORM, ClientSubscriptionORM, SubscriptionPlanORM,
+    AutomatedMessageTemplateORM, AutomatedMessageLogORM, AppointmentORM, PaymentORM, PlanOfferORM,
+)
+import service_modules.trigger_check_service as trigger_module
+from service_modules.trigger_check_service import TriggerCheckService
+
+
+class CountingDispatch:
+    def __init__(self):
+        self.sent = 0
+
+    def send_message(self, **kwargs):
+        self.sent += 1
+        return True
+
+
+def seed(clients: int) -> str:
+    rng = random.Random(clients)
+    today = date.today()
+    db = get_db_session()
+    gym_id = str(uuid.uuid4())
+    trainer_id = str(uuid.uuid4())
+    db.add(UserORM(id=gym_id, username="Bench Gym", role="owner"))
+    db.add(UserORM(id=trainer_id, username="Coach", role="trainer"))
+    plan = SubscriptionPlanORM(id=str(uuid.uuid4()), gym_id=gym_id, name="Monthly", price=49.0)
+    offer = PlanOfferORM(id=str(uuid.uuid4()), gym_id=gym_id, title="Come back", discount_type="percent",
+                         discount_value=20, coupon_code="BACK20", is_active=True)
+    db.add_all([plan, offer])
+
+    for i in range(clients):
+        client_id = str(uuid.uuid4())
+        db.add(UserORM(id=client_id, username=f"member_{i}", role="client"))
+        db.add(ClientProfileORM(id=client_id, gym_id=gym_id, trainer_id=trainer_id if i % 2 else None))
+        for _ in range(rng.randint(0, 4)):
+            day = today - timedelta(days=rng.randint(1, 40))
+            db.add(ClientScheduleORM(client_id=client_id, date=day.isoformat(), type="workout",
+                                     title="Leg day", completed=rng.random() < 0.8))
+        roll = rng.random()
+        if roll < 0.1:
+            sub_id = str(uuid.uuid4())
+            db.add(ClientSubscriptionORM(id=sub_id, client_id=client_id, gym_id=gym_id, plan_id=plan.id,
+                                         status=rng.choice(["canceled", "past_due"]),
+                                         canceled_at=(datetime.utcnow() - timedelta(days=rng.randint(0, 10))).isoformat()))
+            if rng.random() < 0.5:
+                db.add(PaymentORM(id=str(uuid.uuid4()), client_id=client_id, subscription_id=sub_id, gym_id=gym_id,
+                                  amount=49.0, currency="eur", status="failed", created_at=datetime.utcnow().isoformat()))
+        elif roll < 0.8:
+            db.add(ClientSubscriptionORM(id=str(uuid.uuid4()), client_id=client_id, gym_id=gym_id,
+                                         plan_id=plan.id, status="active"))
+        if rng.random() < 0.05:
+            db.add(AppointmentORM(id=str(uuid.uuid4()), client_id=client_id, trainer_id=trainer_id,
+                                  date=(today + timedelta(days=rng.choice([-3, 1]))).isoformat(),
+                                  start_time="10:00", status="scheduled"))
+
+    templates = [
+        ("missed_workout", {}, None),
+        ("days_inactive", {"days_threshold": 5}, None),
+        ("days_inactive", {"days_threshold": 5}, None),
+        ("days_inactive", {"days_threshold": 14}, None),
+        ("days_inactive", {"days_threshold": 30}, offer.id),
+        ("subscription_canceled", {"days_since_cancellation": 7}, None),
+        ("subscription_canceled", {"days_since_cancellation": 7}, offer.id),
+        ("no_show_appointment", {}, None),
+        ("upcoming_appointment", {"hours_before": 48}, None),
+        ("payment_failed", {"days_threshold": 3}, None),
+    ]
+    for i, (trigger_type, config, offer_id) in enumerate(templates):
+        db.add(AutomatedMessageTemplateORM(
+            id=str(uuid.uuid4()), gym_id=gym_id, name=f"T{i} {trigger_type}", trigger_type=trigger_type,
+            trigger_config=json.dumps(config), message_template="Hi {client_name}, from {gym_name} {trainer_name}",
+            delivery_methods='["in_app"]', is_enabled=True, linked_offer_id=offer_id,
+        ))
+    db.commit()
+    db.close()
+    return gym_id
+
+
+# --- Previous evaluation: templates one by one, lookups per match ---
+
+class LegacyTriggerCheckService(TriggerCheckService):
+    def check_all_triggers(self, gym_id: str = None) -> dict:
+        db = get_db_session()
+        try:
+            templates = db.query(AutomatedMessageTemplateORM).filter(
+                AutomatedMessageTemplateORM.gym_id == gym_id,
+                AutomatedMessageTemplateORM.is_enabled == True
+            ).all()
+        finally:
+            db.close()
+        results = {"messages_sent": 0, "messages_skipped": 0}
+        auto_msg_service = trigger_module.get_automated_message_service()
+        dispatch = trigger_module.get_message_dispatch_service()
+        for template in templates:
+            key = self._trigger_key(template)
+            matches = self._evaluate_trigger(gym_id, *key)
+            for match in matches:
+                ref = match.get("trigger_reference")
+                if auto_msg_service.was_message_sent(template.id, match["client_id"], ref, within_hours=24):
+                    results["messages_skipped"] += 1
+                    continue
+                context = self._build_context(match, gym_id=gym_id, linked_offer_id=template.linked_offer_id)
+                message = auto_msg_service.substitute_variables(template.message_template, context)
+                dispatch.send_message(client_id=match["client_id"], delivery_method="in_app",
+                                      title=template.name, message=message)
+                auto_msg_service.log_message(template.id, match["client_id"], gym_id, template.trigger_type,
+                                             ref, "in_app", "sent")
+                results["messages_sent"] += 1
+        return results
+
+    def check_days_inactive(self, gym_id: str, threshold_days: int):
+        db = get_db_session()
+        try:
+            today = date.today()
+            clients = db.query(ClientProfileORM).filter(ClientProfileORM.gym_id == gym_id).all()
+            names = {u.id: u.username for u in db.query(UserORM).filter(UserORM.id.in_([c.id for c in clients])).all()}
+            results = []
+            for client in clients:
+                last = db.query(ClientScheduleORM).filter(
+                    ClientScheduleORM.client_id == client.id,
+                    ClientScheduleORM.type == "workout",
+                    ClientScheduleORM.completed == True
+                ).order_by(ClientScheduleORM.date.desc()).first()
+                days = (today - datetime.strptime(last.date, "%Y-%m-%d").date()).days if last else threshold_days
+                if days >= threshold_days:
+                    results.append({"client_id": client.id, "client_name": names.get(client.id, ""),
+                                    "days_inactive": days, "last_workout_date": last.date if last else None,
+                                    "trigger_reference": f"inactive_{client.id}_{today.isoformat()}"})
+            return results
+        finally:
+            db.close()
+
+    def check_subscription_canceled(self, gym_id: str, days_since_threshold: int = 7):
+        db = get_db_session()
+        try:
+            today = date.today()
+            subs = db.query(ClientSubscriptionORM).filter(
+                ClientSubscriptionORM.gym_id == gym_id,
+                ClientSubscriptionORM.status.in_(['canceled', 'past_due'])
+            ).all()
+            results = []
+            for sub in subs:
+                cancel = sub.canceled_at or sub.current_period_end or sub.created_at
+                days_since = (today - datetime.fromisoformat(cancel).date()).days
+                if days_since > days_since_threshold:
+                    continue
+                if db.query(ClientSubscriptionORM).filter(
+                    ClientSubscriptionORM.client_id == sub.client_id,
+                    ClientSubscriptionORM.gym_id == gym_id,
+                    ClientSubscriptionORM.status == "active"
+                ).first():
+                    continue
+                plan = db.query(SubscriptionPlanORM).filter(SubscriptionPlanORM.id == sub.plan_id).first()
+                user = db.query(UserORM).filter(UserORM.id == sub.client_id).first()
+                results.append({"client_id": sub.client_id, "client_name": user.username if user else "",
+                                "plan_name": plan.name if plan else "", "canceled_at": cancel,
+                                "days_since_cancellation": days_since,
+                                "trigger_reference": f"sub_canceled_{sub.id}"})
+            return results
+        finally:
+            db.close()
+
+
+def timed(service, gym_id, counter):
+    counter["n"] = 0
+    start = time.perf_counter()
+    result = service.check_all_triggers(gym_id)
+    return time.perf_counter() - start, counter["n"], result["messages_sent"], result["messages_skipped"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=5000)
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger("gym_app").setLevel(logging.WARNING)
+
+    Base.metadata.create_all(bind=engine)
+    gym_id = seed(args.clients)
+    trigger_module.get_message_dispatch_service = lambda: CountingDispatch()
+
+    counter = {"n": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(*_):
+        counter["n"] += 1
+
+    print(f"{args.clients} clients, 10 templates")
+    for label, service in (("per-match", LegacyTriggerCheckService()), ("batched", TriggerCheckService())):
+        db = get_db_session()
+        db.query(AutomatedMessageLogORM).delete()
+        db.commit()
+        db.close()
+        for run in ("first run", "steady state"):
+            seconds, queries, sent, skipped = timed(service, gym_id, counter)
+            print(f"  {label:<9} {run:<12} {seconds * 1000:9.1f} ms {queries:>7} queries "
+                  f"({sent} sent, {skipped} deduplicated)")
+
+
+if __name__ == "__main__":
+    main()
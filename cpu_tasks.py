@@ -0,0 +1,164 @@
+"""
+CPU Tasks - process pool for CPU-bound work (bcrypt hashing, image encoding).
+
+Heavy work would otherwise run on the event loop or hold the GIL in the thread
+pool, stalling every other request in the worker. Tasks here run in a lazily
+created spawn-context ProcessPoolExecutor shared by the whole worker process.
+
+Pool processes import this module to unpickle the task functions, so it must stay
+light: no database, models or service_modules imports (database.py runs
+migrations at import time).
+"""
+import asyncio
+import functools
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import logging
+logger = logging.getLogger("gym_app")
+
+CPU_POOL_WORKERS = int(os.environ.get("CPU_POOL_WORKERS", str(os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_cpu_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded server process can deadlock the child
+            _pool = ProcessPoolExecutor(max_workers=max(1, CPU_POOL_WORKERS),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_cpu_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+async def run_cpu(func, *args, **kwargs):
+    """Run func in the process pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    try:
+        return await loop.run_in_executor(get_cpu_pool(), call)
+    except BrokenProcessPool:
+        # A pool process was killed (OOM, signal): start a fresh pool next time and
+        # finish this call in a thread so the request still succeeds
+        logger.warning(f"CPU pool died running {func.__name__}, retrying in a thread")
+        shutdown_cpu_pool()
+        return await loop.run_in_executor(None, call)
+
+
+# ═══════════════════════════════════════════════════════════
+#  PASSWORD HASHING
+# ═══════════════════════════════════════════════════════════
+
+def hash_password_batch(passwords, rounds=12):
+    import bcrypt
+    return [bcrypt.hashpw(p.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8') for p in passwords]
+
+
+# ═══════════════════════════════════════════════════════════
+#  IMAGE VARIANTS
+# ═══════════════════════════════════════════════════════════
+
+# Longest edge of the smaller variants; "full" uses the caller's max_size
+IMAGE_VARIANT_EDGES = {"feed": 640, "thumb": 160}
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+WEBP_METHOD = 2  # 0 (fast) .. 6 (small); beyond 2 files shrink <1% for 3x the encode time
+
+
+def _fit(size, box):
+    w, h = size
+    scale = min(box[0] / w, box[1] / h, 1.0)
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def process_image(content: bytes, max_size: tuple = (1200, 1200), crop_square: bool = False) -> dict:
+    """
+    Decode an uploaded image once and encode the thumb/feed/full variants.
+
+    Returns {name: {"width", "height", "jpg": bytes, "webp": bytes}}. "full" matches
+    what upload_helper._optimize_image used to produce for the same arguments (fit
+    into max_size, then centre-cropped when crop_square); smaller variants are only
+    emitted when they are actually smaller than "full".
+    """
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(content))
+
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale directly: a 12MP phone photo
+    # reduced for a 400px avatar never gets decoded at full resolution
+    if img.format == "JPEG":
+        box = max_size
+        if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):  # rotated 90°: box applies after transpose
+            box = (max_size[1], max_size[0])
+        img.draft("RGB", _fit(img.size, box))
+
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    img.thumbnail(max_size, Image.Resampling.LANCZOS)
+    if crop_square:
+        w, h = img.size
+        d = min(w, h)
+        left = (w - d) // 2
+        top = (h - d) // 2
+        img = img.crop((left, top, left + d, top + d))
+
+    frames = {"full": img}
+    source = img
+    for name, edge in sorted(IMAGE_VARIANT_EDGES.items(), key=lambda item: -item[1]):
+        if max(source.size) <= edge:
+            continue
+        # Resize from the previous (smaller) variant rather than from the original
+        source = source.copy()
+        source.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        frames[name] = source
+
+    variants = {}
+    for name, frame in frames.items():
+        jpg, webp = io.BytesIO(), io.BytesIO()
+        frame.save(jpg, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        frame.save(webp, format="WEBP", quality=WEBP_QUALITY, method=WEBP_METHOD)
+        variants[name] = {"width": frame.width, "height": frame.height,
+                          "jpg": jpg.getvalue(), "webp": webp.getvalue()}
+    return variants
+
+
+# ═══════════════════════════════════════════════════════════
+#  PERCEPTUAL HASH
+# ═══════════════════════════════════════════════════════════
+
+def image_dhash(content: bytes) -> int:
+    """
+    64-bit difference hash of an image: 1 bit per horizontally adjacent pixel pair
+    of a 9x8 grayscale reduction. Re-encoded, resized or slightly recropped copies
+    of a photo differ in only a few bits.
+    """
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(content))
+    if img.format == "JPEG":
+        img.draft("L", (64, 64))
+    img = ImageOps.exif_transpose(img).convert("L").resize((9, 8), Image.Resampling.BOX)
+    pixels = img.tobytes()
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            value = (value << 1) | (left > pixels[row * 9 + col + 1])
+    return value
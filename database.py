@@ -1,6 +1,7 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import functools
 import os
 
 # --- CONFIGURATION ---
@@ -12,13 +13,17 @@ if DATABASE_URL.startswith("postgres://"):
 
 IS_POSTGRES = DATABASE_URL.startswith("postgresql")
 
+# Connection pool sizing (Postgres only); the offload thread pool below is sized to match
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 5
+
 # --- ENGINE & SESSION ---
 if IS_POSTGRES:
     # Production: PostgreSQL with connection pooling
     engine = create_engine(
         DATABASE_URL,
-        pool_size=10,
-        max_overflow=5,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
         pool_timeout=30,
         pool_recycle=300,       # Recycle connections every 5 min (prevents stale connections)
         pool_pre_ping=True,     # Test connection before using it (auto-replaces dead ones)
@@ -157,3 +162,34 @@ def get_db():
 # --- UTILS ---
 def get_db_session():
     return SessionLocal()
+
+
+# --- EXECUTION LAYER ---
+# Route handlers are `async def`, so any blocking call made directly inside them
+# (SQLAlchemy sessions, bcrypt, requests, Stripe SDK) stalls every request and
+# WebSocket on the worker. run_sync() moves that work to a bounded thread pool.
+# The limit matches the connection pool so threads never queue on pool_timeout.
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", DB_POOL_SIZE + DB_MAX_OVERFLOW))
+_db_limiter = None
+
+
+def _get_db_limiter():
+    global _db_limiter
+    if _db_limiter is None:
+        import anyio
+        _db_limiter = anyio.CapacityLimiter(DB_THREADPOOL_SIZE)
+    return _db_limiter
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    Run a blocking callable (service method, DB query, bcrypt, HTTP SDK call)
+    in the DB thread pool and await its result without blocking the event loop.
+
+    Usage in routes:
+        return await run_sync(service.get_conversations, user.id)
+    """
+    import anyio.to_thread
+    return await anyio.to_thread.run_sync(
+        functools.partial(func, *args, **kwargs), limiter=_get_db_limiter()
+    )
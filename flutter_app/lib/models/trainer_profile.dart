@@ -7,6 +7,8 @@ class TrainerProfile {
   final List<TrainerClient> clients;
   final int activeClients;
   final int atRiskClients;
+  // Only the window around today sent by /api/trainer/data (30 days back, 90 ahead by
+  // default); other weeks come from /api/trainer/schedule?from=&to=
   final List<TrainerEvent> schedule;
   final Map<String, dynamic>? todaysWorkout;
   final List<Map<String, dynamic>> workouts;
@@ -5,13 +5,49 @@ Supports multi-gym owners via X-Gym-Id header.
 from fastapi import Depends, Header, HTTPException
 from typing import Optional
 from auth import get_current_user
-from database import get_db_session
+from database import get_db_session, run_sync
 from models_orm import GymORM, UserORM, ClientProfileORM
+from principal_cache import principal_cache
 import logging
 
 logger = logging.getLogger("gym_app")
 
 
+def _load_owner_gym_id(user: UserORM, x_gym_id: Optional[str]) -> Optional[str]:
+    """Gym the owner targets, or None if x_gym_id is not one of their active gyms."""
+    db = get_db_session()
+    try:
+        if x_gym_id:
+            # Verify owner actually owns this gym
+            gym = db.query(GymORM).filter(
+                GymORM.id == x_gym_id,
+                GymORM.owner_id == user.id,
+                GymORM.is_active == True
+            ).first()
+            return gym.id if gym else None
+        else:
+            # Default to first active gym (backward compat: gym.id == owner.id for migrated)
+            gym = db.query(GymORM).filter(
+                GymORM.owner_id == user.id,
+                GymORM.is_active == True
+            ).order_by(GymORM.created_at).first()
+            return gym.id if gym else user.id  # fallback for safety
+    finally:
+        db.close()
+
+
+def _load_client_gym_id(user_id: str) -> Optional[str]:
+    """Gym of the client's profile, or None without a profile."""
+    db = get_db_session()
+    try:
+        profile = db.query(ClientProfileORM).filter(
+            ClientProfileORM.id == user_id
+        ).first()
+        return profile.gym_id if profile else None
+    finally:
+        db.close()
+
+
 def resolve_gym_id(user: UserORM, x_gym_id: Optional[str] = None) -> str:
     """
     Resolve which gym the current request targets.
@@ -20,47 +56,36 @@ def resolve_gym_id(user: UserORM, x_gym_id: Optional[str] = None) -> str:
     For staff/trainers: uses their gym_owner_id (which equals the gym.id for migrated data).
     For clients: uses their profile's gym_id.
 
+    Lookups are cached per user in the principal cache.
+
     Returns the gym ID string.
     """
     if user.role == "owner":
-        db = get_db_session()
-        try:
-            if x_gym_id:
-                # Verify owner actually owns this gym
-                gym = db.query(GymORM).filter(
-                    GymORM.id == x_gym_id,
-                    GymORM.owner_id == user.id,
-                    GymORM.is_active == True
-                ).first()
-                if not gym:
-                    raise HTTPException(status_code=403, detail="You don't own this gym")
-                return gym.id
-            else:
-                # Default to first active gym (backward compat: gym.id == owner.id for migrated)
-                gym = db.query(GymORM).filter(
-                    GymORM.owner_id == user.id,
-                    GymORM.is_active == True
-                ).order_by(GymORM.created_at).first()
-                return gym.id if gym else user.id  # fallback for safety
-        finally:
-            db.close()
+        gym_id = principal_cache.gym_id(user.id, ("owner", x_gym_id), lambda: _load_owner_gym_id(user, x_gym_id))
+        if gym_id is None:
+            raise HTTPException(status_code=403, detail="You don't own this gym")
+        return gym_id
 
     elif user.role in ("staff", "trainer", "nutritionist"):
         return user.gym_owner_id or ""
 
     elif user.role == "client":
-        db = get_db_session()
-        try:
-            profile = db.query(ClientProfileORM).filter(
-                ClientProfileORM.id == user.id
-            ).first()
-            return profile.gym_id if profile else ""
-        finally:
-            db.close()
+        return principal_cache.gym_id(user.id, "client", lambda: _load_client_gym_id(user.id)) or ""
 
     return ""
 
 
+def _cached_gym_id(user: UserORM, x_gym_id: Optional[str]) -> Optional[str]:
+    """Resolve from cache or identity columns alone, or None if a query is needed."""
+    if user.role == "owner":
+        found, gym_id = principal_cache.get_gym(user.id, ("owner", x_gym_id))
+        return gym_id if found and gym_id is not None else None
+    if user.role == "client":
+        found, gym_id = principal_cache.get_gym(user.id, "client")
+        return (gym_id or "") if found else None
+    return resolve_gym_id(user, x_gym_id)
+
+
 async def get_gym_context(
     user: UserORM = Depends(get_current_user),
     x_gym_id: Optional[str] = Header(None)
@@ -76,4 +101,7 @@ async def get_gym_context(
         ):
             ...
     """
-    return resolve_gym_id(user, x_gym_id)
+    gym_id = _cached_gym_id(user, x_gym_id)
+    if gym_id is not None:
+        return gym_id
+    return await run_sync(resolve_gym_id, user, x_gym_id)
@@ -31,7 +31,7 @@ try:
     from fastapi import WebSocket, WebSocketDisconnect
     import uvicorn
     from fastapi.middleware.cors import CORSMiddleware
-    from routes import router
+    from routes import router, etag_json
     from sockets import manager, start_file_watcher
     from simple_auth import simple_auth_router, SECRET_KEY, ALGORITHM
     from jose import jwt, JWTError
@@ -41,7 +41,9 @@ try:
     from services import UserService, get_user_service
     from service_modules.gym_assignment_service import get_gym_assignment_service, GymAssignmentService
     from auth import get_current_user, create_access_token
-    from fastapi import Depends, HTTPException
+    from fastapi import Depends, HTTPException, Query
+    from typing import Optional
+    from database import run_sync
     from models_orm import UserORM
     # Rate limiting
     from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -214,6 +216,7 @@ async def join_gym_landing(request: Request, gym_code: str):
 async def debug_ws_connections():
     """Temp: show all connected WebSocket users."""
     return {
+        "worker_id": manager.worker_id,
         "total_connections": len(manager.active_connections),
         "user_connections": {uid: str(ws.client) for uid, ws in manager.user_connections.items()},
     }
@@ -392,9 +395,13 @@ async def get_version():
         "storage": storage["provider"]
     }
 
-# Mount static and templates
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Mount static and templates. Assets are fingerprinted (templates use static_url())
+# and served with immutable caching and precompressed variants, see static_assets.py
+from static_assets import AssetStaticFiles, asset_manifest, install_template_helpers
+asset_manifest.build()
+app.mount("/static", AssetStaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+install_template_helpers(templates)
 templates.env.auto_reload = True
 
 # --- ROUTES DEFINED DIRECTLY ON APP ---
@@ -402,11 +409,14 @@ templates.env.auto_reload = True
 
 @app.get("/api/trainer/data", response_model=TrainerData)
 async def get_trainer_data_direct(
+    request: Request,
+    schedule_from: Optional[str] = Query(None, alias="from"),
+    schedule_to: Optional[str] = Query(None, alias="to"),
     service: UserService = Depends(get_user_service),
     current_user: UserORM = Depends(get_current_user)
 ):
-    data = service.get_trainer(current_user.id)
-    return data
+    data = await run_sync(service.get_trainer, current_user.id, schedule_from, schedule_to)
+    return etag_json(request, data)
 
 @app.get("/api/trainer/weekly-overview")
 async def get_trainer_weekly_overview(
@@ -1078,27 +1088,6 @@ def run_migrations(engine):
                 logger.info(f"Multi-gym migration complete: {len(owners)} gyms created")
 
 
-def background_trigger_checker():
-    """Background thread that periodically checks for automated message triggers."""
-    import time
-    from service_modules.trigger_check_service import get_trigger_check_service
-
-    # Wait 60 seconds before first check to let the app fully initialize
-    time.sleep(60)
-
-    while True:
-        try:
-            logger.info("Running automated message trigger check...")
-            trigger_service = get_trigger_check_service()
-            results = trigger_service.check_all_triggers()
-            logger.info(f"Trigger check complete: {results['messages_sent']} sent, {results['messages_skipped']} skipped")
-        except Exception as e:
-            logger.error(f"Background trigger check error: {e}")
-
-        # Sleep for 15 minutes between checks
-        time.sleep(900)
-
-
 @app.on_event("startup")
 async def startup_event():
     logger.info("Initializing Database...")
@@ -1138,102 +1127,70 @@ async def startup_event():
     else:
         logger.info("File Storage: Local Filesystem (Development)")
 
-    # --- Data retention cleanup (TODO: move to a scheduled cron job) ---
-    try:
-        from sqlalchemy import text
-        from database import get_db_session
-        cleanup_db = get_db_session()
-        try:
-            now = datetime.utcnow()
-
-            # 1. Delete audit logs older than 90 days
-            cutoff_90 = (now - timedelta(days=90)).isoformat()
-            deleted_audit = cleanup_db.execute(
-                text("DELETE FROM sensitive_data_access_log WHERE accessed_at < :cutoff"),
-                {"cutoff": cutoff_90}
-            ).rowcount
-
-            # 2. Delete expired password reset tokens (expired and older than 7 days)
-            cutoff_7 = (now - timedelta(days=7)).isoformat()
-            deleted_tokens = cleanup_db.execute(
-                text("DELETE FROM password_reset_tokens WHERE expires_at < :cutoff"),
-                {"cutoff": cutoff_7}
-            ).rowcount
-
-            # 3. Delete old read notifications (older than 60 days, already read)
-            cutoff_60 = (now - timedelta(days=60)).isoformat()
-            deleted_notifs = cleanup_db.execute(
-                text("DELETE FROM notifications WHERE read = true AND created_at < :cutoff"),
-                {"cutoff": cutoff_60}
-            ).rowcount
-
-            cleanup_db.commit()
-            logger.info(
-                f"Data retention cleanup: {deleted_audit} audit logs, "
-                f"{deleted_tokens} expired tokens, {deleted_notifs} old notifications deleted"
-            )
-        except Exception as e:
-            logger.warning(f"Data retention cleanup error (non-fatal): {e}")
-            cleanup_db.rollback()
-        finally:
-            cleanup_db.close()
-    except Exception as e:
-        logger.warning(f"Data retention cleanup setup error (non-fatal): {e}")
+    # Listen for principal cache invalidations published by other workers
+    from principal_cache import start_invalidation_listener
+    await start_invalidation_listener()
 
-    # --- Deactivate clients with expired subscriptions (10+ days overdue) ---
-    try:
-        from database import get_db_session as _get_db
-        from models_orm import ClientSubscriptionORM
-        _exp_db = _get_db()
-        try:
-            _now = datetime.utcnow()
-            _grace_cutoff = (_now - timedelta(days=10)).isoformat()
-
-            # Find clients whose latest subscription ended 10+ days ago
-            expired_subs = _exp_db.query(ClientSubscriptionORM).filter(
-                ClientSubscriptionORM.status.in_(["canceled", "past_due", "incomplete"]),
-                ClientSubscriptionORM.current_period_end < _grace_cutoff,
-                ClientSubscriptionORM.current_period_end != None,
-            ).all()
-
-            deactivated = 0
-            for sub in expired_subs:
-                client = _exp_db.query(UserORM).filter(
-                    UserORM.id == sub.client_id,
-                    UserORM.is_active == True,
-                    UserORM.role == "client",
-                ).first()
-                if client:
-                    # Check they don't have another active subscription
-                    active_sub = _exp_db.query(ClientSubscriptionORM).filter(
-                        ClientSubscriptionORM.client_id == client.id,
-                        ClientSubscriptionORM.status == "active",
-                    ).first()
-                    if not active_sub:
-                        client.is_active = False
-                        deactivated += 1
-
-            if deactivated > 0:
-                _exp_db.commit()
-                logger.info(f"Subscription check: deactivated {deactivated} clients with 10+ day expired subscriptions")
-        except Exception as e:
-            logger.warning(f"Subscription expiry check error (non-fatal): {e}")
-            _exp_db.rollback()
-        finally:
-            _exp_db.close()
-    except Exception as e:
-        logger.warning(f"Subscription expiry setup error (non-fatal): {e}")
+    # Start the push dispatcher (drains push_outbox in the background)
+    from service_modules.push_dispatcher import push_dispatcher
+    await push_dispatcher.start()
 
-    # Start background thread for automated message trigger checking
-    import threading
-    trigger_thread = threading.Thread(target=background_trigger_checker, daemon=True)
-    trigger_thread.start()
-    logger.info("Automated message trigger checker started (runs every 15 minutes)")
+    # Start the community counter flusher (recounts liked/commented posts in batches)
+    from service_modules.community_counters import community_counters
+    await community_counters.start()
+
+    # Start the audit log writer (sensitive-data access entries, written in batches)
+    from service_modules.audit_writer import audit_writer
+    await audit_writer.start()
+
+    # Start the email queue (pooled SMTP sessions, retries with backoff)
+    from service_modules.smtp_delivery import email_queue
+    await email_queue.start()
+
+    # Start the job scheduler: trigger checks, subscription expiry and data retention
+    # run on whichever worker holds the leader lease, once per slot fleet-wide
+    from service_modules.job_scheduler import job_scheduler, SCHEDULER_ENABLED
+    from service_modules.maintenance_jobs import register_maintenance_jobs
+    if SCHEDULER_ENABLED:
+        register_maintenance_jobs(job_scheduler)
+        await job_scheduler.start()
 
     logger.info("Registered Routes:")
     for route in app.routes:
         logger.info(f"{route.path} [{route.name}]")
 
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Remove this worker's WebSocket presence so other workers stop routing to it
+    await manager.shutdown()
+
+    from service_modules.push_dispatcher import push_dispatcher
+    await push_dispatcher.stop()
+
+    from service_modules.job_scheduler import job_scheduler
+    await job_scheduler.stop()
+
+    from service_modules.community_counters import community_counters
+    await community_counters.stop()
+
+    # Writes the entries still queued
+    from service_modules.audit_writer import audit_writer
+    await audit_writer.stop()
+
+    # After the scheduler: a trigger run may still be waiting on its emails
+    from service_modules.smtp_delivery import email_queue
+    await email_queue.stop()
+
+    from principal_cache import stop_invalidation_listener
+    await stop_invalidation_listener()
+
+    from cpu_tasks import shutdown_cpu_pool
+    shutdown_cpu_pool()
+
+    from service_modules.barcode_service import barcode_service
+    await barcode_service.close()
+
 @app.websocket("/ws/gate/{device_key}")
 async def gate_websocket(websocket: WebSocket, device_key: str):
     """WebSocket for Pi gate relay. Pi connects and waits for gate-open events."""
@@ -1312,7 +1269,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                     partner_id = msg.get("partner_id")
                     logger.info(f"CO-OP Invite: {username} (id={user_id}) inviting partner_id={partner_id}")
                     logger.info(f"CO-OP Invite: Online users = {list(manager.user_connections.keys())}")
-                    if partner_id and manager.is_user_online(partner_id):
+                    if partner_id and await manager.is_user_online(partner_id):
                         logger.info(f"CO-OP Invite: Partner {partner_id} is online, sending invite with from_id={user_id}")
                         # Send invitation to the partner
                         await manager.send_to_user(partner_id, {
@@ -1331,7 +1288,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                     inviter_id = msg.get("inviter_id")
                     logger.info(f"CO-OP Accept: {username} accepting invite from inviter_id={inviter_id}")
                     logger.info(f"CO-OP Accept: Online users = {list(manager.user_connections.keys())}")
-                    if inviter_id and manager.is_user_online(inviter_id):
+                    if inviter_id and await manager.is_user_online(inviter_id):
                         logger.info(f"CO-OP Accept: Inviter {inviter_id} is online, sending coop_accepted")
                         await manager.send_to_user(inviter_id, {
                             "type": "coop_accepted",
@@ -1346,7 +1303,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                 # CO-OP Decline: Friend declines the invitation
                 elif msg_type == "coop_decline" and user_id:
                     inviter_id = msg.get("inviter_id")
-                    if inviter_id and manager.is_user_online(inviter_id):
+                    if inviter_id and await manager.is_user_online(inviter_id):
                         await manager.send_to_user(inviter_id, {
                             "type": "coop_declined",
                             "partner_name": username
@@ -1355,7 +1312,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                 # CO-OP Completed: Notify partner that workout is done
                 elif msg_type == "coop_completed" and user_id:
                     partner_id = msg.get("partner_id")
-                    if partner_id and manager.is_user_online(partner_id):
+                    if partner_id and await manager.is_user_online(partner_id):
                         await manager.send_to_user(partner_id, {
                             "type": "coop_completed",
                             "partner_name": username
@@ -1370,7 +1327,9 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
 async def log_requests(request: Request, call_next):
     try:
         response = await call_next(request)
-        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate, max-age=0, private"
+        # HTML and API responses are never cached; /static sets its own policy
+        if not request.url.path.startswith("/static/"):
+            response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate, max-age=0, private"
         response.headers["X-Content-Type-Options"] = "nosniff"
         response.headers["X-Frame-Options"] = "SAMEORIGIN"
         response.headers["X-XSS-Protection"] = "1; mode=block"
@@ -1403,62 +1362,39 @@ async def cookies_page(request: Request):
 
 # --- GDPR DATA EXPORT ---
 from sqlalchemy.orm import Session
-from database import get_db
-
-@app.get("/api/gdpr/export-data")
-async def gdpr_export_data(request: Request, current_user: UserORM = Depends(get_current_user), db: Session = Depends(get_db)):
-    """GDPR Art. 20 - Data portability. Returns all user data as JSON."""
-    from models_orm import (ClientProfileORM, WeightHistoryORM, ClientDietLogORM,
-        ClientDailyDietSummaryORM, ClientDietSettingsORM, ClientExerciseLogORM,
-        ClientScheduleORM, AppointmentORM, CheckInORM, PhysiquePhotoORM,
-        MedicalCertificateORM, ClientDocumentORM, MessageORM, NotificationORM,
-        ClientSubscriptionORM, PaymentORM, DailyQuestCompletionORM,
-        LessonEnrollmentORM, FriendshipORM, NfcTagORM, ShowerUsageORM)
-
-    user = db.query(UserORM).filter(UserORM.id == current_user.id).first()
-    uid = user.id
-
-    def rows_to_list(rows, exclude=None):
-        exclude = exclude or {"hashed_password"}
-        result = []
-        for r in rows:
-            d = {c.name: getattr(r, c.name) for c in r.__table__.columns if c.name not in exclude}
-            result.append(d)
-        return result
-
-    data = {
-        "export_date": datetime.utcnow().isoformat(),
-        "account": rows_to_list([user])[0] if user else {},
-        "profile": rows_to_list(db.query(ClientProfileORM).filter(ClientProfileORM.id == uid).all()),
-        "weight_history": rows_to_list(db.query(WeightHistoryORM).filter(WeightHistoryORM.client_id == uid).all()),
-        "diet_settings": rows_to_list(db.query(ClientDietSettingsORM).filter(ClientDietSettingsORM.id == uid).all()),
-        "diet_logs": rows_to_list(db.query(ClientDietLogORM).filter(ClientDietLogORM.client_id == uid).all()),
-        "diet_summaries": rows_to_list(db.query(ClientDailyDietSummaryORM).filter(ClientDailyDietSummaryORM.client_id == uid).all()),
-        "exercise_logs": rows_to_list(db.query(ClientExerciseLogORM).filter(ClientExerciseLogORM.client_id == uid).all()),
-        "schedule": rows_to_list(db.query(ClientScheduleORM).filter(ClientScheduleORM.client_id == uid).all()),
-        "appointments": rows_to_list(db.query(AppointmentORM).filter(AppointmentORM.client_id == uid).all()),
-        "checkins": rows_to_list(db.query(CheckInORM).filter(CheckInORM.member_id == uid).all()),
-        "physique_photos": rows_to_list(db.query(PhysiquePhotoORM).filter(PhysiquePhotoORM.client_id == uid).all()),
-        "medical_certificates": rows_to_list(db.query(MedicalCertificateORM).filter(MedicalCertificateORM.client_id == uid).all()),
-        "documents": rows_to_list(db.query(ClientDocumentORM).filter(ClientDocumentORM.client_id == uid).all()),
-        "messages_sent": rows_to_list(db.query(MessageORM).filter(MessageORM.sender_id == uid).all()),
-        "notifications": rows_to_list(db.query(NotificationORM).filter(NotificationORM.user_id == uid).all()),
-        "subscriptions": rows_to_list(db.query(ClientSubscriptionORM).filter(ClientSubscriptionORM.client_id == uid).all()),
-        "payments": rows_to_list(db.query(PaymentORM).filter(PaymentORM.client_id == uid).all()),
-        "quest_completions": rows_to_list(db.query(DailyQuestCompletionORM).filter(DailyQuestCompletionORM.client_id == uid).all()),
-        "lesson_enrollments": rows_to_list(db.query(LessonEnrollmentORM).filter(LessonEnrollmentORM.client_id == uid).all()),
-        "friendships": rows_to_list(db.query(FriendshipORM).filter(
-            (FriendshipORM.user1_id == uid) | (FriendshipORM.user2_id == uid)
-        ).all()),
-        "nfc_tags": rows_to_list(db.query(NfcTagORM).filter(NfcTagORM.member_id == uid).all()),
-        "shower_usage": rows_to_list(db.query(ShowerUsageORM).filter(ShowerUsageORM.member_id == uid).all()),
-    }
-
-    from fastapi.responses import Response
-    return Response(
-        content=json.dumps(data, indent=2, default=str),
-        media_type="application/json",
-        headers={"Content-Disposition": f"attachment; filename=fitos_data_export_{uid}.json"}
+from database import get_db, run_sync
+
+@app.post("/api/gdpr/export-jobs")
+async def gdpr_start_export(current_user: UserORM = Depends(get_current_user)):
+    """GDPR Art. 20 - Data portability. Starts a background export of all user data (ZIP of NDJSON files).
+    Poll GET /api/gdpr/export-jobs/{job_id}; once ready it includes a signed download_url."""
+    from service_modules.gdpr_export_service import get_gdpr_export_service
+    job = await run_sync(get_gdpr_export_service().start_export, current_user.id)
+    return JSONResponse(content=job, status_code=202)
+
+
+@app.get("/api/gdpr/export-jobs/{job_id}")
+async def gdpr_get_export(job_id: str, current_user: UserORM = Depends(get_current_user)):
+    """Status of a data export; download_url (valid for 15 minutes) once it is ready."""
+    from service_modules.gdpr_export_service import get_gdpr_export_service
+    job = await run_sync(get_gdpr_export_service().get_export, job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return job
+
+
+@app.get("/api/gdpr/export-jobs/{job_id}/download")
+async def gdpr_download_export(job_id: str, token: str):
+    """Download a ready export. The signed token is the authorization, so the link works outside the app."""
+    from fastapi.responses import FileResponse
+    from service_modules.gdpr_export_service import get_gdpr_export_service
+    export = await run_sync(get_gdpr_export_service().resolve_download, job_id, token)
+    if not export:
+        raise HTTPException(status_code=410, detail="Download link expired or invalid")
+    return FileResponse(
+        export["path"],
+        media_type="application/zip",
+        filename=f"fitos_data_export_{export['user_id']}.zip"
     )
 
 # --- GDPR ACCOUNT DELETION ---
@@ -1470,8 +1406,14 @@ async def gdpr_delete_account(request: Request, current_user: UserORM = Depends(
         ClientScheduleORM, AppointmentORM, CheckInORM, PhysiquePhotoORM,
         MedicalCertificateORM, ClientDocumentORM, MessageORM, NotificationORM,
         ClientSubscriptionORM, PaymentORM, DailyQuestCompletionORM,
-        LessonEnrollmentORM, FriendshipORM, ConversationORM, ChatRequestORM,
+        LessonEnrollmentORM, LessonWaitlistORM, FriendshipORM, ConversationORM, ChatRequestORM,
         AutomatedMessageLogORM, NfcTagORM, ShowerUsageORM)
+    from service_modules.community_counters import recount
+    from service_modules.community_timeline import erase_user_comments
+    from service_modules.lesson_seats import release_client_seats
+    from service_modules.message_service import forget_unread_totals
+    from service_modules.gdpr_export_service import get_gdpr_export_service
+    from sqlalchemy import literal, select, union
     import bcrypt
 
     body = await request.json()
@@ -1488,13 +1430,25 @@ async def gdpr_delete_account(request: Request, current_user: UserORM = Depends(
     uid = user.id
 
     # Delete all associated data (order matters for FK constraints)
+    get_gdpr_export_service().delete_user_exports(db, uid)
     db.query(ShowerUsageORM).filter(ShowerUsageORM.member_id == uid).delete()
     db.query(NfcTagORM).filter(NfcTagORM.member_id == uid).delete()
     db.query(AutomatedMessageLogORM).filter(AutomatedMessageLogORM.client_id == uid).delete()
     db.query(DailyQuestCompletionORM).filter(DailyQuestCompletionORM.client_id == uid).delete()
+    release_client_seats(db, uid)
+    db.query(LessonWaitlistORM).filter(LessonWaitlistORM.client_id == uid).delete()
     db.query(LessonEnrollmentORM).filter(LessonEnrollmentORM.client_id == uid).delete()
     db.query(NotificationORM).filter(NotificationORM.user_id == uid).delete()
+    # Other members' posts stop showing the user's comments in their stored feeds
+    recount(db, erase_user_comments(db, uid))
     db.query(MessageORM).filter(MessageORM.sender_id == uid).delete()
+    # Partners' unread badges are recomputed from the conversations they have left
+    forget_unread_totals(db, union(
+        select(ConversationORM.trainer_id).where(ConversationORM.client_id == uid),
+        select(ConversationORM.user1_id).where(ConversationORM.user2_id == uid),
+        select(ConversationORM.user2_id).where(ConversationORM.user1_id == uid),
+        select(literal(uid)),
+    ))
     db.query(ConversationORM).filter(
         (ConversationORM.client_id == uid) | (ConversationORM.user1_id == uid) | (ConversationORM.user2_id == uid)
     ).delete(synchronize_session=False)
@@ -1594,7 +1548,7 @@ async def read_root(request: Request, gym_id: str = "iron_gym", role: str = "cli
         "role": role,
         "mode": mode,
         "token": token,
-        "cache_buster": str(int(time.time())),  # Use timestamp directly
+        "cache_buster": CACHE_BUSTER,
         "static_build": False,
         "stripe_publishable_key": os.getenv("STRIPE_PUBLISHABLE_KEY", ""),
         "server_trainer_name": server_trainer_name,
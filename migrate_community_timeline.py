@@ -0,0 +1,39 @@
+"""
+Migration: Index the community feed and build every community timeline.
+The community_timeline tables are created by create_all at startup. Timelines not
+built here are built the first time they are read.
+"""
+from sqlalchemy import text
+from database import get_db_session
+from models_orm import CommunityPostORM
+from service_modules.community_timeline import GLOBAL_TIMELINE, ensure_timeline
+
+def migrate():
+    db = get_db_session()
+    try:
+        print("Creating community feed index...")
+        db.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_community_posts_gym_feed "
+            "ON community_posts(gym_id, is_deleted, is_pinned, created_at)"
+        ))
+        db.commit()
+        print("[OK] Index created successfully!")
+
+        gym_ids = [row[0] for row in db.query(CommunityPostORM.gym_id).filter(
+            CommunityPostORM.gym_id != None
+        ).distinct().all()]
+        print(f"Building {len(gym_ids) + 1} community timelines...")
+        for timeline in [GLOBAL_TIMELINE] + gym_ids:
+            ensure_timeline(db, timeline)
+        print("[OK] Timelines built successfully!")
+
+        print("\nMigration completed successfully!")
+
+    except Exception as e:
+        print(f"[ERROR] Migration failed: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,28 @@
+"""
+Migration: Index the lesson waitlist queue for existing databases.
+The lesson_seat_counters table is created by create_all at startup, and each lesson's
+counter is filled from its current enrollments the first time it is used.
+"""
+from sqlalchemy import text
+from database import get_db_session
+
+def migrate():
+    db = get_db_session()
+    try:
+        print("Creating waitlist queue index...")
+        db.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_lesson_waitlist_queue ON lesson_waitlist(lesson_id, status, position)"
+        ))
+        db.commit()
+        print("[OK] Index created successfully!")
+
+        print("\nMigration completed successfully!")
+
+    except Exception as e:
+        print(f"[ERROR] Migration failed: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -179,11 +179,14 @@ class TrainerData(BaseModel):
     video_library: List[Video]
     active_clients: int
     at_risk_clients: int
-    schedule: Optional[List[TrainerEvent]] = []
+    schedule: Optional[List[TrainerEvent]] = []  # Only schedule_from..schedule_to; other ranges via /api/trainer/schedule
     todays_workout: Optional[Workout] = None
     workouts: Optional[List[WorkoutTemplate]] = []
     splits: Optional[List[WeeklySplit]] = []
     streak: int = 0
+    schedule_version: Optional[str] = None  # Pass as ?since= to /api/trainer/schedule for changes only
+    schedule_from: Optional[str] = None  # Window covered by `schedule` (YYYY-MM-DD, inclusive)
+    schedule_to: Optional[str] = None
 
 # --- OWNER ---
 class Activity(BaseModel):
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Text, UniqueConstraint, Index
 from database import Base
 from datetime import datetime
 
@@ -334,6 +334,34 @@ class ClientDietLogORM(Base):
     calories = Column(Integer)
     time = Column(String)
 
+class BarcodeProductORM(Base):
+    """Barcode lookups cached from Open Food Facts, including misses (found=False) so they aren't refetched."""
+    __tablename__ = "barcode_products"
+
+    barcode = Column(String, primary_key=True)
+    found = Column(Boolean, default=True)
+    data = Column(Text, nullable=True)  # JSON: diet log fields returned by the barcode endpoint
+    source = Column(String, nullable=True)  # openfoodfacts_api
+    fetched_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+    expires_at = Column(String, nullable=False, index=True)
+
+class MealScanCacheORM(Base):
+    """Meal scan analyses keyed by the photo's perceptual hash, so near-duplicate photos skip the AI providers."""
+    __tablename__ = "meal_scan_cache"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    phash = Column(String, nullable=False)  # 64-bit dHash as 16 hex digits
+    # The hash split in four 16-bit bands: hashes within 3 bits share at least one band
+    band0 = Column(Integer, nullable=False, index=True)
+    band1 = Column(Integer, nullable=False, index=True)
+    band2 = Column(Integer, nullable=False, index=True)
+    band3 = Column(Integer, nullable=False, index=True)
+    method = Column(String, nullable=False)  # Provider that produced the analysis
+    result = Column(Text, nullable=False)  # JSON: data returned by the scan endpoint
+    hits = Column(Integer, default=0)
+    created_at = Column(String, default=lambda: datetime.utcnow().isoformat(), index=True)
+
 class ClientDailyDietSummaryORM(Base):
     """Daily diet summaries - stores end-of-day totals for metrics/history"""
     __tablename__ = "client_daily_diet_summary"
@@ -362,6 +390,25 @@ class ClientDailyDietSummaryORM(Base):
     # Daily health score (calculated from diet adherence)
     health_score = Column(Integer, default=0)
 
+class ClientActivityStateORM(Base):
+    """Materialized dashboard state per client (see service_modules/activity_state_service.py)"""
+    __tablename__ = "client_activity_state"
+
+    client_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+
+    # Day streak as of streak_date (YYYY-MM-DD)
+    day_streak = Column(Integer, default=0)
+    streak_date = Column(String, nullable=True)
+
+    # Health scores for the past days of the week starting week_start (Mon), JSON list of 7 ints
+    week_start = Column(String, nullable=True)
+    week_scores = Column(String, nullable=True)
+    week_targets = Column(String, nullable=True)  # "cal:prot:carbs:fat" the scores were computed with
+
+    # Set by schedule / daily summary writes; the next read recomputes
+    dirty = Column(Boolean, default=True)
+    updated_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+
 class ClientExerciseLogORM(Base):
     __tablename__ = "client_exercise_log"
 
@@ -402,6 +449,17 @@ class TrainerScheduleORM(Base):
     course_id = Column(String, ForeignKey("courses.id"), nullable=True, index=True)
 
 
+class TrainerScheduleChangeORM(Base):
+    """Change log of trainer_schedule rows, read by the trainer dashboard's delta sync (service_modules/schedule_sync.py)."""
+    __tablename__ = "trainer_schedule_changes"
+    __table_args__ = (Index("idx_trainer_schedule_changes_seq", "trainer_id", "seq"),)
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    trainer_id = Column(String, nullable=False)
+    entry_id = Column(Integer, nullable=False)  # trainer_schedule.id (may no longer exist)
+    changed_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+
+
 class TrainerNoteORM(Base):
     __tablename__ = "trainer_notes"
 
@@ -506,6 +564,43 @@ class PaymentORM(Base):
     created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
 
 
+class GymDailyStatsORM(Base):
+    """Per-gym daily rollup read by the owner dashboard (kept by service_modules/gym_rollups.py)."""
+    __tablename__ = "gym_daily_stats"
+
+    gym_id = Column(String, primary_key=True)
+    day = Column(String, primary_key=True)  # YYYY-MM-DD
+
+    # What happened that day
+    signups = Column(Integer, default=0, nullable=False)
+    checkins = Column(Integer, default=0, nullable=False)
+    subscription_payments = Column(Float, default=0.0, nullable=False)  # Succeeded payments
+    appointment_revenue = Column(Float, default=0.0, nullable=False)  # Paid appointments on that day
+    appointment_count = Column(Integer, default=0, nullable=False)
+    nutrition_revenue = Column(Float, default=0.0, nullable=False)
+    nutrition_count = Column(Integer, default=0, nullable=False)
+
+    # State at the end of the day; NULL until a snapshot was taken that day
+    active_members = Column(Integer, nullable=True)
+    active_subscriptions = Column(Integer, nullable=True)
+    monthly_recurring_revenue = Column(Float, nullable=True)
+
+    updated_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+
+
+class GymDailyPlanStatsORM(Base):
+    """Active subscriptions and monthly revenue per plan, for each day with a snapshot in gym_daily_stats."""
+    __tablename__ = "gym_daily_plan_stats"
+
+    gym_id = Column(String, primary_key=True)
+    day = Column(String, primary_key=True)  # YYYY-MM-DD
+    plan_id = Column(String, primary_key=True)
+    plan_name = Column(String, nullable=True)
+    currency = Column(String, nullable=True)
+    active_subscriptions = Column(Integer, default=0, nullable=False)
+    monthly_revenue = Column(Float, default=0.0, nullable=False)  # Yearly plans count 1/12 of their price
+
+
 class StripeTransferORM(Base):
     """Tracks Stripe Connect transfers for payment splitting between platform, gym, and professionals."""
     __tablename__ = "stripe_transfers"
@@ -765,6 +860,15 @@ class MessageORM(Base):
     created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
 
 
+class UserUnreadTotalORM(Base):
+    """Per-user unread message total (the badge): kept in step with the conversation unread counters."""
+    __tablename__ = "user_unread_totals"
+
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    unread_messages = Column(Integer, nullable=False, default=0)
+    updated_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+
+
 class PhysiquePhotoORM(Base):
     """Physique progress photos - visible to client and their trainer/nutritionist."""
     __tablename__ = "physique_photos"
@@ -862,6 +966,116 @@ class FCMDeviceTokenORM(Base):
     updated_at = Column(String, default=lambda: datetime.utcnow().isoformat())
 
 
+class PushOutboxORM(Base):
+    """Transactional outbox of pending push notifications, drained by the push dispatcher."""
+    __tablename__ = "push_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    title = Column(String)
+    body = Column(String)
+    data = Column(Text, nullable=True)  # JSON data payload
+    image_url = Column(String, nullable=True)
+    status = Column(String, default="pending", index=True)  # pending, sending, sent, skipped, failed
+    attempts = Column(Integer, default=0)
+    claim_token = Column(String, nullable=True, index=True)  # Set by the dispatcher that claimed the row
+    claimed_at = Column(String, nullable=True)
+    next_attempt_at = Column(String, default=lambda: datetime.utcnow().isoformat(), index=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+    sent_at = Column(String, nullable=True)
+
+
+class SchedulerLockORM(Base):
+    """Leader lease for the background job scheduler (used when Redis isn't configured)."""
+    __tablename__ = "scheduler_locks"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)  # Worker id holding the lease
+    expires_at = Column(String, nullable=False)
+
+
+class JobRunORM(Base):
+    """One run of a scheduled job. (job_name, scheduled_for) is unique so a slot runs once fleet-wide."""
+    __tablename__ = "job_runs"
+    __table_args__ = (UniqueConstraint("job_name", "scheduled_for", name="uq_job_run_slot"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_name = Column(String, nullable=False, index=True)
+    scheduled_for = Column(String, nullable=False)  # ISO slot time the run belongs to
+    worker_id = Column(String, nullable=True)
+    status = Column(String, default="running")  # running, success, failed
+    started_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+    finished_at = Column(String, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    result = Column(Text, nullable=True)  # JSON returned by the job
+    error = Column(Text, nullable=True)
+
+
+class ClientImportJobORM(Base):
+    """Bulk client import (CSV/XLSX) running in the background; polled by the owner UI."""
+    __tablename__ = "client_import_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    owner_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    filename = Column(String, nullable=True)
+    status = Column(String, default="queued")  # queued, running, completed, failed
+    total_rows = Column(Integer, default=0)
+    processed_rows = Column(Integer, default=0)
+    created_count = Column(Integer, default=0)
+    skipped_count = Column(Integer, default=0)
+    error_count = Column(Integer, default=0)
+    result = Column(Text, nullable=True)  # JSON import result (includes temp passwords; purged after 24h)
+    error = Column(Text, nullable=True)
+    created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+    finished_at = Column(String, nullable=True)
+
+
+class ImageVariantORM(Base):
+    """Size/format variants generated for an uploaded image, keyed by the URL stored on the owning row."""
+    __tablename__ = "image_variants"
+
+    url = Column(String, primary_key=True)  # Full-size JPEG URL (the value saved in profile_picture, file_path, ...)
+    owner_id = Column(String, nullable=True, index=True)
+    variants = Column(Text, nullable=False)  # JSON: {"thumb": {"width", "height", "jpg", "webp"}, "feed": ..., "full": ...}
+    created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+
+
+class MediaUploadORM(Base):
+    """Chunked (resumable) chat media upload in progress; the message is sent when it is finalized."""
+    __tablename__ = "media_uploads"
+
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    receiver_id = Column(String, nullable=False)
+    media_type = Column(String, nullable=False)  # image, video, voice
+    mime_type = Column(String, nullable=True)
+    filename = Column(String, nullable=True)  # Original client file name
+    size = Column(Integer, nullable=False)  # Declared total bytes
+    received = Column(Integer, default=0)  # Bytes written so far (next chunk offset)
+    duration = Column(Float, nullable=True)
+    temp_path = Column(String, nullable=False)  # Spool file on the instance's disk
+    status = Column(String, default="uploading")  # uploading, receiving (a chunk is being written), finalizing, completed
+    created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+    updated_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+
+
+class GdprExportJobORM(Base):
+    """GDPR data export built in the background; the ZIP is downloaded through a signed link."""
+    __tablename__ = "gdpr_export_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    status = Column(String, default="queued")  # queued, running, ready, failed
+    file_path = Column(String, nullable=True)  # ZIP on the instance's disk, once ready
+    size_bytes = Column(Integer, nullable=True)
+    row_count = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+    finished_at = Column(String, nullable=True)
+    expires_at = Column(String, nullable=True)  # The file is deleted after this
+
+
 class ChatRequestORM(Base):
     """Chat requests for private users - must be accepted before messaging."""
     __tablename__ = "chat_requests"
@@ -1027,12 +1241,14 @@ class LessonEnrollmentORM(Base):
 class LessonWaitlistORM(Base):
     """Tracks clients on waitlist for full lessons."""
     __tablename__ = "lesson_waitlist"
+    # Next in line for a lesson: first row of (lesson_id, "waiting") in position order
+    __table_args__ = (Index("idx_lesson_waitlist_queue", "lesson_id", "status", "position"),)
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     lesson_id = Column(Integer, ForeignKey("course_lessons.id", ondelete="CASCADE"), index=True)
     client_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), index=True)
 
-    position = Column(Integer)  # 1 = first in line
+    position = Column(Integer)  # Sequence from LessonSeatCounterORM.waitlist_seq: lower = earlier in line (gaps allowed)
     added_at = Column(String, default=lambda: datetime.utcnow().isoformat())
 
     # Notification tracking
@@ -1042,6 +1258,16 @@ class LessonWaitlistORM(Base):
     status = Column(String, default="waiting")  # waiting, notified, accepted, declined, expired
 
 
+class LessonSeatCounterORM(Base):
+    """Per-lesson seat counter: enrollments reserve seats with a conditional UPDATE on this row."""
+    __tablename__ = "lesson_seat_counters"
+
+    lesson_id = Column(Integer, ForeignKey("course_lessons.id", ondelete="CASCADE"), primary_key=True)
+    seats_taken = Column(Integer, nullable=False, default=0)  # Confirmed enrollments + seats held for notified waitlist entries
+    waitlist_seq = Column(Integer, nullable=False, default=0)  # Last waitlist position handed out
+    updated_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+
+
 # --- NFC SHOWER SYSTEM ---
 
 class NfcTagORM(Base):
@@ -1211,10 +1437,26 @@ class FacilityBookingORM(Base):
     updated_at = Column(String, nullable=True)
 
 
+class AvailabilityDayORM(Base):
+    """Busy minutes of one bookable resource (trainer, nutritionist, facility) on one day, as a bitmap."""
+    __tablename__ = "availability_days"
+
+    resource_type = Column(String, primary_key=True)  # trainer, nutritionist, facility
+    resource_id = Column(String, primary_key=True)
+    date = Column(String, primary_key=True)  # YYYY-MM-DD
+    busy = Column(Text, nullable=False, default="0")  # Hex bitmap: bit n set = minute n of the day is taken
+    version = Column(Integer, nullable=False, default=0)  # Bumped by every booking/calendar change on that day
+    built_version = Column(Integer, nullable=False, default=-1)  # Version `busy` reflects (stale when != version)
+    computed_at = Column(String, nullable=True)
+
+
 # --- COMMUNITY / SOCIAL FEED ---
 
 class CommunityPostORM(Base):
     __tablename__ = "community_posts"
+    __table_args__ = (
+        Index("idx_community_posts_gym_feed", "gym_id", "is_deleted", "is_pinned", "created_at"),
+    )
 
     id = Column(String, primary_key=True, index=True)  # UUID
     author_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), index=True)
@@ -1291,6 +1533,29 @@ class CommunityCommentLikeORM(Base):
     created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
 
 
+class CommunityTimelineORM(Base):
+    """Precomputed feed entry: one row per post per timeline (a gym's local feed, or "global") it shows in."""
+    __tablename__ = "community_timeline"
+    __table_args__ = (
+        Index("idx_community_timeline_page", "timeline", "is_pinned", "created_at", "post_id"),
+    )
+
+    timeline = Column(String, primary_key=True)  # gym_id, or "global"
+    post_id = Column(String, ForeignKey("community_posts.id", ondelete="CASCADE"), primary_key=True, index=True)
+    is_pinned = Column(Boolean, default=False)  # Always false on the global timeline
+    created_at = Column(String)
+    payload = Column(Text)  # JSON post dict: author snapshot, counters, first comment, gym name
+    updated_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+
+
+class CommunityTimelineStateORM(Base):
+    """Timelines that have been fully built from community_posts."""
+    __tablename__ = "community_timeline_state"
+
+    timeline = Column(String, primary_key=True)
+    built_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+
+
 # --- DATA CONSENT & AUDIT ---
 
 class DataConsentORM(Base):
@@ -0,0 +1,237 @@
+"""
+Open Food Facts offline index - compact local copy of the products members scan.
+
+Built from an Open Food Facts dump, either the CSV export
+(en.openfoodfacts.org.products.csv[.gz], tab-separated) or the JSONL export
+(openfoodfacts-products.jsonl[.gz]):
+
+    python off_index.py build <dump> [--countries italy,france,...] [--min-scans 1]
+
+Only products sold in the selected countries (EU by default) that have energy data
+are kept, with the few fields the diet log needs, in a read-only SQLite file
+(OFF_INDEX_PATH, default data/off_index.sqlite). The file is written next to the
+target and renamed into place, so running workers switch over atomically.
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Iterator, Optional
+
+import logging
+logger = logging.getLogger("gym_app")
+
+OFF_INDEX_PATH = os.environ.get("OFF_INDEX_PATH", os.path.join("data", "off_index.sqlite"))
+
+EU_COUNTRIES = (
+    "italy", "austria", "belgium", "bulgaria", "croatia", "cyprus", "czech-republic", "denmark",
+    "estonia", "finland", "france", "germany", "greece", "hungary", "ireland", "latvia", "lithuania",
+    "luxembourg", "malta", "netherlands", "poland", "portugal", "romania", "slovakia", "slovenia",
+    "spain", "sweden", "switzerland", "san-marino",
+)
+
+COLUMNS = ("barcode", "product_name", "brands", "quantity", "serving_size", "serving_quantity",
+           "kcal_100g", "energy_kj_100g", "proteins_100g", "carbohydrates_100g", "fat_100g")
+
+
+def _float(value) -> Optional[float]:
+    try:
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _open_text(path: str):
+    raw = gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+    return io.TextIOWrapper(raw, encoding="utf-8", errors="replace", newline="")
+
+
+def _read_csv(path: str) -> Iterator[dict]:
+    csv.field_size_limit(sys.maxsize)
+    with _open_text(path) as f:
+        for row in csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            yield {
+                "code": row.get("code"),
+                "product_name": row.get("product_name_it") or row.get("product_name"),
+                "brands": row.get("brands"),
+                "quantity": row.get("quantity"),
+                "serving_size": row.get("serving_size"),
+                "serving_quantity": row.get("serving_quantity"),
+                "countries": (row.get("countries_tags") or "").split(","),
+                "unique_scans_n": row.get("unique_scans_n"),
+                "nutriments": {
+                    "energy-kcal_100g": row.get("energy-kcal_100g"),
+                    "energy_100g": row.get("energy_100g"),
+                    "proteins_100g": row.get("proteins_100g"),
+                    "carbohydrates_100g": row.get("carbohydrates_100g"),
+                    "fat_100g": row.get("fat_100g"),
+                },
+            }
+
+
+def _read_jsonl(path: str) -> Iterator[dict]:
+    with _open_text(path) as f:
+        for line in f:
+            try:
+                product = json.loads(line)
+            except ValueError:
+                continue
+            yield {
+                "code": product.get("code"),
+                "product_name": product.get("product_name_it") or product.get("product_name")
+                or product.get("product_name_en"),
+                "brands": product.get("brands"),
+                "quantity": product.get("quantity"),
+                "serving_size": product.get("serving_size"),
+                "serving_quantity": product.get("serving_quantity"),
+                "countries": product.get("countries_tags") or [],
+                "unique_scans_n": product.get("unique_scans_n"),
+                "nutriments": product.get("nutriments") or {},
+            }
+
+
+def _to_row(product: dict) -> Optional[tuple]:
+    code = (product.get("code") or "").strip()
+    nutriments = product["nutriments"]
+    kcal, kj = _float(nutriments.get("energy-kcal_100g")), _float(nutriments.get("energy_100g"))
+    if not code.isdigit() or (kcal is None and kj is None):
+        return None
+    return (
+        code, product.get("product_name") or None, product.get("brands") or None,
+        product.get("quantity") or None, product.get("serving_size") or None,
+        _float(product.get("serving_quantity")), kcal, kj,
+        _float(nutriments.get("proteins_100g")), _float(nutriments.get("carbohydrates_100g")),
+        _float(nutriments.get("fat_100g")),
+    )
+
+
+def build_index(dump_path: str, index_path: str = OFF_INDEX_PATH, countries=EU_COUNTRIES,
+                min_scans: int = 0, batch_size: int = 10000) -> int:
+    """Build the index from a dump; returns the number of products kept."""
+    reader = _read_jsonl if ".jsonl" in os.path.basename(dump_path) else _read_csv
+    wanted = {f"en:{c.strip().lower()}" for c in countries if c.strip()}
+
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    tmp_path = f"{index_path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute(f"CREATE TABLE products ({COLUMNS[0]} TEXT PRIMARY KEY, "
+                     f"{', '.join(c + ' ' + ('REAL' if c.endswith(('_100g', '_quantity')) else 'TEXT') for c in COLUMNS[1:])}"
+                     f") WITHOUT ROWID")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        insert = f"INSERT OR REPLACE INTO products VALUES ({', '.join('?' * len(COLUMNS))})"
+
+        kept, seen, batch = 0, 0, []
+        for product in reader(dump_path):
+            seen += 1
+            if wanted and not wanted.intersection(product["countries"]):
+                continue
+            if min_scans and (_float(product.get("unique_scans_n")) or 0) < min_scans:
+                continue
+            row = _to_row(product)
+            if row is None:
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                conn.executemany(insert, batch)
+                kept += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(insert, batch)
+            kept += len(batch)
+
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("built_at", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())),
+            ("source", os.path.basename(dump_path)),
+            ("products", str(kept)),
+        ])
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp_path, index_path)
+    logger.info(f"Open Food Facts index: kept {kept} of {seen} products in {index_path}")
+    return kept
+
+
+class OffIndex:
+    """Read-only lookups in the index file; reopens it when a rebuild replaces the file."""
+
+    def __init__(self, path: str = OFF_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.mtime != mtime:
+            if conn is not None:
+                conn.close()
+            # One connection per thread (lookups run in the DB thread pool)
+            conn = sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True)
+            self._local.conn, self._local.mtime = conn, mtime
+        return conn
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(self.path)
+
+    def get(self, barcode: str) -> Optional[dict]:
+        """The product in Open Food Facts API shape (product_name, nutriments, ...), or None."""
+        conn = self._connection()
+        if conn is None:
+            return None
+        row = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM products WHERE barcode = ?", (barcode,)).fetchone()
+        if row is None:
+            return None
+        values = dict(zip(COLUMNS, row))
+        return {
+            "product_name": values["product_name"],
+            "brands": values["brands"] or "",
+            "quantity": values["quantity"] or "",
+            "serving_size": values["serving_size"],
+            "serving_quantity": values["serving_quantity"],
+            "nutriments": {
+                "energy-kcal_100g": values["kcal_100g"],
+                "energy_100g": values["energy_kj_100g"],
+                "proteins_100g": values["proteins_100g"],
+                "carbohydrates_100g": values["carbohydrates_100g"],
+                "fat_100g": values["fat_100g"],
+            },
+        }
+
+    def info(self) -> dict:
+        conn = self._connection()
+        if conn is None:
+            return {"available": False}
+        return {"available": True, **dict(conn.execute("SELECT key, value FROM meta").fetchall())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline Open Food Facts barcode index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="build the index from a CSV or JSONL dump")
+    build.add_argument("dump")
+    build.add_argument("--output", default=OFF_INDEX_PATH)
+    build.add_argument("--countries", default=",".join(EU_COUNTRIES),
+                       help="comma-separated Open Food Facts country tags without 'en:' (empty: all)")
+    build.add_argument("--min-scans", type=int, default=0, help="keep products scanned at least this often")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = build_index(args.dump, args.output, args.countries.split(","), args.min_scans)
+    size = os.path.getsize(args.output)
+    print(f"{count} products, {size / 1e6:.1f} MB -> {args.output}")
@@ -0,0 +1,279 @@
+"""
+Principal Cache - short-lived, per-worker cache of authenticated identities.
+
+Every authenticated request used to run one query for the user row in
+get_current_user, and one or two more for the gym id (gym_context.resolve_gym_id,
+authorization.get_user_gym_id). This module keeps the identity columns of the user
+(keyed by the token's session id) and the resolved gym ids (keyed by user id) in a
+size-bounded LRU with a short TTL, so a typical request does no identity queries.
+
+A cache hit is merged into the request session with load=False: the user object is
+a normal persistent instance, so routes can still modify and commit it, and any
+column not cached here is loaded on first access.
+
+Entries are dropped when active_session_id, role or gym assignment change:
+- in this worker, by the mapper events at the bottom of this module
+- in other workers, through a Redis pub/sub message when REDIS_URL is set
+The TTL bounds staleness for writes that bypass the ORM (bulk UPDATEs, raw SQL).
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from models_orm import UserORM, ClientProfileORM, GymORM
+
+import logging
+logger = logging.getLogger("gym_app")
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "15"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+REDIS_URL = os.getenv("REDIS_URL")
+INVALIDATION_CHANNEL = "gym_principal_invalidate"
+
+# Columns needed to authenticate and authorize a request. Everything else on the
+# user row is loaded lazily (one SELECT) by the few routes that read it.
+IDENTITY_COLUMNS = (
+    "id", "username", "role", "sub_role", "is_active", "is_approved",
+    "gym_owner_id", "active_session_id", "must_change_password",
+)
+
+
+class PrincipalCache:
+    """Thread-safe LRU of user identity snapshots and resolved gym ids, with TTL."""
+
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, max_size: int = PRINCIPAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._users: "OrderedDict[str, tuple]" = OrderedDict()   # key -> (expires, user_id, values)
+        self._gyms: "OrderedDict[tuple, tuple]" = OrderedDict()  # (user_id, slot) -> (expires, gym_id)
+        self._keys_by_user: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def principal_key(username: str, sid: Optional[str]) -> str:
+        return f"{sid or ''}:{username}"
+
+    def _get(self, store: OrderedDict, key) -> tuple:
+        entry = store.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del store[key]
+            return None
+        store.move_to_end(key)
+        return entry
+
+    def _evict(self, store: OrderedDict):
+        while len(store) > self.max_size:
+            store.popitem(last=False)
+
+    # --- Users ---
+
+    def get_user(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._get(self._users, key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[2]
+
+    def put_user(self, key: str, user: UserORM):
+        values = {name: getattr(user, name) for name in IDENTITY_COLUMNS}
+        with self._lock:
+            self._users[key] = (time.monotonic() + self.ttl, user.id, values)
+            self._users.move_to_end(key)
+            self._keys_by_user.setdefault(user.id, set()).add(key)
+            self._evict(self._users)
+
+    def attach(self, db: Session, values: dict) -> UserORM:
+        """Return a persistent UserORM in `db` built from cached values, without a query."""
+        user = UserORM(**values)
+        make_transient_to_detached(user)
+        return db.merge(user, load=False)
+
+    # --- Gym ids ---
+
+    def get_gym(self, user_id: str, slot) -> tuple:
+        """Return (found, gym_id) for a cached gym resolution."""
+        with self._lock:
+            entry = self._get(self._gyms, (user_id, slot))
+            return (True, entry[1]) if entry else (False, None)
+
+    def put_gym(self, user_id: str, slot, gym_id: Optional[str]):
+        with self._lock:
+            self._gyms[(user_id, slot)] = (time.monotonic() + self.ttl, gym_id)
+            self._gyms.move_to_end((user_id, slot))
+            self._evict(self._gyms)
+
+    def gym_id(self, user_id: str, slot, loader: Callable[[], Any]):
+        found, gym_id = self.get_gym(user_id, slot)
+        if found:
+            return gym_id
+        gym_id = loader()
+        self.put_gym(user_id, slot, gym_id)
+        return gym_id
+
+    # --- Invalidation ---
+
+    def invalidate_user(self, user_id: str):
+        with self._lock:
+            for key in self._keys_by_user.pop(user_id, ()):
+                self._users.pop(key, None)
+            for key in [k for k in self._gyms if k[0] == user_id]:
+                del self._gyms[key]
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._gyms.clear()
+            self._keys_by_user.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+# --- Cross-worker invalidation ---
+
+_publisher = None
+
+
+def _publish_invalidation(user_ids: set):
+    global _publisher
+    if not REDIS_URL:
+        return
+    try:
+        if _publisher is None:
+            import redis
+            _publisher = redis.Redis.from_url(REDIS_URL)
+        _publisher.publish(INVALIDATION_CHANNEL, json.dumps(sorted(user_ids)))
+    except Exception as e:
+        logger.warning(f"Principal cache invalidation publish failed: {e}")
+
+
+async def listen_for_invalidations():
+    """Drop entries invalidated by other workers. Runs until cancelled."""
+    import redis.asyncio as aioredis
+    client = aioredis.from_url(REDIS_URL, decode_responses=True)
+    while True:
+        try:
+            pubsub = client.pubsub()
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                for user_id in json.loads(message["data"]):
+                    principal_cache.invalidate_user(user_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Entries may be stale until the subscription is back; start from empty
+            logger.warning(f"Principal cache invalidation listener error: {e}")
+            principal_cache.clear()
+            await asyncio.sleep(1)
+
+
+_listener_task: Optional[asyncio.Task] = None
+
+
+async def start_invalidation_listener():
+    global _listener_task
+    if REDIS_URL and _listener_task is None:
+        _listener_task = asyncio.create_task(listen_for_invalidations())
+
+
+async def stop_invalidation_listener():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _listener_task = None
+
+
+# --- Change tracking ---
+# Entries are dropped at flush (so this worker never serves a value older than the
+# pending write) and again after commit, because another request may have re-cached
+# the old row between the flush and the commit.
+
+def _invalidate(user_ids) -> set:
+    user_ids = {u for u in user_ids if u}
+    for user_id in user_ids:
+        principal_cache.invalidate_user(user_id)
+    return user_ids
+
+
+def _track(target, user_ids):
+    session = Session.object_session(target)
+    user_ids = _invalidate(user_ids)
+    if session is not None and user_ids:
+        session.info.setdefault("principal_invalidate", set()).update(user_ids)
+
+
+def _changed(target, *names) -> bool:
+    state = inspect(target)
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+def _previous(target, name) -> set:
+    history = inspect(target).attrs[name].history
+    return set(history.deleted or ()) | set(history.added or ()) | {getattr(target, name)}
+
+
+@event.listens_for(UserORM, "after_update")
+def _user_updated(mapper, connection, target):
+    if _changed(target, *IDENTITY_COLUMNS):
+        _track(target, {target.id})
+
+
+@event.listens_for(UserORM, "after_delete")
+def _user_deleted(mapper, connection, target):
+    _track(target, {target.id})
+
+
+@event.listens_for(ClientProfileORM, "after_insert")
+@event.listens_for(ClientProfileORM, "after_delete")
+def _profile_added_or_removed(mapper, connection, target):
+    _track(target, {target.id})
+
+
+@event.listens_for(ClientProfileORM, "after_update")
+def _profile_updated(mapper, connection, target):
+    if _changed(target, "gym_id"):
+        _track(target, {target.id})
+
+
+@event.listens_for(GymORM, "after_insert")
+@event.listens_for(GymORM, "after_delete")
+def _gym_added_or_removed(mapper, connection, target):
+    _track(target, {target.owner_id})
+
+
+@event.listens_for(GymORM, "after_update")
+def _gym_updated(mapper, connection, target):
+    if _changed(target, "owner_id", "is_active", "created_at"):
+        _track(target, _previous(target, "owner_id"))
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    user_ids = session.info.pop("principal_invalidate", None)
+    if user_ids:
+        _invalidate(user_ids)
+        _publish_invalidation(user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("principal_invalidate", None)
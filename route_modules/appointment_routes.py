@@ -9,7 +9,7 @@ from models import (
     BookAppointmentRequest, UpdateAvailabilityRequest,
     CancelAppointmentRequest
 )
-from database import get_db_session
+from database import get_db_session, run_sync
 from models_orm import UserORM, AppointmentORM, StripeTransferORM
 
 router = APIRouter()
@@ -120,7 +120,7 @@ async def accept_appointment(
 ):
     """Trainer accepts a pending appointment."""
     _require_staff(user)
-    return service.trainer_accept_appointment(appointment_id, user.id)
+    return await run_sync(service.trainer_accept_appointment, appointment_id, user.id)
 
 
 @router.post("/api/trainer/appointments/{appointment_id}/decline")
@@ -133,7 +133,7 @@ async def decline_appointment(
     """Trainer declines a pending appointment. Auto-refunds card payments."""
     _require_staff(user)
     reason = request.get("reason") if request else None
-    return service.trainer_decline_appointment(appointment_id, user.id, reason)
+    return await run_sync(service.trainer_decline_appointment, appointment_id, user.id, reason)
 
 
 @router.get("/api/trainer/appointments/pending")
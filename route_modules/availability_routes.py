@@ -0,0 +1,26 @@
+"""
+Availability Routes - free-slot search across several trainers, nutritionists or facilities.
+"""
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from auth import get_current_user
+from database import run_sync
+from service_modules.availability_engine import get_free_slots
+
+router = APIRouter()
+
+
+@router.get("/api/availability/slots")
+async def search_available_slots(
+    resource_type: str,  # trainer, nutritionist, facility
+    ids: str,  # Comma-separated resource ids
+    start: Optional[str] = None,  # YYYY-MM-DD, default today
+    days: int = 14,
+    user = Depends(get_current_user)
+):
+    """Free slots for every listed resource over the next `days` days (paints the booking week view in one call)."""
+    resource_ids = [i.strip() for i in ids.split(",") if i.strip()]
+    if user.role != "client" and resource_ids != [user.id]:
+        raise HTTPException(status_code=403, detail="Only clients can view other staff members' slots")
+
+    return await run_sync(get_free_slots, resource_type, resource_ids, start, days)
@@ -6,7 +6,7 @@ from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from auth import get_current_user
 from models_orm import UserORM
 from service_modules.client_import_service import get_client_import_service, ClientImportService
-from database import get_db as _get_db_dep
+from database import get_db as _get_db_dep, run_sync
 from sqlalchemy.orm import Session
 import logging
 
@@ -18,17 +18,8 @@ MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 ALLOWED_EXTENSIONS = ('.csv', '.xlsx', '.xls')
 
 
-@router.post("/api/owner/import-clients")
-async def import_clients_csv(
-    file: UploadFile = File(...),
-    user: UserORM = Depends(get_current_user),
-    service: ClientImportService = Depends(get_client_import_service)
-):
-    """Import clients from CSV or Excel file. Owner only.
-    Auto-detects source platform (Golee, BookyWay, Gymdesk, etc.)."""
-    if user.role != "owner":
-        raise HTTPException(status_code=403, detail="Only gym owners can import clients")
-
+async def _read_import_file(file: UploadFile) -> bytes:
+    """Validate the upload and return CSV bytes (Excel is converted in memory)."""
     filename = (file.filename or '').lower()
     if not any(filename.endswith(ext) for ext in ALLOWED_EXTENSIONS):
         raise HTTPException(status_code=400, detail="Formati accettati: CSV, XLSX, XLS")
@@ -42,30 +33,30 @@ async def import_clients_csv(
     # Convert Excel to CSV in memory if needed
     if filename.endswith('.xlsx') or filename.endswith('.xls'):
         try:
-            import openpyxl
-            import io
-            wb = openpyxl.load_workbook(io.BytesIO(content), read_only=True)
-            ws = wb.active
-            output = io.StringIO()
-            import csv
-            writer = csv.writer(output)
-            for row in ws.iter_rows(values_only=True):
-                writer.writerow([str(cell) if cell is not None else '' for cell in row])
-            content = output.getvalue().encode('utf-8')
-            wb.close()
+            content = await run_sync(_excel_to_csv, content)
         except ImportError:
             raise HTTPException(status_code=400, detail="Formato Excel non supportato su questo server. Converti in CSV.")
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Errore lettura Excel: {str(e)}")
+    return content
 
-    result = service.process_csv(content, owner_id=user.id)
 
-    logger.info(
-        f"Client import by owner {user.id} (platform: {result.get('platform_detected', '?')}): "
-        f"{result['created']} created, {result['skipped']} skipped, "
-        f"{len(result['errors'])} errors"
-    )
+def _excel_to_csv(content: bytes) -> bytes:
+    import openpyxl
+    import io
+    import csv
+    wb = openpyxl.load_workbook(io.BytesIO(content), read_only=True)
+    ws = wb.active
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for row in ws.iter_rows(values_only=True):
+        writer.writerow([str(cell) if cell is not None else '' for cell in row])
+    wb.close()
+    return output.getvalue().encode('utf-8')
 
+
+def _build_import_response(result: dict, user: UserORM) -> dict:
+    """Add gym code and WhatsApp invite links to an import result."""
     # Get gym code for WhatsApp invite links
     from models_orm import GymORM
     from database import get_db_session as _get_db
@@ -111,6 +102,64 @@ async def import_clients_csv(
     }
 
 
+@router.post("/api/owner/import-clients")
+async def import_clients_csv(
+    file: UploadFile = File(...),
+    user: UserORM = Depends(get_current_user),
+    service: ClientImportService = Depends(get_client_import_service)
+):
+    """Import clients from CSV or Excel file. Owner only.
+    Auto-detects source platform (Golee, BookyWay, Gymdesk, etc.).
+    For large files use /api/owner/import-clients/jobs instead."""
+    if user.role != "owner":
+        raise HTTPException(status_code=403, detail="Only gym owners can import clients")
+
+    content = await _read_import_file(file)
+    result = await run_sync(service.process_csv, content, user.id)
+
+    logger.info(
+        f"Client import by owner {user.id} (platform: {result.get('platform_detected', '?')}): "
+        f"{result['created']} created, {result['skipped']} skipped, "
+        f"{len(result['errors'])} errors"
+    )
+
+    return await run_sync(_build_import_response, result, user)
+
+
+@router.post("/api/owner/import-clients/jobs")
+async def start_import_job(
+    file: UploadFile = File(...),
+    user: UserORM = Depends(get_current_user),
+    service: ClientImportService = Depends(get_client_import_service)
+):
+    """Start a background client import. Poll GET /api/owner/import-clients/jobs/{job_id} for progress."""
+    if user.role != "owner":
+        raise HTTPException(status_code=403, detail="Only gym owners can import clients")
+
+    content = await _read_import_file(file)
+    job_id = await run_sync(service.start_import_job, content, user.id, file.filename)
+    logger.info(f"Client import job {job_id} started by owner {user.id} ({file.filename})")
+    return {"job_id": job_id, "status": "queued"}
+
+
+@router.get("/api/owner/import-clients/jobs/{job_id}")
+async def get_import_job(
+    job_id: str,
+    user: UserORM = Depends(get_current_user),
+    service: ClientImportService = Depends(get_client_import_service)
+):
+    """Progress of a background import; includes the full import result once completed."""
+    if user.role != "owner":
+        raise HTTPException(status_code=403, detail="Only gym owners can import clients")
+
+    job = await run_sync(service.get_import_job, job_id, user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    if job["result"] is not None:
+        job["result"] = await run_sync(_build_import_response, job["result"], user)
+    return job
+
+
 @router.post("/api/owner/send-credentials-bulk")
 async def send_credentials_bulk(
     data: dict,
@@ -8,7 +8,7 @@ from datetime import datetime
 from sqlalchemy.orm import Session
 import hashlib, time, logging, traceback
 from auth import get_current_user
-from database import get_db, get_db_session
+from database import get_db, get_db_session, run_sync
 from authorization import authorize_client_access
 
 logger = logging.getLogger("gym_app")
@@ -56,7 +56,8 @@ async def get_client_data(
     """Get client's own data (current user)."""
     try:
         workout_service = get_workout_service()
-        return service.get_client(
+        return await run_sync(
+            service.get_client,
             current_user.id,
             get_workout_details_fn=workout_service.get_workout_details
         )
@@ -76,10 +77,13 @@ async def get_client_for_trainer(
     db: Session = Depends(get_db)
 ):
     """Get a specific client's data (trainer access)."""
-    authorize_client_access(current_user, client_id, "training_data", "view",
-                            "/api/trainer/client/{client_id}", db, request)
+    await run_sync(
+        authorize_client_access, current_user, client_id, "training_data", "view",
+        "/api/trainer/client/{client_id}", db, request
+    )
     workout_service = get_workout_service()
-    return service.get_client(
+    return await run_sync(
+        service.get_client,
         client_id,
         get_workout_details_fn=workout_service.get_workout_details
     )
@@ -92,7 +96,7 @@ async def update_client_profile(
     current_user: UserORM = Depends(get_current_user)
 ):
     """Update a client's profile information."""
-    return service.update_client_profile(profile_update, current_user.id)
+    return await run_sync(service.update_client_profile, profile_update, current_user.id)
 
 
 @router.get("/api/client/weight-history")
@@ -102,7 +106,7 @@ async def get_weight_history(
     current_user: UserORM = Depends(get_current_user)
 ):
     """Get client's weight history for charting."""
-    return service.get_weight_history(current_user.id, period)
+    return await run_sync(service.get_weight_history, current_user.id, period)
 
 
 @router.get("/api/client/strength-progress")
@@ -112,7 +116,7 @@ async def get_strength_progress(
     current_user: UserORM = Depends(get_current_user)
 ):
     """Get client's strength progress based on exercise weight increases."""
-    return service.get_strength_progress(current_user.id, period)
+    return await run_sync(service.get_strength_progress, current_user.id, period)
 
 
 @router.get("/api/client/exercise-details")
@@ -123,7 +127,7 @@ async def get_exercise_details(
     current_user: UserORM = Depends(get_current_user)
 ):
     """Get detailed exercise history for a specific category."""
-    return service.get_exercise_details(current_user.id, category, period)
+    return await run_sync(service.get_exercise_details, current_user.id, category, period)
 
 
 @router.get("/api/trainer/client/{client_id}/weight-history")
@@ -136,9 +140,11 @@ async def get_client_weight_history_for_trainer(
     db: Session = Depends(get_db)
 ):
     """Get a client's weight history (trainer access)."""
-    authorize_client_access(current_user, client_id, "weight", "view",
-                            "/api/trainer/client/{client_id}/weight-history", db, request)
-    return service.get_weight_history(client_id, period)
+    await run_sync(
+        authorize_client_access, current_user, client_id, "weight", "view",
+        "/api/trainer/client/{client_id}/weight-history", db, request
+    )
+    return await run_sync(service.get_weight_history, client_id, period)
 
 
 @router.get("/api/trainer/client/{client_id}/strength-progress")
@@ -151,9 +157,11 @@ async def get_client_strength_progress_for_trainer(
     db: Session = Depends(get_db)
 ):
     """Get a client's strength progress (trainer access)."""
-    authorize_client_access(current_user, client_id, "training_data", "view",
-                            "/api/trainer/client/{client_id}/strength-progress", db, request)
-    return service.get_strength_progress(client_id, period)
+    await run_sync(
+        authorize_client_access, current_user, client_id, "training_data", "view",
+        "/api/trainer/client/{client_id}/strength-progress", db, request
+    )
+    return await run_sync(service.get_strength_progress, client_id, period)
 
 
 @router.get("/api/trainer/client/{client_id}/diet-consistency")
@@ -166,9 +174,11 @@ async def get_client_diet_consistency_for_trainer(
     db: Session = Depends(get_db)
 ):
     """Get a client's diet consistency data (trainer access)."""
-    authorize_client_access(current_user, client_id, "diet", "view",
-                            "/api/trainer/client/{client_id}/diet-consistency", db, request)
-    return service.get_diet_consistency(client_id, period)
+    await run_sync(
+        authorize_client_access, current_user, client_id, "diet", "view",
+        "/api/trainer/client/{client_id}/diet-consistency", db, request
+    )
+    return await run_sync(service.get_diet_consistency, client_id, period)
 
 
 @router.get("/api/trainer/client/{client_id}/week-streak")
@@ -180,9 +190,11 @@ async def get_client_week_streak_for_trainer(
     db: Session = Depends(get_db)
 ):
     """Get a client's week streak data (trainer access)."""
-    authorize_client_access(current_user, client_id, "training_data", "view",
-                            "/api/trainer/client/{client_id}/week-streak", db, request)
-    return service.get_week_streak_data(client_id)
+    await run_sync(
+        authorize_client_access, current_user, client_id, "training_data", "view",
+        "/api/trainer/client/{client_id}/week-streak", db, request
+    )
+    return await run_sync(service.get_week_streak_data, client_id)
 
 
 @router.post("/api/trainer/client/{client_id}/toggle_premium")
@@ -195,9 +207,11 @@ async def toggle_client_premium(
 ):
     """Toggle premium status for a client (trainer access)."""
     # No sensitive scope — just gym isolation check
-    authorize_client_access(current_user, client_id, None, "update",
-                            "/api/trainer/client/{client_id}/toggle_premium", db, request)
-    return service.toggle_premium_status(client_id)
+    await run_sync(
+        authorize_client_access, current_user, client_id, None, "update",
+        "/api/trainer/client/{client_id}/toggle_premium", db, request
+    )
+    return await run_sync(service.toggle_premium_status, client_id)
 
 
 @router.get("/api/trainer/client/{client_id}/strength-goals")
@@ -208,8 +222,10 @@ async def get_client_strength_goals(
     db: Session = Depends(get_db)
 ):
     """Get a client's strength goals (trainer access)."""
-    authorize_client_access(current_user, client_id, "training_data", "view",
-                            "/api/trainer/client/{client_id}/strength-goals", db, request)
+    await run_sync(
+        authorize_client_access, current_user, client_id, "training_data", "view",
+        "/api/trainer/client/{client_id}/strength-goals", db, request
+    )
 
     profile = db.query(ClientProfileORM).filter(ClientProfileORM.id == client_id).first()
     if not profile:
@@ -230,8 +246,10 @@ async def set_client_strength_goals(
     db: Session = Depends(get_db)
 ):
     """Set strength goals for a client (trainer access)."""
-    authorize_client_access(current_user, client_id, "training_data", "update",
-                            "/api/trainer/client/{client_id}/strength-goals", db, request)
+    await run_sync(
+        authorize_client_access, current_user, client_id, "training_data", "update",
+        "/api/trainer/client/{client_id}/strength-goals", db, request
+    )
 
     profile = db.query(ClientProfileORM).filter(ClientProfileORM.id == client_id).first()
     if not profile:
@@ -260,7 +278,7 @@ async def toggle_quest_completion(
     current_user: UserORM = Depends(get_current_user)
 ):
     """Toggle a daily quest completion status."""
-    return service.toggle_quest_completion(current_user.id, request.quest_index)
+    return await run_sync(service.toggle_quest_completion, current_user.id, request.quest_index)
 
 
 # ============ PRIVACY SETTINGS ============
@@ -3,10 +3,11 @@ Community Routes - Social feed, posts, likes, comments.
 """
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
 from auth import get_current_user
+from database import run_sync
 from models import CommunityPostCreate, CommunityCommentCreate
 from models_orm import UserORM
 from service_modules.community_service import CommunityService, get_community_service
-from service_modules.upload_helper import save_file, _optimize_image, ALLOWED_IMAGE_EXTENSIONS, MAX_IMAGE_SIZE
+from service_modules.upload_helper import save_file, save_image, ALLOWED_IMAGE_EXTENSIONS, MAX_IMAGE_SIZE
 import uuid
 import os
 import logging
@@ -32,7 +33,7 @@ async def get_community_feed(
     """Get the community feed — local (gym) or global."""
     if scope not in ("local", "global"):
         raise HTTPException(status_code=400, detail="scope must be 'local' or 'global'")
-    return service.get_feed(current_user.id, scope=scope, cursor=cursor, limit=limit)
+    return await run_sync(service.get_feed, current_user.id, scope=scope, cursor=cursor, limit=limit)
 
 
 @router.get("/api/community/my-posts")
@@ -43,7 +44,7 @@ async def get_my_posts(
     service: CommunityService = Depends(get_community_service),
 ):
     """Get posts by the current user."""
-    return service.get_user_posts(current_user.id, cursor=cursor, limit=limit)
+    return await run_sync(service.get_user_posts, current_user.id, cursor=cursor, limit=limit)
 
 
 @router.get("/api/community/liked-posts")
@@ -54,7 +55,7 @@ async def get_liked_posts(
     service: CommunityService = Depends(get_community_service),
 ):
     """Get posts liked by the current user."""
-    return service.get_liked_posts(current_user.id, cursor=cursor, limit=limit)
+    return await run_sync(service.get_liked_posts, current_user.id, cursor=cursor, limit=limit)
 
 
 @router.post("/api/community/posts")
@@ -85,18 +86,18 @@ async def create_community_post(
 
         # Optimize image
         try:
-            optimized, ext = _optimize_image(raw, max_size=(1200, 1200), crop_square=False)
+            image_url, _ = await save_image(raw, "community", uuid.uuid4().hex, max_size=(1200, 1200),
+                                            owner_id=current_user.id)
         except Exception as e:
             logger.warning("Image optimization failed, using original: %s", e)
-            optimized, ext = raw, os.path.splitext(image.filename)[1].lstrip(".")
-
-        filename = f"{uuid.uuid4().hex}.{ext}"
-        image_url = await save_file(optimized, "community", filename)
+            ext = os.path.splitext(image.filename)[1].lstrip(".")
+            image_url = await save_file(raw, "community", f"{uuid.uuid4().hex}.{ext}")
 
         if post_type == "text":
             post_type = "image"
 
-    return service.create_post(
+    return await run_sync(
+        service.create_post,
         author_id=current_user.id,
         post_type=post_type,
         scope=scope,
@@ -119,7 +120,7 @@ async def delete_community_post(
     service: CommunityService = Depends(get_community_service),
 ):
     """Delete a community post."""
-    return service.delete_post(post_id, current_user.id)
+    return await run_sync(service.delete_post, post_id, current_user.id)
 
 
 @router.post("/api/community/posts/{post_id}/like")
@@ -129,7 +130,7 @@ async def toggle_post_like(
     service: CommunityService = Depends(get_community_service),
 ):
     """Toggle like on a post."""
-    return service.toggle_like(post_id, current_user.id)
+    return await run_sync(service.toggle_like, post_id, current_user.id)
 
 
 @router.get("/api/community/posts/{post_id}/comments")
@@ -141,7 +142,7 @@ async def get_post_comments(
     service: CommunityService = Depends(get_community_service),
 ):
     """Get comments for a post."""
-    return service.get_comments(post_id, current_user.id, cursor=cursor, limit=limit)
+    return await run_sync(service.get_comments, post_id, current_user.id, cursor=cursor, limit=limit)
 
 
 @router.post("/api/community/posts/{post_id}/comments")
@@ -152,7 +153,7 @@ async def add_post_comment(
     service: CommunityService = Depends(get_community_service),
 ):
     """Add a comment to a post."""
-    return service.add_comment(post_id, current_user.id, data.content, data.parent_comment_id)
+    return await run_sync(service.add_comment, post_id, current_user.id, data.content, data.parent_comment_id)
 
 
 @router.delete("/api/community/comments/{comment_id}")
@@ -162,7 +163,7 @@ async def delete_comment(
     service: CommunityService = Depends(get_community_service),
 ):
     """Delete a comment."""
-    return service.delete_comment(comment_id, current_user.id)
+    return await run_sync(service.delete_comment, comment_id, current_user.id)
 
 
 @router.post("/api/community/comments/{comment_id}/like")
@@ -172,7 +173,7 @@ async def toggle_comment_like(
     service: CommunityService = Depends(get_community_service),
 ):
     """Toggle like on a comment."""
-    return service.toggle_comment_like(comment_id, current_user.id)
+    return await run_sync(service.toggle_comment_like, comment_id, current_user.id)
 
 
 @router.post("/api/community/posts/{post_id}/participate")
@@ -182,7 +183,7 @@ async def toggle_event_participation(
     service: CommunityService = Depends(get_community_service),
 ):
     """Toggle participation in a community event."""
-    return service.toggle_event_participation(post_id, current_user.id)
+    return await run_sync(service.toggle_event_participation, post_id, current_user.id)
 
 
 @router.post("/api/community/posts/{post_id}/pin")
@@ -192,4 +193,4 @@ async def pin_post(
     service: CommunityService = Depends(get_community_service),
 ):
     """Pin/unpin a post (owner only)."""
-    return service.pin_post(post_id, current_user.id)
+    return await run_sync(service.pin_post, post_id, current_user.id)
@@ -3,6 +3,7 @@ Course Routes - API endpoints for course management.
 """
 from fastapi import APIRouter, Depends
 from auth import get_current_user
+from database import run_sync
 from models_orm import UserORM
 from service_modules.course_service import CourseService, get_course_service
 
@@ -167,7 +168,7 @@ async def enroll_in_lesson(
     current_user: UserORM = Depends(get_current_user)
 ):
     """Enroll in a lesson. If full, adds to waitlist."""
-    return service.enroll_in_lesson(lesson_id, current_user.id)
+    return await run_sync(service.enroll_in_lesson, lesson_id, current_user.id)
 
 
 @router.post("/api/lessons/{lesson_id}/cancel")
@@ -177,7 +178,7 @@ async def cancel_enrollment(
     current_user: UserORM = Depends(get_current_user)
 ):
     """Cancel enrollment in a lesson."""
-    return service.cancel_enrollment(lesson_id, current_user.id)
+    return await run_sync(service.cancel_enrollment, lesson_id, current_user.id)
 
 
 @router.post("/api/waitlist/{waitlist_id}/accept")
@@ -188,7 +189,7 @@ async def accept_waitlist_spot(
     current_user: UserORM = Depends(get_current_user)
 ):
     """Accept a waitlist spot when notified."""
-    return service.accept_waitlist_spot(waitlist_id, current_user.id, add_to_calendar)
+    return await run_sync(service.accept_waitlist_spot, waitlist_id, current_user.id, add_to_calendar)
 
 
 @router.post("/api/waitlist/{waitlist_id}/decline")
@@ -198,7 +199,7 @@ async def decline_waitlist_spot(
     current_user: UserORM = Depends(get_current_user)
 ):
     """Decline a waitlist spot."""
-    return service.decline_waitlist_spot(waitlist_id, current_user.id)
+    return await run_sync(service.decline_waitlist_spot, waitlist_id, current_user.id)
 
 
 @router.get("/api/trainer/lessons/{lesson_id}/enrollments")
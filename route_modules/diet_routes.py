@@ -4,11 +4,13 @@ Diet Routes - API endpoints for diet management, meal scanning, and logging.
 from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 from auth import get_current_user
-from database import get_db, get_db_session
+from database import get_db, get_db_session, run_sync
 from authorization import authorize_client_access
 from models import AssignDietRequest, SelfAssignDietRequest, SetWeeklyMealPlanRequest, ClientAddMealRequest
 from models_orm import UserORM, WeeklyMealPlanORM, ClientDietLogORM, ClientDietSettingsORM, WeightHistoryORM, ClientProfileORM
 from service_modules.diet_service import DietService, get_diet_service
+from service_modules.barcode_service import BarcodeService, get_barcode_service
+from service_modules.meal_scan_service import MealScanService, get_meal_scan_service
 from datetime import datetime, date
 
 router = APIRouter()
@@ -17,23 +19,34 @@ router = APIRouter()
 @router.post("/api/client/diet/scan")
 async def scan_meal(
     file: UploadFile = File(...),
-    service: DietService = Depends(get_diet_service),
+    service: MealScanService = Depends(get_meal_scan_service),
     current_user: UserORM = Depends(get_current_user)
 ):
     """Scan a meal image using AI to estimate nutritional content."""
     # Read file bytes
     content = await file.read()
-    return service.scan_meal(content)
+    return await service.scan(content, current_user.id)
 
 
 @router.get("/api/client/diet/barcode/{barcode}")
 async def lookup_barcode(
     barcode: str,
-    service: DietService = Depends(get_diet_service),
+    service: BarcodeService = Depends(get_barcode_service),
+    current_user: UserORM = Depends(get_current_user)
+):
+    """Look up a product by barcode: local caches and index first, then Open Food Facts."""
+    return await service.lookup(barcode)
+
+
+@router.get("/api/diet/barcode-cache/stats")
+async def barcode_cache_stats(
+    service: BarcodeService = Depends(get_barcode_service),
     current_user: UserORM = Depends(get_current_user)
 ):
-    """Look up a product by barcode using Open Food Facts."""
-    return service.lookup_barcode(barcode)
+    """Barcode lookup hit rates per tier (this worker) and cached product counts."""
+    if current_user.role not in ("owner", "staff"):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return await run_sync(service.get_stats)
 
 
 @router.post("/api/client/diet/log")
@@ -397,7 +397,7 @@ async def upload_gym_logo(
     gym_id: str = Depends(get_gym_context),
 ):
     """Upload or update gym logo."""
-    from service_modules.upload_helper import save_file, delete_file, _optimize_image, ALLOWED_IMAGE_EXTENSIONS, MAX_IMAGE_SIZE
+    from service_modules.upload_helper import save_image, delete_file, ALLOWED_IMAGE_EXTENSIONS, MAX_IMAGE_SIZE
     from models_orm import GymORM
 
     if user.role != "owner":
@@ -421,9 +421,8 @@ async def upload_gym_logo(
         if old_logo:
             await delete_file(old_logo)
 
-        optimized, ext = _optimize_image(content, max_size=(400, 400), crop_square=False)
-        filename = f"gym_logo_{gym_id}.{ext}"
-        url = await save_file(optimized, "profiles", filename)
+        url, _ = await save_image(content, "profiles", f"gym_logo_{gym_id}", max_size=(400, 400),
+                                  owner_id=user.id)
 
         if gym:
             gym.logo = url
@@ -1,16 +1,19 @@
 """
 Message Routes - API endpoints for messaging between trainers and clients.
 """
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request
 from pydantic import BaseModel
 from typing import Optional, List
 import uuid, os
 from auth import get_current_user
 from gym_context import get_gym_context
 from models_orm import UserORM, ClientProfileORM
-from database import get_db_session
+from database import get_db_session, run_sync
 from service_modules.message_service import MessageService, get_message_service
-from service_modules.upload_helper import save_file, _optimize_image, ALLOWED_VIDEO_EXTENSIONS, ALLOWED_AUDIO_EXTENSIONS, MAX_VIDEO_SIZE, MAX_AUDIO_SIZE, MAX_IMAGE_SIZE
+from service_modules.upload_helper import save_image, store_stream
+from service_modules.media_upload_service import (
+    MediaUploadService, get_media_upload_service, classify_media, MEDIA_FOLDERS,
+)
 from sockets import manager
 
 router = APIRouter(tags=["Messages"])
@@ -43,13 +46,27 @@ class ConversationResponse(BaseModel):
     created_at: str
 
 
+def _queue_chat_push(receiver_id: str, title: str, body: str, data: dict, image_url: Optional[str]):
+    """Queue an FCM push for a chat message (delivered by the push dispatcher); call through run_sync."""
+    try:
+        from service_modules.notification_service import enqueue_push
+        db = get_db_session()
+        try:
+            enqueue_push(db, receiver_id, title, body, data, image_url=image_url)
+            db.commit()
+        finally:
+            db.close()
+    except Exception:
+        pass  # FCM is best-effort
+
+
 @router.get("/api/messages/conversations", response_model=List[ConversationResponse])
 async def get_conversations(
     user: UserORM = Depends(get_current_user),
     service: MessageService = Depends(get_message_service)
 ):
     """Get all conversations for the current user."""
-    return service.get_conversations(user.id)
+    return await run_sync(service.get_conversations, user.id)
 
 
 @router.get("/api/messages/conversation/{conversation_id}")
@@ -61,7 +78,7 @@ async def get_messages(
     service: MessageService = Depends(get_message_service)
 ):
     """Get messages in a conversation."""
-    messages = service.get_messages(user.id, conversation_id, limit, before)
+    messages = await run_sync(service.get_messages, user.id, conversation_id, limit, before)
     return {"messages": messages}
 
 
@@ -74,7 +91,7 @@ async def send_message(
     """Send a message to another user."""
     if not request.content or not request.content.strip():
         raise HTTPException(status_code=400, detail="Message content cannot be empty")
-    result = service.send_message(user.id, request.receiver_id, request.content)
+    result = await run_sync(service.send_message, user.id, request.receiver_id, request.content)
 
     # Send real-time notification to receiver via WebSocket
     await manager.send_to_user(request.receiver_id, {
@@ -84,22 +101,14 @@ async def send_message(
     })
 
     # Send FCM push for when the receiver's app is in the background
-    try:
-        from service_modules.notification_service import send_fcm_push
-        from database import get_db_session
-        db = get_db_session()
-        try:
-            send_fcm_push(
-                db, request.receiver_id,
-                user.username or "Nuovo messaggio",
-                request.content[:200],
-                {"type": "chat_message", "sender_id": user.id, "conversation_id": result.get("conversation_id", "")},
-                image_url=user.profile_picture,
-            )
-        finally:
-            db.close()
-    except Exception:
-        pass  # FCM is best-effort
+    await run_sync(
+        _queue_chat_push,
+        request.receiver_id,
+        user.username or "Nuovo messaggio",
+        request.content[:200],
+        {"type": "chat_message", "sender_id": user.id, "conversation_id": result.get("conversation_id", "")},
+        user.profile_picture,
+    )
 
     return {
         "conversation_id": result.get("conversation_id"),
@@ -114,7 +123,7 @@ async def mark_messages_read(
     service: MessageService = Depends(get_message_service)
 ):
     """Mark all messages in a conversation as read."""
-    return service.mark_messages_read(user.id, conversation_id)
+    return await run_sync(service.mark_messages_read, user.id, conversation_id)
 
 
 @router.get("/api/messages/unread-count")
@@ -123,7 +132,7 @@ async def get_unread_count(
     service: MessageService = Depends(get_message_service)
 ):
     """Get total unread message count."""
-    return {"unread_count": service.get_unread_count(user.id)}
+    return {"unread_count": await run_sync(service.get_unread_count, user.id)}
 
 
 @router.get("/api/owner/gym-users")
@@ -163,45 +172,110 @@ async def upload_media_message(
     user: UserORM = Depends(get_current_user),
     service: MessageService = Depends(get_message_service)
 ):
-    """Upload a media file (image/video/voice) and send it as a message."""
+    """Upload a media file (image/video/voice) and send it as a message.
+
+    The multipart body is spooled to disk by Starlette; large videos should use the
+    resumable /api/messages/uploads endpoints instead.
+    """
     mime = (file.content_type or "").lower()
-    ext = (file.filename or "").rsplit(".", 1)[-1].lower() if "." in (file.filename or "") else ""
-
-    # Determine media type
-    if mime.startswith("image/"):
-        media_type = "image"
-        folder = "chat_images"
-        max_size = MAX_IMAGE_SIZE
-    elif mime.startswith("video/"):
-        media_type = "video"
-        folder = "chat_videos"
-        max_size = MAX_VIDEO_SIZE
-    elif mime.startswith("audio/") or ext in ALLOWED_AUDIO_EXTENSIONS:
-        media_type = "voice"
-        folder = "chat_audio"
-        max_size = MAX_AUDIO_SIZE
-    else:
-        raise HTTPException(status_code=400, detail="Unsupported media type")
+    media_type, ext = classify_media(mime, file.filename)
+    folder, max_size = MEDIA_FOLDERS[media_type]
 
-    content = await file.read()
-    if len(content) > max_size:
+    if file.size is not None and file.size > max_size:
         raise HTTPException(status_code=413, detail=f"File too large (max {max_size // 1024 // 1024}MB)")
 
     # Compress images before storing
     if media_type == "image":
-        content, opt_ext = _optimize_image(content, max_size=(1200, 1200), crop_square=False)
-        ext = opt_ext
+        content = await file.read()
+        if len(content) > max_size:
+            raise HTTPException(status_code=413, detail=f"File too large (max {max_size // 1024 // 1024}MB)")
+        file_url, variants = await save_image(content, folder, str(uuid.uuid4()), max_size=(1200, 1200),
+                                              owner_id=user.id)
+        file_size = variants["full"]["size"] if variants else len(content)
+    else:
+        # Stream from the spooled upload instead of reading it into memory
+        file.file.seek(0, os.SEEK_END)
+        file_size = file.file.tell()
+        if file_size > max_size:
+            raise HTTPException(status_code=413, detail=f"File too large (max {max_size // 1024 // 1024}MB)")
+        filename = f"{uuid.uuid4()}.{ext or 'bin'}"
+        file_url = await run_sync(store_stream, file.file, folder, filename, file_size, upload_type=media_type)
 
-    filename = f"{uuid.uuid4()}.{ext or 'bin'}"
-    file_url = await save_file(content, folder, filename, upload_type=media_type)
+    return await _send_media_message(user, service, receiver_id, media_type, file_url, file_size, mime, duration)
 
-    result = service.send_message(
+
+class CreateMediaUploadRequest(BaseModel):
+    receiver_id: str
+    filename: str
+    mime_type: str
+    size: int
+    duration: Optional[float] = None
+
+
+@router.post("/api/messages/uploads")
+async def create_media_upload(
+    data: CreateMediaUploadRequest,
+    user: UserORM = Depends(get_current_user),
+    uploads: MediaUploadService = Depends(get_media_upload_service)
+):
+    """Start a resumable media upload. Send the bytes with PUT, then call complete."""
+    return await run_sync(
+        uploads.create_upload,
+        user.id, data.receiver_id, data.filename, data.mime_type, data.size, data.duration,
+    )
+
+
+@router.get("/api/messages/uploads/{upload_id}")
+async def get_media_upload(
+    upload_id: str,
+    user: UserORM = Depends(get_current_user),
+    uploads: MediaUploadService = Depends(get_media_upload_service)
+):
+    """Status of a resumable upload; `offset` is where to resume."""
+    return await run_sync(uploads.get_upload, upload_id, user.id)
+
+
+@router.put("/api/messages/uploads/{upload_id}")
+async def put_media_upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    user: UserORM = Depends(get_current_user),
+    uploads: MediaUploadService = Depends(get_media_upload_service)
+):
+    """Append the raw request body at `offset` (must equal the bytes received so far)."""
+    length = request.headers.get("content-length")
+    return await uploads.receive_chunk(
+        upload_id, user.id, offset, request.stream(),
+        length=int(length) if length and length.isdigit() else None,
+    )
+
+
+@router.post("/api/messages/uploads/{upload_id}/complete")
+async def complete_media_upload(
+    upload_id: str,
+    user: UserORM = Depends(get_current_user),
+    service: MessageService = Depends(get_message_service),
+    uploads: MediaUploadService = Depends(get_media_upload_service)
+):
+    """Store a fully uploaded file and send it as a message."""
+    stored = await uploads.finalize(upload_id, user.id)
+    return await _send_media_message(
+        user, service, stored["receiver_id"], stored["media_type"], stored["file_url"],
+        stored["file_size"], stored["mime_type"], stored["duration"],
+    )
+
+
+async def _send_media_message(user: UserORM, service: MessageService, receiver_id: str, media_type: str,
+                              file_url: str, file_size: int, mime: str, duration: Optional[float]) -> dict:
+    result = await run_sync(
+        service.send_message,
         sender_id=user.id,
         receiver_id=receiver_id,
         content="",
         media_type=media_type,
         file_url=file_url,
-        file_size=len(content),
+        file_size=file_size,
         mime_type=mime,
         duration=duration,
     )
@@ -213,22 +287,14 @@ async def upload_media_message(
     })
 
     # Send FCM push for when the receiver's app is in the background
-    try:
-        from service_modules.notification_service import send_fcm_push
-        from database import get_db_session
-        media_labels = {"image": "una foto", "video": "un video", "voice": "un messaggio vocale"}
-        db = get_db_session()
-        try:
-            send_fcm_push(
-                db, receiver_id,
-                user.username or "Nuovo messaggio",
-                f"Ti ha inviato {media_labels.get(media_type, 'un file')}",
-                {"type": "chat_message", "sender_id": user.id, "conversation_id": result.get("conversation_id", "")},
-                image_url=user.profile_picture,
-            )
-        finally:
-            db.close()
-    except Exception:
-        pass  # FCM is best-effort
+    media_labels = {"image": "una foto", "video": "un video", "voice": "un messaggio vocale"}
+    await run_sync(
+        _queue_chat_push,
+        receiver_id,
+        user.username or "Nuovo messaggio",
+        f"Ti ha inviato {media_labels.get(media_type, 'un file')}",
+        {"type": "chat_message", "sender_id": user.id, "conversation_id": result.get("conversation_id", "")},
+        user.profile_picture,
+    )
 
     return {"conversation_id": result.get("conversation_id"), "message": result}
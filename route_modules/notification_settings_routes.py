@@ -3,7 +3,7 @@ Notification Settings Routes - SMTP email config, FCM push notification tokens.
 """
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, run_sync
 from auth import get_current_user
 from models_orm import UserORM, FCMDeviceTokenORM
 from datetime import datetime
@@ -98,7 +98,8 @@ async def test_smtp_settings(
     )
 
     to_email = user.smtp_from_email or user.smtp_user or user.email
-    success = test_service.send_email(
+    success = await run_sync(
+        test_service.send_email,
         to_email,
         "FitOS - Test Email",
         """
@@ -8,7 +8,7 @@ from database import get_db, get_db_session
 from authorization import authorize_client_access
 from models_orm import UserORM, PhysiquePhotoORM, ClientProfileORM, MedicalCertificateORM, NotificationORM
 from service_modules.upload_helper import (
-    save_file, delete_file, _optimize_image,
+    save_file, save_image, delete_file, get_image_variants, image_srcset,
     ALLOWED_IMAGE_EXTENSIONS, ALLOWED_DOC_EXTENSIONS,
     MAX_IMAGE_SIZE, MAX_DOC_SIZE
 )
@@ -39,15 +39,13 @@ async def upload_profile_picture(
     if len(content) > MAX_IMAGE_SIZE:
         raise HTTPException(status_code=400, detail=f"File too large. Maximum: {MAX_IMAGE_SIZE // (1024*1024)}MB")
 
-    # Optimize: resize + crop square
-    optimized, ext = _optimize_image(content, max_size=(400, 400), crop_square=True)
-    filename = f"{user.id}.{ext}"
-
     # Delete old picture if stored in Cloudinary
     if user.profile_picture:
         await delete_file(user.profile_picture)
 
-    url = await save_file(optimized, "profiles", filename)
+    # Resize + crop square, plus feed/thumb variants
+    url, variants = await save_image(content, "profiles", str(user.id), max_size=(400, 400),
+                                     crop_square=True, owner_id=str(user.id))
 
     db = get_db_session()
     try:
@@ -62,10 +60,37 @@ async def upload_profile_picture(
     return {
         "success": True,
         "profile_picture": url + cache_bust,
+        "variants": _cache_busted(variants, cache_bust),
         "message": "Profile picture updated successfully"
     }
 
 
+def _cache_busted(variants: dict, cache_bust: str) -> dict:
+    """Variant URLs with the same cache-busting query as the main URL (the file names are reused)."""
+    return {
+        name: {key: value + cache_bust if key in ("jpg", "webp") else value for key, value in variant.items()}
+        for name, variant in variants.items()
+    }
+
+
+@router.post("/api/images/variants")
+async def lookup_image_variants(
+    payload: dict,
+    user: UserORM = Depends(get_current_user)
+):
+    """Size/format variants for image URLs returned by other endpoints, to pick the smallest adequate one."""
+    from database import run_sync
+
+    urls = [u for u in (payload.get("urls") or []) if isinstance(u, str)][:200]
+    found = await run_sync(get_image_variants, urls)
+    return {
+        "images": {
+            url: {"variants": variants, "srcset": image_srcset(variants), "srcset_jpg": image_srcset(variants, "jpg")}
+            for url, variants in found.items()
+        }
+    }
+
+
 @router.delete("/api/profile/picture")
 async def delete_profile_picture(user: UserORM = Depends(get_current_user)):
     """Delete user's profile picture."""
@@ -207,11 +232,11 @@ async def upload_physique_photo(
             raise HTTPException(status_code=400, detail=f"File too large. Maximum: {MAX_PHYSIQUE_FILE_SIZE // (1024*1024)}MB")
 
         # Optimize image (larger size for physique photos)
-        optimized, ext = _optimize_image(content, max_size=(1200, 1600), crop_square=False)
         unique_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
-        filename = f"{unique_id}.{ext}"
+        filename = f"{unique_id}.jpg"
 
-        url = await save_file(optimized, f"physique/{user.id}", filename)
+        url, variants = await save_image(content, f"physique/{user.id}", unique_id, max_size=(1200, 1600),
+                                         owner_id=str(user.id))
 
         db = get_db_session()
         trainer_id = get_client_trainer_id(str(user.id), db)
@@ -234,6 +259,7 @@ async def upload_physique_photo(
             "success": True,
             "photo_id": photo_record.id,
             "photo_url": url + cache_bust,
+            "variants": variants,
             "title": photo_record.title,
             "photo_date": photo_record.photo_date,
             "notes": photo_record.notes,
@@ -372,14 +398,14 @@ async def upload_medical_certificate(
     unique_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
     filename = f"{unique_id}.{ext}"
 
-    # Optimize images (not PDFs)
-    if ext != 'pdf':
-        content, ext = _optimize_image(content, max_size=(1600, 2200), crop_square=False)
-        filename = f"{unique_id}.{ext}"
-
     db = None
     try:
-        url = await save_file(content, f"certificates/{user.id}", filename, upload_type="document")
+        # Optimize images (not PDFs)
+        if ext != 'pdf':
+            url, _ = await save_image(content, f"certificates/{user.id}", unique_id, max_size=(1600, 2200),
+                                      owner_id=str(user.id), upload_type="document")
+        else:
+            url = await save_file(content, f"certificates/{user.id}", filename, upload_type="document")
 
         db = get_db_session()
 
@@ -1,10 +1,14 @@
 """
 Schedule Routes - API endpoints for trainer events, client schedules, and workout completion.
 """
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from auth import get_current_user
+from database import run_sync
 from models_orm import UserORM
 from service_modules.schedule_service import ScheduleService, get_schedule_service
+from service_modules.schedule_sync import schedule_window
 from services import UserService
 
 router = APIRouter()
@@ -104,6 +108,33 @@ async def complete_trainer_schedule_item(
     return service.complete_trainer_schedule_item(payload, current_user.id)
 
 
+@router.get("/api/trainer/schedule")
+async def get_trainer_schedule(
+    request: Request,
+    response: Response,
+    schedule_from: Optional[str] = Query(None, alias="from"),
+    schedule_to: Optional[str] = Query(None, alias="to"),
+    since: Optional[str] = None,
+    service: ScheduleService = Depends(get_schedule_service),
+    current_user: UserORM = Depends(get_current_user)
+):
+    """Trainer's calendar for from..to; with ?since=<version> only the entries changed since then.
+
+    `removed` lists ids deleted or moved out of the window. `full` is true when the
+    version was too old for a delta and `entries` is the whole window.
+    """
+    start, end = schedule_window(schedule_from, schedule_to)
+    tag = lambda version: f'W/"{version}:{start}:{end}:{since or ""}"'
+    version = await run_sync(service.get_trainer_schedule_version, current_user.id)
+    if tag(version) in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": tag(version), "Cache-Control": "private, no-cache"})
+
+    result = await run_sync(service.get_trainer_schedule, current_user.id, start, end, since)
+    response.headers["ETag"] = tag(result["version"])
+    response.headers["Cache-Control"] = "private, no-cache"
+    return result
+
+
 @router.post("/api/trainer/events")
 async def add_trainer_event(
     event_data: dict,
@@ -6,7 +6,7 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import RedirectResponse
 from auth import get_current_user
 from models_orm import UserORM, ClientProfileORM
-from database import get_db_session
+from database import get_db_session, run_sync
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime, timedelta
@@ -204,7 +204,7 @@ async def trial_send_verification_code(
             <p style="color: #888; font-size: 13px;">Il codice scade tra 10 minuti.</p>
         </div>
         """
-        sent = email_service.send_email(email, "Il tuo codice FitOS", html)
+        sent = await run_sync(email_service.send_email, email, "Il tuo codice FitOS", html)
         if not sent:
             raise HTTPException(status_code=500, detail="Errore nell'invio dell'email")
 
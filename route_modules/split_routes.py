@@ -3,6 +3,7 @@ Split Routes - API endpoints for weekly split management.
 """
 from fastapi import APIRouter, Depends, HTTPException
 from auth import get_current_user
+from database import run_sync
 from models_orm import UserORM
 from service_modules.split_service import SplitService, get_split_service
 
@@ -64,6 +65,6 @@ async def assign_split(
     service: SplitService = Depends(get_split_service),
     current_user: UserORM = Depends(get_current_user)
 ):
-    """Assign a split to a client or trainer's own schedule."""
+    """Assign a split to a client, a group of clients or the trainer's own schedule."""
     require_trainer(current_user)
-    return service.assign_split(assignment, current_user.id)
+    return await run_sync(service.assign_split, assignment, current_user.id)
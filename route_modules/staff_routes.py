@@ -5,7 +5,7 @@ Staff/Reception API routes for gym management
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import HTMLResponse
 from sqlalchemy.orm import Session
-from database import get_db_session
+from database import get_db_session, run_sync
 from models_orm import UserORM, AppointmentORM, CheckInORM, ClientProfileORM, SubscriptionPlanORM, ClientSubscriptionORM, ClientDocumentORM, MedicalCertificateORM, PaymentORM, TrainerAvailabilityORM, NotificationORM
 from auth import get_current_user, get_password_hash
 from datetime import datetime, date, timedelta
@@ -1219,7 +1219,7 @@ async def change_client_subscription(
                 <p style="color: #888; font-size: 12px;">Questo è un messaggio automatico da {gym_name}.</p>
             </div>
             """
-            email_svc.send_email(client_email, f"Abbonamento aggiornato - {gym_name}", html)
+            await run_sync(email_svc.send_email, client_email, f"Abbonamento aggiornato - {gym_name}", html)
     except Exception as e:
         logger.warning(f"Failed to send email for plan change: {e}")
 
@@ -1339,16 +1339,12 @@ async def update_registration_photo(
 
     if photo_data.startswith("data:image/"):
         import base64 as b64
-        from service_modules.upload_helper import save_file as _save_file, _optimize_image
+        from service_modules.upload_helper import save_image
         try:
-            header, photo_b64 = photo_data.split(",", 1)
-            ext = header.split("/")[1].split(";")[0]
-            if ext not in ("png", "jpg", "jpeg", "webp"):
-                ext = "jpg"
+            _, photo_b64 = photo_data.split(",", 1)
             photo_bytes = b64.b64decode(photo_b64)
-            optimized, ext = _optimize_image(photo_bytes, max_size=(400, 400), crop_square=True)
-            photo_filename = f"reg_{member_id}.{ext}"
-            url = await _save_file(optimized, "registration_photos", photo_filename)
+            url, _ = await save_image(photo_bytes, "registration_photos", f"reg_{member_id}", max_size=(400, 400),
+                                      crop_square=True, owner_id=member_id)
             member.registration_photo = url
             db.commit()
             return {"status": "ok", "registration_photo": url}
@@ -1557,17 +1553,12 @@ async def onboard_new_client(
         # 5. Save profile photo if provided
         if profile_photo and profile_photo.startswith("data:image/"):
             import base64 as b64
-            from service_modules.upload_helper import save_file as _save_file, _optimize_image
+            from service_modules.upload_helper import save_image
             try:
-                header, photo_b64 = profile_photo.split(",", 1)
-                ext = header.split("/")[1].split(";")[0]
-                if ext not in ("png", "jpg", "jpeg", "webp"):
-                    ext = "jpg"
-
+                _, photo_b64 = profile_photo.split(",", 1)
                 photo_bytes = b64.b64decode(photo_b64)
-                optimized, ext = _optimize_image(photo_bytes, max_size=(400, 400), crop_square=True)
-                photo_filename = f"{client_id}.{ext}"
-                url = await _save_file(optimized, "profiles", photo_filename)
+                url, _ = await save_image(photo_bytes, "profiles", client_id, max_size=(400, 400),
+                                          crop_square=True, owner_id=client_id)
                 new_user.profile_picture = url
                 new_user.registration_photo = url  # Staff-taken photo for ID verification
             except Exception as photo_err:
@@ -1843,7 +1834,7 @@ async def send_client_credentials(
                     <p>Scarica l'app FitOS per iniziare il tuo percorso fitness!</p>
                 </div>
                 """
-                sent = email_svc.send_email(email, f"Le tue credenziali - {gym_name}", html)
+                sent = await run_sync(email_svc.send_email, email, f"Le tue credenziali - {gym_name}", html)
                 if not sent:
                     raise HTTPException(status_code=500, detail="Invio email fallito")
                 return {"status": "success", "method": "email", "message": f"Credenziali inviate a {email}"}
@@ -1881,13 +1872,7 @@ async def send_client_credentials(
                 read=False,
                 created_at=datetime.utcnow().isoformat()
             ))
-            db.commit()
-
-            try:
-                from service_modules.notification_service import send_fcm_push
-                send_fcm_push(db, user.id, notif_title, notif_body, notif_data)
-            except Exception:
-                pass  # FCM is best-effort
+            db.commit()  # Push is queued by the NotificationORM outbox hook
 
             return {"status": "success", "method": "whatsapp", "link": whatsapp_link, "message": "Notifica inviata al tuo telefono"}
 
@@ -1911,13 +1896,7 @@ async def send_client_credentials(
                 read=False,
                 created_at=datetime.utcnow().isoformat()
             ))
-            db.commit()
-
-            try:
-                from service_modules.notification_service import send_fcm_push
-                send_fcm_push(db, user.id, notif_title, notif_body, notif_data)
-            except Exception:
-                pass  # FCM is best-effort
+            db.commit()  # Push is queued by the NotificationORM outbox hook
 
             return {"status": "success", "method": "sms", "link": sms_link, "message": "Notifica inviata al tuo telefono"}
 
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, Header, HTTPException, status, File, UploadFile, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, status, File, UploadFile, Request, Query, Response
+from fastapi.encoders import jsonable_encoder
 from typing import Optional
 from fastapi.security import OAuth2PasswordRequestForm
 from models import GymConfig, ClientData, TrainerData, OwnerData, LeaderboardData, WorkoutAssignment, ExerciseTemplate, AssignDietRequest
@@ -6,8 +7,10 @@ from services import GymService, UserService, LeaderboardService
 from datetime import timedelta
 from auth import create_access_token, get_current_user
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, run_sync
 from models_orm import UserORM
+import hashlib
+import json
 import logging
 
 logger = logging.getLogger("gym_app")
@@ -28,6 +31,16 @@ def _rate_limit_auth(limit_str):
         return func
     return decorator
 
+def etag_json(request: Request, payload) -> Response:
+    """JSON response with a content-hash ETag; an empty 304 when If-None-Match already has it."""
+    body = json.dumps(jsonable_encoder(payload), separators=(",", ":")).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    known = {tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")}
+    if etag in known:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
 # Import modular routes
 from route_modules.workout_routes import router as workout_router
 from route_modules.split_routes import router as split_router
@@ -38,6 +51,7 @@ from route_modules.schedule_routes import router as schedule_router
 from route_modules.client_routes import router as client_router
 from route_modules.subscription_routes import router as subscription_router
 from route_modules.appointment_routes import router as appointment_router
+from route_modules.availability_routes import router as availability_router
 from route_modules.notification_routes import router as notification_router
 from route_modules.course_routes import router as course_router
 from route_modules.friend_routes import router as friend_router
@@ -58,6 +72,7 @@ router.include_router(schedule_router)
 router.include_router(client_router)
 router.include_router(subscription_router)
 router.include_router(appointment_router)
+router.include_router(availability_router)
 router.include_router(notification_router)
 router.include_router(course_router)
 router.include_router(friend_router)
@@ -128,9 +143,7 @@ async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends
                         read=False,
                         created_at=_dt.utcnow().isoformat()
                     ))
-                    db2.commit()
-                    from service_modules.notification_service import send_fcm_push
-                    send_fcm_push(db2, user.id, "Benvenuto su FitOS!", "Completa il tuo profilo per iniziare")
+                    db2.commit()  # Push is queued by the NotificationORM outbox hook
             finally:
                 db2.close()
         except Exception:
@@ -193,10 +206,15 @@ async def get_gym_config(gym_id: str, service: GymService = Depends(get_gym_serv
 
 @router.get("/api/trainer/data", response_model=TrainerData)
 async def get_trainer_data(
+    request: Request,
+    schedule_from: Optional[str] = Query(None, alias="from"),
+    schedule_to: Optional[str] = Query(None, alias="to"),
     service: UserService = Depends(get_user_service),
     current_user: UserORM = Depends(get_current_user)
 ):
-    return service.get_trainer(current_user.id)
+    """Trainer dashboard; `schedule` covers from..to (default: around today). Supports If-None-Match."""
+    data = await run_sync(service.get_trainer, current_user.id, schedule_from, schedule_to)
+    return etag_json(request, data)
 
 # Trainer event routes moved to route_modules/schedule_routes.py
 
@@ -319,6 +337,21 @@ async def get_owner_data(
     gym_id = resolve_gym_id(current_user, x_gym_id)
     return service.get_owner(owner_id=gym_id)
 
+@router.get("/api/owner/stats/history")
+async def get_owner_stats_history(
+    months: int = 12,
+    service: UserService = Depends(get_user_service),
+    current_user: UserORM = Depends(get_current_user),
+    x_gym_id: Optional[str] = Header(None)
+):
+    """Monthly revenue, signups, check-ins and subscriptions for the owner's charts (oldest first). Owner only."""
+    from gym_context import resolve_gym_id
+    from database import run_sync
+    if current_user.role != "owner":
+        raise HTTPException(status_code=403, detail="Only gym owners can view gym statistics")
+    gym_id = resolve_gym_id(current_user, x_gym_id)
+    return await run_sync(service.get_owner_history, gym_id, max(1, min(months, 24)))
+
 @router.get("/api/leaderboard/data", response_model=LeaderboardData)
 async def get_leaderboard_data(
     service: LeaderboardService = Depends(get_leaderboard_service),
@@ -0,0 +1,254 @@
+"""
+Activity State - persisted day streak and weekly health scores per client.
+
+The client dashboard used to rebuild the day streak by querying the schedule one day
+at a time (up to 365 queries) and the weekly health chart one day at a time. Both now
+live in client_activity_state:
+- refreshed eagerly when a workout is completed (ScheduleService.complete_schedule_item,
+  complete_coop_workout)
+- refreshed lazily on the next read when stale: marked dirty by a schedule or daily
+  diet summary write, a new day or week started, or the diet targets changed
+
+A refresh costs a fixed number of queries regardless of history length. Today's health
+score is always derived from the live diet settings row, so logging a meal needs no write.
+
+Backfill existing clients:
+    python -m service_modules.activity_state_service
+"""
+import json
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, event, func
+
+from database import get_db_session
+from models_orm import (
+    ClientActivityStateORM, ClientProfileORM, ClientScheduleORM,
+    ClientDietSettingsORM, ClientDailyDietSummaryORM,
+)
+
+logger = logging.getLogger("gym_app")
+
+STREAK_LOOKBACK_DAYS = 365
+MAX_REST_DAYS = 3  # Consecutive days without workouts allowed inside a streak
+
+DEFAULT_TARGETS = (2000, 150, 200, 70)  # calories, protein, carbs, fat
+
+
+def _targets(diet_settings) -> Tuple[int, int, int, int]:
+    if not diet_settings:
+        return DEFAULT_TARGETS
+    return (diet_settings.calories_target, diet_settings.protein_target,
+            diet_settings.carbs_target, diet_settings.fat_target)
+
+
+def health_score(cals, prot, carbs, fat, targets) -> int:
+    """Weighted diet adherence score (Cals 45%, Protein 35%, Carbs 10%, Fat 10%), penalizing overshoot."""
+    def calc_score(current, target):
+        if target == 0:
+            return 0
+        ratio = current / target
+        if ratio > 1:
+            # Penalize going over (mirror the deficit penalty)
+            return max(0, 100 - abs(ratio - 1) * 100)
+        return ratio * 100
+
+    cal_target, prot_target, carb_target, fat_target = targets
+    score = (calc_score(cals, cal_target) * 0.45) + (calc_score(prot, prot_target) * 0.35) + \
+            (calc_score(carbs, carb_target) * 0.1) + (calc_score(fat, fat_target) * 0.1)
+    return int(score)
+
+
+def workout_day_totals(db, client_id: str, start: date, end: date) -> Dict[str, Tuple[int, int]]:
+    """(scheduled, completed) workout counts per day between start and end, in one query."""
+    rows = db.query(
+        ClientScheduleORM.date,
+        func.count(ClientScheduleORM.id),
+        func.sum(case((ClientScheduleORM.completed == True, 1), else_=0)),
+    ).filter(
+        ClientScheduleORM.client_id == client_id,
+        ClientScheduleORM.type == "workout",
+        ClientScheduleORM.date >= start.isoformat(),
+        ClientScheduleORM.date <= end.isoformat()
+    ).group_by(ClientScheduleORM.date).all()
+    return {day: (int(total), int(done or 0)) for day, total, done in rows}
+
+
+def compute_day_streak(db, client_id: str, today: date) -> int:
+    """Consecutive days with ALL scheduled workouts completed, walking back from today."""
+    totals = workout_day_totals(db, client_id, today - timedelta(days=STREAK_LOOKBACK_DAYS - 1), today)
+
+    streak = 0
+    consecutive_empty = 0
+    for offset in range(STREAK_LOOKBACK_DAYS):
+        total, done = totals.get((today - timedelta(days=offset)).isoformat(), (0, 0))
+        if total == 0:
+            # Rest days are allowed, but too many in a row break the streak
+            consecutive_empty += 1
+            if consecutive_empty > MAX_REST_DAYS:
+                break
+        elif done == total:
+            consecutive_empty = 0
+            streak += 1
+        elif offset > 0:
+            # Past day with incomplete workouts (today can still be completed)
+            break
+    return streak
+
+
+def compute_past_week_scores(db, client_id: str, today: date, targets) -> List[int]:
+    """Health scores Mon-Sun of the current week from daily summaries. Today and future days are 0."""
+    monday = today - timedelta(days=today.weekday())
+    summaries = {
+        s.date: s for s in db.query(ClientDailyDietSummaryORM).filter(
+            ClientDailyDietSummaryORM.client_id == client_id,
+            ClientDailyDietSummaryORM.date >= monday.isoformat(),
+            ClientDailyDietSummaryORM.date < today.isoformat()
+        ).all()
+    }
+
+    scores = []
+    for i in range(7):
+        day = monday + timedelta(days=i)
+        summary = summaries.get(day.isoformat())
+        if day >= today or not summary or summary.total_calories == 0:
+            scores.append(0)
+            continue
+        scores.append(health_score(summary.total_calories, summary.total_protein,
+                                   summary.total_carbs, summary.total_fat, targets))
+    return scores
+
+
+def _insert(conn):
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(ClientActivityStateORM.__table__)
+
+
+def refresh_activity_state(db, client_id: str, diet_settings=None, today: Optional[date] = None) -> ClientActivityStateORM:
+    """Recompute and stage a client's activity state in the caller's session (no commit)."""
+    today = today or date.today()
+    db.flush()  # Include pending schedule changes
+    if diet_settings is None:
+        diet_settings = db.query(ClientDietSettingsORM).filter(ClientDietSettingsORM.id == client_id).first()
+    targets = _targets(diet_settings)
+
+    state = db.query(ClientActivityStateORM).populate_existing().filter(
+        ClientActivityStateORM.client_id == client_id
+    ).first()
+    if not state:
+        # Two first reads can race here: insert-if-missing, then load whichever row won
+        db.execute(_insert(db.connection()).values(client_id=client_id).on_conflict_do_nothing(
+            index_elements=[ClientActivityStateORM.client_id]
+        ))
+        state = db.query(ClientActivityStateORM).populate_existing().filter(
+            ClientActivityStateORM.client_id == client_id
+        ).one()
+
+    state.day_streak = compute_day_streak(db, client_id, today)
+    state.streak_date = today.isoformat()
+    state.week_start = (today - timedelta(days=today.weekday())).isoformat()
+    state.week_scores = json.dumps(compute_past_week_scores(db, client_id, today, targets))
+    state.week_targets = ":".join(str(t) for t in targets)
+    state.dirty = False
+    state.updated_at = datetime.utcnow().isoformat()
+
+    # Keep the profile streak (friends list, CRM) in line with the dashboard
+    profile = db.query(ClientProfileORM).filter(ClientProfileORM.id == client_id).first()
+    if profile and profile.streak != state.day_streak:
+        profile.streak = state.day_streak
+
+    return state
+
+
+def get_activity_state(db, client_id: str, diet_settings=None) -> ClientActivityStateORM:
+    """Return the client's activity state, refreshing it first if stale. Caller commits."""
+    today = date.today()
+    if diet_settings is None:
+        diet_settings = db.query(ClientDietSettingsORM).filter(ClientDietSettingsORM.id == client_id).first()
+    state = db.query(ClientActivityStateORM).filter(ClientActivityStateORM.client_id == client_id).first()
+    if (
+        state is None
+        or state.dirty
+        or state.streak_date != today.isoformat()
+        or state.week_targets != ":".join(str(t) for t in _targets(diet_settings))
+    ):
+        state = refresh_activity_state(db, client_id, diet_settings, today)
+    return state
+
+
+def weekly_health_scores(state: ClientActivityStateORM, diet_settings) -> List[int]:
+    """Mon-Sun health scores: stored past days plus today's live score from diet settings."""
+    today = date.today()
+    scores = json.loads(state.week_scores) if state.week_scores else [0] * 7
+    if diet_settings and (diet_settings.calories_current or 0) > 0:
+        scores[today.weekday()] = health_score(
+            diet_settings.calories_current or 0, diet_settings.protein_current or 0,
+            diet_settings.carbs_current or 0, diet_settings.fat_current or 0,
+            _targets(diet_settings),
+        )
+    return scores
+
+
+def backfill_activity_state(session_factory=get_db_session, batch_size: int = 200) -> int:
+    """One-shot job: build activity state for every client. Returns the number of clients processed."""
+    db = session_factory()
+    try:
+        client_ids = [row[0] for row in db.query(ClientProfileORM.id).all()]
+    finally:
+        db.close()
+
+    processed = 0
+    for start in range(0, len(client_ids), batch_size):
+        db = session_factory()
+        try:
+            for client_id in client_ids[start:start + batch_size]:
+                refresh_activity_state(db, client_id)
+            db.commit()
+            processed += len(client_ids[start:start + batch_size])
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Activity state backfill failed for batch at {start}: {e}")
+        finally:
+            db.close()
+    logger.info(f"Activity state backfilled for {processed} clients")
+    return processed
+
+
+# ── SQLAlchemy events: writes that change streak or past health scores mark the state dirty ──
+# Runs on the flushing connection so the flag commits atomically with the change.
+
+def mark_activity_dirty(connection, client_ids):
+    """Flag the clients' state for refresh; for writers that bypass the ORM events below."""
+    client_ids = [c for c in set(client_ids) if c]
+    if client_ids:
+        connection.execute(
+            ClientActivityStateORM.__table__.update()
+            .where(ClientActivityStateORM.__table__.c.client_id.in_(client_ids))
+            .values(dirty=True)
+        )
+
+
+def _mark_dirty(connection, client_id):
+    mark_activity_dirty(connection, [client_id])
+
+
+@event.listens_for(ClientScheduleORM, "after_insert")
+@event.listens_for(ClientScheduleORM, "after_update")
+@event.listens_for(ClientScheduleORM, "after_delete")
+def _schedule_changed(mapper, connection, target):
+    _mark_dirty(connection, target.client_id)
+
+
+@event.listens_for(ClientDailyDietSummaryORM, "after_insert")
+@event.listens_for(ClientDailyDietSummaryORM, "after_update")
+def _diet_summary_changed(mapper, connection, target):
+    _mark_dirty(connection, target.client_id)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Backfilled {backfill_activity_state()} clients")
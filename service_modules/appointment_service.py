@@ -6,6 +6,7 @@ from .base import (
     get_db_session
 )
 from models_orm import TrainerAvailabilityORM, AppointmentORM, UserORM, TrainerScheduleORM, NotificationORM, ClientProfileORM
+from .availability_engine import day_slots
 from models import (
     TrainerAvailability, Appointment, BookAppointmentRequest,
     SetAvailabilityRequest, UpdateAvailabilityRequest,
@@ -141,103 +142,7 @@ class AppointmentService:
         """
         db = get_db_session()
         try:
-            # Parse date and get day of week (0 = Monday, 6 = Sunday)
-            target_date = datetime.fromisoformat(date_str)
-            day_of_week = target_date.weekday()
-
-            # Get trainer's availability for this day of week
-            availability = db.query(TrainerAvailabilityORM).filter(
-                TrainerAvailabilityORM.trainer_id == trainer_id,
-                TrainerAvailabilityORM.day_of_week == day_of_week,
-                TrainerAvailabilityORM.is_available == True
-            ).all()
-
-            if not availability:
-                return []
-
-            # Get all booked appointments for this date
-            booked_appointments = db.query(AppointmentORM).filter(
-                AppointmentORM.trainer_id == trainer_id,
-                AppointmentORM.date == date_str,
-                AppointmentORM.status.in_(["scheduled", "confirmed"])
-            ).all()
-
-            # Also get all trainer calendar events for this date (to avoid conflicts)
-            # NOTE: Exclude personal workouts (workout_id is not null) - they are flexible notes
-            trainer_events = db.query(TrainerScheduleORM).filter(
-                TrainerScheduleORM.trainer_id == trainer_id,
-                TrainerScheduleORM.date == date_str,
-                TrainerScheduleORM.completed == False,
-                TrainerScheduleORM.workout_id == None  # Only block for non-workout events
-            ).all()
-
-            # Build list of available slots
-            available_slots = []
-
-            for avail_block in availability:
-                # Parse start and end times
-                start_hour, start_min = map(int, avail_block.start_time.split(':'))
-                end_hour, end_min = map(int, avail_block.end_time.split(':'))
-
-                start_time = datetime.combine(target_date.date(), datetime.min.time().replace(hour=start_hour, minute=start_min))
-                end_time = datetime.combine(target_date.date(), datetime.min.time().replace(hour=end_hour, minute=end_min))
-
-                # Generate 1-hour slots
-                current_time = start_time
-                while current_time < end_time:
-                    slot_end = current_time + timedelta(hours=1)
-
-                    if slot_end > end_time:
-                        break
-
-                    # Check if this slot is already booked by an appointment
-                    is_booked = False
-                    for appointment in booked_appointments:
-                        appt_start_hour, appt_start_min = map(int, appointment.start_time.split(':'))
-                        appt_start = datetime.combine(target_date.date(), datetime.min.time().replace(hour=appt_start_hour, minute=appt_start_min))
-
-                        appt_duration = timedelta(minutes=appointment.duration)
-                        appt_end = appt_start + appt_duration
-
-                        # Check for overlap
-                        if not (slot_end <= appt_start or current_time >= appt_end):
-                            is_booked = True
-                            break
-
-                    # Also check if slot conflicts with other trainer calendar events
-                    if not is_booked:
-                        for event in trainer_events:
-                            # Parse time in 12-hour format (HH:MM AM/PM)
-                            try:
-                                event_time = datetime.strptime(event.time, "%I:%M %p")
-                                event_start = datetime.combine(target_date.date(), event_time.time())
-                                event_duration = timedelta(minutes=event.duration)
-                                event_end = event_start + event_duration
-
-                                # Check for overlap
-                                if not (slot_end <= event_start or current_time >= event_end):
-                                    is_booked = True
-                                    break
-                            except ValueError:
-                                # If time format is invalid, skip this event
-                                continue
-
-                    # Skip past time slots if the date is today
-                    now = datetime.now()
-                    if target_date.date() == now.date() and current_time <= now:
-                        current_time = slot_end
-                        continue
-
-                    if not is_booked:
-                        available_slots.append({
-                            "start_time": current_time.strftime("%H:%M"),
-                            "end_time": slot_end.strftime("%H:%M"),
-                            "available": True
-                        })
-
-                    current_time = slot_end
-
-            return available_slots
+            return day_slots(db, "trainer", trainer_id, date_str)
 
         except Exception as e:
             logger.error(f"Error getting available slots: {e}")
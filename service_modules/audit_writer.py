@@ -0,0 +1,211 @@
+"""
+Audit Writer - buffered, append-only writes to the sensitive-data access log.
+
+authorize_client_access records every trainer/nutritionist/owner view of weight,
+diet, photo and other sensitive data. Entries used to be committed one by one on the
+request's own session (an extra round trip, and it committed whatever else the request
+had pending). Now they are queued in-process and written by a background flusher in
+multi-row INSERTs, every AUDIT_FLUSH_INTERVAL seconds or as soon as AUDIT_FLUSH_BATCH
+entries are waiting. The access time is taken when the entry is recorded, not when
+it's written.
+
+The queue holds AUDIT_QUEUE_SIZE entries. When it's full, a request recording the next
+entry from a worker thread writes the queue itself (back-pressure: requests slow down
+to the database's pace); on the event loop it only wakes the flusher. A failed write
+puts its entries back, and nothing retries for AUDIT_RETRY_BACKOFF seconds. If the
+database stays down, the buffer stops growing at AUDIT_BUFFER_LIMIT entries: the
+oldest are dropped and counted in stats["overflowed"]. A batch the database rejects for integrity (a
+client or accessor deleted while its entries were queued) is retried in halves, and
+only the entries that fail on their own are dropped (counted in stats["dropped"]), so
+one bad entry never holds up the rest. stop() writes everything left, so a graceful
+shutdown loses nothing. When the flusher isn't running (tests, scripts), every entry
+is written at once.
+
+Same table (sensitive_data_access_log) and same retention job as before.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from database import get_db_session, run_sync
+from models_orm import SensitiveDataAccessLogORM
+
+import logging
+logger = logging.getLogger("gym_app")
+
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+AUDIT_FLUSH_BATCH = int(os.getenv("AUDIT_FLUSH_BATCH", "200"))
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BUFFER_LIMIT = int(os.getenv("AUDIT_BUFFER_LIMIT", "50000"))
+AUDIT_RETRY_BACKOFF = float(os.getenv("AUDIT_RETRY_BACKOFF", "5.0"))
+INSERT_CHUNK = 100  # Rows per INSERT statement, under SQLite's bound-parameter limit
+
+
+class AuditWriter:
+    """Per-worker queue of audit entries, written in batches."""
+
+    def __init__(self, interval: float = AUDIT_FLUSH_INTERVAL, batch_size: int = AUDIT_FLUSH_BATCH,
+                 maxsize: int = AUDIT_QUEUE_SIZE, limit: int = AUDIT_BUFFER_LIMIT,
+                 backoff: float = AUDIT_RETRY_BACKOFF):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.maxsize = maxsize
+        self.limit = max(limit, maxsize)
+        self.backoff = backoff
+        self._retry_at = 0.0  # No flush attempts before this (time.monotonic) after a failure
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._loop_thread: Optional[int] = None
+        self.stats = {"recorded": 0, "written": 0, "flushes": 0, "failed_flushes": 0,
+                      "dropped": 0, "overflowed": 0, "queue_full": 0, "max_depth": 0}
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def record(self, **entry):
+        """Queue one access-log entry (SensitiveDataAccessLogORM columns)."""
+        entry.setdefault("accessed_at", datetime.utcnow().isoformat())
+        with self._lock:
+            self._pending.append(entry)
+            self._trim()
+            depth = len(self._pending)
+            self.stats["recorded"] += 1
+            self.stats["max_depth"] = max(self.stats["max_depth"], depth)
+            full = depth >= self.maxsize
+            if full:
+                self.stats["queue_full"] += 1
+
+        inline = (self._task is None or full) and threading.get_ident() != self._loop_thread
+        if inline and time.monotonic() >= self._retry_at:
+            if full:
+                logger.warning(f"Audit queue full ({depth} entries), writing it from the request")
+            try:
+                self.flush()
+            except Exception as e:
+                # The entries stay queued; the request itself goes on
+                logger.error(f"Audit log flush error ({self.depth} entries waiting): {e}")
+        elif self._task is not None and depth >= self.batch_size and not self._wake.is_set():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _trim(self):
+        """Drop the oldest entries past the buffer limit (the lock is held)."""
+        over = len(self._pending) - self.limit
+        if over <= 0:
+            return
+        for _ in range(over):
+            self._pending.popleft()
+        before = self.stats["overflowed"]
+        self.stats["overflowed"] += over
+        if before == 0 or before // 1000 != self.stats["overflowed"] // 1000:
+            logger.error(f"Audit buffer over {self.limit} entries: {self.stats['overflowed']} oldest dropped so far")
+
+    def _take(self) -> List[dict]:
+        with self._lock:
+            return [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+
+    def _write(self, entries: List[dict]):
+        db = get_db_session()
+        try:
+            table = SensitiveDataAccessLogORM.__table__
+            for i in range(0, len(entries), INSERT_CHUNK):
+                db.execute(table.insert().values(entries[i:i + INSERT_CHUNK]))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write_batch(self, entries: List[dict]) -> int:
+        """Write a batch, splitting it on integrity errors; returns entries written."""
+        parts = [entries]
+        written = 0
+        while parts:
+            part = parts.pop()
+            try:
+                self._write(part)
+            except IntegrityError as e:
+                if len(part) > 1:
+                    parts += [part[len(part) // 2:], part[:len(part) // 2]]
+                    continue
+                logger.error(f"Dropped audit entry {part[0]}: {e.orig}")
+                with self._lock:
+                    self.stats["dropped"] += 1
+                continue
+            except Exception:
+                # What wasn't written goes back to the front of the queue, in order, for the next flush
+                unwritten = part + [entry for rest in reversed(parts) for entry in rest]
+                with self._lock:
+                    self._pending.extendleft(reversed(unwritten))
+                    self._trim()
+                    self.stats["failed_flushes"] += 1
+                    self._retry_at = time.monotonic() + self.backoff
+                raise
+            written += len(part)
+            with self._lock:
+                self.stats["written"] += len(part)
+        return written
+
+    def flush(self) -> int:
+        """Write everything queued, a batch per transaction; returns entries written."""
+        written = 0
+        while True:
+            entries = self._take()
+            if not entries:
+                return written
+            written += self._write_batch(entries)
+            with self._lock:
+                self.stats["flushes"] += 1
+
+    async def start(self):
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info("Audit log writer started")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._loop_thread = None
+        try:
+            await run_sync(self.flush)
+        except Exception as e:
+            logger.error(f"Audit log writer stopped with {self.depth} entries unwritten: {e}")
+
+    async def _run(self):
+        while True:
+            # asyncio.wait, not wait_for: wait_for can swallow stop()'s cancel when the wake-up lands at the same time
+            waiter = asyncio.ensure_future(self._wake.wait())
+            try:
+                await asyncio.wait([waiter], timeout=self.interval)
+            finally:
+                waiter.cancel()
+            self._wake.clear()
+            if time.monotonic() < self._retry_at:
+                continue
+            try:
+                await run_sync(self.flush)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Audit log flush error ({self.depth} entries waiting): {e}")
+
+
+audit_writer = AuditWriter()
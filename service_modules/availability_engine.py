@@ -0,0 +1,365 @@
+"""
+Availability Engine - free-slot search for trainers, nutritionists and facilities.
+
+A resource's taken time on a day is kept as a 1440-bit bitmap (bit n = minute n is
+booked) in availability_days, so checking a slot is one AND against a mask instead
+of parsing and comparing every booking of the day.
+
+Rows are kept current by the mapper events at the bottom of this module: any ORM
+insert/update/delete of an appointment, nutritionist appointment, facility booking
+or trainer calendar event bumps the affected day's `version` and rebuilds its bitmap
+in the same transaction (the bump locks the row, so concurrent bookings of the same
+day rebuild one after the other). Rows missing, stale (built_version != version) or
+older than AVAILABILITY_MAX_AGE - which bounds staleness from bulk UPDATEs and raw
+SQL that bypass the ORM - are rebuilt by the next search.
+
+Weekly opening hours come straight from the *_availability tables at search time.
+"""
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List
+
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.orm import Session, object_session
+
+from database import get_db_session
+from models_orm import (
+    AvailabilityDayORM, AppointmentORM, TrainerScheduleORM, TrainerAvailabilityORM,
+    NutritionistAppointmentORM, NutritionistAvailabilityORM,
+    FacilityORM, FacilityAvailabilityORM, FacilityBookingORM,
+)
+
+import logging
+logger = logging.getLogger("gym_app")
+
+AVAILABILITY_MAX_AGE = int(os.getenv("AVAILABILITY_MAX_AGE", "900"))  # seconds
+MAX_SEARCH_DAYS = 31
+MAX_SEARCH_RESOURCES = 50
+
+RESOURCE_TYPES = ("trainer", "nutritionist", "facility")
+
+# resource type -> (weekly availability model, its resource id column)
+_AVAILABILITY = {
+    "trainer": (TrainerAvailabilityORM, TrainerAvailabilityORM.trainer_id),
+    "nutritionist": (NutritionistAvailabilityORM, NutritionistAvailabilityORM.nutritionist_id),
+    "facility": (FacilityAvailabilityORM, FacilityAvailabilityORM.facility_id),
+}
+
+_DAYS = AvailabilityDayORM.__table__
+
+
+def _hhmm(value) -> int:
+    """Minutes since midnight for "HH:MM"."""
+    hours, minutes = value.split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def _mask(start: int, length: int) -> int:
+    """Bits for minutes [start, start + length), clipped to the day."""
+    start, end = max(0, start), min(24 * 60, start + length)
+    return ((1 << (end - start)) - 1) << start if end > start else 0
+
+
+def _format(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+# --- Busy bitmaps ---
+
+def _booked_intervals(conn, resource_type: str, resource_ids, dates):
+    """(resource_id, date, start_minute, duration) of everything that takes a resource's time."""
+    if resource_type == "trainer":
+        appointments = conn.execute(select(
+            AppointmentORM.trainer_id, AppointmentORM.date, AppointmentORM.start_time, AppointmentORM.duration
+        ).where(
+            AppointmentORM.trainer_id.in_(resource_ids),
+            AppointmentORM.date.in_(dates),
+            AppointmentORM.status.in_(["scheduled", "confirmed"])
+        ))
+        for trainer_id, day, start_time, duration in appointments:
+            yield trainer_id, day, _hhmm(start_time), duration or 0
+
+        # Calendar events block slots too, except personal workouts (flexible notes)
+        events = conn.execute(select(
+            TrainerScheduleORM.trainer_id, TrainerScheduleORM.date, TrainerScheduleORM.time, TrainerScheduleORM.duration
+        ).where(
+            TrainerScheduleORM.trainer_id.in_(resource_ids),
+            TrainerScheduleORM.date.in_(dates),
+            TrainerScheduleORM.completed == False,
+            TrainerScheduleORM.workout_id == None
+        ))
+        for trainer_id, day, time_str, duration in events:
+            try:
+                event_time = datetime.strptime(time_str or "", "%I:%M %p")
+            except ValueError:
+                continue  # If time format is invalid, skip this event
+            yield trainer_id, day, event_time.hour * 60 + event_time.minute, duration if duration is not None else 60
+
+    elif resource_type == "nutritionist":
+        appointments = conn.execute(select(
+            NutritionistAppointmentORM.nutritionist_id, NutritionistAppointmentORM.date,
+            NutritionistAppointmentORM.start_time, NutritionistAppointmentORM.duration
+        ).where(
+            NutritionistAppointmentORM.nutritionist_id.in_(resource_ids),
+            NutritionistAppointmentORM.date.in_(dates),
+            NutritionistAppointmentORM.status.in_(["scheduled", "confirmed"])
+        ))
+        for row in appointments:
+            yield row[0], row[1], _hhmm(row[2]), row[3] or 0
+
+    elif resource_type == "facility":
+        bookings = conn.execute(select(
+            FacilityBookingORM.facility_id, FacilityBookingORM.date,
+            FacilityBookingORM.start_time, FacilityBookingORM.duration
+        ).where(
+            FacilityBookingORM.facility_id.in_(resource_ids),
+            FacilityBookingORM.date.in_(dates),
+            FacilityBookingORM.status == "confirmed"
+        ))
+        for row in bookings:
+            yield row[0], row[1], _hhmm(row[2]), row[3] or 0
+
+
+def compute_busy(conn, resource_type: str, resource_ids, dates) -> Dict[tuple, int]:
+    """Busy bitmaps straight from the booking tables: {(resource_id, date): bits}."""
+    busy = {(rid, day): 0 for rid in resource_ids for day in dates}
+    for rid, day, start, duration in _booked_intervals(conn, resource_type, list(resource_ids), list(dates)):
+        if (rid, day) in busy:
+            busy[(rid, day)] |= _mask(start, duration)
+    return busy
+
+
+def _insert(conn):
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(_DAYS)
+
+
+def _key_filter(resource_type: str, resource_id: str, day: str):
+    return (_DAYS.c.resource_type == resource_type) & (_DAYS.c.resource_id == resource_id) & (_DAYS.c.date == day)
+
+
+def refresh_days(conn, keys: Iterable[tuple]):
+    """Rebuild the bitmaps of (resource_type, resource_id, date) days inside the caller's transaction."""
+    by_type = {}
+    for resource_type, resource_id, day in keys:
+        by_type.setdefault(resource_type, set()).add((resource_id, day))
+
+    now = datetime.utcnow().isoformat()
+    for resource_type, days in by_type.items():
+        # Bump first: takes the row lock, so the rebuild below sees every committed booking
+        for resource_id, day in sorted(days):
+            stmt = _insert(conn).values(resource_type=resource_type, resource_id=resource_id, date=day,
+                                        busy="0", version=1, built_version=-1)
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=[_DAYS.c.resource_type, _DAYS.c.resource_id, _DAYS.c.date],
+                set_={"version": _DAYS.c.version + 1}
+            ))
+        busy = compute_busy(conn, resource_type, {rid for rid, _ in days}, {day for _, day in days})
+        for resource_id, day in days:
+            conn.execute(update(_DAYS).where(_key_filter(resource_type, resource_id, day)).values(
+                busy=format(busy[(resource_id, day)], "x"), built_version=_DAYS.c.version, computed_at=now
+            ))
+
+
+def get_busy(db, resource_type: str, resource_ids, dates) -> Dict[tuple, int]:
+    """Busy bitmaps from availability_days, rebuilding missing or stale days (commits)."""
+    conn = db.connection()
+    cutoff = (datetime.utcnow() - timedelta(seconds=AVAILABILITY_MAX_AGE)).isoformat()
+    rows = conn.execute(select(
+        _DAYS.c.resource_id, _DAYS.c.date, _DAYS.c.busy, _DAYS.c.version, _DAYS.c.built_version, _DAYS.c.computed_at
+    ).where(
+        _DAYS.c.resource_type == resource_type,
+        _DAYS.c.resource_id.in_(list(resource_ids)),
+        _DAYS.c.date.in_(list(dates))
+    )).all()
+
+    busy, versions = {}, {}
+    for resource_id, day, bits, version, built_version, computed_at in rows:
+        versions[(resource_id, day)] = version
+        if built_version == version and computed_at and computed_at >= cutoff:
+            busy[(resource_id, day)] = int(bits, 16)
+
+    missing = [(rid, day) for rid in resource_ids for day in dates if (rid, day) not in busy]
+    if not missing:
+        return busy
+
+    computed = compute_busy(conn, resource_type, {rid for rid, _ in missing}, {day for _, day in missing})
+    now = datetime.utcnow().isoformat()
+    for key in missing:
+        busy[key] = computed[key]
+        resource_id, day = key
+        if key in versions:
+            # Only if no booking bumped the day since it was read
+            conn.execute(update(_DAYS).where(
+                _key_filter(resource_type, resource_id, day), _DAYS.c.version == versions[key]
+            ).values(busy=format(computed[key], "x"), built_version=versions[key], computed_at=now))
+        else:
+            conn.execute(_insert(conn).values(
+                resource_type=resource_type, resource_id=resource_id, date=day,
+                busy=format(computed[key], "x"), version=0, built_version=0, computed_at=now
+            ).on_conflict_do_nothing())
+    db.commit()
+    return busy
+
+
+# --- Slots ---
+
+def _opening_blocks(conn, resource_type: str, resource_ids) -> Dict[str, Dict[int, List[tuple]]]:
+    """{resource_id: {day_of_week: [(start_minute, end_minute)]}} from the weekly availability."""
+    model, owner = _AVAILABILITY[resource_type]
+    rows = conn.execute(select(owner, model.day_of_week, model.start_time, model.end_time).where(
+        owner.in_(list(resource_ids)),
+        model.is_available == True
+    ))
+    blocks = {}
+    for resource_id, day_of_week, start_time, end_time in rows:
+        blocks.setdefault(resource_id, {}).setdefault(day_of_week, []).append((_hhmm(start_time), _hhmm(end_time)))
+    for per_day in blocks.values():
+        for day_blocks in per_day.values():
+            day_blocks.sort()
+    return blocks
+
+
+def free_slots(blocks: List[tuple], busy: int, day: date, slot_minutes: int, now: datetime) -> List[dict]:
+    """Slots of slot_minutes laid out from the start of each opening block that don't touch busy minutes."""
+    past = now.hour * 60 + now.minute if day == now.date() else -1
+    slots = []
+    for start, end in blocks:
+        current = start
+        while current + slot_minutes <= end:
+            # Skip past time slots if the date is today
+            if current > past and not busy & _mask(current, slot_minutes):
+                slots.append({
+                    "start_time": _format(current),
+                    "end_time": _format(current + slot_minutes),
+                    "available": True
+                })
+            current += slot_minutes
+    return slots
+
+
+def day_slots(db, resource_type: str, resource_id: str, date_str: str, slot_minutes: int = 60) -> List[dict]:
+    """Free slots of one resource on one day, computed from the booking tables (used to validate bookings)."""
+    day = datetime.fromisoformat(date_str).date()
+    conn = db.connection()
+    blocks = _opening_blocks(conn, resource_type, [resource_id]).get(resource_id, {}).get(day.weekday())
+    if not blocks:
+        return []
+    busy = compute_busy(conn, resource_type, [resource_id], [date_str])[(resource_id, date_str)]
+    return free_slots(blocks, busy, day, slot_minutes, datetime.now())
+
+
+def search_free_slots(db, resource_type: str, resource_ids: List[str], start: date, days: int) -> Dict[str, dict]:
+    """{resource_id: {date: [slots]}} for every resource over `days` days from `start`."""
+    resource_ids = list(dict.fromkeys(resource_ids))
+    slot_minutes = {rid: 60 for rid in resource_ids}
+    if resource_type == "facility":
+        facilities = db.query(FacilityORM.id, FacilityORM.slot_duration).filter(
+            FacilityORM.id.in_(resource_ids),
+            FacilityORM.is_active == True
+        ).all()
+        slot_minutes = {fid: duration or 60 for fid, duration in facilities}
+
+    dates = [start + timedelta(days=i) for i in range(days)]
+    date_strs = [d.isoformat() for d in dates]
+    blocks = _opening_blocks(db.connection(), resource_type, list(slot_minutes))
+    open_ids = [rid for rid in slot_minutes if rid in blocks]
+    busy = get_busy(db, resource_type, open_ids, date_strs) if open_ids else {}
+
+    now = datetime.now()
+    result = {}
+    for rid in resource_ids:
+        per_day = {}
+        for day, day_str in zip(dates, date_strs):
+            day_blocks = blocks.get(rid, {}).get(day.weekday()) if rid in open_ids else None
+            per_day[day_str] = free_slots(day_blocks, busy[(rid, day_str)], day, slot_minutes[rid], now) if day_blocks else []
+        result[rid] = per_day
+    return result
+
+
+# --- Keeping bitmaps current ---
+
+_SOURCES = {
+    AppointmentORM: ("trainer", "trainer_id"),
+    TrainerScheduleORM: ("trainer", "trainer_id"),
+    NutritionistAppointmentORM: ("nutritionist", "nutritionist_id"),
+    FacilityBookingORM: ("facility", "facility_id"),
+}
+
+
+def attribute_values(mapper, connection, target, name) -> set:
+    """Current and previous values of an attribute (a booking moved to another day touches both)."""
+    state = inspect(target)
+    history = state.attrs[name].history
+    values = {*(history.deleted or ()), *(history.added or ()), getattr(target, name)}
+    if history.added and not history.deleted and state.key is not None:
+        # Changed without the old value being loaded (e.g. after a commit expired it): read it from the row
+        pk = mapper.primary_key[0]
+        values.add(connection.execute(
+            select(mapper.columns[name]).where(pk == mapper.primary_key_from_instance(target)[0])
+        ).scalar())
+    return {v for v in values if v}
+
+
+def _track(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    resource_type, owner = _SOURCES[mapper.class_]
+    keys = {(resource_type, rid, day)
+            for rid in attribute_values(mapper, connection, target, owner)
+            for day in attribute_values(mapper, connection, target, "date")}
+    session.info.setdefault("availability_dirty", set()).update(keys)
+
+
+for _model in _SOURCES:
+    event.listen(_model, "after_insert", _track)
+    event.listen(_model, "before_update", _track)  # before: the row still holds the old day
+    event.listen(_model, "after_delete", _track)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _refresh_after_flush(session, flush_context):
+    keys = session.info.pop("availability_dirty", None)
+    if keys:
+        refresh_days(session.connection(), keys)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("availability_dirty", None)
+
+
+def get_free_slots(resource_type: str, resource_ids: List[str], start_str: str = None, days: int = 14) -> dict:
+    """Free slots of up to MAX_SEARCH_RESOURCES resources over up to MAX_SEARCH_DAYS days, in one call."""
+    from fastapi import HTTPException
+
+    if resource_type not in RESOURCE_TYPES:
+        raise HTTPException(status_code=400, detail=f"resource_type must be one of {', '.join(RESOURCE_TYPES)}")
+    if not resource_ids or len(resource_ids) > MAX_SEARCH_RESOURCES:
+        raise HTTPException(status_code=400, detail=f"Give between 1 and {MAX_SEARCH_RESOURCES} ids")
+    if not 1 <= days <= MAX_SEARCH_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {MAX_SEARCH_DAYS}")
+    try:
+        start = date.fromisoformat(start_str) if start_str else date.today()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start must be YYYY-MM-DD")
+    start = max(start, date.today())
+
+    db = get_db_session()
+    try:
+        return {
+            "resource_type": resource_type,
+            "start": start.isoformat(),
+            "days": days,
+            "slots": search_free_slots(db, resource_type, resource_ids, start, days),
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error searching available slots: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get available slots: {str(e)}")
+    finally:
+        db.close()
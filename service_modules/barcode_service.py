@@ -0,0 +1,365 @@
+"""
+Barcode Service - tiered product lookup for barcode scans in the diet log.
+
+Members scan the same few hundred products every day, so a scan is resolved by the
+first tier that knows the barcode:
+
+1. in-process LRU (per worker, BARCODE_LRU_SIZE entries)
+2. barcode_products table: earlier Open Food Facts answers, including "not found"
+   (BARCODE_FOUND_TTL_DAYS / BARCODE_NOT_FOUND_TTL_HOURS)
+3. offline index built from an Open Food Facts dump (off_index.py), if present
+4. Open Food Facts API, with an async HTTP client (world, then the Italian mirror)
+
+Concurrent scans of the same barcode share one remote request, and when the API is
+down an expired product row is served rather than nothing. Per-tier counters are
+reported by GET /api/diet/barcode-cache/stats.
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from database import get_db_session, run_sync
+from models_orm import BarcodeProductORM
+from off_index import OffIndex
+
+import logging
+logger = logging.getLogger("gym_app")
+
+BARCODE_LRU_SIZE = int(os.getenv("BARCODE_LRU_SIZE", "5000"))
+BARCODE_LRU_TTL = int(os.getenv("BARCODE_LRU_TTL", "3600"))
+BARCODE_FOUND_TTL_DAYS = int(os.getenv("BARCODE_FOUND_TTL_DAYS", "30"))
+BARCODE_NOT_FOUND_TTL_HOURS = int(os.getenv("BARCODE_NOT_FOUND_TTL_HOURS", "24"))
+OFF_TIMEOUT = float(os.getenv("OFF_TIMEOUT", "8"))
+
+OFF_API_URLS = (
+    "https://world.openfoodfacts.org/api/v2/product/{barcode}",
+    "https://it.openfoodfacts.org/api/v2/product/{barcode}",
+)
+OFF_HEADERS = {"User-Agent": "FitOS-GymApp/1.0 (contact@fitos.app)"}
+
+_BARCODE = re.compile(r"^\d{6,14}$")
+_MISSING = object()
+
+
+def product_to_data(product: dict) -> dict:
+    """Diet log fields for an Open Food Facts product (per serving, plus per 100g)."""
+    nutriments = product.get("nutriments", {})
+
+    # Get product info
+    product_name = product.get("product_name") or product.get("product_name_it") or product.get("product_name_en") or "Unknown Product"
+    brands = product.get("brands", "")
+    quantity = product.get("quantity", "")
+
+    # Parse quantity to get package weight
+    package_weight = 100  # default to 100g
+    if quantity:
+        match = re.search(r'(\d+)\s*g', quantity.lower())
+        if match:
+            package_weight = int(match.group(1))
+
+    # Get nutritional values per 100g
+    energy_100g = nutriments.get("energy-kcal_100g") or 0
+    if not energy_100g:
+        # Try energy in kJ and convert
+        energy_kj = nutriments.get("energy_100g", 0)
+        if energy_kj:
+            energy_100g = energy_kj / 4.184
+
+    protein_100g = nutriments.get("proteins_100g", 0) or 0
+    carbs_100g = nutriments.get("carbohydrates_100g", 0) or 0
+    fat_100g = nutriments.get("fat_100g", 0) or 0
+
+    # Use serving size if available, otherwise default to 100g
+    serving_size = nutriments.get("serving_quantity") or product.get("serving_quantity")
+    if serving_size:
+        try:
+            portion = float(serving_size)
+        except (ValueError, TypeError):
+            portion = 100.0
+    else:
+        portion = 100.0
+
+    scale = portion / 100.0
+    serving_label = product.get("serving_size") or f"{int(portion)}g"
+    full_name = f"{brands} {product_name}".strip() if brands else product_name
+
+    return {
+        "name": full_name,
+        "cals": round(energy_100g * scale),
+        "protein": round(protein_100g * scale, 1),
+        "carbs": round(carbs_100g * scale, 1),
+        "fat": round(fat_100g * scale, 1),
+        "portion_size": serving_label,
+        "package_weight": package_weight,
+        "serving_quantity": portion,
+        "per_100g": {
+            "cals": round(energy_100g),
+            "protein": round(protein_100g, 1),
+            "carbs": round(carbs_100g, 1),
+            "fat": round(fat_100g, 1)
+        },
+        "confidence": "high",
+        "source": "openfoodfacts_barcode"
+    }
+
+
+class ProductLRU:
+    """Thread-safe LRU of barcode -> product data (None for "not found"), with TTL."""
+
+    def __init__(self, max_size: int = BARCODE_LRU_SIZE, ttl: int = BARCODE_LRU_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, barcode: str):
+        with self._lock:
+            entry = self._entries.get(barcode)
+            if entry is None:
+                return _MISSING
+            if entry[0] < time.monotonic():
+                del self._entries[barcode]
+                return _MISSING
+            self._entries.move_to_end(barcode)
+            return entry[1]
+
+    def put(self, barcode: str, data: Optional[dict], ttl: Optional[int] = None):
+        with self._lock:
+            self._entries[barcode] = (time.monotonic() + (ttl or self.ttl), data)
+            self._entries.move_to_end(barcode)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class BarcodeService:
+    """Service for barcode lookups through the local tiers and Open Food Facts."""
+
+    def __init__(self, index: Optional[OffIndex] = None):
+        self.lru = ProductLRU()
+        self.index = index or OffIndex()
+        self._client = None
+        self._client_loop = None
+        self._inflight = {}
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "lookups": 0, "lru_hits": 0, "db_hits": 0, "index_hits": 0,
+            "remote_found": 0, "remote_not_found": 0, "remote_errors": 0,
+            "negative_hits": 0, "stale_served": 0, "coalesced": 0, "invalid": 0,
+        }
+        self._started = time.time()
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    async def lookup(self, barcode: str) -> dict:
+        """Barcode endpoint response: status success/not_found, product data and the tier that answered."""
+        barcode = (barcode or "").strip()
+        self._count("lookups")
+        if not _BARCODE.match(barcode):
+            self._count("invalid")
+            return self._not_found(barcode)
+
+        data = self.lru.get(barcode)
+        if data is not _MISSING:
+            self._count("lru_hits")
+            if data is None:
+                self._count("negative_hits")
+            return self._response(barcode, data, "lru")
+
+        data, tier, stale = await run_sync(self._lookup_local, barcode)
+        if tier:
+            self._count(f"{tier}_hits")
+            if data is None:
+                self._count("negative_hits")
+            self.lru.put(barcode, data)
+            return self._response(barcode, data, tier)
+
+        # Concurrent scans of the same product share one remote request
+        pending = self._inflight.get(barcode)
+        if pending is not None:
+            self._count("coalesced")
+            data, tier = await asyncio.shield(pending)
+            return self._response(barcode, data, tier)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[barcode] = future
+        try:
+            data, tier = await self._lookup_remote(barcode, stale)
+            future.set_result((data, tier))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved: there may be no coalesced waiter
+            raise
+        finally:
+            del self._inflight[barcode]
+        return self._response(barcode, data, tier)
+
+    # --- Tiers ---
+
+    def _lookup_local(self, barcode: str) -> tuple:
+        """(data, tier, stale): tier is None when the network has to be asked."""
+        now = datetime.utcnow().isoformat()
+        stale = None
+        db = get_db_session()
+        try:
+            row = db.get(BarcodeProductORM, barcode)
+            if row is not None:
+                data = json.loads(row.data) if row.found and row.data else None
+                if row.expires_at > now:
+                    return data, "db", None
+                stale = data
+        finally:
+            db.close()
+
+        try:
+            product = self.index.get(barcode)
+        except Exception as e:
+            logger.warning(f"Open Food Facts index lookup failed: {e}")
+            product = None
+        if product is not None:
+            return product_to_data(product), "index", None
+        return None, None, stale
+
+    async def _lookup_remote(self, barcode: str, stale: Optional[dict]) -> tuple:
+        try:
+            product = await self._fetch_remote(barcode)
+        except Exception as e:
+            self._count("remote_errors")
+            logger.warning(f"Open Food Facts barcode lookup error: {e}")
+            if stale is not None:
+                self._count("stale_served")
+                return stale, "db"
+            # Not cached: the product may well exist once the API is back
+            return None, "remote"
+
+        data = product_to_data(product) if product is not None else None
+        self._count("remote_found" if data else "remote_not_found")
+        self.lru.put(barcode, data)
+        try:
+            await run_sync(self._store, barcode, data)
+        except Exception as e:
+            logger.warning(f"Caching barcode {barcode} failed: {e}")
+        return data, "remote"
+
+    async def _fetch_remote(self, barcode: str) -> Optional[dict]:
+        """The Open Food Facts product, None if unknown. Raises if no mirror answered."""
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            # The client's connection pool belongs to the loop that created it
+            self._client = httpx.AsyncClient(timeout=OFF_TIMEOUT, headers=OFF_HEADERS)
+            self._client_loop = loop
+        error = None
+        answered = False
+        for api_url in OFF_API_URLS:
+            try:
+                response = await self._client.get(api_url.format(barcode=barcode))
+            except httpx.HTTPError as e:
+                error = e
+                continue
+            if response.status_code == 404:
+                answered = True
+                continue
+            if response.status_code != 200:
+                error = RuntimeError(f"HTTP {response.status_code} from {api_url.format(barcode=barcode)}")
+                continue
+            answered = True
+            data = response.json()
+            if data.get("status") == 1:
+                return data.get("product", {})
+        if answered:
+            return None
+        raise error or RuntimeError("Open Food Facts unavailable")
+
+    def _store(self, barcode: str, data: Optional[dict]):
+        now = datetime.utcnow()
+        ttl = timedelta(days=BARCODE_FOUND_TTL_DAYS) if data else timedelta(hours=BARCODE_NOT_FOUND_TTL_HOURS)
+        db = get_db_session()
+        try:
+            db.merge(BarcodeProductORM(
+                barcode=barcode, found=data is not None, data=json.dumps(data) if data else None,
+                source="openfoodfacts_api", fetched_at=now.isoformat(), expires_at=(now + ttl).isoformat(),
+            ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # --- Responses ---
+
+    def _response(self, barcode: str, data: Optional[dict], tier: str) -> dict:
+        if data is None:
+            return self._not_found(barcode)
+        return {"status": "success", "data": data, "method": "barcode", "tier": tier}
+
+    @staticmethod
+    def _not_found(barcode: str) -> dict:
+        return {
+            "status": "not_found",
+            "message": f"Product with barcode {barcode} not found. Try taking a photo instead.",
+            "barcode": barcode
+        }
+
+    def get_stats(self) -> dict:
+        """Hit rates for this worker since start, plus the shared table and index sizes."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats["lookups"] - stats["invalid"]
+        local = stats["lru_hits"] + stats["db_hits"] + stats["index_hits"]
+        db = get_db_session()
+        try:
+            from sqlalchemy import func
+            counts = dict(db.query(BarcodeProductORM.found, func.count()).group_by(BarcodeProductORM.found).all())
+        finally:
+            db.close()
+        return {
+            "worker_pid": os.getpid(),
+            "since": datetime.utcfromtimestamp(self._started).isoformat(),
+            "counters": stats,
+            "hit_rate": round(local / lookups, 4) if lookups else None,
+            "tier_hit_rates": {
+                tier: round(stats[f"{tier}_hits"] / lookups, 4) if lookups else None
+                for tier in ("lru", "db", "index")
+            },
+            "lru_entries": len(self.lru),
+            "db_products": counts.get(True, 0),
+            "db_not_found": counts.get(False, 0),
+            "index": self.index.info(),
+        }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Singleton instance
+barcode_service = BarcodeService()
+
+
+def get_barcode_service() -> BarcodeService:
+    """Dependency injection helper."""
+    return barcode_service
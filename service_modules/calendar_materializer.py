@@ -0,0 +1,122 @@
+"""
+Calendar Materializer - writes recurring plans (weekly splits, course days) into the
+trainer and client calendars in bulk.
+
+Assigning a split used to walk 28 days one at a time: per day a query for what was
+already there, a query for the workout's title, and a commit. Generating a course
+schedule ran one existence query per date. Callers now describe the rows they want,
+for any number of people and days, and materialize():
+- reads what those calendars already hold on the days concerned, one query per batch
+- diffs in memory. A day already holding exactly the wanted row is left alone. In
+  "replace" mode the day's conflicting rows are swapped for the wanted one; in "keep"
+  mode a day that already has a conflicting row is skipped
+- applies each batch with one DELETE and one multi-row INSERT, in the caller's
+  transaction (the caller commits once)
+
+Core writes skip the mapper events, so what those events do for the rows written is
+done here: the trainer calendar's change log (schedule_sync) and busy bitmaps
+(availability_engine), and the clients' activity-state dirty flag.
+"""
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Sequence
+
+from sqlalchemy import delete, select
+
+from models_orm import TrainerScheduleORM, ClientScheduleORM
+from .activity_state_service import mark_activity_dirty
+from .availability_engine import refresh_days
+from .schedule_sync import record_changes
+
+import logging
+logger = logging.getLogger("gym_app")
+
+MATERIALIZE_BATCH = 200  # Calendar owners per batch
+STATEMENT_ROWS = 500  # Ids per DELETE / rows per INSERT statement
+
+# Calendar model -> its owner column
+_OWNER = {TrainerScheduleORM: "trainer_id", ClientScheduleORM: "client_id"}
+
+MODES = ("replace", "keep")
+
+
+def weekly_dates(start: date, days: int, weekdays: Iterable[int]) -> List[date]:
+    """Dates in [start, start + days) that fall on the given weekdays (0 = Monday)."""
+    weekdays = {int(d) for d in weekdays}
+    return [start + timedelta(days=i) for i in range(days) if (start + timedelta(days=i)).weekday() in weekdays]
+
+
+def _chunks(items: Sequence, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def materialize(db, model, planned: List[dict], mode: str = "replace", conflicts=None,
+                compare: Sequence[str] = ()) -> dict:
+    """
+    Make the calendars of `model` (TrainerScheduleORM or ClientScheduleORM) hold `planned`.
+
+    Each planned row is a dict of column values including the owner column and "date",
+    at most one per owner and day; all rows need the same keys. `conflicts` is an extra
+    condition on existing rows that compete with a planned row on its day (default: every
+    row of that day). An existing row matching the planned one on the `compare` columns
+    counts as already there.
+
+    Returns counts: inserted, deleted, unchanged and kept (skipped in "keep" mode).
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}")
+    table = model.__table__
+    owner_col = _OWNER[model]
+    owner = table.c[owner_col]
+
+    by_owner: Dict[str, Dict[str, dict]] = {}
+    for row in planned:
+        by_owner.setdefault(row[owner_col], {})[row["date"]] = row
+
+    stats = {"inserted": 0, "deleted": 0, "unchanged": 0, "kept": 0}
+    conn = db.connection()
+    for owners in _chunks(sorted(by_owner), MATERIALIZE_BATCH):
+        dates = {day for o in owners for day in by_owner[o]}
+        query = select(table.c.id, owner, table.c.date, *(table.c[c] for c in compare)).where(
+            owner.in_(owners), table.c.date >= min(dates), table.c.date <= max(dates)
+        )
+        if conflicts is not None:
+            query = query.where(conflicts)
+        existing: Dict[tuple, list] = {}
+        for row in conn.execute(query):
+            existing.setdefault((row[1], row[2]), []).append(row)
+
+        deletes, inserts = [], []
+        for o in owners:
+            for day, wanted in by_owner[o].items():
+                current = existing.get((o, day), [])
+                if mode == "keep" and current:
+                    stats["kept"] += 1
+                elif len(current) == 1 and tuple(current[0][3:]) == tuple(wanted.get(c) for c in compare):
+                    stats["unchanged"] += 1
+                else:
+                    deletes.extend(current)
+                    inserts.append(wanted)
+
+        for chunk in _chunks(deletes, STATEMENT_ROWS):
+            conn.execute(delete(table).where(table.c.id.in_([r[0] for r in chunk])))
+        inserted = []
+        for chunk in _chunks(inserts, STATEMENT_ROWS):
+            # Returning owner and date with the id: no need for the rows to come back in order
+            inserted.extend(conn.execute(table.insert().returning(owner, table.c.date, table.c.id), chunk))
+
+        _after_write(conn, model, [(r[1], r[2], r[0]) for r in deletes] + inserted)
+        stats["deleted"] += len(deletes)
+        stats["inserted"] += len(inserts)
+    return stats
+
+
+def _after_write(conn, model, written: List[tuple]):
+    """What the ORM events would have done for (owner, date, id) rows inserted or deleted."""
+    if not written:
+        return
+    if model is TrainerScheduleORM:
+        record_changes(conn, [(o, entry_id) for o, _, entry_id in written])
+        refresh_days(conn, {("trainer", o, day) for o, day, _ in written})
+    elif model is ClientScheduleORM:
+        mark_activity_dirty(conn, {o for o, _, _ in written})
@@ -1,21 +1,45 @@
 """
 Client Import Service - Smart CSV import with auto-detection of source platform.
 Supports: Golee, BookyWay, Gymdesk, Virtuagym, Zen Planner, SportRick, Asso360, generic CSV.
+
+Rows are parsed and imported in chunks: one query per chunk finds existing
+emails/usernames, temporary passwords are bcrypt-hashed in a process pool, and users,
+profiles, medical certificates and subscriptions are bulk-inserted and committed per
+chunk.
+Large files run as a background job (client_import_jobs) whose progress the owner
+UI polls.
 """
 import csv
 import io
+import json
+import math
+import os
+import re
 import uuid
 import string
 import secrets
 import logging
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+from itertools import islice, repeat
+
+from sqlalchemy import insert, or_
+from sqlalchemy.exc import IntegrityError
 
+from cpu_tasks import CPU_POOL_WORKERS, get_cpu_pool, shutdown_cpu_pool, hash_password_batch
 from database import get_db_session
-from models_orm import UserORM, ClientProfileORM, MedicalCertificateORM, ClientSubscriptionORM
-from simple_auth import hash_password
+from models_orm import (
+    UserORM, ClientProfileORM, MedicalCertificateORM, ClientSubscriptionORM, SubscriptionPlanORM,
+    ClientImportJobORM,
+)
 
 logger = logging.getLogger("gym_app")
 
+IMPORT_CHUNK_SIZE = int(os.environ.get("IMPORT_CHUNK_SIZE", "500"))
+IMPORT_HASH_WORKERS = int(os.environ.get("IMPORT_HASH_WORKERS", str(CPU_POOL_WORKERS)))
+BCRYPT_ROUNDS = 12  # Same cost as bcrypt.gensalt() in simple_auth.hash_password
+
 # ═══════════════════════════════════════════════════════════
 #  PLATFORM SIGNATURES - header patterns to detect source
 # ═══════════════════════════════════════════════════════════
@@ -187,9 +211,115 @@ def _normalize_gender(value):
     return 'other'
 
 
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def _iso_date(value):
+    """Return value if _parse_date produced a YYYY-MM-DD date, else None."""
+    return value if value and _ISO_DATE.match(value) else None
+
+
+# ═══════════════════════════════════════════════════════════
+#  PASSWORD HASHING - bcrypt is CPU-bound, so batches run in a
+#  process pool instead of on the request thread
+# ═══════════════════════════════════════════════════════════
+
+def hash_passwords(passwords, rounds=None):
+    """bcrypt-hash a list of passwords, spread over the CPU pool's processes."""
+    rounds = rounds or BCRYPT_ROUNDS
+    if IMPORT_HASH_WORKERS <= 1 or len(passwords) < 2 * IMPORT_HASH_WORKERS:
+        return hash_password_batch(passwords, rounds)
+    size = math.ceil(len(passwords) / IMPORT_HASH_WORKERS)
+    batches = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+    try:
+        hashed = get_cpu_pool().map(hash_password_batch, batches, repeat(rounds))
+        return [h for batch in hashed for h in batch]
+    except BrokenProcessPool:
+        logger.warning("Import: password hashing pool died, hashing inline")
+        shutdown_cpu_pool()
+        return hash_password_batch(passwords, rounds)
+
+
 class ClientImportService:
 
-    def process_csv(self, csv_content, owner_id):
+    def __init__(self):
+        # One background import at a time per worker; hashing already uses every core
+        self._job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="client-import")
+
+    # --- Background jobs ---
+
+    def start_import_job(self, csv_content, owner_id, filename=None) -> str:
+        """Queue an import and return its job id. Progress is stored in client_import_jobs."""
+        job_id = str(uuid.uuid4())
+        db = get_db_session()
+        try:
+            db.add(ClientImportJobORM(id=job_id, owner_id=owner_id, filename=filename, status="queued"))
+            db.commit()
+        finally:
+            db.close()
+        self._job_executor.submit(self._run_job, job_id, csv_content, owner_id)
+        return job_id
+
+    def _run_job(self, job_id, csv_content, owner_id):
+        self._update_job(job_id, status="running")
+
+        def on_progress(processed, total, result):
+            self._update_job(job_id, total_rows=total, processed_rows=processed,
+                             created_count=result["created"], skipped_count=result["skipped"],
+                             error_count=len(result["errors"]))
+
+        try:
+            result = self.process_csv(csv_content, owner_id, on_progress=on_progress)
+            self._update_job(job_id, status="completed", result=json.dumps(result),
+                             created_count=result["created"], skipped_count=result["skipped"],
+                             error_count=len(result["errors"]), finished_at=datetime.utcnow().isoformat())
+            logger.info(f"Import job {job_id}: {result['created']} created, {result['skipped']} skipped, "
+                        f"{len(result['errors'])} errors")
+        except Exception as e:
+            logger.error(f"Import job {job_id} failed: {e}")
+            self._update_job(job_id, status="failed", error=str(e), finished_at=datetime.utcnow().isoformat())
+
+    def _update_job(self, job_id, **values):
+        db = get_db_session()
+        try:
+            db.query(ClientImportJobORM).filter(ClientImportJobORM.id == job_id).update(values)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Import job {job_id} progress update failed: {e}")
+        finally:
+            db.close()
+
+    def get_import_job(self, job_id, owner_id):
+        """Job status for its owner; includes the import result once completed. None if not found."""
+        db = get_db_session()
+        try:
+            job = db.query(ClientImportJobORM).filter(
+                ClientImportJobORM.id == job_id,
+                ClientImportJobORM.owner_id == owner_id
+            ).first()
+            if not job:
+                return None
+            return {
+                "job_id": job.id,
+                "filename": job.filename,
+                "status": job.status,
+                "total_rows": job.total_rows,
+                "processed_rows": job.processed_rows,
+                "created": job.created_count,
+                "skipped": job.skipped_count,
+                "error_count": job.error_count,
+                "error": job.error,
+                "created_at": job.created_at,
+                "finished_at": job.finished_at,
+                "result": json.loads(job.result) if job.result else None,
+            }
+        finally:
+            db.close()
+
+    # --- Import pipeline ---
+
+    def process_csv(self, csv_content, owner_id, on_progress=None):
         result = {
             "created": 0,
             "skipped": 0,
@@ -200,6 +330,42 @@ class ClientImportService:
             "fields_unmapped": [],
         }
 
+        reader, header_map, total = self._open_csv(csv_content, result)
+        if reader is None:
+            return result
+
+        # Parsed rows are read a chunk at a time, never all at once
+        rows = enumerate(reader, start=2)
+        if on_progress:
+            on_progress(0, total, result)
+
+        db = get_db_session()
+        try:
+            plans = {
+                (p.name or '').strip().lower(): p.id
+                for p in db.query(SubscriptionPlanORM).filter(SubscriptionPlanORM.gym_id == owner_id).all()
+            }
+            seen = {"emails": set(), "usernames": set()}
+            processed = 0
+            while True:
+                chunk = list(islice(rows, IMPORT_CHUNK_SIZE))
+                if not chunk:
+                    break
+                self._import_chunk(db, chunk, header_map, owner_id, plans, seen, result)
+                processed += len(chunk)
+                if on_progress:
+                    on_progress(processed, total, result)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Import commit error: {e}")
+            result["errors"].append({"row": 0, "reason": f"Errore database: {str(e)}"})
+        finally:
+            db.close()
+
+        return result
+
+    def _open_csv(self, csv_content, result):
+        """Decode the file, detect delimiter/platform and map headers. Returns (reader, header_map, row count)."""
         # Decode CSV
         try:
             text = csv_content.decode('utf-8-sig')
@@ -208,7 +374,7 @@ class ClientImportService:
                 text = csv_content.decode('latin-1')
             except UnicodeDecodeError:
                 result["errors"].append({"row": 0, "reason": "Impossibile decodificare il file. Usa codifica UTF-8."})
-                return result
+                return None, None, 0
 
         # Auto-detect delimiter
         first_line = text.split('\n')[0] if text.strip() else ''
@@ -222,7 +388,7 @@ class ClientImportService:
         reader = csv.DictReader(io.StringIO(text), delimiter=delimiter)
         if not reader.fieldnames:
             result["errors"].append({"row": 0, "reason": "Il file CSV sembra vuoto o senza intestazioni."})
-            return result
+            return None, None, 0
 
         # Detect source platform
         platform_id, platform_name = _detect_platform(reader.fieldnames)
@@ -245,157 +411,231 @@ class ClientImportService:
                 "row": 0,
                 "reason": f"Il CSV deve avere almeno una colonna 'nome' o 'email'. Trovate: {', '.join(reader.fieldnames)}"
             })
-            return result
+            return None, None, 0
 
-        db = get_db_session()
-        try:
-            for row_num, row in enumerate(reader, start=2):
-                try:
-                    self._process_row(row, row_num, header_map, owner_id, db, result)
-                except Exception as e:
-                    logger.error(f"Import row {row_num} error: {e}")
-                    result["errors"].append({"row": row_num, "reason": str(e)})
+        # Count the data rows for progress (blank lines are skipped, as DictReader does)
+        total = sum(1 for record in csv.reader(io.StringIO(text), delimiter=delimiter) if record) - 1
+        return reader, header_map, total
 
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            logger.error(f"Import commit error: {e}")
-            result["errors"].append({"row": 0, "reason": f"Errore database: {str(e)}"})
-        finally:
-            db.close()
-
-        return result
+    def _parse_row(self, row, header_map):
+        """Extract the import fields of one row. Raises ValueError for unusable rows."""
+        def text(field, default=''):
+            return (row.get(header_map[field]) or '').strip() if field in header_map else default
 
-    def _process_row(self, row, row_num, header_map, owner_id, db, result):
         # Build full name from first_name + last_name if needed
         if header_map.get('_has_split_name'):
-            first = row.get(header_map.get('first_name', ''), '').strip() if 'first_name' in header_map else ''
-            last = row.get(header_map.get('last_name', ''), '').strip() if 'last_name' in header_map else ''
-            name = f"{first} {last}".strip()
+            name = f"{text('first_name')} {text('last_name')}".strip()
         else:
-            name = row.get(header_map.get('name', ''), '').strip() if 'name' in header_map else ''
-
-        email = row.get(header_map.get('email', ''), '').strip() if 'email' in header_map else ''
+            name = text('name')
+        email = text('email')
 
         if not name and not email:
-            result["errors"].append({"row": row_num, "reason": "Nome e email mancanti"})
+            raise ValueError("Nome e email mancanti")
+
+        # Base username; made unique against the database in _import_chunk
+        base_name = name if name else (email.split('@')[0] if email else 'client')
+        username = ''.join(c for c in base_name.strip().lower().replace(' ', '_') if c.isalnum() or c == '_')
+
+        return {
+            "name": name,
+            "email": email,
+            "base_name": base_name,
+            "username": username or 'client',
+            "phone": text('phone', None),
+            "weight": _parse_float(text('weight')),
+            "body_fat": _parse_float(text('body_fat_pct')),
+            "height": _parse_float(text('height_cm')),
+            "dob": _parse_date(text('date_of_birth')),
+            "gender": _normalize_gender(text('gender')) if 'gender' in header_map else None,
+            "plan": text('plan', 'Standard') or 'Standard',
+            "join_date": _parse_date(text('join_date')),
+            "expiry_date": _parse_date(text('expiry_date')),
+            "cert_expiry": _parse_date(text('cert_expiry')),
+        }
+
+    def _taken_identities(self, db, emails, usernames):
+        """Emails and usernames among the given ones that already exist (one query)."""
+        if not emails and not usernames:
+            return set(), set()
+        rows = db.query(UserORM.email, UserORM.username).filter(or_(
+            UserORM.email.in_(emails), UserORM.username.in_(usernames)
+        )).all()
+        return {r.email for r in rows if r.email}, {r.username for r in rows if r.username}
+
+    def _import_chunk(self, db, chunk, header_map, owner_id, plans, seen, result):
+        parsed = []
+        for row_num, row in chunk:
+            try:
+                parsed.append((row_num, self._parse_row(row, header_map)))
+            except ValueError as e:
+                result["errors"].append({"row": row_num, "reason": str(e)})
+            except Exception as e:
+                logger.error(f"Import row {row_num} error: {e}")
+                result["errors"].append({"row": row_num, "reason": str(e)})
+        if not parsed:
             return
 
-        # Check duplicate email
-        if email:
-            existing = db.query(UserORM).filter(UserORM.email == email).first()
-            if existing:
+        taken_emails, taken_usernames = self._taken_identities(
+            db, {f["email"] for _, f in parsed if f["email"]}, {f["username"] for _, f in parsed}
+        )
+        taken_emails |= seen["emails"]
+        taken_usernames |= seen["usernames"]
+
+        # Check duplicate emails and pick usernames
+        accepted, suffixed = [], set()
+        for row_num, fields in parsed:
+            email = fields["email"]
+            if email and email in taken_emails:
                 result["skipped"] += 1
                 result["errors"].append({"row": row_num, "reason": f"Email già esistente: {email}"})
-                return
+                continue
+            if email:
+                taken_emails.add(email)
+            if fields["username"] in taken_usernames:
+                fields["username"] = self._unique_username(fields["base_name"], taken_usernames)
+                suffixed.add(fields["username"])
+            taken_usernames.add(fields["username"])
+            accepted.append((row_num, fields))
+
+        # Suffixed usernames were only checked against names known so far; verify them in one query
+        _, clashes = self._taken_identities(db, set(), suffixed)
+        for _, fields in accepted:
+            if fields["username"] in clashes:
+                fields["username"] = self._unique_username(fields["base_name"], taken_usernames | clashes)
+                taken_usernames.add(fields["username"])
+
+        passwords = [_generate_temp_password() for _ in accepted]
+        hashed = hash_passwords(passwords)
+
+        records = [self._build_records(fields, owner_id, plans, pw_hash)
+                   for (_, fields), pw_hash in zip(accepted, hashed)]
+        try:
+            self._bulk_insert(db, records)
+            db.commit()
+            inserted = [True] * len(records)
+        except IntegrityError:
+            # A concurrent signup took an email/username: retry row by row
+            db.rollback()
+            inserted = self._insert_one_by_one(db, records)
+            db.commit()
 
-        # Generate username
-        base_name = name if name else (email.split('@')[0] if email else 'client')
-        username = ''.join(c for c in base_name.strip().lower().replace(' ', '_') if c.isalnum() or c == '_')
-        if not username:
-            username = 'client'
+        for (row_num, fields), password, ok in zip(accepted, passwords, inserted):
+            seen["usernames"].add(fields["username"])
+            if fields["email"]:
+                seen["emails"].add(fields["email"])
+            if not ok:
+                result["skipped"] += 1
+                result["errors"].append({"row": row_num, "reason": "Email o username già esistente"})
+                continue
+            result["created"] += 1
+            result["created_clients"].append({
+                "name": fields["display_name"],
+                "email": fields["email"] or "N/A",
+                "phone": fields["phone"] or "",
+                "username": fields["username"],
+                "temp_password": password,
+                "plan": fields["plan"],
+                "cert_expiry": fields["cert_expiry"],
+            })
 
-        existing_user = db.query(UserORM).filter(UserORM.username == username).first()
-        if existing_user:
+    def _unique_username(self, base_name, taken):
+        username = _generate_username_from_name(base_name, suffix_len=4)
+        while username in taken:
             username = _generate_username_from_name(base_name, suffix_len=4)
+        return username
 
-        temp_password = _generate_temp_password()
-
-        # Extract all optional fields
-        phone = row.get(header_map.get('phone', ''), '').strip() if 'phone' in header_map else None
-        weight = _parse_float(row.get(header_map.get('weight', ''), '')) if 'weight' in header_map else None
-        body_fat = _parse_float(row.get(header_map.get('body_fat_pct', ''), '')) if 'body_fat_pct' in header_map else None
-        height = _parse_float(row.get(header_map.get('height_cm', ''), '')) if 'height_cm' in header_map else None
-        dob = _parse_date(row.get(header_map.get('date_of_birth', ''), '')) if 'date_of_birth' in header_map else None
-        gender = _normalize_gender(row.get(header_map.get('gender', ''), '')) if 'gender' in header_map else None
-        plan = row.get(header_map.get('plan', ''), '').strip() if 'plan' in header_map else 'Standard'
-        fiscal_code = row.get(header_map.get('fiscal_code', ''), '').strip() if 'fiscal_code' in header_map else None
-        address = row.get(header_map.get('address', ''), '').strip() if 'address' in header_map else None
-        city = row.get(header_map.get('city', ''), '').strip() if 'city' in header_map else None
-        zip_code = row.get(header_map.get('zip_code', ''), '').strip() if 'zip_code' in header_map else None
-        join_date = _parse_date(row.get(header_map.get('join_date', ''), '')) if 'join_date' in header_map else None
-        expiry_date = _parse_date(row.get(header_map.get('expiry_date', ''), '')) if 'expiry_date' in header_map else None
-        cert_expiry = _parse_date(row.get(header_map.get('cert_expiry', ''), '')) if 'cert_expiry' in header_map else None
-        notes = row.get(header_map.get('notes', ''), '').strip() if 'notes' in header_map else None
-
-        if not plan:
-            plan = 'Standard'
-
-        # Full address
-        full_address = None
-        parts = [p for p in [address, city, zip_code] if p]
-        if parts:
-            full_address = ', '.join(parts)
-
-        # Create user
+    def _build_records(self, fields, owner_id, plans, hashed_password):
+        """Insert mappings for one client: {table model: [row dicts]}."""
+        now = datetime.utcnow().isoformat()
         user_id = str(uuid.uuid4())
-        user = UserORM(
-            id=user_id,
-            username=username,
-            email=email if email else None,
-            hashed_password=hash_password(temp_password),
-            role="client",
-            gym_owner_id=owner_id,
-            is_approved=True,
-            must_change_password=True,
-            phone=phone if phone else None,
-        )
-        db.add(user)
-
-        # Create profile
-        display_name = name if name else (email.split('@')[0] if email else username)
-        profile = ClientProfileORM(
-            id=user_id,
-            name=display_name,
-            email=email if email else None,
-            gym_id=owner_id,
-            streak=0,
-            gems=0,
-            health_score=0,
-            plan=plan,
-            status="Active",
-            last_seen="Never",
-            is_premium=False,
-            weight=weight,
-            body_fat_pct=body_fat,
-            height_cm=height,
-            gender=gender,
-        )
-        if dob:
-            profile.date_of_birth = dob
-        if full_address:
-            profile.address = full_address
-        if fiscal_code:
-            profile.fiscal_code = fiscal_code
-        if notes:
-            profile.notes = notes
-        if join_date:
-            profile.join_date = join_date
-        db.add(profile)
-
-        # Create medical certificate placeholder if cert_expiry provided
-        if cert_expiry:
-            cert = MedicalCertificateORM(
-                user_id=user_id,
-                gym_owner_id=owner_id,
-                expiration_date=cert_expiry,
-                approval_status="approved",
-                uploaded_at=datetime.utcnow().isoformat(),
-            )
-            db.add(cert)
-
-        db.flush()
-
-        result["created"] += 1
-        result["created_clients"].append({
-            "name": display_name,
-            "email": email or "N/A",
-            "phone": phone or "",
-            "username": username,
-            "temp_password": temp_password,
-            "plan": plan,
-            "cert_expiry": cert_expiry,
-        })
+        email = fields["email"] or None
+        display_name = fields["name"] or (fields["email"].split('@')[0] if fields["email"] else fields["username"])
+        fields["display_name"] = display_name
+
+        records = {
+            UserORM: [{
+                "id": user_id,
+                "username": fields["username"],
+                "email": email,
+                "hashed_password": hashed_password,
+                "role": "client",
+                "gym_owner_id": owner_id,
+                "is_approved": True,
+                "must_change_password": True,
+                "phone": fields["phone"] or None,
+            }],
+            ClientProfileORM: [{
+                "id": user_id,
+                "name": display_name,
+                "email": email,
+                "gym_id": owner_id,
+                "streak": 0,
+                "gems": 0,
+                "health_score": 0,
+                "plan": fields["plan"],
+                "status": "Active",
+                "last_seen": "Never",
+                "is_premium": False,
+                "weight": fields["weight"],
+                "body_fat_pct": fields["body_fat"],
+                "height_cm": fields["height"],
+                "gender": fields["gender"],
+                "date_of_birth": fields["dob"] or None,
+            }],
+            MedicalCertificateORM: [],
+            ClientSubscriptionORM: [],
+        }
+
+        # Medical certificate placeholder (no file) if cert_expiry provided
+        if fields["cert_expiry"]:
+            records[MedicalCertificateORM].append({
+                "client_id": user_id,
+                "filename": "certificato_importato",
+                "file_path": "",
+                "expiration_date": fields["cert_expiry"],
+                "approval_status": "approved",
+                "reviewed_by": owner_id,
+                "reviewed_at": now,
+                "uploaded_at": now,
+            })
+
+        # Subscription when the plan matches one of the gym's plans
+        plan_id = plans.get(fields["plan"].strip().lower())
+        if plan_id:
+            expiry = _iso_date(fields["expiry_date"])
+            start = _iso_date(fields["join_date"])
+            expired = bool(expiry) and expiry < date.today().isoformat()
+            records[ClientSubscriptionORM].append({
+                "id": str(uuid.uuid4()),
+                "client_id": user_id,
+                "plan_id": plan_id,
+                "gym_id": owner_id,
+                "status": "canceled" if expired else "active",
+                "start_date": start or now,
+                "current_period_start": start,
+                "current_period_end": expiry,
+                "ended_at": expiry if expired else None,
+            })
+        return records
+
+    def _bulk_insert(self, db, records):
+        """One executemany INSERT per table for a list of _build_records results."""
+        for model in (UserORM, ClientProfileORM, MedicalCertificateORM, ClientSubscriptionORM):
+            rows = [row for record in records for row in record[model]]
+            if rows:
+                # Table-level insert: ORM bulk inserts split batches by which values are None
+                db.execute(insert(model.__table__), rows)
+
+    def _insert_one_by_one(self, db, records):
+        inserted = []
+        for record in records:
+            try:
+                with db.begin_nested():
+                    self._bulk_insert(db, [record])
+                inserted.append(True)
+            except IntegrityError:
+                inserted.append(False)
+        return inserted
 
 
 client_import_service = ClientImportService()
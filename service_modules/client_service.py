@@ -7,6 +7,7 @@ from .base import (
     ClientDietSettingsORM, ClientDietLogORM, ClientExerciseLogORM,
     DailyQuestCompletionORM, ClientDailyDietSummaryORM, WeightHistoryORM
 )
+from .activity_state_service import get_activity_state, weekly_health_scores, workout_day_totals
 from models import ClientData, ClientProfileUpdate
 from data import CLIENT_DATA, EXERCISE_LIBRARY
 
@@ -205,6 +206,10 @@ class ClientService:
                 profile.health_score = int(health_score)
                 db.commit() # Save the new score
 
+            # Persisted streak / weekly health state (recomputed only when stale)
+            activity_state = get_activity_state(db, client_id, diet_settings)
+            db.commit()
+
             progress_data = None
             if diet_settings:
                 progress_data = {
@@ -222,7 +227,7 @@ class ClientService:
                     "consistency_target": diet_settings.consistency_target,
                     "plan_mode": getattr(diet_settings, 'plan_mode', 'fixed') or 'fixed',
                     # Weekly health scores (Mon-Sun) for consistency chart
-                    "weekly_health_scores": self._get_weekly_health_scores(client_id, db, diet_settings)
+                    "weekly_health_scores": weekly_health_scores(activity_state, diet_settings)
                 }
 
                 # Fetch real diet logs
@@ -365,8 +370,8 @@ class ClientService:
                  except Exception as e:
                      logger.error(f"Error loading saved workout snapshot: {e}")
 
-            # --- CALCULATE STREAK ---
-            streak = self._calculate_client_streak(client_id, db)
+            # --- STREAK ---
+            streak = activity_state.day_streak
 
             # --- GENERATE DAILY QUESTS ---
             daily_quests = self._generate_daily_quests(
@@ -412,67 +417,6 @@ class ClientService:
         finally:
             db.close()
 
-    def _calculate_client_streak(self, client_id: str, db) -> int:
-        """Calculate client's DAY streak - consecutive days with ALL scheduled workouts completed."""
-        streak = 0
-        try:
-            today = datetime.now().date()
-            current_date = today
-            days_checked = 0
-            consecutive_empty = 0  # Track consecutive days with no workouts
-
-            logger.debug(f"[DAY_STREAK] Starting day streak calculation for client {client_id}, today={today}")
-
-            # Go backwards day by day
-            while days_checked < 365:
-                date_str = current_date.isoformat()
-                is_today = current_date == today
-
-                # Get all scheduled workouts for this day
-                scheduled_workouts = db.query(ClientScheduleORM).filter(
-                    ClientScheduleORM.client_id == client_id,
-                    ClientScheduleORM.date == date_str,
-                    ClientScheduleORM.type == "workout"
-                ).all()
-
-                total_scheduled = len(scheduled_workouts)
-                completed_count = sum(1 for w in scheduled_workouts if w.completed)
-
-                logger.debug(f"[DAY_STREAK] {date_str}: {completed_count}/{total_scheduled} completed")
-
-                if total_scheduled == 0:
-                    # No workouts scheduled - allow rest days but break after 3+ consecutive empty days
-                    consecutive_empty += 1
-                    if consecutive_empty > 3:
-                        logger.debug(f"[DAY_STREAK] {consecutive_empty} consecutive empty days, breaking streak")
-                        break
-                    logger.debug(f"[DAY_STREAK] No workouts scheduled, skipping day ({consecutive_empty} empty)")
-                elif completed_count == total_scheduled:
-                    # All scheduled workouts completed - count this day
-                    consecutive_empty = 0  # Reset empty counter
-                    streak += 1
-                    logger.debug(f"[DAY_STREAK] All workouts completed! Streak = {streak}")
-                else:
-                    # Not all workouts completed
-                    if is_today:
-                        # Today - don't break yet, still time to complete
-                        logger.debug(f"[DAY_STREAK] Today incomplete but day not over yet")
-                    else:
-                        # Past day with incomplete workouts - break streak
-                        logger.debug(f"[DAY_STREAK] Past day incomplete, breaking streak")
-                        break
-
-                # Move to previous day
-                current_date = current_date - timedelta(days=1)
-                days_checked += 1
-
-            logger.debug(f"[DAY_STREAK] Final calculated day streak = {streak}")
-        except Exception as e:
-            logger.error(f"[DAY_STREAK] Error calculating day streak: {e}", exc_info=True)
-            streak = 0
-
-        return streak
-
     def _generate_daily_quests(self, client_id: str, db, today_event, diet_settings, today_logs) -> list:
         """Generate dynamic daily quests based on client's actual progress."""
         today_str = date.today().isoformat()
@@ -526,76 +470,6 @@ class ClientService:
 
         return quests
 
-    def _get_weekly_health_scores(self, client_id: str, db, diet_settings) -> list:
-        """Calculate health scores for each day of the current week (Mon-Sun)."""
-        today = date.today()
-        # Get Monday of current week (weekday() returns 0 for Monday)
-        monday = today - timedelta(days=today.weekday())
-
-        weekly_scores = []
-
-        # Get targets from diet settings (or use defaults)
-        cal_target = diet_settings.calories_target if diet_settings else 2000
-        prot_target = diet_settings.protein_target if diet_settings else 150
-        carb_target = diet_settings.carbs_target if diet_settings else 200
-        fat_target = diet_settings.fat_target if diet_settings else 70
-
-        def calc_score(current, target):
-            if target == 0:
-                return 0
-            ratio = current / target
-            if ratio > 1:
-                # Penalize going over (mirror the deficit penalty)
-                return max(0, 100 - abs(ratio - 1) * 100)
-            return ratio * 100
-
-        for i in range(7):  # Monday to Sunday
-            day = monday + timedelta(days=i)
-            day_str = day.isoformat()
-
-            # Skip future days
-            if day > today:
-                weekly_scores.append(0)
-                continue
-
-            # For TODAY: use real-time values from diet_settings
-            if day == today and diet_settings:
-                cals = diet_settings.calories_current or 0
-                prot = diet_settings.protein_current or 0
-                carbs = diet_settings.carbs_current or 0
-                fat = diet_settings.fat_current or 0
-
-                if cals > 0:  # Only calculate if there's any data
-                    s_cals = calc_score(cals, cal_target)
-                    s_prot = calc_score(prot, prot_target)
-                    s_carb = calc_score(carbs, carb_target)
-                    s_fat = calc_score(fat, fat_target)
-                    health_score = (s_cals * 0.45) + (s_prot * 0.35) + (s_carb * 0.1) + (s_fat * 0.1)
-                    weekly_scores.append(int(health_score))
-                else:
-                    weekly_scores.append(0)
-                continue
-
-            # For PAST days: use daily summaries
-            summary = db.query(ClientDailyDietSummaryORM).filter(
-                ClientDailyDietSummaryORM.client_id == client_id,
-                ClientDailyDietSummaryORM.date == day_str
-            ).first()
-
-            if not summary or summary.total_calories == 0:
-                weekly_scores.append(0)
-                continue
-
-            s_cals = calc_score(summary.total_calories, cal_target)
-            s_prot = calc_score(summary.total_protein, prot_target)
-            s_carb = calc_score(summary.total_carbs, carb_target)
-            s_fat = calc_score(summary.total_fat, fat_target)
-
-            health_score = (s_cals * 0.45) + (s_prot * 0.35) + (s_carb * 0.1) + (s_fat * 0.1)
-            weekly_scores.append(int(health_score))
-
-        return weekly_scores
-
     def update_client_profile(self, profile_update: ClientProfileUpdate, client_id: str) -> dict:
         """Update a client's profile information."""
         db = get_db_session()
@@ -1256,22 +1130,13 @@ class ClientService:
             today = datetime.now().date()
 
             days_data = []
+            totals = workout_day_totals(db, client_id, today - timedelta(days=13), today)
 
-            # Check last 14 days (from oldest to newest)
+            # Last 14 days (from oldest to newest)
             for i in range(13, -1, -1):
                 day = today - timedelta(days=i)
                 date_str = day.isoformat()
-                is_today = i == 0
-
-                # Get all scheduled workouts for this day
-                scheduled_workouts = db.query(ClientScheduleORM).filter(
-                    ClientScheduleORM.client_id == client_id,
-                    ClientScheduleORM.date == date_str,
-                    ClientScheduleORM.type == "workout"
-                ).all()
-
-                total_scheduled = len(scheduled_workouts)
-                completed_count = sum(1 for w in scheduled_workouts if w.completed)
+                total_scheduled, completed_count = totals.get(date_str, (0, 0))
 
                 # Day is completed only if there were workouts scheduled AND all are done
                 day_completed = (total_scheduled > 0) and (completed_count == total_scheduled)
@@ -1280,13 +1145,13 @@ class ClientService:
                     "date": date_str,
                     "day_name": day.strftime("%a"),
                     "completed": day_completed,
-                    "is_today": is_today,
+                    "is_today": i == 0,
                     "total": total_scheduled,
                     "done": completed_count
                 })
 
-            # Calculate current streak
-            streak = self._calculate_client_streak(client_id, db)
+            streak = get_activity_state(db, client_id).day_streak
+            db.commit()
 
             return {
                 "current_streak": streak,
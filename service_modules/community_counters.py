@@ -0,0 +1,174 @@
+"""
+Community Counters - like, comment and participant counts on community posts and comments.
+
+The like, comment and participant rows are the source of truth. The *_count columns are
+a cache of their counts, and they are only ever set by recounting those rows in SQL,
+never by read-modify-write in Python, so concurrent requests cannot lose updates.
+
+Likes and comments don't recount straight away. Each worker collects the posts and
+comments that changed and the background flusher recounts them every
+COMMUNITY_COUNTER_FLUSH_INTERVAL seconds. A post liked 200 times in a second gets one
+UPDATE per worker, not 200. When the flusher isn't running (tests, scripts), every
+change is recounted at once.
+
+Event participants are counted in the join transaction with a conditional UPDATE,
+because the count enforces max_participants (see CommunityService.toggle_event_participation).
+
+reconcile_counters, a maintenance job, recounts everything. It fixes counts left
+behind by a worker that died with changes still pending.
+"""
+import asyncio
+import os
+import threading
+from typing import Iterable, Optional
+
+from sqlalchemy import func, or_, select
+
+from database import get_db_session, run_sync
+from models_orm import (
+    CommunityPostORM, CommunityLikeORM, CommunityCommentORM, CommunityCommentLikeORM,
+    CommunityEventParticipantORM,
+)
+
+import logging
+logger = logging.getLogger("gym_app")
+
+COMMUNITY_COUNTER_FLUSH_INTERVAL = float(os.getenv("COMMUNITY_COUNTER_FLUSH_INTERVAL", "1.0"))
+RECOUNT_BATCH_SIZE = 500
+
+
+def _post_counts():
+    return {
+        "like_count": select(func.count(CommunityLikeORM.id)).where(
+            CommunityLikeORM.post_id == CommunityPostORM.id
+        ).scalar_subquery(),
+        "comment_count": select(func.count(CommunityCommentORM.id)).where(
+            CommunityCommentORM.post_id == CommunityPostORM.id,
+            CommunityCommentORM.is_deleted == False
+        ).scalar_subquery(),
+        "participant_count": select(func.count(CommunityEventParticipantORM.id)).where(
+            CommunityEventParticipantORM.post_id == CommunityPostORM.id
+        ).scalar_subquery(),
+    }
+
+
+def _comment_counts():
+    return {
+        "like_count": select(func.count(CommunityCommentLikeORM.id)).where(
+            CommunityCommentLikeORM.comment_id == CommunityCommentORM.id
+        ).scalar_subquery(),
+    }
+
+
+def _recount(db, model, counts: dict, ids: Optional[list]) -> int:
+    """Set the count columns of `ids` (all rows if None) from their source rows; returns rows fixed."""
+    query = db.query(model).filter(or_(*(getattr(model, name).is_distinct_from(count) for name, count in counts.items())))
+    if ids is not None:
+        query = query.filter(model.id.in_(ids))
+    return query.update(counts, synchronize_session=False)
+
+
+def recount(db, post_ids: Iterable[str] = (), comment_ids: Iterable[int] = ()) -> dict:
+    """Recount the given posts and comments inside the caller's transaction."""
+    post_ids, comment_ids = sorted(set(post_ids)), sorted(set(comment_ids))
+    fixed = {"posts": 0, "comments": 0}
+    for i in range(0, len(post_ids), RECOUNT_BATCH_SIZE):
+        fixed["posts"] += _recount(db, CommunityPostORM, _post_counts(), post_ids[i:i + RECOUNT_BATCH_SIZE])
+    for i in range(0, len(comment_ids), RECOUNT_BATCH_SIZE):
+        fixed["comments"] += _recount(db, CommunityCommentORM, _comment_counts(), comment_ids[i:i + RECOUNT_BATCH_SIZE])
+    return fixed
+
+
+def reconcile_counters() -> dict:
+    """Recount every post and comment; returns how many were off."""
+    db = get_db_session()
+    try:
+        fixed = {
+            "posts": _recount(db, CommunityPostORM, _post_counts(), None),
+            "comments": _recount(db, CommunityCommentORM, _comment_counts(), None),
+        }
+        db.commit()
+        if fixed["posts"] or fixed["comments"]:
+            logger.warning(f"Community counters reconciled: {fixed}")
+        return fixed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class CommunityCounters:
+    """Per-worker set of posts/comments whose counts changed, recounted in batches."""
+
+    def __init__(self, interval: float = COMMUNITY_COUNTER_FLUSH_INTERVAL):
+        self.interval = interval
+        self._posts = set()
+        self._comments = set()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def post_changed(self, post_id: str):
+        """Call after committing a like/unlike or comment on the post."""
+        with self._lock:
+            self._posts.add(post_id)
+        if self._task is None:
+            self.flush()
+
+    def comment_changed(self, comment_id: int):
+        """Call after committing a like/unlike on the comment."""
+        with self._lock:
+            self._comments.add(comment_id)
+        if self._task is None:
+            self.flush()
+
+    def flush(self) -> dict:
+        """Recount everything that changed since the last flush."""
+        with self._lock:
+            posts, comments = self._posts, self._comments
+            self._posts, self._comments = set(), set()
+        if not posts and not comments:
+            return {"posts": 0, "comments": 0}
+
+        db = get_db_session()
+        try:
+            fixed = recount(db, posts, comments)
+            db.commit()
+            return fixed
+        except Exception:
+            db.rollback()
+            # Retry with the next flush
+            with self._lock:
+                self._posts |= posts
+                self._comments |= comments
+            raise
+        finally:
+            db.close()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Community counter flusher started")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await run_sync(self.flush)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_sync(self.flush)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Community counter flush error: {e}")
+
+
+community_counters = CommunityCounters()
@@ -2,11 +2,15 @@
 Community Service - handles social feed, posts, likes, comments.
 """
 from typing import Optional
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
 from .base import (
     HTTPException, uuid, json, logging, datetime,
     get_db_session, UserORM, ClientProfileORM, ClientScheduleORM, NotificationORM,
     CommunityPostORM, CommunityEventParticipantORM, CommunityLikeORM, CommunityCommentORM, CommunityCommentLikeORM
 )
+from .community_timeline import GLOBAL_TIMELINE, post_payload, ensure_timeline, read_page
+from .community_counters import community_counters
 
 logger = logging.getLogger("gym_app")
 
@@ -29,34 +33,10 @@ class CommunityService:
 
     def _post_to_dict(self, post: CommunityPostORM, author: UserORM, is_liked: bool, is_participating: bool = False) -> dict:
         """Convert a post ORM + author to a response dict."""
-        return {
-            "id": post.id,
-            "author_id": post.author_id,
-            "author_username": author.username if author else "Unknown",
-            "author_profile_picture": author.profile_picture if author else None,
-            "author_role": author.role if author else "client",
-            "gym_id": post.gym_id,
-            "scope": getattr(post, "scope", "local") or "local",
-            "gym_name": None,
-            "post_type": post.post_type,
-            "content": post.content,
-            "image_url": post.image_url,
-            "event_title": post.event_title,
-            "event_date": post.event_date,
-            "event_time": post.event_time,
-            "event_location": post.event_location,
-            "max_participants": post.max_participants,
-            "participant_count": post.participant_count or 0,
-            "quest_xp_reward": post.quest_xp_reward,
-            "quest_deadline": post.quest_deadline,
-            "is_pinned": post.is_pinned,
-            "like_count": post.like_count,
-            "comment_count": post.comment_count,
-            "repost_count": post.repost_count,
-            "is_liked_by_me": is_liked,
-            "is_participating": is_participating,
-            "created_at": post.created_at,
-        }
+        d = post_payload(post, author)
+        d["is_liked_by_me"] = is_liked
+        d["is_participating"] = is_participating
+        return d
 
     def get_user_posts(self, user_id: str, cursor: Optional[str] = None, limit: int = 20) -> dict:
         """Get posts by a specific user."""
@@ -142,46 +122,21 @@ class CommunityService:
             db.close()
 
     def get_feed(self, user_id: str, scope: str = "local", cursor: Optional[str] = None, limit: int = 20) -> dict:
-        """Get the community feed — local (gym) or global."""
+        """Get the community feed — local (gym) or global — from its precomputed timeline."""
         db = get_db_session()
         try:
             if scope == "global":
-                # Global feed: all global-scoped text/image posts
-                query = db.query(CommunityPostORM).filter(
-                    CommunityPostORM.scope == "global",
-                    CommunityPostORM.is_deleted == False,
-                    CommunityPostORM.post_type.in_(["text", "image"]),
-                )
-                if cursor:
-                    query = query.filter(CommunityPostORM.created_at < cursor)
-                posts = query.order_by(CommunityPostORM.created_at.desc()).limit(limit + 1).all()
+                timeline = GLOBAL_TIMELINE
             else:
-                # Local feed: gym-scoped (existing behavior)
-                gym_id = self._get_user_gym_id(user_id, db)
-                if not gym_id:
+                timeline = self._get_user_gym_id(user_id, db)
+                if not timeline:
                     return {"posts": [], "next_cursor": None, "has_more": False}
 
-                query = db.query(CommunityPostORM).filter(
-                    CommunityPostORM.gym_id == gym_id,
-                    CommunityPostORM.is_deleted == False,
-                )
-                if cursor:
-                    query = query.filter(CommunityPostORM.created_at < cursor)
-                # Pinned first, then by date
-                posts = query.order_by(
-                    CommunityPostORM.is_pinned.desc(),
-                    CommunityPostORM.created_at.desc()
-                ).limit(limit + 1).all()
+            ensure_timeline(db, timeline)
+            posts, next_cursor, has_more = read_page(db, timeline, cursor, limit)
 
-            has_more = len(posts) > limit
-            posts = posts[:limit]
-
-            # Batch fetch authors
-            author_ids = list({p.author_id for p in posts})
-            authors = {u.id: u for u in db.query(UserORM).filter(UserORM.id.in_(author_ids)).all()} if author_ids else {}
-
-            # Batch fetch likes
-            post_ids = [p.id for p in posts]
+            # Only the viewer's own likes and event participation are looked up per request
+            post_ids = [p["id"] for p in posts]
             liked_ids = set()
             if post_ids:
                 likes = db.query(CommunityLikeORM.post_id).filter(
@@ -190,63 +145,20 @@ class CommunityService:
                 ).all()
                 liked_ids = {l.post_id for l in likes}
 
-            # Batch fetch event participation status
+            event_ids = [p["id"] for p in posts if p["post_type"] == "event"]
             participating_ids = set()
-            if post_ids:
+            if event_ids:
                 participations = db.query(CommunityEventParticipantORM.post_id).filter(
-                    CommunityEventParticipantORM.post_id.in_(post_ids),
+                    CommunityEventParticipantORM.post_id.in_(event_ids),
                     CommunityEventParticipantORM.user_id == user_id
                 ).all()
                 participating_ids = {p.post_id for p in participations}
 
-            # Batch fetch first comment for each post
-            first_comments = {}
-            if post_ids:
-                from sqlalchemy import func
-                # Subquery: max id (latest) per post
-                sub = db.query(
-                    CommunityCommentORM.post_id,
-                    func.max(CommunityCommentORM.id).label("max_id")
-                ).filter(
-                    CommunityCommentORM.post_id.in_(post_ids),
-                    CommunityCommentORM.is_deleted == False,
-                ).group_by(CommunityCommentORM.post_id).subquery()
-
-                latest = db.query(CommunityCommentORM).join(
-                    sub, CommunityCommentORM.id == sub.c.max_id
-                ).all()
-
-                # Fetch comment authors
-                comment_author_ids = list({c.author_id for c in latest})
-                comment_authors = {u.id: u for u in db.query(UserORM).filter(UserORM.id.in_(comment_author_ids)).all()} if comment_author_ids else {}
-
-                for c in latest:
-                    a = comment_authors.get(c.author_id)
-                    first_comments[c.post_id] = {
-                        "author_username": a.username if a else "Unknown",
-                        "author_profile_picture": a.profile_picture if a else None,
-                        "content": c.content,
-                    }
-
-            # Batch fetch gym names for global posts
-            gym_names = {}
-            if scope == "global":
-                gym_ids_set = list({p.gym_id for p in posts if p.gym_id})
-                if gym_ids_set:
-                    gyms = db.query(UserORM.id, UserORM.gym_name).filter(UserORM.id.in_(gym_ids_set)).all()
-                    gym_names = {g.id: g.gym_name for g in gyms if g.gym_name}
-
-            result = []
             for p in posts:
-                d = self._post_to_dict(p, authors.get(p.author_id), p.id in liked_ids, p.id in participating_ids)
-                d["first_comment"] = first_comments.get(p.id)
-                if scope == "global" and p.gym_id:
-                    d["gym_name"] = gym_names.get(p.gym_id)
-                result.append(d)
+                p["is_liked_by_me"] = p["id"] in liked_ids
+                p["is_participating"] = p["id"] in participating_ids
 
-            next_cursor = posts[-1].created_at if has_more and posts else None
-
-            return {"posts": result, "next_cursor": next_cursor, "has_more": has_more}
+            return {"posts": posts, "next_cursor": next_cursor, "has_more": has_more}
         finally:
             db.close()
 
@@ -341,18 +253,16 @@ class CommunityService:
             if not post:
                 raise HTTPException(status_code=404, detail="Post not found")
 
-            existing = db.query(CommunityLikeORM).filter(
+            # The like row is the source of truth; like_count is recounted from it (see community_counters)
+            removed = db.query(CommunityLikeORM).filter(
                 CommunityLikeORM.post_id == post_id,
                 CommunityLikeORM.user_id == user_id
-            ).first()
+            ).delete(synchronize_session=False)
 
-            if existing:
-                db.delete(existing)
-                post.like_count = max(0, post.like_count - 1)
+            if removed:
                 liked = False
             else:
                 db.add(CommunityLikeORM(post_id=post_id, user_id=user_id))
-                post.like_count = post.like_count + 1
                 liked = True
 
                 # Notify post author (if not self-like)
@@ -366,8 +276,18 @@ class CommunityService:
                         data=json.dumps({"post_id": post_id}),
                     ))
 
-            db.commit()
-            return {"liked": liked, "like_count": post.like_count}
+            try:
+                db.commit()
+            except IntegrityError:
+                # Double tap: the same like was committed by a concurrent request
+                db.rollback()
+                liked = True
+
+            community_counters.post_changed(post_id)
+            like_count = db.query(func.count(CommunityLikeORM.id)).filter(
+                CommunityLikeORM.post_id == post_id
+            ).scalar()
+            return {"liked": liked, "like_count": like_count}
         except HTTPException:
             raise
         except Exception as e:
@@ -447,7 +367,6 @@ class CommunityService:
                 parent_comment_id=parent_comment_id,
             )
             db.add(comment)
-            post.comment_count = post.comment_count + 1
 
             # Notify post author
             if post.author_id != user_id:
@@ -462,6 +381,11 @@ class CommunityService:
 
             db.commit()
             db.refresh(comment)
+            community_counters.post_changed(post_id)
+            comment_count = db.query(func.count(CommunityCommentORM.id)).filter(
+                CommunityCommentORM.post_id == post_id,
+                CommunityCommentORM.is_deleted == False
+            ).scalar()
 
             author = db.query(UserORM).filter(UserORM.id == user_id).first()
             return {
@@ -476,7 +400,7 @@ class CommunityService:
                 "like_count": 0,
                 "is_liked_by_me": False,
                 "created_at": comment.created_at,
-                "comment_count": post.comment_count,
+                "comment_count": comment_count,
             }
         except HTTPException:
             raise
@@ -504,9 +428,8 @@ class CommunityService:
                 raise HTTPException(status_code=403, detail="Not authorized")
 
             comment.is_deleted = True
-            if post:
-                post.comment_count = max(0, post.comment_count - 1)
             db.commit()
+            community_counters.post_changed(comment.post_id)
             return {"status": "deleted"}
         finally:
             db.close()
@@ -522,22 +445,28 @@ class CommunityService:
             if not comment:
                 raise HTTPException(status_code=404, detail="Comment not found")
 
-            existing = db.query(CommunityCommentLikeORM).filter(
+            removed = db.query(CommunityCommentLikeORM).filter(
                 CommunityCommentLikeORM.comment_id == comment_id,
                 CommunityCommentLikeORM.user_id == user_id
-            ).first()
+            ).delete(synchronize_session=False)
 
-            if existing:
-                db.delete(existing)
-                comment.like_count = max(0, comment.like_count - 1)
+            if removed:
                 liked = False
             else:
                 db.add(CommunityCommentLikeORM(comment_id=comment_id, user_id=user_id))
-                comment.like_count = comment.like_count + 1
                 liked = True
 
-            db.commit()
-            return {"liked": liked, "like_count": comment.like_count}
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                liked = True
+
+            community_counters.comment_changed(comment_id)
+            like_count = db.query(func.count(CommunityCommentLikeORM.id)).filter(
+                CommunityCommentLikeORM.comment_id == comment_id
+            ).scalar()
+            return {"liked": liked, "like_count": like_count}
         except HTTPException:
             raise
         except Exception as e:
@@ -581,15 +510,19 @@ class CommunityService:
             if not post:
                 raise HTTPException(status_code=404, detail="Event not found")
 
-            existing = db.query(CommunityEventParticipantORM).filter(
+            left = db.query(CommunityEventParticipantORM).filter(
                 CommunityEventParticipantORM.post_id == post_id,
                 CommunityEventParticipantORM.user_id == user_id
-            ).first()
+            ).delete(synchronize_session=False)
 
-            if existing:
+            if left:
                 # LEAVE event
-                db.delete(existing)
-                post.participant_count = max(0, (post.participant_count or 0) - 1)
+                db.query(CommunityPostORM).filter(
+                    CommunityPostORM.id == post_id,
+                    CommunityPostORM.participant_count > 0
+                ).update({
+                    "participant_count": CommunityPostORM.participant_count - 1
+                }, synchronize_session=False)
                 participating = False
 
                 # Remove from calendar
@@ -599,12 +532,21 @@ class CommunityService:
                     ClientScheduleORM.title.contains(post_id[:8])
                 ).delete(synchronize_session=False)
             else:
-                # JOIN event
-                if post.max_participants and (post.participant_count or 0) >= post.max_participants:
+                # JOIN event: take a place only if one is free, in a single statement
+                joined = db.query(CommunityPostORM).filter(
+                    CommunityPostORM.id == post_id,
+                    or_(
+                        CommunityPostORM.max_participants == None,
+                        CommunityPostORM.max_participants == 0,
+                        func.coalesce(CommunityPostORM.participant_count, 0) < CommunityPostORM.max_participants
+                    )
+                ).update({
+                    "participant_count": func.coalesce(CommunityPostORM.participant_count, 0) + 1
+                }, synchronize_session=False)
+                if not joined:
                     raise HTTPException(status_code=400, detail="Event is full")
 
                 db.add(CommunityEventParticipantORM(post_id=post_id, user_id=user_id))
-                post.participant_count = (post.participant_count or 0) + 1
                 participating = True
 
                 # Add to user's calendar
@@ -630,9 +572,19 @@ class CommunityService:
                         data=json.dumps({"post_id": post_id}),
                     ))
 
-            db.commit()
-            return {"participating": participating, "participant_count": post.participant_count}
+            try:
+                db.commit()
+            except IntegrityError:
+                # Joined twice at once: the other request's place stands, this one's is rolled back
+                db.rollback()
+                participating = True
+
+            participant_count = db.query(CommunityPostORM.participant_count).filter(
+                CommunityPostORM.id == post_id
+            ).scalar()
+            return {"participating": participating, "participant_count": participant_count or 0}
         except HTTPException:
+            db.rollback()
             raise
         except Exception as e:
             db.rollback()
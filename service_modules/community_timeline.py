@@ -0,0 +1,298 @@
+"""
+Community Timeline - precomputed, denormalised community feeds.
+
+Every visible post has one community_timeline row per feed it shows in: its gym's
+local feed (timeline = gym_id) and, for global text/image posts, the global feed
+(timeline = "global"). The row carries the post dict the feed returns - author
+snapshot, latest comment, gym name - so a feed page is one index range
+scan on (timeline, is_pinned, created_at, post_id) plus the viewer's own likes and
+event participation.
+
+Pages are cut with a keyset cursor on (is_pinned, created_at, post_id): unlike the
+old created_at cursor it is stable when posts share a timestamp.
+
+Rows are kept current by the mapper events at the bottom of this module: writes to
+posts (pin, delete, edits), comments and author profiles rebuild the affected rows
+in the same transaction. Account erasure deletes users in bulk, which the events don't
+see: it calls erase_user_comments first. Like, comment and participant counts are read from the
+post row with the page (see community_counters). A timeline is built in full from
+community_posts the first time it is read (or by migrate_community_timeline.py).
+"""
+import json
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, inspect, select, delete, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+
+from models_orm import (
+    UserORM, CommunityPostORM, CommunityCommentORM,
+    CommunityTimelineORM, CommunityTimelineStateORM,
+)
+
+import logging
+logger = logging.getLogger("gym_app")
+
+GLOBAL_TIMELINE = "global"
+GLOBAL_POST_TYPES = ("text", "image")
+BUILD_BATCH_SIZE = 500
+
+_TIMELINE = CommunityTimelineORM.__table__
+_POSTS = CommunityPostORM.__table__
+_USERS = UserORM.__table__
+_COMMENTS = CommunityCommentORM.__table__
+
+# Timelines known to be built; they never go back to unbuilt
+_built = set()
+
+
+def post_payload(post, author) -> dict:
+    """The feed dict of a post (ORM object or row) and its author, without the viewer's own state."""
+    return {
+        "id": post.id,
+        "author_id": post.author_id,
+        "author_username": author.username if author else "Unknown",
+        "author_profile_picture": author.profile_picture if author else None,
+        "author_role": author.role if author else "client",
+        "gym_id": post.gym_id,
+        "scope": getattr(post, "scope", "local") or "local",
+        "gym_name": None,
+        "post_type": post.post_type,
+        "content": post.content,
+        "image_url": post.image_url,
+        "event_title": post.event_title,
+        "event_date": post.event_date,
+        "event_time": post.event_time,
+        "event_location": post.event_location,
+        "max_participants": post.max_participants,
+        "participant_count": post.participant_count or 0,
+        "quest_xp_reward": post.quest_xp_reward,
+        "quest_deadline": post.quest_deadline,
+        "is_pinned": post.is_pinned,
+        "like_count": post.like_count,
+        "comment_count": post.comment_count,
+        "repost_count": post.repost_count,
+        "is_liked_by_me": False,
+        "is_participating": False,
+        "created_at": post.created_at,
+    }
+
+
+# --- Cursor ---
+
+def encode_cursor(is_pinned, created_at: str, post_id: str) -> str:
+    return f"{int(bool(is_pinned))}|{created_at}|{post_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[bool, str, str]:
+    """(is_pinned, created_at, post_id); a bare created_at (old clients) continues after the pinned posts."""
+    parts = cursor.split("|", 2)
+    if len(parts) == 3 and parts[0] in ("0", "1"):
+        return parts[0] == "1", parts[1], parts[2]
+    return False, cursor, ""
+
+
+# --- Building rows ---
+
+def _insert(conn):
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(_TIMELINE)
+
+
+def _latest_comments(conn, post_ids) -> dict:
+    """{post_id: first_comment dict} with each post's latest visible comment."""
+    latest_ids = select(func.max(_COMMENTS.c.id)).where(
+        _COMMENTS.c.post_id.in_(post_ids),
+        _COMMENTS.c.is_deleted == False
+    ).group_by(_COMMENTS.c.post_id)
+    rows = conn.execute(select(
+        _COMMENTS.c.post_id, _COMMENTS.c.content, _USERS.c.username, _USERS.c.profile_picture
+    ).select_from(_COMMENTS.outerjoin(_USERS, _USERS.c.id == _COMMENTS.c.author_id)).where(
+        _COMMENTS.c.id.in_(latest_ids)
+    ))
+    return {
+        row.post_id: {
+            "author_username": row.username or "Unknown",
+            "author_profile_picture": row.profile_picture,
+            "content": row.content,
+        }
+        for row in rows
+    }
+
+
+def refresh_posts(conn, post_ids: Iterable[str]):
+    """Rewrite the timeline rows of these posts inside the caller's transaction."""
+    post_ids = sorted(set(post_ids))
+    for i in range(0, len(post_ids), BUILD_BATCH_SIZE):
+        _refresh_batch(conn, post_ids[i:i + BUILD_BATCH_SIZE])
+
+
+def _refresh_batch(conn, post_ids: List[str]):
+    conn.execute(delete(_TIMELINE).where(_TIMELINE.c.post_id.in_(post_ids)))
+    posts = conn.execute(select(_POSTS).where(
+        _POSTS.c.id.in_(post_ids),
+        _POSTS.c.is_deleted == False
+    )).all()
+    if not posts:
+        return
+
+    user_ids = {p.author_id for p in posts} | {p.gym_id for p in posts if p.gym_id}
+    users = {u.id: u for u in conn.execute(select(
+        _USERS.c.id, _USERS.c.username, _USERS.c.profile_picture, _USERS.c.role, _USERS.c.gym_name
+    ).where(_USERS.c.id.in_(user_ids)))}
+    first_comments = _latest_comments(conn, [p.id for p in posts])
+
+    now = datetime.utcnow().isoformat()
+    rows = []
+    for post in posts:
+        payload = post_payload(post, users.get(post.author_id))
+        payload["first_comment"] = first_comments.get(post.id)
+        if post.gym_id:
+            rows.append({"timeline": post.gym_id, "post_id": post.id, "is_pinned": bool(post.is_pinned),
+                         "created_at": post.created_at, "payload": json.dumps(payload), "updated_at": now})
+        if post.scope == "global" and post.post_type in GLOBAL_POST_TYPES:
+            gym = users.get(post.gym_id)
+            payload["gym_name"] = gym.gym_name if gym and gym.gym_name else None
+            rows.append({"timeline": GLOBAL_TIMELINE, "post_id": post.id, "is_pinned": False,
+                         "created_at": post.created_at, "payload": json.dumps(payload), "updated_at": now})
+
+    stmt = _insert(conn)
+    # A concurrent refresh of the same post may have inserted first: last writer wins
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[_TIMELINE.c.timeline, _TIMELINE.c.post_id],
+        set_={"is_pinned": stmt.excluded.is_pinned, "created_at": stmt.excluded.created_at,
+              "payload": stmt.excluded.payload, "updated_at": stmt.excluded.updated_at}
+    ), rows)
+
+
+def ensure_timeline(db, timeline: str):
+    """Build a timeline from community_posts the first time it is read (commits)."""
+    if timeline in _built:
+        return
+    if db.get(CommunityTimelineStateORM, timeline) is None:
+        try:
+            # Claim it first: a concurrent builder blocks here, then finds it built
+            db.add(CommunityTimelineStateORM(timeline=timeline))
+            db.flush()
+            query = select(_POSTS.c.id).where(_POSTS.c.is_deleted == False)
+            if timeline == GLOBAL_TIMELINE:
+                query = query.where(_POSTS.c.scope == "global", _POSTS.c.post_type.in_(GLOBAL_POST_TYPES))
+            else:
+                query = query.where(_POSTS.c.gym_id == timeline)
+            conn = db.connection()
+            post_ids = conn.execute(query).scalars().all()
+            refresh_posts(conn, post_ids)
+            db.commit()
+            logger.info(f"Built community timeline {timeline}: {len(post_ids)} posts")
+        except IntegrityError:
+            db.rollback()
+    _built.add(timeline)
+
+
+def read_page(db, timeline: str, cursor: Optional[str], limit: int) -> Tuple[List[dict], Optional[str], bool]:
+    """(post dicts, next_cursor, has_more) for one page of a timeline, newest first, pinned on top."""
+    # Counters come from the post row, which community_counters keeps current without rewriting payloads
+    query = select(
+        _TIMELINE.c.is_pinned, _TIMELINE.c.created_at, _TIMELINE.c.post_id, _TIMELINE.c.payload,
+        _POSTS.c.like_count, _POSTS.c.comment_count, _POSTS.c.participant_count
+    ).select_from(_TIMELINE.join(_POSTS, _POSTS.c.id == _TIMELINE.c.post_id)).where(_TIMELINE.c.timeline == timeline)
+    if cursor:
+        query = query.where(
+            tuple_(_TIMELINE.c.is_pinned, _TIMELINE.c.created_at, _TIMELINE.c.post_id) < decode_cursor(cursor)
+        )
+    rows = db.execute(query.order_by(
+        _TIMELINE.c.is_pinned.desc(), _TIMELINE.c.created_at.desc(), _TIMELINE.c.post_id.desc()
+    ).limit(limit + 1)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(*rows[-1][:3]) if has_more else None
+    posts = []
+    for row in rows:
+        post = json.loads(row.payload)
+        post.update(like_count=row.like_count, comment_count=row.comment_count,
+                    participant_count=row.participant_count or 0)
+        posts.append(post)
+    return posts, next_cursor, has_more
+
+
+# --- Keeping timelines current ---
+
+def _dirty(session) -> set:
+    return session.info.setdefault("timeline_dirty_posts", set())
+
+
+def _track_post(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        _dirty(session).add(target.id)
+
+
+def _track_comment(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and target.post_id:
+        _dirty(session).add(target.post_id)
+
+
+# Author snapshot and gym name columns copied into timeline payloads
+_PROFILE_COLUMNS = ("username", "profile_picture", "role", "gym_name")
+
+
+def _track_profile(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in _PROFILE_COLUMNS):
+        session.info.setdefault("timeline_dirty_users", set()).add(target.id)
+
+
+for _event in ("after_insert", "after_update", "after_delete"):
+    event.listen(CommunityPostORM, _event, _track_post)
+    event.listen(CommunityCommentORM, _event, _track_comment)
+event.listen(UserORM, "after_update", _track_profile)
+
+
+def _posts_showing(conn, user_ids) -> set:
+    """Posts whose payload shows these users: as author, as latest commenter, or as the gym (global feed)."""
+    return set(conn.execute(select(_POSTS.c.id).where(
+        _POSTS.c.is_deleted == False,
+        (_POSTS.c.author_id.in_(user_ids))
+        | ((_POSTS.c.gym_id.in_(user_ids)) & (_POSTS.c.scope == "global"))
+        | (_POSTS.c.id.in_(select(_COMMENTS.c.post_id).where(_COMMENTS.c.author_id.in_(user_ids))))
+    )).scalars())
+
+
+def erase_user_comments(db, user_id: str) -> set:
+    """
+    Delete a user's comments and rewrite the timeline rows that showed them (account
+    erasure, inside the caller's transaction); returns the posts they were on.
+    """
+    conn = db.connection()
+    post_ids = set(conn.execute(select(_COMMENTS.c.post_id).where(_COMMENTS.c.author_id == user_id)).scalars())
+    conn.execute(delete(_COMMENTS).where(_COMMENTS.c.author_id == user_id))
+    refresh_posts(conn, post_ids)
+    return post_ids
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _refresh_after_flush(session, flush_context):
+    post_ids = session.info.pop("timeline_dirty_posts", None) or set()
+    user_ids = session.info.pop("timeline_dirty_users", None)
+    if not post_ids and not user_ids:
+        return
+    conn = session.connection()
+    if user_ids:
+        post_ids |= _posts_showing(conn, list(user_ids))
+    if post_ids:
+        refresh_posts(conn, post_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("timeline_dirty_posts", None)
+    session.info.pop("timeline_dirty_users", None)
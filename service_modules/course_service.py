@@ -8,6 +8,10 @@ from .base import (
     ClientScheduleORM, ClientProfileORM, NotificationORM,
     LessonEnrollmentORM, LessonWaitlistORM
 )
+from .calendar_materializer import materialize, weekly_dates
+from .lesson_seats import (
+    ensure_counter, reserve_seat, release_seat, next_waitlist_position, waitlist_place, next_in_line, seats_taken
+)
 
 logger = logging.getLogger("gym_app")
 
@@ -375,49 +379,23 @@ class CourseService:
             time_slot = course.time_slot or "9:00 AM"
             duration = course.duration or 60
 
-            # Calculate dates for the next N weeks
+            # Every matching weekday (0=Monday, 6=Sunday) in the next N weeks, today included;
+            # days that already hold this course are skipped
             today = datetime.now().date()
-            created_count = 0
-
-            for week in range(weeks_ahead):
-                for day_num in days_of_week:
-                    # Calculate the date for this day of week
-                    # day_num: 0=Monday, 6=Sunday (Python weekday convention)
-                    days_until = (day_num - today.weekday()) % 7
-                    if week == 0 and days_until == 0:
-                        # Include today if it matches
-                        target_date = today
-                    else:
-                        days_until = days_until + (week * 7)
-                        if week == 0 and days_until < 0:
-                            days_until += 7
-                        target_date = today + timedelta(days=days_until)
-
-                    date_str = target_date.isoformat()
-
-                    # Check if entry already exists for this course on this date
-                    existing = db.query(TrainerScheduleORM).filter(
-                        TrainerScheduleORM.course_id == course_id,
-                        TrainerScheduleORM.date == date_str,
-                        TrainerScheduleORM.trainer_id == trainer_id
-                    ).first()
-
-                    if existing:
-                        continue  # Skip, already scheduled
-
-                    # Create trainer schedule entry
-                    new_entry = TrainerScheduleORM(
-                        trainer_id=trainer_id,
-                        date=date_str,
-                        time=time_slot,
-                        title=course.name,
-                        subtitle="Group Course",
-                        type="course",
-                        duration=duration,
-                        course_id=course_id
-                    )
-                    db.add(new_entry)
-                    created_count += 1
+            stats = materialize(db, TrainerScheduleORM, [
+                {
+                    "trainer_id": trainer_id,
+                    "date": target_date.isoformat(),
+                    "time": time_slot,
+                    "title": course.name,
+                    "subtitle": "Group Course",
+                    "type": "course",
+                    "duration": duration,
+                    "course_id": course_id,
+                }
+                for target_date in weekly_dates(today, 7 * weeks_ahead, days_of_week)
+            ], mode="keep", conflicts=TrainerScheduleORM.course_id == course_id)
+            created_count = stats["inserted"]
 
             db.commit()
             logger.info(f"Generated {created_count} trainer entries for course {course_id}")
@@ -691,6 +669,7 @@ class CourseService:
 
             result = []
             max_capacity = course.max_capacity
+            taken = seats_taken(db, [lesson.id for lesson in lessons])
 
             for lesson in lessons:
                 cap = lesson.max_capacity if lesson.max_capacity else max_capacity
@@ -699,7 +678,8 @@ class CourseService:
                     LessonEnrollmentORM.status == "confirmed"
                 ).count()
 
-                spots_available = max(0, cap - enrolled_count) if cap else None
+                # Seats held for waitlist offers aren't available either
+                spots_available = max(0, cap - taken[lesson.id]) if cap else None
 
                 # Check client's enrollment status
                 user_status = None
@@ -764,7 +744,8 @@ class CourseService:
             # Calculate spots available
             spots_available = None
             if max_capacity:
-                spots_available = max(0, max_capacity - enrolled_count)
+                # Seats held for waitlist offers aren't available either
+                spots_available = max(0, max_capacity - seats_taken(db, [lesson_id])[lesson_id])
 
             # Check client's status if provided
             user_status = None
@@ -809,6 +790,16 @@ class CourseService:
                 raise HTTPException(status_code=404, detail="Lesson not found")
 
             course = db.query(CourseORM).filter(CourseORM.id == lesson.course_id).first()
+            max_capacity = self._lesson_capacity(lesson, course)
+            waitlist_enabled = bool(course and course.waitlist_enabled)
+
+            # Take a seat (or a waitlist position) first: this locks the lesson's counter
+            # row, so the duplicate checks below can't race a second request from the same client
+            ensure_counter(lesson_id)
+            seated = reserve_seat(db, lesson_id, max_capacity)
+            position = None
+            if not seated and waitlist_enabled:
+                position = next_waitlist_position(db, lesson_id)
 
             # Check if already enrolled
             existing = db.query(LessonEnrollmentORM).filter(
@@ -817,6 +808,7 @@ class CourseService:
                 LessonEnrollmentORM.status == "confirmed"
             ).first()
             if existing:
+                db.rollback()
                 raise HTTPException(status_code=400, detail="Already enrolled in this lesson")
 
             # Check if already on waitlist
@@ -826,40 +818,30 @@ class CourseService:
                 LessonWaitlistORM.status.in_(["waiting", "notified"])
             ).first()
             if existing_waitlist:
+                db.rollback()
                 raise HTTPException(status_code=400, detail="Already on waitlist for this lesson")
 
-            # Check capacity
-            max_capacity = lesson.max_capacity if lesson.max_capacity else (course.max_capacity if course else None)
-            enrolled_count = db.query(LessonEnrollmentORM).filter(
-                LessonEnrollmentORM.lesson_id == lesson_id,
-                LessonEnrollmentORM.status == "confirmed"
-            ).count()
-
-            if max_capacity and enrolled_count >= max_capacity:
+            if not seated:
                 # Class is full - add to waitlist if enabled
-                if not course or not course.waitlist_enabled:
+                if not waitlist_enabled:
+                    db.rollback()
                     raise HTTPException(status_code=400, detail="Class is full and waitlist is disabled")
 
-                # Get next position in waitlist
-                max_position = db.query(LessonWaitlistORM).filter(
-                    LessonWaitlistORM.lesson_id == lesson_id
-                ).count()
-
                 waitlist_entry = LessonWaitlistORM(
                     lesson_id=lesson_id,
                     client_id=client_id,
-                    position=max_position + 1,
+                    position=position,
                     status="waiting"
                 )
                 db.add(waitlist_entry)
                 db.commit()
-                db.refresh(waitlist_entry)
 
-                logger.info(f"Client {client_id} added to waitlist for lesson {lesson_id} at position {waitlist_entry.position}")
+                place = waitlist_place(db, lesson_id, position)
+                logger.info(f"Client {client_id} added to waitlist for lesson {lesson_id} at position {place}")
                 return {
                     "status": "waitlisted",
-                    "position": waitlist_entry.position,
-                    "message": f"Class is full. You're #{waitlist_entry.position} on the waitlist."
+                    "position": place,
+                    "message": f"Class is full. You're #{place} on the waitlist."
                 }
 
             # Enroll directly
@@ -942,8 +924,17 @@ class CourseService:
             if not enrollment:
                 raise HTTPException(status_code=404, detail="Enrollment not found")
 
-            enrollment.status = "cancelled"
-            enrollment.cancelled_at = datetime.utcnow().isoformat()
+            ensure_counter(lesson_id)
+            # Conditional, so a double-submitted cancel gives back only one seat
+            cancelled = db.query(LessonEnrollmentORM).filter(
+                LessonEnrollmentORM.id == enrollment.id,
+                LessonEnrollmentORM.status == "confirmed"
+            ).update({"status": "cancelled", "cancelled_at": datetime.utcnow().isoformat()},
+                     synchronize_session=False)
+            if cancelled != 1:
+                db.rollback()
+                raise HTTPException(status_code=404, detail="Enrollment not found")
+            release_seat(db, lesson_id)
 
             # Remove calendar entry for this lesson
             lesson = db.query(CourseLessonORM).filter(CourseLessonORM.id == lesson_id).first()
@@ -954,13 +945,11 @@ class CourseService:
                     ClientScheduleORM.date == lesson.date
                 ).delete()
 
-            db.commit()
+            # Process waitlist - offer the seat to the first person (commits)
+            self._process_waitlist(db, lesson_id)
 
             logger.info(f"Client {client_id} cancelled enrollment in lesson {lesson_id}")
 
-            # Process waitlist - notify first person
-            self._process_waitlist(db, lesson_id)
-
             return {"status": "success", "message": "Enrollment cancelled"}
         except HTTPException:
             raise
@@ -971,21 +960,33 @@ class CourseService:
         finally:
             db.close()
 
+    @staticmethod
+    def _lesson_capacity(lesson, course):
+        """Lesson override or course default (None = unlimited)."""
+        return lesson.max_capacity if lesson.max_capacity else (course.max_capacity if course else None)
+
     def _process_waitlist(self, db, lesson_id: int):
-        """Notify the first person on waitlist that a spot is available."""
+        """
+        Offer a freed seat to the first person on the waitlist, then commit.
+
+        Called right after the caller released a seat in the same transaction, so the
+        seat is held for the notified client before a new enrollment can take it.
+        """
         # Get first person on waitlist
-        first_in_line = db.query(LessonWaitlistORM).filter(
-            LessonWaitlistORM.lesson_id == lesson_id,
-            LessonWaitlistORM.status == "waiting"
-        ).order_by(LessonWaitlistORM.position).first()
+        first_in_line = next_in_line(db, lesson_id)
 
         if not first_in_line:
+            db.commit()
             return  # No one on waitlist
 
         # Get lesson and course info for notification
         lesson = db.query(CourseLessonORM).filter(CourseLessonORM.id == lesson_id).first()
         course = db.query(CourseORM).filter(CourseORM.id == lesson.course_id).first() if lesson else None
 
+        if not lesson or not reserve_seat(db, lesson_id, self._lesson_capacity(lesson, course)):
+            db.commit()
+            return  # Capacity was lowered: no seat to offer
+
         # Mark as notified with expiration (24 hours to respond)
         now = datetime.utcnow()
         expires = now + timedelta(hours=24)
@@ -1013,6 +1014,19 @@ class CourseService:
 
         logger.info(f"Notified client {first_in_line.client_id} about available spot in lesson {lesson_id}")
 
+    def _end_offer(self, db, waitlist_entry, status: str) -> bool:
+        """Move a notified entry to declined/expired, handing its held seat to the next in line."""
+        ended = db.query(LessonWaitlistORM).filter(
+            LessonWaitlistORM.id == waitlist_entry.id,
+            LessonWaitlistORM.status == "notified"
+        ).update({"status": status}, synchronize_session=False)
+        if ended != 1:
+            db.rollback()
+            return False
+        release_seat(db, waitlist_entry.lesson_id)
+        self._process_waitlist(db, waitlist_entry.lesson_id)
+        return True
+
     def accept_waitlist_spot(self, waitlist_id: int, client_id: str, add_to_calendar: bool = True) -> dict:
         """Accept a waitlist spot and convert to enrollment."""
         db = get_db_session()
@@ -1034,16 +1048,25 @@ class CourseService:
             if waitlist_entry.status != "notified":
                 raise HTTPException(status_code=400, detail="No spot available to accept")
 
+            ensure_counter(waitlist_entry.lesson_id)
+
             # Check if offer expired
             if waitlist_entry.notification_expires_at:
                 expires = datetime.fromisoformat(waitlist_entry.notification_expires_at)
                 if datetime.utcnow() > expires:
-                    waitlist_entry.status = "expired"
-                    db.commit()
                     # Process next person in line
-                    self._process_waitlist(db, waitlist_entry.lesson_id)
+                    self._end_offer(db, waitlist_entry, "expired")
                     raise HTTPException(status_code=400, detail="This offer has expired")
 
+            # The seat was reserved when the client was notified: just claim the offer
+            claimed = db.query(LessonWaitlistORM).filter(
+                LessonWaitlistORM.id == waitlist_id,
+                LessonWaitlistORM.status == "notified"
+            ).update({"status": "accepted"}, synchronize_session=False)
+            if claimed != 1:
+                db.rollback()
+                raise HTTPException(status_code=400, detail="Spot already accepted")
+
             # Create enrollment
             enrollment = LessonEnrollmentORM(
                 lesson_id=waitlist_entry.lesson_id,
@@ -1053,18 +1076,6 @@ class CourseService:
             )
             db.add(enrollment)
 
-            # Update waitlist entry
-            waitlist_entry.status = "accepted"
-
-            # Reorder remaining waitlist
-            remaining = db.query(LessonWaitlistORM).filter(
-                LessonWaitlistORM.lesson_id == waitlist_entry.lesson_id,
-                LessonWaitlistORM.status == "waiting",
-                LessonWaitlistORM.position > waitlist_entry.position
-            ).all()
-            for entry in remaining:
-                entry.position -= 1
-
             db.commit()
             db.refresh(enrollment)
 
@@ -1108,23 +1119,11 @@ class CourseService:
                 raise HTTPException(status_code=400, detail="No spot to decline")
 
             lesson_id = waitlist_entry.lesson_id
+            ensure_counter(lesson_id)
 
-            # Mark as declined
-            waitlist_entry.status = "declined"
-
-            # Reorder remaining waitlist
-            remaining = db.query(LessonWaitlistORM).filter(
-                LessonWaitlistORM.lesson_id == lesson_id,
-                LessonWaitlistORM.status == "waiting",
-                LessonWaitlistORM.position > waitlist_entry.position
-            ).all()
-            for entry in remaining:
-                entry.position -= 1
-
-            db.commit()
-
-            # Process next person in line
-            self._process_waitlist(db, lesson_id)
+            # Mark as declined and process next person in line
+            if not self._end_offer(db, waitlist_entry, "declined"):
+                raise HTTPException(status_code=400, detail="No spot to decline")
 
             logger.info(f"Client {client_id} declined waitlist spot for lesson {lesson_id}")
             return {"status": "success", "message": "Spot declined. The next person has been notified."}
@@ -1137,6 +1136,27 @@ class CourseService:
         finally:
             db.close()
 
+    def expire_waitlist_offers(self) -> dict:
+        """Expire waitlist offers nobody answered in time, passing their seats down the line."""
+        now = datetime.utcnow().isoformat()
+        db = get_db_session()
+        try:
+            stale = db.query(LessonWaitlistORM).filter(
+                LessonWaitlistORM.status == "notified",
+                LessonWaitlistORM.notification_expires_at < now
+            ).all()
+            expired = 0
+            for entry in stale:
+                ensure_counter(entry.lesson_id)
+                if self._end_offer(db, entry, "expired"):
+                    expired += 1
+            return {"expired_offers": expired}
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
     def get_lesson_enrollments(self, lesson_id: int, trainer_id: str) -> list:
         """Get all enrollments for a lesson (trainer only)."""
         db = get_db_session()
@@ -1194,12 +1214,12 @@ class CourseService:
             client_lookup = {c.id: c.username for c in clients}
 
             result = []
-            for w in waitlist:
+            for place, w in enumerate(waitlist, start=1):
                 result.append({
                     "id": w.id,
                     "client_id": w.client_id,
                     "client_name": client_lookup.get(w.client_id, "Unknown"),
-                    "position": w.position,
+                    "position": place,
                     "status": w.status,
                     "added_at": w.added_at,
                     "notified_at": w.notified_at
@@ -7,11 +7,74 @@ from .base import (
     ClientSubscriptionORM, AppointmentORM, AutomatedMessageLogORM
 )
 from models_orm import SubscriptionPlanORM
+from sqlalchemy import case, func
+from sqlalchemy.orm import aliased
 from typing import List, Optional
 
 logger = logging.getLogger("gym_app")
 
 
+def _days_inactive(last_workout_date: Optional[str], last_seen: Optional[str], today: date) -> int:
+    """Calculate days since last activity (last completed workout, falling back to last_seen)."""
+    if last_workout_date:
+        try:
+            last_date = datetime.fromisoformat(last_workout_date).date()
+            return (today - last_date).days
+        except ValueError:
+            pass
+
+    # Fallback to last_seen field
+    if last_seen:
+        # Parse various formats like "Today", "5 days ago", or ISO date
+        if last_seen.lower() == "today":
+            return 0
+        elif "days ago" in last_seen.lower():
+            try:
+                return int(last_seen.split()[0])
+            except ValueError:
+                pass
+        else:
+            try:
+                last_date = datetime.fromisoformat(last_seen.replace('Z', '+00:00')).date()
+                return (today - last_date).days
+            except ValueError:
+                pass
+
+    # If no activity data, consider very inactive
+    return 999
+
+
+def _classify_client(snapshot: dict, today: date) -> tuple:
+    """
+    Determine a client's pipeline status from a snapshot row (see _load_client_snapshots).
+    Returns (status, days_inactive).
+    """
+    days_inactive = _days_inactive(snapshot["last_workout_date"], snapshot["last_seen"], today)
+
+    # Check subscription status first
+    if snapshot["subscription_status"] in ('canceled', 'past_due'):
+        return 'churning', days_inactive
+
+    # Check if new user (account created < 14 days)
+    created_at = snapshot["created_at"]
+    if created_at:
+        try:
+            created = datetime.fromisoformat(created_at.replace('Z', '+00:00')).date()
+            account_age = (today - created).days
+            if account_age <= 14 and days_inactive <= 7:
+                return 'new', days_inactive
+        except (ValueError, AttributeError):
+            pass
+
+    # Classify by inactivity
+    if days_inactive <= 5:
+        return 'active', days_inactive
+    elif days_inactive <= 14:
+        return 'at_risk', days_inactive
+    else:
+        return 'churning', days_inactive
+
+
 class CRMService:
     """Service for CRM analytics and client management."""
 
@@ -26,16 +89,12 @@ class CRMService:
         """
         db = get_db_session()
         try:
-            clients = db.query(ClientProfileORM).filter(
-                ClientProfileORM.gym_id == gym_id
-            ).all()
-
             today = date.today()
             pipeline = {"new": 0, "active": 0, "at_risk": 0, "churning": 0, "total": 0}
 
-            for client in clients:
+            for snapshot in self._load_client_snapshots(db, gym_id):
                 pipeline["total"] += 1
-                status = self._calculate_client_status(client, db, today)
+                status, _ = _classify_client(snapshot, today)
                 if status in pipeline:
                     pipeline[status] += 1
 
@@ -51,67 +110,33 @@ class CRMService:
         """Get detailed list of at-risk and churning clients needing attention."""
         db = get_db_session()
         try:
-            clients = db.query(ClientProfileORM).filter(
-                ClientProfileORM.gym_id == gym_id
-            ).all()
-
             today = date.today()
             at_risk_clients = []
 
-            for client in clients:
+            for snapshot in self._load_client_snapshots(db, gym_id):
                 # Use the same classification as the pipeline
-                pipeline_status = self._calculate_client_status(client, db, today)
+                pipeline_status, days_inactive = _classify_client(snapshot, today)
 
                 if pipeline_status not in ("at_risk", "churning"):
                     continue
 
-                days_inactive = self._get_days_inactive(client, db, today)
-
-                # Get trainer name
-                trainer_name = None
-                if client.trainer_id:
-                    trainer = db.query(UserORM).filter(UserORM.id == client.trainer_id).first()
-                    trainer_name = trainer.username if trainer else None
-
-                # Get user info
-                user = db.query(UserORM).filter(UserORM.id == client.id).first()
-
-                # Get last workout date
-                last_workout = db.query(ClientScheduleORM).filter(
-                    ClientScheduleORM.client_id == client.id,
-                    ClientScheduleORM.type == "workout",
-                    ClientScheduleORM.completed == True
-                ).order_by(ClientScheduleORM.date.desc()).first()
-
-                # Get latest subscription/plan name
-                plan_name = None
-                sub_status = None
-                latest_sub = db.query(ClientSubscriptionORM).filter(
-                    ClientSubscriptionORM.client_id == client.id,
-                    ClientSubscriptionORM.gym_id == client.gym_id,
-                ).order_by(ClientSubscriptionORM.created_at.desc()).first()
-                if latest_sub:
-                    sub_status = latest_sub.status
-                    if latest_sub.plan_id:
-                        plan = db.query(SubscriptionPlanORM).filter(SubscriptionPlanORM.id == latest_sub.plan_id).first()
-                        plan_name = plan.name if plan else None
-
+                has_user = snapshot["user_id"] is not None
                 at_risk_clients.append({
-                    "id": client.id,
-                    "name": user.username if user else "Unknown",
-                    "email": user.email if user else None,
-                    "phone": user.phone if user else None,
+                    "id": snapshot["id"],
+                    "name": snapshot["username"] if has_user else "Unknown",
+                    "email": snapshot["email"],
+                    "phone": snapshot["phone"],
                     "days_inactive": days_inactive,
-                    "last_workout_date": last_workout.date if last_workout else None,
-                    "health_score": client.health_score or 0,
-                    "streak": client.streak or 0,
-                    "trainer_id": client.trainer_id,
-                    "trainer_name": trainer_name,
-                    "status": client.status,
+                    "last_workout_date": snapshot["last_workout_date"],
+                    "health_score": snapshot["health_score"] or 0,
+                    "streak": snapshot["streak"] or 0,
+                    "trainer_id": snapshot["trainer_id"],
+                    "trainer_name": snapshot["trainer_name"],
+                    "status": snapshot["status"],
                     "pipeline_status": pipeline_status,
-                    "plan_name": plan_name,
-                    "subscription_status": sub_status,
-                    "profile_picture": user.profile_picture if user else None,
+                    "plan_name": snapshot["plan_name"],
+                    "subscription_status": snapshot["subscription_status"],
+                    "profile_picture": snapshot["profile_picture"],
                 })
 
             # Sort: churning first, then by days inactive
@@ -137,11 +162,9 @@ class CRMService:
         """
         db = get_db_session()
         try:
-            clients = db.query(ClientProfileORM).filter(
-                ClientProfileORM.gym_id == gym_id
-            ).all()
+            snapshots = self._load_client_snapshots(db, gym_id)
 
-            if not clients:
+            if not snapshots:
                 return {
                     "engagement_rate": 0,
                     "churn_rate": 0,
@@ -152,27 +175,26 @@ class CRMService:
                 }
 
             today = date.today()
-            total = len(clients)
+            total = len(snapshots)
             engaged = 0
             churning = 0
             at_risk = 0
             total_health = 0
             health_count = 0
 
-            for client in clients:
-                days_inactive = self._get_days_inactive(client, db, today)
+            for snapshot in snapshots:
+                status, days_inactive = _classify_client(snapshot, today)
 
                 if days_inactive <= 7:
                     engaged += 1
 
-                status = self._calculate_client_status(client, db, today)
                 if status == "churning":
                     churning += 1
                 elif status == "at_risk":
                     at_risk += 1
 
-                if client.health_score:
-                    total_health += client.health_score
+                if snapshot["health_score"]:
+                    total_health += snapshot["health_score"]
                     health_count += 1
 
             engagement_rate = round((engaged / total) * 100) if total > 0 else 0
@@ -285,75 +307,76 @@ class CRMService:
         finally:
             db.close()
 
-    def _calculate_client_status(self, client: ClientProfileORM, db, today: date) -> str:
-        """Determine client's pipeline status."""
-        # Check subscription status first
-        subscription = db.query(ClientSubscriptionORM).filter(
-            ClientSubscriptionORM.client_id == client.id,
-            ClientSubscriptionORM.gym_id == client.gym_id
-        ).first()
-
-        if subscription and subscription.status in ['canceled', 'past_due']:
-            return 'churning'
-
-        # Calculate days inactive
-        days_inactive = self._get_days_inactive(client, db, today)
-
-        # Check if new user (account created < 14 days)
-        user = db.query(UserORM).filter(UserORM.id == client.id).first()
-        if user and user.created_at:
-            try:
-                created = datetime.fromisoformat(user.created_at.replace('Z', '+00:00')).date()
-                account_age = (today - created).days
-                if account_age <= 14 and days_inactive <= 7:
-                    return 'new'
-            except:
-                pass
-
-        # Classify by inactivity
-        if days_inactive <= 5:
-            return 'active'
-        elif days_inactive <= 14:
-            return 'at_risk'
-        else:
-            return 'churning'
-
-    def _get_days_inactive(self, client: ClientProfileORM, db, today: date) -> int:
-        """Calculate days since last activity."""
-        # Try to get last workout date
-        last_workout = db.query(ClientScheduleORM).filter(
-            ClientScheduleORM.client_id == client.id,
+    def _load_client_snapshots(self, db, gym_id: str) -> List[dict]:
+        """
+        Load every client of a gym with the inputs needed for pipeline classification
+        with two queries: profile fields, account creation date, trainer name,
+        last completed workout date and the latest subscription (status + plan name).
+        """
+        last_workout = db.query(
+            ClientScheduleORM.client_id.label("client_id"),
+            func.max(ClientScheduleORM.date).label("last_workout_date"),
+        ).join(
+            ClientProfileORM, ClientProfileORM.id == ClientScheduleORM.client_id
+        ).filter(
+            ClientProfileORM.gym_id == gym_id,
             ClientScheduleORM.type == "workout",
             ClientScheduleORM.completed == True
-        ).order_by(ClientScheduleORM.date.desc()).first()
-
-        if last_workout and last_workout.date:
-            try:
-                last_date = datetime.fromisoformat(last_workout.date).date()
-                return (today - last_date).days
-            except:
-                pass
-
-        # Fallback to last_seen field
-        if client.last_seen:
-            # Parse various formats like "Today", "5 days ago", or ISO date
-            if client.last_seen.lower() == "today":
-                return 0
-            elif "days ago" in client.last_seen.lower():
-                try:
-                    days = int(client.last_seen.split()[0])
-                    return days
-                except:
-                    pass
-            else:
-                try:
-                    last_date = datetime.fromisoformat(client.last_seen.replace('Z', '+00:00')).date()
-                    return (today - last_date).days
-                except:
-                    pass
-
-        # If no activity data, consider very inactive
-        return 999
+        ).group_by(ClientScheduleORM.client_id).subquery()
+
+        trainer = aliased(UserORM)
+        rows = db.query(
+            ClientProfileORM.id,
+            ClientProfileORM.trainer_id,
+            ClientProfileORM.last_seen,
+            ClientProfileORM.health_score,
+            ClientProfileORM.streak,
+            ClientProfileORM.status,
+            UserORM.id.label("user_id"),
+            UserORM.username,
+            UserORM.email,
+            UserORM.phone,
+            UserORM.profile_picture,
+            UserORM.created_at,
+            trainer.username.label("trainer_name"),
+            last_workout.c.last_workout_date,
+        ).select_from(ClientProfileORM).outerjoin(
+            UserORM, UserORM.id == ClientProfileORM.id
+        ).outerjoin(
+            trainer, trainer.id == ClientProfileORM.trainer_id
+        ).outerjoin(
+            last_workout, last_workout.c.client_id == ClientProfileORM.id
+        ).filter(
+            ClientProfileORM.gym_id == gym_id
+        ).all()
+
+        # Latest subscription per client. Kept as a separate query: SQLite can't index
+        # a window-function subquery, so joining it would scan it once per client.
+        ranked_subs = db.query(
+            ClientSubscriptionORM.client_id.label("client_id"),
+            ClientSubscriptionORM.status.label("status"),
+            ClientSubscriptionORM.plan_id.label("plan_id"),
+            func.row_number().over(
+                partition_by=ClientSubscriptionORM.client_id,
+                order_by=(ClientSubscriptionORM.created_at.desc(), ClientSubscriptionORM.id.desc()),
+            ).label("rn"),
+        ).filter(ClientSubscriptionORM.gym_id == gym_id).subquery()
+
+        latest_subs = {
+            client_id: (status, plan_name)
+            for client_id, status, plan_name in db.query(
+                ranked_subs.c.client_id, ranked_subs.c.status, SubscriptionPlanORM.name
+            ).outerjoin(
+                SubscriptionPlanORM, SubscriptionPlanORM.id == ranked_subs.c.plan_id
+            ).filter(ranked_subs.c.rn == 1).all()
+        }
+
+        snapshots = []
+        for row in rows:
+            snapshot = dict(row._mapping)
+            snapshot["subscription_status"], snapshot["plan_name"] = latest_subs.get(row.id, (None, None))
+            snapshots.append(snapshot)
+        return snapshots
 
     def get_activity_feed(self, gym_id: str, limit: int = 20) -> List[dict]:
         """
@@ -552,70 +575,44 @@ class CRMService:
         """Get detailed client list for a specific pipeline status (new, active, at_risk, churning)."""
         db = get_db_session()
         try:
-            clients = db.query(ClientProfileORM).filter(
-                ClientProfileORM.gym_id == gym_id
-            ).all()
-
             today = date.today()
-            result = []
-
-            for client in clients:
-                client_status = self._calculate_client_status(client, db, today)
-                if client_status != status:
-                    continue
-
-                user = db.query(UserORM).filter(UserORM.id == client.id).first()
-                if not user:
-                    continue
-
-                # Count completed workouts
-                completed_workouts = db.query(ClientScheduleORM).filter(
-                    ClientScheduleORM.client_id == client.id,
-                    ClientScheduleORM.type == "workout",
-                    ClientScheduleORM.completed == True
-                ).count()
-
-                # Count completed courses
-                completed_courses = db.query(ClientScheduleORM).filter(
-                    ClientScheduleORM.client_id == client.id,
-                    ClientScheduleORM.type == "course",
-                    ClientScheduleORM.completed == True
-                ).count()
-
-                days_inactive = self._get_days_inactive(client, db, today)
-
-                # Get trainer name
-                trainer_name = None
-                if client.trainer_id:
-                    trainer = db.query(UserORM).filter(UserORM.id == client.trainer_id).first()
-                    if trainer:
-                        trainer_name = trainer.username
-
-                # Get subscription plan
-                plan_name = None
-                sub = db.query(ClientSubscriptionORM).filter(
-                    ClientSubscriptionORM.client_id == client.id,
-                    ClientSubscriptionORM.gym_id == gym_id
-                ).first()
-                if sub and sub.plan_id:
-                    plan = db.query(SubscriptionPlanORM).filter(
-                        SubscriptionPlanORM.id == sub.plan_id
-                    ).first()
-                    if plan:
-                        plan_name = plan.name
+            matches = []
+            for snapshot in self._load_client_snapshots(db, gym_id):
+                client_status, days_inactive = _classify_client(snapshot, today)
+                if client_status == status and snapshot["user_id"] is not None:
+                    matches.append((snapshot, days_inactive))
+
+            # Completed workout/course counts for the whole gym in one grouped query
+            counts = {}
+            if matches:
+                count_rows = db.query(
+                    ClientScheduleORM.client_id,
+                    func.sum(case((ClientScheduleORM.type == "workout", 1), else_=0)),
+                    func.sum(case((ClientScheduleORM.type == "course", 1), else_=0)),
+                ).join(
+                    ClientProfileORM, ClientProfileORM.id == ClientScheduleORM.client_id
+                ).filter(
+                    ClientProfileORM.gym_id == gym_id,
+                    ClientScheduleORM.completed == True,
+                    ClientScheduleORM.type.in_(["workout", "course"])
+                ).group_by(ClientScheduleORM.client_id).all()
+                counts = {row[0]: (int(row[1] or 0), int(row[2] or 0)) for row in count_rows}
 
+            result = []
+            for snapshot, days_inactive in matches:
+                completed_workouts, completed_courses = counts.get(snapshot["id"], (0, 0))
                 result.append({
-                    "id": client.id,
-                    "name": user.username,
-                    "email": user.email,
-                    "streak": client.streak or 0,
-                    "health_score": client.health_score or 0,
+                    "id": snapshot["id"],
+                    "name": snapshot["username"],
+                    "email": snapshot["email"],
+                    "streak": snapshot["streak"] or 0,
+                    "health_score": snapshot["health_score"] or 0,
                     "completed_workouts": completed_workouts,
                     "completed_courses": completed_courses,
                     "days_inactive": days_inactive,
-                    "trainer_name": trainer_name,
-                    "plan_name": plan_name,
-                    "profile_picture": user.profile_picture,
+                    "trainer_name": snapshot["trainer_name"],
+                    "plan_name": snapshot["plan_name"],
+                    "profile_picture": snapshot["profile_picture"],
                 })
 
             # Sort: most active first (lowest days_inactive), then by streak desc
@@ -15,198 +15,78 @@ class DietService:
     """Service for managing client diet, meal scanning, and logging."""
 
     def scan_meal(self, file_bytes: bytes) -> dict:
-        """Scan a meal image using MacroFactor-style approach: AI identifies foods, database provides accurate macros."""
+        """Scan a meal image using MacroFactor-style approach: AI identifies foods, database provides accurate macros.
+
+        Tries the configured providers one after another; async routes use
+        MealScanService, which races them and caches results by image hash.
+        """
+        for method, scan in self.scan_providers():
+            try:
+                result = scan(file_bytes)
+                return {"status": "success", "data": result, "method": method}
+            except Exception as e:
+                logger.error(f"{method} scan failed: {e}")
+
+        return self.mock_scan()
+
+    def scan_providers(self) -> list:
+        """Configured meal scan providers as (method, scan(file_bytes) -> data), best first."""
         import os
-        import random
-        import sys
-        # Add parent directory to path for mock_meals import
-        parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        if parent_dir not in sys.path:
-            sys.path.insert(0, parent_dir)
-        from mock_meals import MOCK_MEALS
+        from functools import partial
 
         gemini_key = os.environ.get("GEMINI_API_KEY")
         usda_key = os.environ.get("USDA_API_KEY")
         nutritionix_app_id = os.environ.get("NUTRITIONIX_APP_ID")
         nutritionix_api_key = os.environ.get("NUTRITIONIX_API_KEY")
+        clarifai_key = os.environ.get("CLARIFAI_API_KEY")
+        groq_key = os.environ.get("GROQ_API_KEY")
 
+        providers = []
         # BEST FREE: Open Food Facts (no API key, excellent for Italian/European foods)
         if gemini_key:
-            try:
-                result = self._scan_gemini_openfoodfacts(file_bytes, gemini_key)
-                return {"status": "success", "data": result, "method": "gemini_openfoodfacts"}
-            except Exception as e:
-                logger.error(f"Gemini+OpenFoodFacts scan failed: {e}")
+            providers.append(("gemini_openfoodfacts", partial(self._scan_gemini_openfoodfacts, gemini_key=gemini_key)))
 
         # BACKUP FREE: MacroFactor-style with USDA (Gemini identifies foods → USDA for accurate macros)
         if gemini_key and usda_key:
-            try:
-                result = self._scan_gemini_usda(file_bytes, gemini_key, usda_key)
-                return {"status": "success", "data": result, "method": "gemini_usda"}
-            except Exception as e:
-                logger.error(f"Gemini+USDA scan failed: {e}")
+            providers.append(("gemini_usda", partial(self._scan_gemini_usda, gemini_key=gemini_key, usda_key=usda_key)))
 
         # PREMIUM: MacroFactor-style with Nutritionix (if keys available)
         if gemini_key and nutritionix_app_id and nutritionix_api_key:
-            try:
-                result = self._scan_macrofactor_style(file_bytes, gemini_key, nutritionix_app_id, nutritionix_api_key)
-                return {"status": "success", "data": result, "method": "macrofactor"}
-            except Exception as e:
-                logger.error(f"MacroFactor-style scan failed: {e}")
+            providers.append(("macrofactor", partial(self._scan_macrofactor_style, gemini_key=gemini_key,
+                                                     nutritionix_app_id=nutritionix_app_id,
+                                                     nutritionix_api_key=nutritionix_api_key)))
 
         # FALLBACK: Gemini direct estimation (works without database)
         if gemini_key:
-            try:
-                result = self._scan_gemini(file_bytes, gemini_key)
-                return {"status": "success", "data": result, "method": "gemini"}
-            except Exception as e:
-                logger.error(f"Gemini scan failed: {e}")
+            providers.append(("gemini", partial(self._scan_gemini, api_key=gemini_key)))
 
         # Legacy fallbacks
-        clarifai_key = os.environ.get("CLARIFAI_API_KEY")
-        groq_key = os.environ.get("GROQ_API_KEY")
-
         if clarifai_key and nutritionix_app_id and nutritionix_api_key:
-            try:
-                result = self._scan_hybrid(file_bytes, clarifai_key, nutritionix_app_id, nutritionix_api_key)
-                return {"status": "success", "data": result, "method": "clarifai_nutritionix"}
-            except Exception as e:
-                logger.error(f"Hybrid scan failed: {e}")
-
+            providers.append(("clarifai_nutritionix", partial(self._scan_hybrid, clarifai_key=clarifai_key,
+                                                              nutritionix_app_id=nutritionix_app_id,
+                                                              nutritionix_api_key=nutritionix_api_key)))
         if clarifai_key and groq_key:
-            try:
-                result = self._scan_clarifai_groq(file_bytes, clarifai_key, groq_key)
-                return {"status": "success", "data": result, "method": "clarifai_groq"}
-            except Exception as e:
-                logger.error(f"Clarifai+Groq scan failed: {e}")
-
+            providers.append(("clarifai_groq", partial(self._scan_clarifai_groq, clarifai_key=clarifai_key,
+                                                       groq_key=groq_key)))
         if groq_key:
-            try:
-                result = self._scan_groq_only(file_bytes, groq_key)
-                return {"status": "success", "data": result, "method": "groq"}
-            except Exception as e:
-                logger.error(f"Groq Vision scan failed: {e}")
+            providers.append(("groq", partial(self._scan_groq_only, groq_key=groq_key)))
+        return providers
+
+    def mock_scan(self) -> dict:
+        """Final fallback: a random entry from the mock meal database."""
+        import os
+        import random
+        import sys
+        # Add parent directory to path for mock_meals import
+        parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        if parent_dir not in sys.path:
+            sys.path.insert(0, parent_dir)
+        from mock_meals import MOCK_MEALS
 
-        # Final fallback: Mock data
         logger.warning("No API keys found, using mock meal database.")
         result = random.choice(MOCK_MEALS)
         return {"status": "success", "data": result, "method": "mock"}
 
-    def lookup_barcode(self, barcode: str) -> dict:
-        """Look up a product by barcode using Open Food Facts API.
-
-        This provides accurate nutritional data for packaged foods.
-        Open Food Facts has excellent coverage for EU/Italian products.
-        """
-        import requests
-
-        logger.info(f"Looking up barcode: {barcode}")
-
-        # Try world database (more reliable), then Italian
-        api_urls = [
-            f"https://world.openfoodfacts.org/api/v2/product/{barcode}",
-            f"https://it.openfoodfacts.org/api/v2/product/{barcode}",
-        ]
-
-        headers = {"User-Agent": "FitOS-GymApp/1.0 (contact@fitos.app)"}
-
-        for api_url in api_urls:
-            try:
-                response = requests.get(api_url, timeout=15, headers=headers)
-
-                if not response.ok:
-                    continue
-
-                data = response.json()
-
-                if data.get("status") != 1:
-                    continue
-
-                product = data.get("product", {})
-                nutriments = product.get("nutriments", {})
-
-                # Get product info
-                product_name = product.get("product_name") or product.get("product_name_it") or product.get("product_name_en") or "Unknown Product"
-                brands = product.get("brands", "")
-                quantity = product.get("quantity", "")
-
-                # Parse quantity to get package weight
-                package_weight = 100  # default to 100g
-                if quantity:
-                    import re
-                    match = re.search(r'(\d+)\s*g', quantity.lower())
-                    if match:
-                        package_weight = int(match.group(1))
-
-                # Get nutritional values per 100g
-                energy_100g = nutriments.get("energy-kcal_100g") or 0
-                if not energy_100g:
-                    # Try energy in kJ and convert
-                    energy_kj = nutriments.get("energy_100g", 0)
-                    if energy_kj:
-                        energy_100g = energy_kj / 4.184
-
-                protein_100g = nutriments.get("proteins_100g", 0) or 0
-                carbs_100g = nutriments.get("carbohydrates_100g", 0) or 0
-                fat_100g = nutriments.get("fat_100g", 0) or 0
-
-                # Use serving size if available, otherwise default to 100g
-                serving_size = nutriments.get("serving_quantity") or product.get("serving_quantity")
-                if serving_size:
-                    try:
-                        portion = float(serving_size)
-                    except (ValueError, TypeError):
-                        portion = 100.0
-                else:
-                    portion = 100.0
-
-                scale = portion / 100.0
-                total_calories = round(energy_100g * scale)
-                total_protein = round(protein_100g * scale, 1)
-                total_carbs = round(carbs_100g * scale, 1)
-                total_fat = round(fat_100g * scale, 1)
-
-                serving_label = product.get("serving_size", f"{int(portion)}g")
-
-                full_name = f"{brands} {product_name}".strip() if brands else product_name
-
-                logger.info(f"Found product: {full_name}, portion={serving_label}, {total_calories} kcal")
-
-                return {
-                    "status": "success",
-                    "data": {
-                        "name": full_name,
-                        "cals": total_calories,
-                        "protein": total_protein,
-                        "carbs": total_carbs,
-                        "fat": total_fat,
-                        "portion_size": serving_label,
-                        "package_weight": package_weight,
-                        "serving_quantity": portion,
-                        "per_100g": {
-                            "cals": round(energy_100g),
-                            "protein": round(protein_100g, 1),
-                            "carbs": round(carbs_100g, 1),
-                            "fat": round(fat_100g, 1)
-                        },
-                        "confidence": "high",
-                        "source": "openfoodfacts_barcode"
-                    },
-                    "method": "barcode"
-                }
-
-            except Exception as e:
-                logger.warning(f"Open Food Facts barcode lookup error: {e}")
-                continue
-
-        # Product not found
-        logger.warning(f"Barcode {barcode} not found in Open Food Facts")
-        return {
-            "status": "not_found",
-            "message": f"Product with barcode {barcode} not found. Try taking a photo instead.",
-            "barcode": barcode
-        }
-
     def _scan_macrofactor_style(self, file_bytes: bytes, gemini_key: str, nutritionix_app_id: str, nutritionix_api_key: str) -> dict:
         """MacroFactor-style: Gemini identifies individual foods, Nutritionix provides accurate macros."""
         import base64
@@ -1,18 +1,28 @@
 """
 Email Service - handles sending emails via SMTP.
 Supports: global env-var config, per-gym SMTP credentials, and OAuth2 XOAUTH2.
+Messages go out over pooled SMTP sessions (see smtp_delivery.py).
 """
 import smtplib
 import ssl
 import os
+import re
 import base64
 import logging
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
+from typing import List, Tuple
 
 logger = logging.getLogger("gym_app")
 
+SMTP_TIMEOUT = 30
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def _tls_context() -> ssl.SSLContext:
+    return ssl.create_default_context()
+
 
 class EmailService:
     """Service for sending transactional emails via SMTP."""
@@ -96,50 +106,71 @@ class EmailService:
         auth = f"user={self.smtp_user}\x01auth=Bearer {self.oauth_access_token}\x01\x01"
         return base64.b64encode(auth.encode()).decode()
 
-    def send_email(self, to_email: str, subject: str, html_body: str) -> bool:
-        if not self.is_configured():
-            logger.warning("SMTP not configured, cannot send email")
-            return False
-
-        try:
-            msg = MIMEMultipart("alternative")
-            msg["Subject"] = subject
-            msg["From"] = f"{self.from_name} <{self.from_email}>"
-            msg["To"] = to_email
-
-            # Plain text fallback
-            text_body = html_body.replace("<br>", "\n").replace("</p>", "\n")
-            import re
-            text_body = re.sub(r"<[^>]+>", "", text_body)
-
-            msg.attach(MIMEText(text_body, "plain"))
-            msg.attach(MIMEText(html_body, "html"))
+    def pool_key(self) -> tuple:
+        """Identifies the SMTP account: sessions in the pool are shared by services with the same key."""
+        if self.oauth_provider and self.oauth_refresh_token:
+            return (self.smtp_host, self.smtp_port, self.smtp_user, "xoauth2", self.oauth_refresh_token)
+        return (self.smtp_host, self.smtp_port, self.smtp_user, "login", self.smtp_password)
 
-            context = ssl.create_default_context()
+    def connect(self) -> smtplib.SMTP:
+        """Open an authenticated SMTP session (STARTTLS + login or XOAUTH2)."""
+        if self.oauth_provider and self.oauth_refresh_token:
+            # OAuth2 XOAUTH2 authentication
+            if self._is_token_expired() and not self._refresh_oauth_token():
+                raise smtplib.SMTPException("OAuth token refresh failed, cannot send email")
 
+        server = smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=SMTP_TIMEOUT)
+        try:
+            server.starttls(context=_tls_context())
             if self.oauth_provider and self.oauth_refresh_token:
-                # OAuth2 XOAUTH2 authentication
-                if self._is_token_expired():
-                    if not self._refresh_oauth_token():
-                        logger.error("OAuth token refresh failed, cannot send email")
-                        return False
-
-                with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                    server.starttls(context=context)
-                    server.docmd('AUTH', 'XOAUTH2 ' + self._xoauth2_string())
-                    server.sendmail(self.from_email, to_email, msg.as_string())
+                code, response = server.docmd('AUTH', 'XOAUTH2 ' + self._xoauth2_string())
+                if code != 235:
+                    raise smtplib.SMTPAuthenticationError(code, response)
             else:
                 # Standard password authentication
-                with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                    server.starttls(context=context)
-                    server.login(self.smtp_user, self.smtp_password)
-                    server.sendmail(self.from_email, to_email, msg.as_string())
+                server.login(self.smtp_user, self.smtp_password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def build_message(self, to_email: str, subject: str, html_body: str) -> str:
+        msg = MIMEMultipart("alternative")
+        msg["Subject"] = subject
+        msg["From"] = f"{self.from_name} <{self.from_email}>"
+        msg["To"] = to_email
+
+        # Plain text fallback
+        text_body = html_body.replace("<br>", "\n").replace("</p>", "\n")
+        text_body = _TAG_RE.sub("", text_body)
+
+        msg.attach(MIMEText(text_body, "plain"))
+        msg.attach(MIMEText(html_body, "html"))
+        return msg.as_string()
+
+    def send_many(self, emails: List[Tuple[str, str, str]]) -> List[bool]:
+        """Send (to_email, subject, html_body) emails over pooled sessions; one result per email, in order."""
+        if not self.is_configured():
+            logger.warning("SMTP not configured, cannot send email")
+            return [False] * len(emails)
 
-            logger.info(f"Email sent to {to_email}: {subject}")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to send email to {to_email}: {e}")
-            return False
+        from .smtp_delivery import email_queue
+        messages = []
+        for to_email, subject, html_body in emails:
+            try:
+                messages.append((to_email, self.build_message(to_email, subject, html_body)))
+            except Exception as e:
+                logger.error(f"Failed to build email to {to_email}: {e}")
+                messages.append(None)
+        results = iter(email_queue.send_many(self, [m for m in messages if m]))
+        sent = [next(results) if m else False for m in messages]
+        for (to_email, subject, _), ok in zip(emails, sent):
+            if ok:
+                logger.info(f"Email sent to {to_email}: {subject}")
+        return sent
+
+    def send_email(self, to_email: str, subject: str, html_body: str) -> bool:
+        return self.send_many([(to_email, subject, html_body)])[0]
 
     def send_password_reset_email(self, to_email: str, username: str, reset_url: str) -> bool:
         subject = "FitOS - Reset Your Password"
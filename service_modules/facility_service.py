@@ -9,6 +9,7 @@ from models_orm import (
     ActivityTypeORM, FacilityORM, FacilityAvailabilityORM, FacilityBookingORM,
     UserORM, ClientProfileORM, ClientScheduleORM, NotificationORM
 )
+from .availability_engine import day_slots
 
 logger = logging.getLogger("gym_app")
 
@@ -300,67 +301,7 @@ class FacilityService:
             if not facility:
                 raise HTTPException(status_code=404, detail="Facility not found")
 
-            slot_minutes = facility.slot_duration or 60
-
-            target_date = datetime.fromisoformat(date_str)
-            day_of_week = target_date.weekday()
-
-            # Get availability for this day
-            availability = db.query(FacilityAvailabilityORM).filter(
-                FacilityAvailabilityORM.facility_id == facility_id,
-                FacilityAvailabilityORM.day_of_week == day_of_week,
-                FacilityAvailabilityORM.is_available == True
-            ).all()
-
-            if not availability:
-                return []
-
-            # Get existing bookings
-            bookings = db.query(FacilityBookingORM).filter(
-                FacilityBookingORM.facility_id == facility_id,
-                FacilityBookingORM.date == date_str,
-                FacilityBookingORM.status.in_(["confirmed"])
-            ).all()
-
-            available_slots = []
-            now = datetime.now()
-
-            for avail_block in availability:
-                start_h, start_m = map(int, avail_block.start_time.split(':'))
-                end_h, end_m = map(int, avail_block.end_time.split(':'))
-
-                current = datetime.combine(target_date.date(), datetime.min.time().replace(hour=start_h, minute=start_m))
-                block_end = datetime.combine(target_date.date(), datetime.min.time().replace(hour=end_h, minute=end_m))
-
-                while current + timedelta(minutes=slot_minutes) <= block_end:
-                    slot_end = current + timedelta(minutes=slot_minutes)
-
-                    # Skip past slots
-                    if target_date.date() == now.date() and current <= now:
-                        current = slot_end
-                        continue
-
-                    # Check conflicts with bookings
-                    is_booked = False
-                    for b in bookings:
-                        b_start_h, b_start_m = map(int, b.start_time.split(':'))
-                        b_start = datetime.combine(target_date.date(), datetime.min.time().replace(hour=b_start_h, minute=b_start_m))
-                        b_end = b_start + timedelta(minutes=b.duration)
-
-                        if not (slot_end <= b_start or current >= b_end):
-                            is_booked = True
-                            break
-
-                    if not is_booked:
-                        available_slots.append({
-                            "start_time": current.strftime("%H:%M"),
-                            "end_time": slot_end.strftime("%H:%M"),
-                            "available": True
-                        })
-
-                    current = slot_end
-
-            return available_slots
+            return day_slots(db, "facility", facility_id, date_str, facility.slot_duration or 60)
         except HTTPException:
             raise
         except Exception as e:
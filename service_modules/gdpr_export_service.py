@@ -0,0 +1,298 @@
+"""
+GDPR Export Service - Art. 20 data portability exports, built in the background.
+
+An export is a ZIP with one NDJSON file per section (account, diet_logs,
+exercise_logs, messages_sent, ...) and a manifest.json with the row counts. Rows are
+read with yield_per (a server-side cursor on Postgres) and written straight into
+the archive entry, so memory stays flat however long the member's history is.
+
+Jobs run one at a time per worker (gdpr_export_jobs holds their status) and the
+ZIP is written to GDPR_EXPORT_DIR on the instance's disk. The status endpoint hands
+out a short-lived signed download link; the file is deleted GDPR_EXPORT_TTL_HOURS
+after it was built.
+"""
+import json
+import os
+import tempfile
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+
+from jose import JWTError, jwt
+from sqlalchemy import and_, or_, select
+
+from auth import SECRET_KEY, ALGORITHM
+from database import get_db_session
+from models_orm import (
+    UserORM, ClientProfileORM, WeightHistoryORM, ClientDietLogORM,
+    ClientDailyDietSummaryORM, ClientDietSettingsORM, ClientExerciseLogORM,
+    ClientScheduleORM, AppointmentORM, CheckInORM, PhysiquePhotoORM,
+    MedicalCertificateORM, ClientDocumentORM, MessageORM, NotificationORM,
+    ClientSubscriptionORM, PaymentORM, DailyQuestCompletionORM,
+    LessonEnrollmentORM, FriendshipORM, NfcTagORM, ShowerUsageORM,
+    GdprExportJobORM,
+)
+
+import logging
+logger = logging.getLogger("gym_app")
+
+GDPR_EXPORT_DIR = os.environ.get("GDPR_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "gym_gdpr_exports"))
+GDPR_EXPORT_TTL = timedelta(hours=int(os.environ.get("GDPR_EXPORT_TTL_HOURS", "24")))
+DOWNLOAD_LINK_TTL = timedelta(minutes=15)
+STALE_JOB_AGE = timedelta(hours=1)  # A queued/running job this old lost its worker
+EXPORT_BATCH_SIZE = 500
+
+EXCLUDED_COLUMNS = {"hashed_password"}
+
+# (section, model, criterion for the user's rows)
+EXPORT_SECTIONS = [
+    ("account", UserORM, lambda uid: UserORM.id == uid),
+    ("profile", ClientProfileORM, lambda uid: ClientProfileORM.id == uid),
+    ("weight_history", WeightHistoryORM, lambda uid: WeightHistoryORM.client_id == uid),
+    ("diet_settings", ClientDietSettingsORM, lambda uid: ClientDietSettingsORM.id == uid),
+    ("diet_logs", ClientDietLogORM, lambda uid: ClientDietLogORM.client_id == uid),
+    ("diet_summaries", ClientDailyDietSummaryORM, lambda uid: ClientDailyDietSummaryORM.client_id == uid),
+    ("exercise_logs", ClientExerciseLogORM, lambda uid: ClientExerciseLogORM.client_id == uid),
+    ("schedule", ClientScheduleORM, lambda uid: ClientScheduleORM.client_id == uid),
+    ("appointments", AppointmentORM, lambda uid: AppointmentORM.client_id == uid),
+    ("checkins", CheckInORM, lambda uid: CheckInORM.member_id == uid),
+    ("physique_photos", PhysiquePhotoORM, lambda uid: PhysiquePhotoORM.client_id == uid),
+    ("medical_certificates", MedicalCertificateORM, lambda uid: MedicalCertificateORM.client_id == uid),
+    ("documents", ClientDocumentORM, lambda uid: ClientDocumentORM.client_id == uid),
+    ("messages_sent", MessageORM, lambda uid: MessageORM.sender_id == uid),
+    ("notifications", NotificationORM, lambda uid: NotificationORM.user_id == uid),
+    ("subscriptions", ClientSubscriptionORM, lambda uid: ClientSubscriptionORM.client_id == uid),
+    ("payments", PaymentORM, lambda uid: PaymentORM.client_id == uid),
+    ("quest_completions", DailyQuestCompletionORM, lambda uid: DailyQuestCompletionORM.client_id == uid),
+    ("lesson_enrollments", LessonEnrollmentORM, lambda uid: LessonEnrollmentORM.client_id == uid),
+    ("friendships", FriendshipORM, lambda uid: (FriendshipORM.user1_id == uid) | (FriendshipORM.user2_id == uid)),
+    ("nfc_tags", NfcTagORM, lambda uid: NfcTagORM.member_id == uid),
+    ("shower_usage", ShowerUsageORM, lambda uid: ShowerUsageORM.member_id == uid),
+]
+
+
+def write_export(db, user_id: str, fileobj) -> dict:
+    """Stream the user's data into a ZIP written to fileobj; returns {section: rows}."""
+    counts = {}
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for section, model, criterion in EXPORT_SECTIONS:
+            table = model.__table__
+            columns = [c for c in table.columns if c.name not in EXCLUDED_COLUMNS]
+            rows = db.execute(
+                select(*columns).where(criterion(user_id)).execution_options(yield_per=EXPORT_BATCH_SIZE)
+            )
+            count = 0
+            with archive.open(f"{section}.ndjson", "w", force_zip64=True) as entry:
+                for row in rows:
+                    entry.write(json.dumps(dict(row._mapping), default=str).encode() + b"\n")
+                    count += 1
+            counts[section] = count
+        archive.writestr("manifest.json", json.dumps({
+            "export_date": datetime.utcnow().isoformat(),
+            "user_id": user_id,
+            "format": "One JSON object per line in each <section>.ndjson file",
+            "sections": counts,
+        }, indent=2))
+    return counts
+
+
+class GdprExportService:
+
+    def __init__(self):
+        # One export at a time per worker: they are I/O heavy and nobody waits on the request
+        self._job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gdpr-export")
+
+    # --- Jobs ---
+
+    def start_export(self, user_id: str) -> dict:
+        """Queue an export for the user, or return the one already queued or still downloadable."""
+        now = datetime.utcnow()
+        db = get_db_session()
+        try:
+            job = db.query(GdprExportJobORM).filter(
+                GdprExportJobORM.user_id == user_id,
+                or_(
+                    and_(GdprExportJobORM.status == "ready", GdprExportJobORM.expires_at > now.isoformat()),
+                    and_(GdprExportJobORM.status.in_(("queued", "running")),
+                         GdprExportJobORM.created_at >= (now - STALE_JOB_AGE).isoformat())
+                )
+            ).order_by(GdprExportJobORM.created_at.desc()).first()
+            if job:
+                return self._to_dict(job)
+
+            job = GdprExportJobORM(id=str(uuid.uuid4()), user_id=user_id, status="queued",
+                                   created_at=now.isoformat())
+            db.add(job)
+            db.commit()
+            result = self._to_dict(job)
+        finally:
+            db.close()
+        self._job_executor.submit(self._run_job, result["job_id"], user_id)
+        return result
+
+    def _run_job(self, job_id: str, user_id: str):
+        self._update_job(job_id, status="running")
+        os.makedirs(GDPR_EXPORT_DIR, exist_ok=True)
+        path = os.path.join(GDPR_EXPORT_DIR, f"{job_id}.zip")
+        partial = path + ".part"
+        db = get_db_session()
+        try:
+            with open(partial, "wb") as f:
+                counts = write_export(db, user_id, f)
+            os.replace(partial, path)
+            finished = datetime.utcnow()
+            if not self._update_job(job_id, status="ready", file_path=path, size_bytes=os.path.getsize(path),
+                                    row_count=sum(counts.values()), finished_at=finished.isoformat(),
+                                    expires_at=(finished + GDPR_EXPORT_TTL).isoformat()):
+                # The job was deleted while it ran (account deletion): nothing may keep the file
+                os.remove(path)
+                logger.info(f"GDPR export {job_id} was deleted while running; file removed")
+                return
+            logger.info(f"GDPR export {job_id} for user {user_id}: {sum(counts.values())} rows, "
+                        f"{os.path.getsize(path)} bytes")
+        except Exception as e:
+            logger.error(f"GDPR export {job_id} failed: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
+            self._update_job(job_id, status="failed", error=str(e), finished_at=datetime.utcnow().isoformat())
+        finally:
+            db.close()
+
+    def _update_job(self, job_id: str, **values) -> bool:
+        """Update the job row; False if it no longer exists or the update failed."""
+        db = get_db_session()
+        try:
+            updated = db.query(GdprExportJobORM).filter(GdprExportJobORM.id == job_id).update(values)
+            db.commit()
+            return updated == 1
+        except Exception as e:
+            db.rollback()
+            logger.error(f"GDPR export {job_id} status update failed: {e}")
+            return False
+        finally:
+            db.close()
+
+    def get_export(self, job_id: str, user_id: str) -> Optional[dict]:
+        """Job status for its user; includes a fresh signed download_url once ready. None if not found."""
+        db = get_db_session()
+        try:
+            job = db.query(GdprExportJobORM).filter(
+                GdprExportJobORM.id == job_id,
+                GdprExportJobORM.user_id == user_id
+            ).first()
+            return self._to_dict(job) if job else None
+        finally:
+            db.close()
+
+    def _to_dict(self, job) -> dict:
+        ready = job.status == "ready" and (job.expires_at or "") > datetime.utcnow().isoformat()
+        return {
+            "job_id": job.id,
+            "status": job.status if ready or job.status != "ready" else "expired",
+            "size_bytes": job.size_bytes,
+            "row_count": job.row_count,
+            "error": job.error,
+            "created_at": job.created_at,
+            "finished_at": job.finished_at,
+            "expires_at": job.expires_at,
+            "download_url": f"/api/gdpr/export-jobs/{job.id}/download?token={self.sign_download(job.id)}"
+            if ready else None,
+        }
+
+    # --- Signed downloads ---
+
+    def sign_download(self, job_id: str) -> str:
+        return jwt.encode({"gdpr_export": job_id, "exp": datetime.utcnow() + DOWNLOAD_LINK_TTL},
+                          SECRET_KEY, algorithm=ALGORITHM)
+
+    def resolve_download(self, job_id: str, token: str) -> Optional[dict]:
+        """{"path", "user_id"} of a ready export if the token signs this job and has not expired, else None."""
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+        if payload.get("gdpr_export") != job_id:
+            return None
+        db = get_db_session()
+        try:
+            job = db.query(GdprExportJobORM).filter(GdprExportJobORM.id == job_id).first()
+            if (not job or job.status != "ready" or (job.expires_at or "") <= datetime.utcnow().isoformat()
+                    or not job.file_path or not os.path.exists(job.file_path)):
+                return None
+            return {"path": job.file_path, "user_id": job.user_id}
+        finally:
+            db.close()
+
+    # --- Cleanup ---
+
+    def delete_user_exports(self, db, user_id: str):
+        """Remove the user's export files and jobs inside the caller's transaction (account deletion)."""
+        for job in db.query(GdprExportJobORM).filter(GdprExportJobORM.user_id == user_id).all():
+            if job.file_path and os.path.exists(job.file_path):
+                os.remove(job.file_path)
+            db.delete(job)
+
+    def cleanup_expired(self) -> dict:
+        """Delete expired export files and their jobs, fail jobs whose worker died, and sweep orphan files."""
+        now = datetime.utcnow()
+        # Listed before the jobs are read: a file's job row was committed before the file was created
+        files = os.listdir(GDPR_EXPORT_DIR) if os.path.isdir(GDPR_EXPORT_DIR) else []
+        db = get_db_session()
+        try:
+            # Failed jobs are kept for a day so the member sees the error
+            expired = db.query(GdprExportJobORM).filter(or_(
+                and_(GdprExportJobORM.status == "ready", GdprExportJobORM.expires_at < now.isoformat()),
+                and_(GdprExportJobORM.status == "failed",
+                     GdprExportJobORM.created_at < (now - timedelta(days=1)).isoformat())
+            )).all()
+            removed_files = 0
+            for job in expired:
+                if job.file_path and os.path.exists(job.file_path):
+                    os.remove(job.file_path)
+                    removed_files += 1
+                db.delete(job)
+            stale = db.query(GdprExportJobORM).filter(
+                GdprExportJobORM.status.in_(("queued", "running")),
+                GdprExportJobORM.created_at < (now - STALE_JOB_AGE).isoformat()
+            ).update({"status": "failed", "error": "Export interrupted", "finished_at": now.isoformat()},
+                     synchronize_session=False)
+            db.commit()
+            return {"expired_exports": len(expired), "files_removed": removed_files, "stale_jobs": stale,
+                    "orphan_files": self._remove_orphans(db, files)}
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _remove_orphans(self, db, files) -> int:
+        """Remove export files (and partial files) whose job row is gone."""
+        by_job = {}
+        for name in files:
+            if name.endswith(".zip") or name.endswith(".zip.part"):
+                by_job.setdefault(name.split(".zip", 1)[0], []).append(name)
+        if not by_job:
+            return 0
+        known = {job_id for (job_id,) in db.query(GdprExportJobORM.id).filter(GdprExportJobORM.id.in_(list(by_job)))}
+        removed = 0
+        for job_id, names in by_job.items():
+            if job_id in known:
+                continue
+            for name in names:
+                try:
+                    os.remove(os.path.join(GDPR_EXPORT_DIR, name))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            logger.warning(f"GDPR export cleanup removed {removed} files without a job")
+        return removed
+
+
+gdpr_export_service = GdprExportService()
+
+
+def get_gdpr_export_service() -> GdprExportService:
+    return gdpr_export_service
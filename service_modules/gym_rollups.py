@@ -0,0 +1,431 @@
+"""
+Gym Rollups - per-gym daily figures for the owner dashboard and its monthly history.
+
+gym_daily_stats holds one row per gym and day with two kinds of figures:
+- flows, what happened that day: signups, check-ins, subscription payments, paid
+  appointment and nutritionist-appointment revenue (by appointment date);
+- a snapshot of the state at the end of the day: members, active subscriptions and
+  monthly recurring revenue, with the per-plan split in gym_daily_plan_stats. Days
+  without changes have no snapshot; the latest one before them still holds.
+
+The dashboard reads this month's rows and the latest snapshot: O(days), however many
+members the gym has.
+
+Rows are kept current by the mapper events at the bottom of this module. Any ORM
+write to a check-in, payment (Stripe webhooks), appointment (booking completions),
+client profile, subscription or plan marks the gym-days it touches; updates to a
+profile, subscription or plan only do when a column the figures read changed (not on
+every gems, streak or last-seen write). Those are
+recomputed from their source rows in the same transaction; touching the day's row
+first locks it, so concurrent writers recompute one after the other. Bulk UPDATEs,
+raw SQL and database cascades bypass the events: reconcile_rollups, a nightly
+maintenance job, recomputes the last ROLLUP_RECONCILE_DAYS days and takes a snapshot
+of every gym. A gym with no snapshot yet gets ROLLUP_BACKFILL_DAYS of history built on
+its first dashboard load. Both run to the end of the current month, since paid
+appointments booked later in the month count in its figures. After deploying, build
+the history for every existing gym with
+    python -m service_modules.gym_rollups
+"""
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List
+
+from sqlalchemy import delete, event, func, inspect, select, union, update
+from sqlalchemy.orm import Session, object_session
+
+from database import get_db_session
+from .availability_engine import attribute_values
+from models_orm import (
+    GymDailyStatsORM, GymDailyPlanStatsORM, UserORM, ClientProfileORM, CheckInORM, PaymentORM,
+    AppointmentORM, NutritionistAppointmentORM, ClientSubscriptionORM, SubscriptionPlanORM,
+)
+
+import logging
+logger = logging.getLogger("gym_app")
+
+ROLLUP_RECONCILE_DAYS = int(os.getenv("ROLLUP_RECONCILE_DAYS", "35"))
+ROLLUP_BACKFILL_DAYS = int(os.getenv("ROLLUP_BACKFILL_DAYS", "400"))
+
+STAFF_ROLES = ("trainer", "staff", "nutritionist")
+ACTIVE_STATUSES = ("active", "trialing")
+
+_DAILY = GymDailyStatsORM.__table__
+_PLANS = GymDailyPlanStatsORM.__table__
+
+FLOWS = ("signups", "checkins", "subscription_payments", "appointment_revenue", "appointment_count",
+         "nutrition_revenue", "nutrition_count")
+SNAPSHOT = ("active_members", "active_subscriptions", "monthly_recurring_revenue")
+
+
+def _today() -> str:
+    return date.today().isoformat()
+
+
+def _month_end() -> str:
+    """Last day of the current month: paid appointments later this month count in its figures."""
+    return (date.fromisoformat(_next_month(date.today().replace(day=1).isoformat())) - timedelta(days=1)).isoformat()
+
+
+def _next_day(day: str) -> str:
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+def _insert(conn):
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(_DAILY)
+
+
+def _touch(conn, gym_id: str, day: str):
+    """Create or bump the gym's row for the day. Takes its row lock before anything is recomputed."""
+    now = datetime.utcnow().isoformat()
+    conn.execute(_insert(conn).values(gym_id=gym_id, day=day, updated_at=now).on_conflict_do_update(
+        index_elements=[_DAILY.c.gym_id, _DAILY.c.day], set_={"updated_at": now}
+    ))
+
+
+# --- Computing from source rows ---
+
+def compute_flows(conn, gym_id: str, start: str, end: str) -> Dict[str, dict]:
+    """Flows of a gym for each day in [start, end] that had any."""
+    flows = {}
+    end_exclusive = _next_day(end)
+
+    def collect(query, *names):
+        for day, *values in conn.execute(query):
+            row = flows.setdefault(day, dict.fromkeys(FLOWS, 0))
+            for name, value in zip(names, values):
+                row[name] = value or 0
+
+    signup_day = func.substr(UserORM.created_at, 1, 10)
+    collect(select(signup_day, func.count()).select_from(ClientProfileORM)
+            .join(UserORM, UserORM.id == ClientProfileORM.id)
+            .where(ClientProfileORM.gym_id == gym_id, UserORM.created_at >= start, UserORM.created_at < end_exclusive)
+            .group_by(signup_day), "signups")
+
+    checkin_day = func.substr(CheckInORM.checked_in_at, 1, 10)
+    collect(select(checkin_day, func.count())
+            .where(CheckInORM.gym_owner_id == gym_id, CheckInORM.checked_in_at >= start,
+                   CheckInORM.checked_in_at < end_exclusive)
+            .group_by(checkin_day), "checkins")
+
+    paid_at = func.coalesce(PaymentORM.paid_at, PaymentORM.created_at)
+    paid_day = func.substr(paid_at, 1, 10)
+    collect(select(paid_day, func.sum(PaymentORM.amount))
+            .where(PaymentORM.gym_id == gym_id, PaymentORM.status == "succeeded",
+                   paid_at >= start, paid_at < end_exclusive)
+            .group_by(paid_day), "subscription_payments")
+
+    # Appointments count for the gym their professional belongs to
+    staff = select(UserORM.id).where(UserORM.gym_owner_id == gym_id, UserORM.role.in_(STAFF_ROLES))
+    for model, professional, revenue, count in (
+        (AppointmentORM, AppointmentORM.trainer_id, "appointment_revenue", "appointment_count"),
+        (NutritionistAppointmentORM, NutritionistAppointmentORM.nutritionist_id, "nutrition_revenue", "nutrition_count"),
+    ):
+        collect(select(model.date, func.sum(model.price), func.count(model.id))
+                .where(model.date >= start, model.date <= end, model.payment_status == "paid",
+                       professional.in_(staff))
+                .group_by(model.date), revenue, count)
+    return flows
+
+
+def compute_snapshot(conn, gym_id: str) -> dict:
+    """The gym's members, active subscriptions and monthly recurring revenue right now, split by plan."""
+    members = conn.execute(select(func.count()).select_from(ClientProfileORM)
+                           .where(ClientProfileORM.gym_id == gym_id)).scalar()
+    rows = conn.execute(
+        select(SubscriptionPlanORM.id, SubscriptionPlanORM.name, SubscriptionPlanORM.currency,
+               SubscriptionPlanORM.price, SubscriptionPlanORM.billing_interval, func.count(ClientSubscriptionORM.id))
+        .join(SubscriptionPlanORM, ClientSubscriptionORM.plan_id == SubscriptionPlanORM.id)
+        .where(ClientSubscriptionORM.gym_id == gym_id, ClientSubscriptionORM.status.in_(ACTIVE_STATUSES))
+        .group_by(SubscriptionPlanORM.id, SubscriptionPlanORM.name, SubscriptionPlanORM.currency,
+                  SubscriptionPlanORM.price, SubscriptionPlanORM.billing_interval)
+    ).all()
+    plans = []
+    for plan_id, name, currency, price, interval, count in rows:
+        plan_monthly = (price or 0) / 12 if interval == "year" else (price or 0)
+        plans.append({"plan_id": plan_id, "plan_name": name, "currency": currency,
+                      "active_subscriptions": count, "monthly_revenue": plan_monthly * count})
+    return {
+        "active_members": members,
+        "active_subscriptions": sum(p["active_subscriptions"] for p in plans),
+        "monthly_recurring_revenue": sum(p["monthly_revenue"] for p in plans),
+        "plans": plans,
+    }
+
+
+# --- Writing rollup rows ---
+
+def refresh_flows(conn, gym_id: str, start: str, end: str) -> int:
+    """Recompute the gym's flows for [start, end] inside the caller's transaction; returns days that changed."""
+    computed = compute_flows(conn, gym_id, start, end)
+    range_filter = (_DAILY.c.gym_id == gym_id) & (_DAILY.c.day >= start) & (_DAILY.c.day <= end)
+    stored = {row.day: {name: row._mapping[name] for name in FLOWS}
+              for row in conn.execute(select(_DAILY.c.day, *(_DAILY.c[name] for name in FLOWS)).where(range_filter))}
+
+    zero = dict.fromkeys(FLOWS, 0)
+    changed = 0
+    for day in sorted(set(stored) | set(computed)):
+        values = computed.get(day, zero)
+        if day in stored and all(abs((stored[day][n] or 0) - values[n]) < 0.005 for n in FLOWS):
+            continue
+        changed += 1
+        if day not in stored:
+            _touch(conn, gym_id, day)
+        conn.execute(update(_DAILY).where(_DAILY.c.gym_id == gym_id, _DAILY.c.day == day)
+                     .values(**values, updated_at=datetime.utcnow().isoformat()))
+    return changed
+
+
+def refresh_snapshot(conn, gym_id: str, day: str = None) -> dict:
+    """Write the gym's current state as the snapshot of `day` (today) inside the caller's transaction."""
+    day = day or _today()
+    _touch(conn, gym_id, day)
+    snapshot = compute_snapshot(conn, gym_id)
+    conn.execute(update(_DAILY).where(_DAILY.c.gym_id == gym_id, _DAILY.c.day == day)
+                 .values(**{name: snapshot[name] for name in SNAPSHOT}))
+    conn.execute(delete(_PLANS).where(_PLANS.c.gym_id == gym_id, _PLANS.c.day == day))
+    if snapshot["plans"]:
+        conn.execute(_PLANS.insert(), [{"gym_id": gym_id, "day": day, **plan} for plan in snapshot["plans"]])
+    return snapshot
+
+
+def build_gym_rollups(conn, gym_id: str, days: int = ROLLUP_BACKFILL_DAYS):
+    """Flows for the last `days` days up to the end of the month and today's snapshot, for a gym without rollups."""
+    today = _today()
+    refresh_flows(conn, gym_id, (date.today() - timedelta(days=days)).isoformat(), _month_end())
+    refresh_snapshot(conn, gym_id, today)
+    logger.info(f"Built {days} days of rollups for gym {gym_id}")
+
+
+def _gym_ids(conn) -> List[str]:
+    """Every gym with members, staff, subscriptions, check-ins, payments or rollups."""
+    sources = union(
+        select(ClientProfileORM.gym_id.label("gym_id")),
+        select(UserORM.gym_owner_id).where(UserORM.role.in_(STAFF_ROLES)),
+        select(ClientSubscriptionORM.gym_id),
+        select(CheckInORM.gym_owner_id),
+        select(PaymentORM.gym_id),
+        select(_DAILY.c.gym_id),
+    ).subquery()
+    return [gym_id for (gym_id,) in conn.execute(select(sources.c.gym_id).where(sources.c.gym_id != None))]
+
+
+def reconcile_rollups(days: int = ROLLUP_RECONCILE_DAYS) -> dict:
+    """
+    Recompute every gym's flows from `days` days ago to the end of the month and take
+    today's snapshot; returns how many days were off.
+    """
+    db = get_db_session()
+    try:
+        gym_ids = _gym_ids(db.connection())
+        db.rollback()
+    finally:
+        db.close()
+
+    today, month_end = _today(), _month_end()
+    start = (date.today() - timedelta(days=days)).isoformat()
+    fixed, failed = 0, 0
+    for gym_id in gym_ids:
+        db = get_db_session()
+        try:
+            conn = db.connection()
+            fixed += refresh_flows(conn, gym_id, start, month_end)
+            refresh_snapshot(conn, gym_id, today)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            failed += 1
+            logger.error(f"Rollup reconcile failed for gym {gym_id}: {e}")
+        finally:
+            db.close()
+    if fixed:
+        logger.warning(f"Gym rollups reconciled: {fixed} gym-days were off")
+    return {"gyms": len(gym_ids), "days_fixed": fixed, "failed": failed}
+
+
+# --- Reading ---
+
+def _latest_snapshot(conn, gym_id: str, before: str):
+    return conn.execute(
+        select(_DAILY.c.day, *(_DAILY.c[name] for name in SNAPSHOT))
+        .where(_DAILY.c.gym_id == gym_id, _DAILY.c.day <= before, _DAILY.c.active_members != None)
+        .order_by(_DAILY.c.day.desc()).limit(1)
+    ).first()
+
+
+def get_dashboard_figures(db, gym_id: str) -> dict:
+    """The gym's current snapshot (with plans) and this month's flows. Builds missing rollups (commits)."""
+    conn = db.connection()
+    today = _today()
+    snapshot = _latest_snapshot(conn, gym_id, today)
+    if snapshot is None:
+        build_gym_rollups(conn, gym_id)
+        db.commit()
+        conn = db.connection()
+        snapshot = _latest_snapshot(conn, gym_id, today)
+
+    plans = conn.execute(
+        select(_PLANS.c.plan_name, _PLANS.c.currency, _PLANS.c.active_subscriptions, _PLANS.c.monthly_revenue)
+        .where(_PLANS.c.gym_id == gym_id, _PLANS.c.day == snapshot.day)
+    ).all()
+
+    month_start = date.today().replace(day=1).isoformat()
+    totals = conn.execute(
+        select(*(func.coalesce(func.sum(_DAILY.c[name]), 0) for name in FLOWS))
+        .where(_DAILY.c.gym_id == gym_id, _DAILY.c.day >= month_start, _DAILY.c.day < _next_month(month_start))
+    ).one()
+
+    figures = {name: snapshot._mapping[name] for name in SNAPSHOT}
+    figures["plans"] = [dict(p._mapping) for p in plans]
+    figures.update(zip(FLOWS, totals))
+    return figures
+
+
+def _next_month(month_start: str) -> str:
+    first = date.fromisoformat(month_start)
+    return (first.replace(day=28) + timedelta(days=4)).replace(day=1).isoformat()
+
+
+def get_monthly_history(db, gym_id: str, months: int = 12) -> List[dict]:
+    """Per-month flows and end-of-month snapshot for the last `months` months, oldest first."""
+    conn = db.connection()
+    if _latest_snapshot(conn, gym_id, _today()) is None:
+        build_gym_rollups(conn, gym_id)
+        db.commit()
+        conn = db.connection()
+
+    first = date.today().replace(day=1)
+    for _ in range(months - 1):
+        first = (first - timedelta(days=1)).replace(day=1)
+    starts = [first.isoformat()]
+    while len(starts) < months:
+        starts.append(_next_month(starts[-1]))
+
+    month = func.substr(_DAILY.c.day, 1, 7)
+    flows = {row[0]: row[1:] for row in conn.execute(
+        select(month, *(func.sum(_DAILY.c[name]) for name in FLOWS))
+        .where(_DAILY.c.gym_id == gym_id, _DAILY.c.day >= starts[0])
+        .group_by(month)
+    )}
+
+    # End-of-month state: the last snapshot on or before the month's last day
+    snapshots = conn.execute(
+        select(_DAILY.c.day, *(_DAILY.c[name] for name in SNAPSHOT))
+        .where(_DAILY.c.gym_id == gym_id, _DAILY.c.active_members != None)
+        .order_by(_DAILY.c.day)
+    ).all()
+
+    history, i, current = [], 0, None
+    for start in starts:
+        end = _next_month(start)
+        while i < len(snapshots) and snapshots[i].day < end:
+            current = snapshots[i]
+            i += 1
+        values = dict(zip(FLOWS, flows.get(start[:7], (0,) * len(FLOWS))))
+        entry = {"month": start[:7], **{name: values[name] or 0 for name in FLOWS}}
+        entry["revenue"] = round(entry["subscription_payments"] + entry["appointment_revenue"]
+                                 + entry["nutrition_revenue"], 2)
+        entry.update({name: (current._mapping[name] if current is not None else 0) for name in SNAPSHOT})
+        history.append(entry)
+    return history
+
+
+# --- Keeping rows current ---
+
+def _mark(target, flows: Iterable[tuple] = (), snapshots: Iterable[str] = (), signups: Iterable[tuple] = ()):
+    session = object_session(target)
+    if session is None:
+        return
+    session.info.setdefault("rollup_flows", set()).update((g, d[:10]) for g, d in flows if g and d)
+    session.info.setdefault("rollup_snapshots", set()).update(g for g in snapshots if g)
+    session.info.setdefault("rollup_signups", set()).update((g, u) for g, u in signups if g)
+
+
+def _checkin_changed(mapper, connection, target):
+    gyms = attribute_values(mapper, connection, target, "gym_owner_id")
+    days = attribute_values(mapper, connection, target, "checked_in_at")
+    _mark(target, flows=[(g, d) for g in gyms for d in days])
+
+
+def _payment_changed(mapper, connection, target):
+    gyms = attribute_values(mapper, connection, target, "gym_id")
+    days = attribute_values(mapper, connection, target, "paid_at") | attribute_values(mapper, connection, target, "created_at")
+    _mark(target, flows=[(g, d) for g in gyms for d in days])
+
+
+def _appointment_changed(mapper, connection, target):
+    professional = "trainer_id" if mapper.class_ is AppointmentORM else "nutritionist_id"
+    ids = attribute_values(mapper, connection, target, professional)
+    gyms = {g for (g,) in connection.execute(
+        select(UserORM.gym_owner_id).where(UserORM.id.in_(list(ids)))
+    )} if ids else set()
+    days = attribute_values(mapper, connection, target, "date")
+    _mark(target, flows=[(g, d) for g in gyms for d in days])
+
+
+def _profile_changed(mapper, connection, target):
+    # The signup day is users.created_at, looked up after the flush: the user row may not be written yet
+    gyms = attribute_values(mapper, connection, target, "gym_id")
+    _mark(target, snapshots=gyms, signups=[(g, target.id) for g in gyms])
+
+
+def _subscription_changed(mapper, connection, target):
+    _mark(target, snapshots=attribute_values(mapper, connection, target, "gym_id"))
+
+
+def _when_changed(columns: tuple, listener):
+    """before_update listener calling listener only when one of columns was changed."""
+    def changed(mapper, connection, target):
+        state = inspect(target)
+        if any(state.attrs[name].history.has_changes() for name in columns):
+            listener(mapper, connection, target)
+    return changed
+
+
+for _model, _listener, _columns in (
+    (CheckInORM, _checkin_changed, None),
+    (PaymentORM, _payment_changed, None),
+    (AppointmentORM, _appointment_changed, None),
+    (NutritionistAppointmentORM, _appointment_changed, None),
+    (ClientProfileORM, _profile_changed, ("gym_id",)),
+    (ClientSubscriptionORM, _subscription_changed, ("gym_id", "status", "plan_id")),
+    (SubscriptionPlanORM, _subscription_changed, ("gym_id", "name", "currency", "price", "billing_interval")),
+):
+    event.listen(_model, "after_insert", _listener)
+    # before: the row still holds the old values
+    event.listen(_model, "before_update", _when_changed(_columns, _listener) if _columns else _listener)
+    event.listen(_model, "after_delete", _listener)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _refresh_after_flush(session, flush_context):
+    flows = session.info.pop("rollup_flows", None)
+    snapshots = session.info.pop("rollup_snapshots", None)
+    signups = session.info.pop("rollup_signups", None)
+    if not flows and not snapshots and not signups:
+        return
+    conn = session.connection()
+    if signups:
+        joined = dict(conn.execute(select(UserORM.id, UserORM.created_at)
+                                   .where(UserORM.id.in_({user_id for _, user_id in signups}))).all())
+        flows = set(flows or ()) | {(g, joined[u][:10]) for g, u in signups if joined.get(u)}
+    for gym_id, day in sorted(flows or ()):
+        _touch(conn, gym_id, day)
+        refresh_flows(conn, gym_id, day, day)
+    for gym_id in sorted(snapshots or ()):
+        refresh_snapshot(conn, gym_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("rollup_flows", None)
+    session.info.pop("rollup_snapshots", None)
+    session.info.pop("rollup_signups", None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(reconcile_rollups(ROLLUP_BACKFILL_DAYS))
@@ -0,0 +1,407 @@
+"""
+Job Scheduler - runs periodic maintenance jobs once per slot across the whole fleet.
+
+Every worker runs a JobScheduler, but only the worker holding the leader lease runs jobs:
+- Redis lease (SET NX PX + compare-and-renew) when REDIS_URL is set
+- scheduler_locks row (conditional UPDATE on expiry) otherwise
+
+Each run is recorded in job_runs. (job_name, scheduled_for) is unique, so even two
+leaders overlapping during a lease handover can't run the same slot twice.
+
+Schedules are Every(seconds) (slots aligned to the epoch) or Cron("m h dom mon dow"),
+both in UTC. A random per-run jitter delays the start so jobs sharing a slot don't
+hit the database at the same instant.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from database import get_db_session, run_sync
+from models_orm import SchedulerLockORM, JobRunORM
+
+logger = logging.getLogger("gym_app")
+
+REDIS_URL = os.getenv("REDIS_URL")
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() not in ("0", "false", "no")
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", "15"))
+SCHEDULER_LEASE_SECONDS = 60  # Leadership moves to another worker this long after the leader dies
+SCHEDULER_LOCK_NAME = "maintenance"
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_EPOCH = datetime(1970, 1, 1)
+MAX_CATCH_UP_SLOTS = 100000
+
+
+# --- Schedules ---
+
+class Every:
+    """Fixed interval, with slots aligned to the epoch so every worker agrees on them."""
+
+    def __init__(self, seconds: int):
+        if seconds <= 0:
+            raise ValueError("Interval must be positive")
+        self.seconds = int(seconds)
+
+    def next_after(self, dt: datetime) -> datetime:
+        slots = int((dt - _EPOCH).total_seconds() // self.seconds) + 1
+        return _EPOCH + timedelta(seconds=slots * self.seconds)
+
+    def __repr__(self):
+        return f"Every({self.seconds}s)"
+
+
+class Cron:
+    """
+    Five-field cron expression: minute hour day-of-month month day-of-week (0 = Sunday).
+    Fields accept *, numbers, ranges (a-b), steps (*/n, a-b/n) and comma lists.
+    """
+
+    _BOUNDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expr!r}")
+        self.expr = expr
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self._BOUNDS)
+        )
+        # Standard cron: when both day fields are restricted, either one matching is enough
+        self._either_day = fields[2] != "*" and fields[4] != "*"
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> set:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_str = part.split("/", 1)
+                step = int(step_str)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(v) for v in part.split("-", 1))
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Invalid cron field {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt: datetime) -> bool:
+        dom = dt.day in self.days
+        dow = (dt.weekday() + 1) % 7 in self.weekdays
+        return (dom or dow) if self._either_day else (dom and dow)
+
+    def next_after(self, dt: datetime) -> datetime:
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression never fires: {self.expr!r}")
+
+    def __repr__(self):
+        return f"Cron({self.expr!r})"
+
+
+# --- Leader election ---
+
+class DBLeaderLock:
+    """Leader lease stored in the scheduler_locks table."""
+
+    def __init__(self, name: str, owner: str, ttl_seconds: int = SCHEDULER_LEASE_SECONDS,
+                 session_factory: Callable = get_db_session):
+        self.name = name
+        self.owner = owner
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.session_factory = session_factory
+
+    def _acquire(self) -> bool:
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            renewed = db.query(SchedulerLockORM).filter(
+                SchedulerLockORM.name == self.name,
+                or_(SchedulerLockORM.owner == self.owner, SchedulerLockORM.expires_at < now.isoformat())
+            ).update({
+                "owner": self.owner,
+                "expires_at": (now + self.ttl).isoformat(),
+            }, synchronize_session=False)
+            if renewed:
+                db.commit()
+                return True
+
+            if db.query(SchedulerLockORM.name).filter(SchedulerLockORM.name == self.name).first():
+                db.rollback()
+                return False  # Held by a live leader
+
+            db.add(SchedulerLockORM(name=self.name, owner=self.owner, expires_at=(now + self.ttl).isoformat()))
+            try:
+                db.commit()
+                return True
+            except IntegrityError:
+                db.rollback()
+                return False  # Another worker created it first
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _release(self):
+        db = self.session_factory()
+        try:
+            db.query(SchedulerLockORM).filter(
+                SchedulerLockORM.name == self.name,
+                SchedulerLockORM.owner == self.owner
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    async def acquire(self) -> bool:
+        """Take or renew the lease. Returns True while this worker is the leader."""
+        return await run_sync(self._acquire)
+
+    async def release(self):
+        await run_sync(self._release)
+
+
+class RedisLeaderLock:
+    """Leader lease stored in a Redis key with a TTL."""
+
+    _RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, url: str, name: str, owner: str, ttl_seconds: int = SCHEDULER_LEASE_SECONDS):
+        import redis.asyncio as aioredis
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self.key = f"scheduler:leader:{name}"
+        self.owner = owner
+        self.ttl_ms = ttl_seconds * 1000
+
+    async def acquire(self) -> bool:
+        if await self._redis.set(self.key, self.owner, nx=True, px=self.ttl_ms):
+            return True
+        return bool(await self._redis.eval(self._RENEW, 1, self.key, self.owner, self.ttl_ms))
+
+    async def release(self):
+        await self._redis.eval(self._RELEASE, 1, self.key, self.owner)
+
+
+# --- Scheduler ---
+
+class ScheduledJob:
+    """A registered job and its in-memory scheduling state."""
+
+    def __init__(self, name: str, func: Callable, schedule, jitter: float = 0):
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.jitter = jitter
+        self.next_slot: Optional[datetime] = None  # Loaded from job_runs when this worker becomes leader
+        self.task: Optional[asyncio.Task] = None
+
+
+class JobScheduler:
+    """Runs registered jobs on the leader worker and records every run in job_runs."""
+
+    def __init__(self, lock=None, session_factory: Callable = get_db_session,
+                 worker_id: str = WORKER_ID, tick_seconds: float = SCHEDULER_TICK_SECONDS):
+        self.session_factory = session_factory
+        self.worker_id = worker_id
+        self.tick_seconds = tick_seconds
+        self.lock = lock or (
+            RedisLeaderLock(REDIS_URL, SCHEDULER_LOCK_NAME, worker_id) if REDIS_URL
+            else DBLeaderLock(SCHEDULER_LOCK_NAME, worker_id, session_factory=session_factory)
+        )
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    def add_job(self, name: str, func: Callable, schedule, jitter: float = 0):
+        """Register (or replace) a job. func may be sync (runs in the DB thread pool) or async."""
+        self.jobs[name] = ScheduledJob(name, func, schedule, jitter)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Job scheduler started ({len(self.jobs)} jobs, worker {self.worker_id})")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for job in self.jobs.values():
+            if job.task and not job.task.done():
+                job.task.cancel()
+        if self.is_leader:
+            try:
+                await self.lock.release()
+            except Exception as e:
+                logger.warning(f"Failed to release scheduler lease: {e}")
+            self.is_leader = False
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job scheduler error: {e}")
+            await asyncio.sleep(self.tick_seconds)
+
+    async def tick(self, now: Optional[datetime] = None):
+        """Renew leadership and start any due jobs."""
+        try:
+            leader = await self.lock.acquire()
+        except Exception as e:
+            logger.warning(f"Scheduler lease check failed: {e}")
+            leader = False
+
+        if leader != self.is_leader:
+            logger.info(f"Job scheduler: worker {self.worker_id} {'became' if leader else 'is no longer'} leader")
+            self.is_leader = leader
+            for job in self.jobs.values():
+                job.next_slot = None  # Re-read history on the next leadership term
+        if not leader:
+            return
+
+        now = now or datetime.utcnow()
+        for job in self.jobs.values():
+            if job.task and not job.task.done():
+                continue  # Previous run still going
+            if job.next_slot is None:
+                last = await run_sync(self._last_slot, job.name)
+                job.next_slot = job.schedule.next_after(last or now)
+            if job.next_slot > now:
+                continue
+
+            # Missed slots (no leader, downtime) collapse into a single run of the latest one
+            slot = job.next_slot
+            for _ in range(MAX_CATCH_UP_SLOTS):
+                following = job.schedule.next_after(slot)
+                if following > now:
+                    break
+                slot = following
+            job.next_slot = job.schedule.next_after(slot)
+            job.task = asyncio.create_task(self._execute(job, slot))
+
+    async def _execute(self, job: ScheduledJob, slot: datetime) -> Optional[str]:
+        """Run one slot of a job. Returns the run status, or None if the slot was already taken."""
+        if job.jitter:
+            await asyncio.sleep(random.uniform(0, job.jitter))
+
+        run_id = await run_sync(self._claim_slot, job.name, slot)
+        if run_id is None:
+            logger.info(f"Job {job.name} slot {slot.isoformat()} already ran elsewhere, skipping")
+            return None
+
+        started = time.perf_counter()
+        result, error = None, None
+        try:
+            if asyncio.iscoroutinefunction(job.func):
+                result = await job.func()
+            else:
+                result = await run_sync(job.func)
+            status = "success"
+        except Exception as e:
+            status = "failed"
+            error = f"{type(e).__name__}: {e}"
+            logger.error(f"Job {job.name} failed: {error}")
+        duration_ms = int((time.perf_counter() - started) * 1000)
+
+        await run_sync(self._finish_run, run_id, status, result, error, duration_ms)
+        logger.info(f"Job {job.name} {status} in {duration_ms} ms: {result if result is not None else error}")
+        return status
+
+    # --- Run history (run in the DB thread pool) ---
+
+    def _last_slot(self, job_name: str) -> Optional[datetime]:
+        db = self.session_factory()
+        try:
+            row = db.query(JobRunORM.scheduled_for).filter(
+                JobRunORM.job_name == job_name
+            ).order_by(JobRunORM.scheduled_for.desc()).first()
+            return datetime.fromisoformat(row[0]) if row else None
+        finally:
+            db.close()
+
+    def _claim_slot(self, job_name: str, slot: datetime) -> Optional[int]:
+        db = self.session_factory()
+        try:
+            run = JobRunORM(job_name=job_name, scheduled_for=slot.isoformat(), worker_id=self.worker_id,
+                            status="running", started_at=datetime.utcnow().isoformat())
+            db.add(run)
+            db.commit()
+            return run.id
+        except IntegrityError:
+            db.rollback()
+            return None
+        finally:
+            db.close()
+
+    def _finish_run(self, run_id: int, status: str, result, error: Optional[str], duration_ms: int):
+        db = self.session_factory()
+        try:
+            db.query(JobRunORM).filter(JobRunORM.id == run_id).update({
+                "status": status,
+                "finished_at": datetime.utcnow().isoformat(),
+                "duration_ms": duration_ms,
+                "result": json.dumps(result, default=str) if result is not None else None,
+                "error": error,
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def get_run_history(self, job_name: Optional[str] = None, limit: int = 50) -> List[dict]:
+        """Most recent runs, newest first."""
+        db = self.session_factory()
+        try:
+            query = db.query(JobRunORM)
+            if job_name:
+                query = query.filter(JobRunORM.job_name == job_name)
+            return [{
+                "job_name": r.job_name,
+                "scheduled_for": r.scheduled_for,
+                "worker_id": r.worker_id,
+                "status": r.status,
+                "started_at": r.started_at,
+                "finished_at": r.finished_at,
+                "duration_ms": r.duration_ms,
+                "result": json.loads(r.result) if r.result else None,
+                "error": r.error,
+            } for r in query.order_by(JobRunORM.id.desc()).limit(limit).all()]
+        finally:
+            db.close()
+
+
+# Singleton instance (jobs registered and started from main.startup_event)
+job_scheduler = JobScheduler()
@@ -0,0 +1,176 @@
+"""
+Lesson Seats - contention-safe seat accounting for course lessons.
+
+Each lesson has one lesson_seat_counters row. A seat is taken with a single
+conditional UPDATE (seats_taken < capacity), so when a popular class opens and
+many members enroll in the same second, exactly `capacity` of them get a seat
+whatever the interleaving. Waitlist positions come from the same row's
+waitlist_seq, so they are unique and strictly ordered.
+
+The UPDATE also write-locks the counter row (Postgres) or the database (SQLite)
+until the caller commits, which serializes everything else done for that lesson in
+the same transaction: duplicate checks, picking the next person on the waitlist.
+All helpers below work inside the caller's session and leave committing to it,
+except ensure_counter, which creates the row in its own transaction, and
+reconcile_seat_counters, the periodic repair for rows removed without
+release_seat (e.g. by the users foreign key cascade).
+"""
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from database import get_db_session
+from models_orm import LessonSeatCounterORM, LessonEnrollmentORM, LessonWaitlistORM
+
+import logging
+logger = logging.getLogger("gym_app")
+
+
+def _holding_counts(db, lesson_ids) -> Dict[int, int]:
+    """Confirmed enrollments plus held (notified) waitlist offers per lesson, from the rows."""
+    held = {}
+    for model, status in ((LessonEnrollmentORM, "confirmed"), (LessonWaitlistORM, "notified")):
+        for lesson_id, count in db.query(model.lesson_id, func.count(model.id)).filter(
+            model.lesson_id.in_(lesson_ids), model.status == status
+        ).group_by(model.lesson_id):
+            held[lesson_id] = held.get(lesson_id, 0) + count
+    return held
+
+
+def ensure_counter(lesson_id: int):
+    """Create the lesson's counter from its current enrollments if it doesn't exist yet."""
+    db = get_db_session()
+    try:
+        if db.get(LessonSeatCounterORM, lesson_id) is not None:
+            return
+        enrolled = db.query(func.count(LessonEnrollmentORM.id)).filter(
+            LessonEnrollmentORM.lesson_id == lesson_id,
+            LessonEnrollmentORM.status == "confirmed"
+        ).scalar()
+        held = db.query(func.count(LessonWaitlistORM.id)).filter(
+            LessonWaitlistORM.lesson_id == lesson_id,
+            LessonWaitlistORM.status == "notified"
+        ).scalar()
+        last_position = db.query(func.max(LessonWaitlistORM.position)).filter(
+            LessonWaitlistORM.lesson_id == lesson_id
+        ).scalar()
+        db.add(LessonSeatCounterORM(lesson_id=lesson_id, seats_taken=enrolled + held,
+                                    waitlist_seq=last_position or 0))
+        db.commit()
+    except IntegrityError:
+        # Created concurrently by another request
+        db.rollback()
+    finally:
+        db.close()
+
+
+def reserve_seat(db, lesson_id: int, capacity: Optional[int]) -> bool:
+    """Take a seat if one is free (always, for lessons without a capacity)."""
+    query = db.query(LessonSeatCounterORM).filter(LessonSeatCounterORM.lesson_id == lesson_id)
+    if capacity:
+        query = query.filter(LessonSeatCounterORM.seats_taken < capacity)
+    updated = query.update({
+        "seats_taken": LessonSeatCounterORM.seats_taken + 1,
+        "updated_at": datetime.utcnow().isoformat()
+    }, synchronize_session=False)
+    return updated == 1
+
+
+def release_seat(db, lesson_id: int):
+    """Give back a seat (cancelled enrollment, declined or expired waitlist offer)."""
+    db.query(LessonSeatCounterORM).filter(
+        LessonSeatCounterORM.lesson_id == lesson_id,
+        LessonSeatCounterORM.seats_taken > 0
+    ).update({
+        "seats_taken": LessonSeatCounterORM.seats_taken - 1,
+        "updated_at": datetime.utcnow().isoformat()
+    }, synchronize_session=False)
+
+
+def seats_taken(db, lesson_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    Seats taken per lesson, as enroll sees them: the counter where it exists (seats held
+    for waitlist offers included), else counted from the rows.
+    """
+    lesson_ids = list(set(lesson_ids))
+    if not lesson_ids:
+        return {}
+    taken = dict(db.query(LessonSeatCounterORM.lesson_id, LessonSeatCounterORM.seats_taken).filter(
+        LessonSeatCounterORM.lesson_id.in_(lesson_ids)
+    ).all())
+    missing = [i for i in lesson_ids if i not in taken]
+    if missing:
+        held = _holding_counts(db, missing)
+        taken.update({i: held.get(i, 0) for i in missing})
+    return taken
+
+
+def release_client_seats(db, client_id: str):
+    """Give back every seat the client holds (enrollments, waitlist offers); before deleting their rows."""
+    held = [lesson_id for (lesson_id,) in db.query(LessonEnrollmentORM.lesson_id).filter(
+        LessonEnrollmentORM.client_id == client_id, LessonEnrollmentORM.status == "confirmed")]
+    held += [lesson_id for (lesson_id,) in db.query(LessonWaitlistORM.lesson_id).filter(
+        LessonWaitlistORM.client_id == client_id, LessonWaitlistORM.status == "notified")]
+    for lesson_id in held:
+        release_seat(db, lesson_id)
+
+
+def reconcile_seat_counters() -> dict:
+    """Recount the counters that disagree with their lesson's rows; returns how many were off."""
+    db = get_db_session()
+    try:
+        counters = dict(db.query(LessonSeatCounterORM.lesson_id, LessonSeatCounterORM.seats_taken).all())
+        held = _holding_counts(db, list(counters))
+        fixed = 0
+        for lesson_id, taken in counters.items():
+            if held.get(lesson_id, 0) == taken:
+                continue
+            # Lock the counter, then recount: an enroll that took a seat has committed its row by now
+            db.query(LessonSeatCounterORM).filter(
+                LessonSeatCounterORM.lesson_id == lesson_id).with_for_update().one()
+            actual = _holding_counts(db, [lesson_id]).get(lesson_id, 0)
+            fixed += db.query(LessonSeatCounterORM).filter(
+                LessonSeatCounterORM.lesson_id == lesson_id,
+                LessonSeatCounterORM.seats_taken != actual
+            ).update({"seats_taken": actual, "updated_at": datetime.utcnow().isoformat()},
+                     synchronize_session=False)
+            db.commit()
+        if fixed:
+            logger.warning(f"Lesson seat counters reconciled: {fixed}")
+        return {"fixed": fixed}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def next_waitlist_position(db, lesson_id: int) -> int:
+    """Hand out the next waitlist position for the lesson."""
+    db.query(LessonSeatCounterORM).filter(LessonSeatCounterORM.lesson_id == lesson_id).update({
+        "waitlist_seq": LessonSeatCounterORM.waitlist_seq + 1,
+        "updated_at": datetime.utcnow().isoformat()
+    }, synchronize_session=False)
+    # The row stays locked until the caller commits, so nobody else can read this value
+    return db.query(LessonSeatCounterORM.waitlist_seq).filter(
+        LessonSeatCounterORM.lesson_id == lesson_id
+    ).scalar()
+
+
+def waitlist_place(db, lesson_id: int, position: int) -> int:
+    """1-based place in line of the waiting entry at `position`."""
+    return db.query(func.count(LessonWaitlistORM.id)).filter(
+        LessonWaitlistORM.lesson_id == lesson_id,
+        LessonWaitlistORM.status == "waiting",
+        LessonWaitlistORM.position <= position
+    ).scalar()
+
+
+def next_in_line(db, lesson_id: int) -> Optional[LessonWaitlistORM]:
+    """The earliest waiting entry for the lesson (an index seek on idx_lesson_waitlist_queue)."""
+    return db.query(LessonWaitlistORM).filter(
+        LessonWaitlistORM.lesson_id == lesson_id,
+        LessonWaitlistORM.status == "waiting"
+    ).order_by(LessonWaitlistORM.position).first()
@@ -0,0 +1,189 @@
+"""
+Maintenance Jobs - periodic background tasks run by the job scheduler (see job_scheduler.py).
+
+Each job is a plain function that opens its own session and returns a small dict that
+is stored in job_runs.result.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from database import get_db_session
+from models_orm import UserORM, ClientSubscriptionORM
+from .job_scheduler import Every, Cron
+
+import logging
+logger = logging.getLogger("gym_app")
+
+
+def check_automated_triggers() -> dict:
+    """Send automated CRM messages whose triggers fired."""
+    from service_modules.trigger_check_service import get_trigger_check_service
+    results = get_trigger_check_service().check_all_triggers()
+    return {"messages_sent": results["messages_sent"], "messages_skipped": results["messages_skipped"]}
+
+
+def run_retention_cleanup() -> dict:
+    """Delete data past its retention period."""
+    db = get_db_session()
+    try:
+        now = datetime.utcnow()
+
+        # 1. Delete audit logs older than 90 days
+        cutoff_90 = (now - timedelta(days=90)).isoformat()
+        deleted_audit = db.execute(
+            text("DELETE FROM sensitive_data_access_log WHERE accessed_at < :cutoff"),
+            {"cutoff": cutoff_90}
+        ).rowcount
+
+        # 2. Delete expired password reset tokens (expired and older than 7 days)
+        cutoff_7 = (now - timedelta(days=7)).isoformat()
+        deleted_tokens = db.execute(
+            text("DELETE FROM password_reset_tokens WHERE expires_at < :cutoff"),
+            {"cutoff": cutoff_7}
+        ).rowcount
+
+        # 3. Delete old read notifications (older than 60 days, already read)
+        cutoff_60 = (now - timedelta(days=60)).isoformat()
+        deleted_notifs = db.execute(
+            text("DELETE FROM notifications WHERE read = true AND created_at < :cutoff"),
+            {"cutoff": cutoff_60}
+        ).rowcount
+
+        # 4. Delete delivered/abandoned push outbox rows (older than 7 days)
+        deleted_pushes = db.execute(
+            text("DELETE FROM push_outbox WHERE status IN ('sent', 'skipped', 'failed') AND created_at < :cutoff"),
+            {"cutoff": cutoff_7}
+        ).rowcount
+
+        # 5. Delete scheduler run history older than 30 days
+        cutoff_30 = (now - timedelta(days=30)).isoformat()
+        deleted_runs = db.execute(
+            text("DELETE FROM job_runs WHERE started_at < :cutoff"),
+            {"cutoff": cutoff_30}
+        ).rowcount
+
+        # 6. Delete finished client import jobs (their results hold temporary passwords)
+        cutoff_1 = (now - timedelta(days=1)).isoformat()
+        deleted_imports = db.execute(
+            text("DELETE FROM client_import_jobs WHERE created_at < :cutoff"),
+            {"cutoff": cutoff_1}
+        ).rowcount
+
+        db.commit()
+        return {
+            "audit_logs": deleted_audit,
+            "expired_tokens": deleted_tokens,
+            "notifications": deleted_notifs,
+            "push_outbox": deleted_pushes,
+            "job_runs": deleted_runs,
+            "client_import_jobs": deleted_imports,
+        }
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def cleanup_media_uploads() -> dict:
+    """Remove resumable chat uploads that were abandoned, with their spool files."""
+    from service_modules.media_upload_service import get_media_upload_service
+    return get_media_upload_service().cleanup_expired()
+
+
+def cleanup_gdpr_exports() -> dict:
+    """Delete data export archives past their download window."""
+    from service_modules.gdpr_export_service import get_gdpr_export_service
+    return get_gdpr_export_service().cleanup_expired()
+
+
+def cleanup_meal_scan_cache() -> dict:
+    """Drop cached meal scan analyses past their retention."""
+    from service_modules.meal_scan_service import get_meal_scan_service
+    return get_meal_scan_service().cleanup_expired()
+
+
+def expire_waitlist_offers() -> dict:
+    """Expire unanswered lesson waitlist offers so their held seats go to the next in line."""
+    from service_modules.course_service import get_course_service
+    return get_course_service().expire_waitlist_offers()
+
+
+def reconcile_lesson_seats() -> dict:
+    """Recount lesson seat counters left off by enrollments removed without giving their seat back."""
+    from service_modules.lesson_seats import reconcile_seat_counters
+    return reconcile_seat_counters()
+
+
+def reconcile_community_counters() -> dict:
+    """Recount community likes, comments and event participants from their rows."""
+    from service_modules.community_counters import reconcile_counters
+    return reconcile_counters()
+
+
+def reconcile_gym_rollups() -> dict:
+    """Recompute recent owner dashboard rollups from their source rows and snapshot every gym."""
+    from service_modules.gym_rollups import reconcile_rollups
+    return reconcile_rollups()
+
+
+def prune_trainer_schedule_changes() -> dict:
+    """Drop trainer calendar change-log entries older than the delta-sync retention."""
+    from service_modules.schedule_sync import prune_schedule_changes
+    return {"deleted": prune_schedule_changes()}
+
+
+def deactivate_expired_subscriptions() -> dict:
+    """Deactivate clients whose subscription ended 10+ days ago and who have no active one."""
+    db = get_db_session()
+    try:
+        grace_cutoff = (datetime.utcnow() - timedelta(days=10)).isoformat()
+
+        # Find clients whose latest subscription ended 10+ days ago
+        expired_subs = db.query(ClientSubscriptionORM).filter(
+            ClientSubscriptionORM.status.in_(["canceled", "past_due", "incomplete"]),
+            ClientSubscriptionORM.current_period_end < grace_cutoff,
+            ClientSubscriptionORM.current_period_end != None,
+        ).all()
+
+        deactivated = 0
+        for sub in expired_subs:
+            client = db.query(UserORM).filter(
+                UserORM.id == sub.client_id,
+                UserORM.is_active == True,
+                UserORM.role == "client",
+            ).first()
+            if client:
+                # Check they don't have another active subscription
+                active_sub = db.query(ClientSubscriptionORM).filter(
+                    ClientSubscriptionORM.client_id == client.id,
+                    ClientSubscriptionORM.status == "active",
+                ).first()
+                if not active_sub:
+                    client.is_active = False
+                    deactivated += 1
+
+        if deactivated > 0:
+            db.commit()
+        return {"deactivated": deactivated}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def register_maintenance_jobs(scheduler):
+    """Register the periodic maintenance jobs (times are UTC)."""
+    scheduler.add_job("automated_message_triggers", check_automated_triggers, Every(15 * 60), jitter=30)
+    scheduler.add_job("subscription_expiry", deactivate_expired_subscriptions, Cron("5 * * * *"), jitter=60)
+    scheduler.add_job("data_retention", run_retention_cleanup, Cron("15 3 * * *"), jitter=300)
+    scheduler.add_job("waitlist_offer_expiry", expire_waitlist_offers, Every(10 * 60), jitter=30)
+    scheduler.add_job("lesson_seat_reconcile", reconcile_lesson_seats, Cron("20 4 * * *"), jitter=300)
+    scheduler.add_job("media_upload_cleanup", cleanup_media_uploads, Every(60 * 60), jitter=300)
+    scheduler.add_job("gdpr_export_cleanup", cleanup_gdpr_exports, Every(60 * 60), jitter=300)
+    scheduler.add_job("meal_scan_cache_cleanup", cleanup_meal_scan_cache, Cron("45 3 * * *"), jitter=300)
+    scheduler.add_job("community_counter_reconcile", reconcile_community_counters, Every(60 * 60), jitter=300)
+    scheduler.add_job("gym_rollup_reconcile", reconcile_gym_rollups, Cron("30 2 * * *"), jitter=300)
+    scheduler.add_job("schedule_change_prune", prune_trainer_schedule_changes, Cron("50 3 * * *"), jitter=300)
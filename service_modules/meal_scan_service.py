@@ -0,0 +1,312 @@
+"""
+Meal Scan Service - cached, concurrent meal photo analysis.
+
+DietService knows how to ask each AI/nutrition provider about a photo; this service
+decides which ones to ask and when:
+
+1. The photo's perceptual hash (dHash) is looked up in meal_scan_cache for the same
+   user: a near-duplicate photo (re-taken, re-encoded, resized) returns the earlier
+   analysis without calling any provider.
+2. Otherwise the configured providers are raced in their preference order. The first
+   starts immediately; the next one is started after MEAL_SCAN_HEDGE_DELAY seconds
+   without an answer, or as soon as a provider fails. The first high-confidence
+   answer wins and the others are cancelled. A lower-confidence answer is held for
+   MEAL_SCAN_GRACE seconds in case a better one arrives.
+3. Every provider call has its own deadline (MEAL_SCAN_PROVIDER_TIMEOUT) and a
+   circuit breaker: after repeated failures the provider is skipped for a while
+   instead of costing each scan a timeout.
+
+Provider calls are blocking HTTP requests and run on a dedicated thread pool. A call
+that is abandoned (timed out or lost the race) finishes in its thread, but nothing
+waits for it.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import or_
+
+from cpu_tasks import image_dhash, run_cpu
+from database import get_db_session, run_sync
+from models_orm import MealScanCacheORM
+
+import logging
+logger = logging.getLogger("gym_app")
+
+MEAL_SCAN_HEDGE_DELAY = float(os.getenv("MEAL_SCAN_HEDGE_DELAY", "4"))
+MEAL_SCAN_GRACE = float(os.getenv("MEAL_SCAN_GRACE", "2"))
+MEAL_SCAN_PROVIDER_TIMEOUT = float(os.getenv("MEAL_SCAN_PROVIDER_TIMEOUT", "20"))
+MEAL_SCAN_DEADLINE = float(os.getenv("MEAL_SCAN_DEADLINE", "25"))
+MEAL_SCAN_THREADS = int(os.getenv("MEAL_SCAN_THREADS", "8"))
+MEAL_SCAN_MAX_DISTANCE = int(os.getenv("MEAL_SCAN_MAX_DISTANCE", "3"))
+MEAL_SCAN_CACHE_DAYS = int(os.getenv("MEAL_SCAN_CACHE_DAYS", "30"))
+BREAKER_FAILURES = int(os.getenv("MEAL_SCAN_BREAKER_FAILURES", "3"))
+BREAKER_RESET = float(os.getenv("MEAL_SCAN_BREAKER_RESET", "60"))
+
+CONFIDENCE_RANK = {"high": 3, "medium": 2, "low": 1}
+
+
+def confidence_rank(data: dict) -> int:
+    """3 for "high" (also "high if read from label" etc.), 2 medium, 1 low, 0 unknown."""
+    words = str(data.get("confidence") or "").lower().split()
+    return CONFIDENCE_RANK.get(words[0], 0) if words else 0
+
+
+def hash_bands(phash: int) -> tuple:
+    """The four 16-bit bands of a 64-bit hash, most significant first."""
+    return tuple((phash >> shift) & 0xFFFF for shift in (48, 32, 16, 0))
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker for one provider.
+
+    closed: calls allowed. open (after `failures` failures in a row): calls refused
+    for `reset_after` seconds. half-open: then a single trial call is allowed, whose
+    outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_after: float = BREAKER_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_after:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open" or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._trial or self.consecutive_failures >= self.failures:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self):
+        """The call was abandoned without an outcome (lost the race)."""
+        with self._lock:
+            self._trial = False
+
+
+class MealScanService:
+    """Service for meal photo scans: perceptual-hash cache, then racing the providers."""
+
+    def __init__(self, providers: Optional[Callable[[], list]] = None):
+        # providers() -> [(method, scan(file_bytes) -> data)], best first
+        self._providers = providers or self._configured_providers
+        self._executor = ThreadPoolExecutor(max_workers=MEAL_SCAN_THREADS, thread_name_prefix="meal-scan")
+        self.breakers = {}
+        self._breakers_lock = threading.Lock()
+
+    @staticmethod
+    def _configured_providers() -> list:
+        from .diet_service import get_diet_service
+        return get_diet_service().scan_providers()
+
+    def breaker(self, method: str) -> CircuitBreaker:
+        with self._breakers_lock:
+            if method not in self.breakers:
+                self.breakers[method] = CircuitBreaker()
+            return self.breakers[method]
+
+    async def scan(self, file_bytes: bytes, user_id: Optional[str] = None) -> dict:
+        """Scan endpoint response: {"status", "data", "method"}, plus "cached" when served from the cache."""
+        phash = None
+        if user_id:
+            try:
+                phash = await run_cpu(image_dhash, file_bytes)
+            except Exception as e:
+                logger.warning(f"Meal scan: cannot hash image: {e}")
+        if phash is not None:
+            cached = await run_sync(self._cache_lookup, user_id, phash)
+            if cached is not None:
+                method, data = cached
+                return {"status": "success", "data": data, "method": method, "cached": True}
+
+        winner = await self._race(file_bytes)
+        if winner is None:
+            from .diet_service import get_diet_service
+            return get_diet_service().mock_scan()
+
+        method, data = winner
+        if phash is not None:
+            try:
+                await run_sync(self._cache_store, user_id, phash, method, data)
+            except Exception as e:
+                logger.warning(f"Meal scan: caching result failed: {e}")
+        return {"status": "success", "data": data, "method": method}
+
+    # --- Provider race ---
+
+    async def _race(self, file_bytes: bytes) -> Optional[tuple]:
+        """(method, data) of the best answer, or None if no provider answered."""
+        loop = asyncio.get_running_loop()
+        queue = list(self._providers())
+        pending = {}
+        best = None
+        deadline = loop.time() + MEAL_SCAN_DEADLINE
+        next_launch = loop.time()
+        grace_until = None
+
+        def launch() -> bool:
+            while queue:
+                method, scan = queue.pop(0)
+                breaker = self.breaker(method)
+                if breaker.allow():
+                    task = loop.create_task(self._call(method, scan, file_bytes, breaker))
+                    pending[task] = method
+                    return True
+                logger.info(f"Meal scan: skipping {method} (circuit {breaker.state})")
+            return False
+
+        try:
+            while True:
+                now = loop.time()
+                if queue and (now >= next_launch or not pending):
+                    if launch():
+                        next_launch = now + MEAL_SCAN_HEDGE_DELAY
+                if not pending:
+                    break
+                if now >= deadline or (grace_until is not None and now >= grace_until):
+                    break
+
+                wake = min(deadline, grace_until or deadline, next_launch if queue else deadline)
+                done, _ = await asyncio.wait(pending, timeout=max(0.0, wake - now),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    method = pending.pop(task)
+                    data = task.result()
+                    if data is None:
+                        # Failed: don't wait out the hedge delay for the next provider
+                        next_launch = loop.time()
+                        continue
+                    if confidence_rank(data) >= CONFIDENCE_RANK["high"]:
+                        return method, data
+                    if best is None or confidence_rank(data) > confidence_rank(best[1]):
+                        best = (method, data)
+                    if grace_until is None:
+                        grace_until = loop.time() + MEAL_SCAN_GRACE
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if best is None and pending:
+            logger.warning(f"Meal scan: no provider answered within {MEAL_SCAN_DEADLINE}s")
+        return best
+
+    async def _call(self, method: str, scan: Callable, file_bytes: bytes, breaker: CircuitBreaker) -> Optional[dict]:
+        """One provider's data, or None if it failed or missed its deadline."""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            data = await asyncio.wait_for(loop.run_in_executor(self._executor, scan, file_bytes),
+                                          MEAL_SCAN_PROVIDER_TIMEOUT)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            logger.error(f"{method} scan timed out after {MEAL_SCAN_PROVIDER_TIMEOUT}s")
+            return None
+        except Exception as e:
+            breaker.record_failure()
+            logger.error(f"{method} scan failed: {e}")
+            return None
+        breaker.record_success()
+        logger.info(f"{method} scan answered in {time.monotonic() - started:.1f}s")
+        return data
+
+    # --- Cache (blocking; called through run_sync) ---
+
+    def _cache_lookup(self, user_id: str, phash: int) -> Optional[tuple]:
+        """(method, data) of the closest cached scan within MEAL_SCAN_MAX_DISTANCE bits."""
+        bands = hash_bands(phash)
+        cutoff = (datetime.utcnow() - timedelta(days=MEAL_SCAN_CACHE_DAYS)).isoformat()
+        db = get_db_session()
+        try:
+            candidates = db.query(MealScanCacheORM).filter(
+                MealScanCacheORM.user_id == user_id,
+                MealScanCacheORM.created_at >= cutoff,
+                or_(MealScanCacheORM.band0 == bands[0], MealScanCacheORM.band1 == bands[1],
+                    MealScanCacheORM.band2 == bands[2], MealScanCacheORM.band3 == bands[3])
+            ).all()
+            best, best_distance = None, MEAL_SCAN_MAX_DISTANCE + 1
+            for row in candidates:
+                distance = bin(int(row.phash, 16) ^ phash).count("1")
+                if distance < best_distance:
+                    best, best_distance = row, distance
+            if best is None:
+                return None
+            best.hits = (best.hits or 0) + 1
+            db.commit()
+            return best.method, json.loads(best.result)
+        finally:
+            db.close()
+
+    def _cache_store(self, user_id: str, phash: int, method: str, data: dict):
+        bands = hash_bands(phash)
+        db = get_db_session()
+        try:
+            db.add(MealScanCacheORM(
+                user_id=user_id, phash=f"{phash:016x}", band0=bands[0], band1=bands[1],
+                band2=bands[2], band3=bands[3], method=method, result=json.dumps(data),
+            ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def cleanup_expired(self) -> dict:
+        """Delete cached scans older than MEAL_SCAN_CACHE_DAYS."""
+        cutoff = (datetime.utcnow() - timedelta(days=MEAL_SCAN_CACHE_DAYS)).isoformat()
+        db = get_db_session()
+        try:
+            deleted = db.query(MealScanCacheORM).filter(
+                MealScanCacheORM.created_at < cutoff
+            ).delete(synchronize_session=False)
+            db.commit()
+            return {"expired_scans": deleted}
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+# Singleton instance
+meal_scan_service = MealScanService()
+
+
+def get_meal_scan_service() -> MealScanService:
+    """Dependency injection helper."""
+    return meal_scan_service
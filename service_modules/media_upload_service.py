@@ -0,0 +1,364 @@
+"""
+Media Upload Service - chunked, resumable uploads for chat media.
+
+Videos and voice notes are sent in pieces instead of one multipart body:
+
+    POST /api/messages/uploads                -> upload_id (declares size and type)
+    PUT  /api/messages/uploads/{id}?offset=N  -> raw bytes, written at offset N
+    GET  /api/messages/uploads/{id}           -> bytes received so far (resume point)
+    POST /api/messages/uploads/{id}/complete  -> stores the file, then the route sends the message
+
+Chunk bodies are streamed from the request into a spool file on local disk, and the
+finished file is streamed to the storage backend, so memory per upload stays
+constant whatever the file size. Progress lives in media_uploads, so chunks can be
+handled by any worker of the instance (spool files are in MEDIA_UPLOAD_DIR on its disk).
+A chunk claims its offset (status "receiving") before it writes anything, so two
+requests for the same offset never both write; a claim left by a dead worker lapses
+after CHUNK_CLAIM_TIMEOUT.
+"""
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+
+from database import get_db_session, run_sync
+from models_orm import MediaUploadORM
+from .upload_helper import (
+    save_image, store_stream,
+    ALLOWED_AUDIO_EXTENSIONS, MAX_AUDIO_SIZE, MAX_IMAGE_SIZE, MAX_VIDEO_SIZE,
+)
+
+import logging
+logger = logging.getLogger("gym_app")
+
+MEDIA_UPLOAD_DIR = os.environ.get("MEDIA_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "gym_media_uploads"))
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+WRITE_BUFFER = 1024 * 1024  # Bytes collected from the request body per spool file write
+UPLOAD_EXPIRY = timedelta(hours=24)
+CHUNK_CLAIM_TIMEOUT = timedelta(minutes=15)
+
+# media_type -> (storage folder, max size)
+MEDIA_FOLDERS = {
+    "image": ("chat_images", MAX_IMAGE_SIZE),
+    "video": ("chat_videos", MAX_VIDEO_SIZE),
+    "voice": ("chat_audio", MAX_AUDIO_SIZE),
+}
+
+
+def classify_media(mime_type: Optional[str], filename: Optional[str]) -> tuple:
+    """Return (media_type, extension) for a chat attachment, or raise 400."""
+    mime = (mime_type or "").lower()
+    ext = filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else ""
+    if mime.startswith("image/"):
+        return "image", ext
+    if mime.startswith("video/"):
+        return "video", ext
+    if mime.startswith("audio/") or ext in ALLOWED_AUDIO_EXTENSIONS:
+        return "voice", ext
+    raise HTTPException(status_code=400, detail="Unsupported media type")
+
+
+def _open_spool(path: str, offset: int):
+    f = open(path, "r+b")
+    f.seek(offset)
+    return f
+
+
+def _too_large(max_size: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File too large (max {max_size // 1024 // 1024}MB)")
+
+
+class MediaUploadService:
+    """Service for resumable chat media uploads."""
+
+    def create_upload(self, user_id: str, receiver_id: str, filename: Optional[str], mime_type: Optional[str],
+                      size: int, duration: Optional[float] = None) -> dict:
+        """Validate an upload before any byte is sent and reserve its spool file."""
+        from .message_service import get_message_service
+
+        media_type, _ = classify_media(mime_type, filename)
+        _, max_size = MEDIA_FOLDERS[media_type]
+        if size <= 0:
+            raise HTTPException(status_code=400, detail="size must be positive")
+        if size > max_size:
+            raise _too_large(max_size)
+        if not get_message_service().can_message(user_id, receiver_id):
+            raise HTTPException(status_code=403, detail="You cannot message this user")
+
+        upload_id = str(uuid.uuid4())
+        os.makedirs(MEDIA_UPLOAD_DIR, exist_ok=True)
+        temp_path = os.path.join(MEDIA_UPLOAD_DIR, upload_id)
+        open(temp_path, "wb").close()
+
+        db = get_db_session()
+        try:
+            upload = MediaUploadORM(
+                id=upload_id, user_id=user_id, receiver_id=receiver_id, media_type=media_type,
+                mime_type=(mime_type or "").lower(), filename=filename, size=size, received=0,
+                duration=duration, temp_path=temp_path, status="uploading",
+            )
+            db.add(upload)
+            db.commit()
+            return self._public(self._to_dict(upload))
+        except Exception:
+            db.rollback()
+            os.remove(temp_path)
+            raise
+        finally:
+            db.close()
+
+    def get_upload(self, upload_id: str, user_id: str) -> dict:
+        """Upload status; `offset` is where the client resumes."""
+        return self._public(self._get(upload_id, user_id))
+
+    async def receive_chunk(self, upload_id: str, user_id: str, offset: int,
+                            chunks: AsyncIterator[bytes], length: Optional[int] = None) -> dict:
+        """
+        Write a chunk body at `offset`. The offset must equal the bytes received so far
+        (409 otherwise, with the expected value in the Upload-Offset header).
+        """
+        upload = await run_sync(self._get, upload_id, user_id)
+        if upload["status"] not in ("uploading", "receiving"):
+            raise HTTPException(status_code=409, detail=f"Upload is {upload['status']}")
+        limit = min(upload["size"] - offset, MAX_CHUNK_SIZE)
+        if length is not None and offset == upload["offset"] and length > limit:
+            raise self._chunk_too_large(upload["size"], offset)
+        # Claim the offset before writing: a concurrent request for it gets a 409 instead
+        if not await run_sync(self._claim_offset, upload_id, offset):
+            current = await run_sync(self._get, upload_id, user_id)
+            raise HTTPException(status_code=409, detail=f"Expected offset {current['offset']}",
+                                headers={"Upload-Offset": str(current["offset"])})
+
+        # Body pieces arrive as they are read from the socket; file I/O runs in the thread
+        # pool, in writes of up to WRITE_BUFFER bytes
+        written, buffer, buffered = 0, [], 0
+        try:
+            f = await run_sync(_open_spool, upload["temp_path"], offset)
+            try:
+                async for chunk in chunks:
+                    written += len(chunk)
+                    if written > limit:
+                        raise self._chunk_too_large(upload["size"], offset)
+                    buffer.append(chunk)
+                    buffered += len(chunk)
+                    if buffered >= WRITE_BUFFER:
+                        await run_sync(f.write, b"".join(buffer))
+                        buffer, buffered = [], 0
+                if buffer:
+                    await run_sync(f.write, b"".join(buffer))
+            except BaseException:
+                # Drop the partial write; the client resumes from the stored offset
+                await run_sync(f.truncate, offset)
+                raise
+            finally:
+                await run_sync(f.close)
+        except BaseException:
+            await run_sync(self._release_offset, upload_id, offset)
+            raise
+
+        if not await run_sync(self._advance, upload_id, offset, written):
+            # The claim lapsed and another request took the offset over
+            current = await run_sync(self._get, upload_id, user_id)
+            raise HTTPException(status_code=409, detail=f"Expected offset {current['offset']}",
+                                headers={"Upload-Offset": str(current["offset"])})
+        upload.update(offset=offset + written, status="uploading")
+        return self._public(upload)
+
+    async def finalize(self, upload_id: str, user_id: str) -> dict:
+        """Store a fully received upload and return what MessageService.send_message needs."""
+        upload = await run_sync(self._claim, upload_id, user_id)
+        folder, _ = MEDIA_FOLDERS[upload["media_type"]]
+        try:
+            if upload["media_type"] == "image":
+                # Images are at most MAX_IMAGE_SIZE and get resized anyway
+                content = await run_sync(_read_file, upload["temp_path"])
+                file_url, variants = await save_image(content, folder, str(uuid.uuid4()), max_size=(1200, 1200),
+                                                      owner_id=user_id)
+                file_size = variants["full"]["size"] if variants else len(content)
+            else:
+                _, ext = classify_media(upload["mime_type"], upload["filename"])
+                filename = f"{uuid.uuid4()}.{ext or 'bin'}"
+                file_url = await run_sync(_store_spooled, upload["temp_path"], folder, filename,
+                                          upload["size"], upload["media_type"])
+                file_size = upload["size"]
+        except Exception:
+            # Leave it resumable: the client can call complete again
+            await run_sync(self._set_status, upload_id, "uploading")
+            raise
+
+        await run_sync(self._complete, upload_id, upload["temp_path"])
+        return {
+            "receiver_id": upload["receiver_id"],
+            "media_type": upload["media_type"],
+            "file_url": file_url,
+            "file_size": file_size,
+            "mime_type": upload["mime_type"],
+            "duration": upload["duration"],
+        }
+
+    def cleanup_expired(self) -> dict:
+        """Delete uploads idle for UPLOAD_EXPIRY, with their spool files."""
+        cutoff = (datetime.utcnow() - UPLOAD_EXPIRY).isoformat()
+        db = get_db_session()
+        try:
+            expired = db.query(MediaUploadORM).filter(MediaUploadORM.updated_at < cutoff).all()
+            removed_files = 0
+            for upload in expired:
+                if os.path.exists(upload.temp_path):
+                    os.remove(upload.temp_path)
+                    removed_files += 1
+                db.delete(upload)
+            db.commit()
+            return {"expired_uploads": len(expired), "spool_files_removed": removed_files}
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # --- Helpers (blocking; called through run_sync) ---
+
+    def _get(self, upload_id: str, user_id: str) -> dict:
+        db = get_db_session()
+        try:
+            return self._to_dict(self._load(db, upload_id, user_id))
+        finally:
+            db.close()
+
+    def _load(self, db, upload_id: str, user_id: str) -> MediaUploadORM:
+        upload = db.query(MediaUploadORM).filter(
+            MediaUploadORM.id == upload_id,
+            MediaUploadORM.user_id == user_id
+        ).first()
+        if not upload:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return upload
+
+    def _claim_offset(self, upload_id: str, offset: int) -> bool:
+        """Take the right to write at `offset` (atomic conditional update)."""
+        now = datetime.utcnow()
+        db = get_db_session()
+        try:
+            claimed = db.query(MediaUploadORM).filter(
+                MediaUploadORM.id == upload_id,
+                MediaUploadORM.received == offset,
+                (MediaUploadORM.status == "uploading")
+                | ((MediaUploadORM.status == "receiving")
+                   & (MediaUploadORM.updated_at < (now - CHUNK_CLAIM_TIMEOUT).isoformat()))
+            ).update({"status": "receiving", "updated_at": now.isoformat()}, synchronize_session=False)
+            db.commit()
+            return claimed == 1
+        finally:
+            db.close()
+
+    def _release_offset(self, upload_id: str, offset: int):
+        self._advance(upload_id, offset, 0)
+
+    def _advance(self, upload_id: str, offset: int, written: int) -> bool:
+        """Record `written` bytes at the claimed `offset` and end the claim."""
+        db = get_db_session()
+        try:
+            updated = db.query(MediaUploadORM).filter(
+                MediaUploadORM.id == upload_id,
+                MediaUploadORM.received == offset,
+                MediaUploadORM.status == "receiving"
+            ).update({"received": offset + written, "status": "uploading",
+                      "updated_at": datetime.utcnow().isoformat()}, synchronize_session=False)
+            db.commit()
+            return updated == 1
+        finally:
+            db.close()
+
+    def _claim(self, upload_id: str, user_id: str) -> dict:
+        db = get_db_session()
+        try:
+            upload = self._load(db, upload_id, user_id)
+            if upload.received != upload.size:
+                raise HTTPException(status_code=409, detail=f"Upload incomplete ({upload.received}/{upload.size} bytes)",
+                                    headers={"Upload-Offset": str(upload.received)})
+            claimed = db.query(MediaUploadORM).filter(
+                MediaUploadORM.id == upload_id,
+                MediaUploadORM.status == "uploading"
+            ).update({"status": "finalizing", "updated_at": datetime.utcnow().isoformat()},
+                     synchronize_session=False)
+            db.commit()
+            if claimed != 1:
+                raise HTTPException(status_code=409, detail="Upload already finalized")
+            return self._to_dict(upload)
+        finally:
+            db.close()
+
+    def _set_status(self, upload_id: str, status: str):
+        db = get_db_session()
+        try:
+            db.query(MediaUploadORM).filter(MediaUploadORM.id == upload_id).update(
+                {"status": status, "updated_at": datetime.utcnow().isoformat()}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _complete(self, upload_id: str, temp_path: str):
+        self._set_status(upload_id, "completed")
+        try:
+            os.remove(temp_path)
+        except OSError as e:
+            logger.warning(f"Media upload {upload_id}: cannot remove spool file: {e}")
+
+    @staticmethod
+    def _chunk_too_large(size: int, offset: int) -> HTTPException:
+        return HTTPException(status_code=413,
+                             detail=f"Chunk too large (max {min(size - offset, MAX_CHUNK_SIZE)} bytes at offset {offset})",
+                             headers={"Upload-Offset": str(offset)})
+
+    @staticmethod
+    def _to_dict(upload: MediaUploadORM) -> dict:
+        return {
+            "upload_id": upload.id,
+            "receiver_id": upload.receiver_id,
+            "media_type": upload.media_type,
+            "mime_type": upload.mime_type,
+            "filename": upload.filename,
+            "size": upload.size,
+            "offset": upload.received or 0,
+            "duration": upload.duration,
+            "status": upload.status,
+            "temp_path": upload.temp_path,
+            "updated_at": upload.updated_at,
+        }
+
+    @staticmethod
+    def _public(upload: dict) -> dict:
+        """Status returned to the client (no server paths)."""
+        updated_at = datetime.fromisoformat(upload["updated_at"]) if upload.get("updated_at") else datetime.utcnow()
+        return {
+            "upload_id": upload["upload_id"],
+            "media_type": upload["media_type"],
+            "size": upload["size"],
+            "offset": upload["offset"],
+            "status": upload["status"],
+            "complete": upload["offset"] == upload["size"],
+            "max_chunk_size": MAX_CHUNK_SIZE,
+            "expires_at": (updated_at + UPLOAD_EXPIRY).isoformat(),
+        }
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _store_spooled(path: str, folder: str, filename: str, size: int, upload_type: str) -> str:
+    with open(path, "rb") as f:
+        return store_stream(f, folder, filename, size, upload_type=upload_type)
+
+
+# Singleton instance
+media_upload_service = MediaUploadService()
+
+
+def get_media_upload_service() -> MediaUploadService:
+    """Dependency injection helper."""
+    return media_upload_service
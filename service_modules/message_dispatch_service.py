@@ -7,10 +7,28 @@ from .base import (
     get_db_session, UserORM
 )
 from .notification_service import get_notification_service
-from typing import Optional
+from string import Template
+from typing import List, Optional, Tuple
 
 logger = logging.getLogger("gym_app")
 
+# Branded body of automated emails, compiled once
+BRANDED_EMAIL = Template("""
+            <div style="max-width:480px;margin:0 auto;font-family:-apple-system,BlinkMacSystemFont,'Segoe UI',Roboto,sans-serif;background:#1a1a2e;border-radius:16px;overflow:hidden;border:1px solid rgba(255,255,255,0.1);">
+                <div style="background:linear-gradient(135deg,#f97316,#ea580c);padding:24px;text-align:center;">
+                    <h1 style="color:white;margin:0;font-size:24px;">${gym_name}</h1>
+                </div>
+                <div style="padding:32px 24px;">
+                    <p style="color:#e5e7eb;font-size:16px;margin:0 0 16px;">${message}</p>
+                </div>
+                <div style="padding:16px 24px;border-top:1px solid rgba(255,255,255,0.05);">
+                    <p style="color:#6b7280;font-size:12px;margin:0;text-align:center;">
+                        Questa email è stata inviata automaticamente da ${gym_name}.
+                    </p>
+                </div>
+            </div>
+            """)
+
 
 class MessageDispatchService:
     """Service for dispatching automated messages through different delivery channels."""
@@ -81,65 +99,57 @@ class MessageDispatchService:
         gym_id: str = None
     ) -> bool:
         """Send an email notification using the gym's SMTP config or global fallback."""
+        return self.send_emails([(client_id, subject, message)], gym_id)[0]
+
+    def send_emails(self, emails: List[Tuple[str, str, str]], gym_id: str = None) -> List[bool]:
+        """
+        Send (client_id, subject, message) emails for one gym in a batch: recipients and
+        the gym owner are loaded once, and the messages share pooled SMTP sessions.
+        Returns one result per email, in order.
+        """
         from .email_service import get_email_service, get_email_service_for_gym
 
         db = get_db_session()
         try:
-            user = db.query(UserORM).filter(UserORM.id == client_id).first()
-            if not user or not user.email:
-                logger.warning(f"No email found for client {client_id}")
-                return False
+            client_ids = {client_id for client_id, _, _ in emails}
+            addresses = dict(db.query(UserORM.id, UserORM.email).filter(UserORM.id.in_(client_ids)).all())
 
             # Try gym-specific SMTP config first
             email_service = None
-            if gym_id:
-                owner = db.query(UserORM).filter(UserORM.id == gym_id).first()
-                if owner:
-                    email_service = get_email_service_for_gym(owner)
+            owner = db.query(UserORM).filter(UserORM.id == gym_id).first() if gym_id else None
+            if owner:
+                email_service = get_email_service_for_gym(owner)
 
             if not email_service or not email_service.is_configured():
                 email_service = get_email_service()
 
-            if not email_service.is_configured():
-                logger.warning(f"SMTP not configured. Cannot send email to {user.email}")
-                return False
-
-            # Get gym name for branding
-            gym_name = "FitOS"
-            if gym_id:
-                owner = db.query(UserORM).filter(UserORM.id == gym_id).first()
-                if owner and owner.gym_name:
-                    gym_name = owner.gym_name
-
-            html_body = f"""
-            <div style="max-width:480px;margin:0 auto;font-family:-apple-system,BlinkMacSystemFont,'Segoe UI',Roboto,sans-serif;background:#1a1a2e;border-radius:16px;overflow:hidden;border:1px solid rgba(255,255,255,0.1);">
-                <div style="background:linear-gradient(135deg,#f97316,#ea580c);padding:24px;text-align:center;">
-                    <h1 style="color:white;margin:0;font-size:24px;">{gym_name}</h1>
-                </div>
-                <div style="padding:32px 24px;">
-                    <p style="color:#e5e7eb;font-size:16px;margin:0 0 16px;">{message}</p>
-                </div>
-                <div style="padding:16px 24px;border-top:1px solid rgba(255,255,255,0.05);">
-                    <p style="color:#6b7280;font-size:12px;margin:0;text-align:center;">
-                        Questa email è stata inviata automaticamente da {gym_name}.
-                    </p>
-                </div>
-            </div>
-            """
-
-            success = email_service.send_email(user.email, subject, html_body)
-            if success:
-                logger.info(f"Email sent to {user.email}: {subject}")
-            else:
-                logger.warning(f"Failed to send email to {user.email}: {subject}")
-            return success
-
+            # Gym name for branding
+            gym_name = owner.gym_name if owner and owner.gym_name else "FitOS"
         except Exception as e:
             logger.error(f"Failed to send email: {e}")
-            return False
+            return [False] * len(emails)
         finally:
             db.close()
 
+        if not email_service.is_configured():
+            logger.warning(f"SMTP not configured. Cannot send {len(emails)} email(s) for gym {gym_id}")
+            return [False] * len(emails)
+
+        outgoing = []
+        for client_id, subject, message in emails:
+            if not addresses.get(client_id):
+                logger.warning(f"No email found for client {client_id}")
+                continue
+            html_body = BRANDED_EMAIL.substitute(gym_name=gym_name, message=message)
+            outgoing.append((addresses[client_id], subject, html_body))
+
+        results = iter(email_service.send_many(outgoing))
+        sent = [next(results) if addresses.get(client_id) else False for client_id, _, _ in emails]
+        for (client_id, subject, _), ok in zip(emails, sent):
+            if not ok and addresses.get(client_id):
+                logger.warning(f"Failed to send email to {addresses[client_id]}: {subject}")
+        return sent
+
     def send_whatsapp(
         self,
         client_id: str,
@@ -212,15 +222,17 @@ class MessageDispatchService:
         message: str,
         gym_id: str = None
     ) -> bool:
-        """Send a push notification via FCM v1 API (centralized, no per-gym config)."""
-        from .notification_service import send_fcm_push
+        """Queue a push notification for the FCM v1 dispatcher (centralized, no per-gym config)."""
+        from .notification_service import enqueue_push
 
         db = get_db_session()
         try:
-            send_fcm_push(db, client_id, title, message, {"type": "automated_message"})
+            enqueue_push(db, client_id, title, message, {"type": "automated_message"})
+            db.commit()
             return True
         except Exception as e:
-            logger.error(f"Failed to send push notification: {e}")
+            db.rollback()
+            logger.error(f"Failed to queue push notification: {e}")
             return False
         finally:
             db.close()
@@ -1,16 +1,84 @@
 """
 Message Service - handles messaging between trainers and clients, and between clients.
+
+Unread messages are counted twice: per conversation (the *_unread_count column of the
+reader's slot) and per user in user_unread_totals, which is what the badge polls.
+send_message and mark_messages_read change both with SQL increments in one
+transaction, so the badge is a primary-key read. A user without a total row gets one
+computed from their conversations the first time it is needed.
 """
 from .base import (
     HTTPException, uuid, json, logging,
     get_db_session, UserORM, ClientProfileORM
 )
-from models_orm import ConversationORM, MessageORM, ChatRequestORM
+from models_orm import ConversationORM, MessageORM, ChatRequestORM, UserUnreadTotalORM
 from datetime import datetime
 from typing import List, Optional
+from sqlalchemy import and_, case, delete, event, func, inspect, or_, select
+from sqlalchemy.orm import aliased
 
 logger = logging.getLogger("gym_app")
 
+# Roles that read conversations from the trainer_id slot
+STAFF_ROLES = ("trainer", "staff", "owner")
+
+_TOTALS = UserUnreadTotalORM.__table__
+
+
+def _unread_sum(user_id: str, role: str):
+    """SQL expression: the user's unread messages summed over the conversation slots their role reads."""
+    def total(column, *criteria):
+        return select(func.coalesce(func.sum(column), 0)).where(*criteria).scalar_subquery()
+
+    if role in STAFF_ROLES:
+        return total(ConversationORM.trainer_unread_count, ConversationORM.trainer_id == user_id)
+    client_client = ConversationORM.conversation_type == "client_client"
+    return (
+        total(ConversationORM.client_unread_count, ConversationORM.client_id == user_id)
+        + total(ConversationORM.user1_unread_count, ConversationORM.user1_id == user_id, client_client)
+        + total(ConversationORM.user2_unread_count, ConversationORM.user2_id == user_id, client_client)
+    )
+
+
+def _insert(db):
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(_TOTALS)
+
+
+def _add_to_unread_total(db, user_id: str, role: str, delta: int):
+    """Add delta to the user's unread total inside the caller's transaction.
+
+    Call after changing the conversation counter: a missing total row is created from
+    the conversations, which then already include the change.
+    """
+    stmt = _insert(db).values(
+        user_id=user_id,
+        unread_messages=_unread_sum(user_id, role),
+        updated_at=datetime.utcnow().isoformat()
+    )
+    total = _TOTALS.c.unread_messages + delta
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[_TOTALS.c.user_id],
+        set_={"unread_messages": case((total < 0, 0), else_=total), "updated_at": stmt.excluded.updated_at}
+    ))
+
+
+def _conversation_dict(conv, other_id, name, role, profile_picture, unread) -> dict:
+    return {
+        "id": conv.id,
+        "other_user_id": other_id,
+        "other_user_name": name,
+        "other_user_role": role or "unknown",
+        "other_user_profile_picture": profile_picture,
+        "last_message_preview": conv.last_message_preview,
+        "last_message_at": conv.last_message_at,
+        "unread_count": unread or 0,
+        "created_at": conv.created_at
+    }
+
 
 class MessageService:
     """Service for managing messages between trainers and clients."""
@@ -322,19 +390,22 @@ class MessageService:
             preview_text = content if content else f"[{media_type or 'media'}]"
             conversation.last_message_preview = preview_text[:50] + "..." if len(preview_text) > 50 else preview_text
 
-            # Update unread count for receiver
+            # Update unread count for receiver, and their badge total if their role reads that slot
             if is_client_client:
-                # For client-client: increment the other user's unread count
                 if sender_id == conversation.user1_id:
-                    conversation.user2_unread_count = (conversation.user2_unread_count or 0) + 1
+                    column = ConversationORM.user2_unread_count
                 else:
-                    conversation.user1_unread_count = (conversation.user1_unread_count or 0) + 1
-            else:
+                    column = ConversationORM.user1_unread_count
+            elif sender.role in STAFF_ROLES:
                 # For trainer-client (staff uses trainer_id slot)
-                if sender.role in ("trainer", "staff", "owner"):
-                    conversation.client_unread_count = (conversation.client_unread_count or 0) + 1
-                else:
-                    conversation.trainer_unread_count = (conversation.trainer_unread_count or 0) + 1
+                column = ConversationORM.client_unread_count
+            else:
+                column = ConversationORM.trainer_unread_count
+            db.query(ConversationORM).filter(ConversationORM.id == conversation.id).update(
+                {column: func.coalesce(column, 0) + 1}, synchronize_session=False
+            )
+            if (column.key == "trainer_unread_count") == (receiver.role in STAFF_ROLES):
+                _add_to_unread_total(db, receiver_id, receiver.role, 1)
 
             db.commit()
 
@@ -366,100 +437,66 @@ class MessageService:
             db.close()
 
     def get_conversations(self, user_id: str) -> List[dict]:
-        """Get all conversations for a user."""
+        """Get all conversations for a user, with the other participant joined in the same query."""
         db = get_db_session()
         try:
             user = db.query(UserORM).filter(UserORM.id == user_id).first()
             if not user:
                 return []
 
+            other = aliased(UserORM)
+            other_profile = aliased(ClientProfileORM)
             result = []
 
-            if user.role in ("trainer", "staff", "owner"):
+            if user.role in STAFF_ROLES:
                 # Trainer/Staff/Owner: get trainer-client conversations (owner uses trainer_id slot)
-                conversations = db.query(ConversationORM).filter(
+                rows = db.query(
+                    ConversationORM, other.username, other.role, other.profile_picture, other_profile.name
+                ).outerjoin(
+                    other, other.id == ConversationORM.client_id
+                ).outerjoin(
+                    other_profile, other_profile.id == ConversationORM.client_id
+                ).filter(
                     ConversationORM.trainer_id == user_id
                 ).order_by(ConversationORM.last_message_at.desc()).all()
 
-                for conv in conversations:
-                    other_id = conv.client_id
-                    other_user = db.query(UserORM).filter(UserORM.id == other_id).first()
-                    other_profile = db.query(ClientProfileORM).filter(ClientProfileORM.id == other_id).first()
-                    unread = conv.trainer_unread_count or 0
-
+                for conv, username, role, picture, profile_name in rows:
                     # Use profile name if available, fallback to username
-                    display_name = (other_profile.name if other_profile and other_profile.name else None) or (other_user.username if other_user else "Unknown")
-
-                    result.append({
-                        "id": conv.id,
-                        "other_user_id": other_id,
-                        "other_user_name": display_name,
-                        "other_user_role": other_user.role if other_user else "unknown",
-                        "other_user_profile_picture": other_user.profile_picture if other_user else None,
-                        "last_message_preview": conv.last_message_preview,
-                        "last_message_at": conv.last_message_at,
-                        "unread_count": unread,
-                        "created_at": conv.created_at
-                    })
+                    display_name = profile_name or username or "Unknown"
+                    result.append(_conversation_dict(
+                        conv, conv.client_id, display_name, role, picture, conv.trainer_unread_count
+                    ))
             else:
-                # Client: get trainer-client conversations
-                trainer_convs = db.query(ConversationORM).filter(
-                    ConversationORM.client_id == user_id,
-                    ConversationORM.conversation_type == "trainer_client"
-                ).all()
-
-                for conv in trainer_convs:
-                    other_id = conv.trainer_id
-                    other_user = db.query(UserORM).filter(UserORM.id == other_id).first()
-                    unread = conv.client_unread_count or 0
-
-                    # Trainers use username as display name
-                    display_name = other_user.username if other_user else "Unknown"
-
-                    result.append({
-                        "id": conv.id,
-                        "other_user_id": other_id,
-                        "other_user_name": display_name,
-                        "other_user_role": other_user.role if other_user else "unknown",
-                        "other_user_profile_picture": other_user.profile_picture if other_user else None,
-                        "last_message_preview": conv.last_message_preview,
-                        "last_message_at": conv.last_message_at,
-                        "unread_count": unread,
-                        "created_at": conv.created_at
-                    })
-
-                # Client: also get client-client conversations
-                client_convs = db.query(ConversationORM).filter(
-                    ((ConversationORM.user1_id == user_id) | (ConversationORM.user2_id == user_id)),
-                    ConversationORM.conversation_type == "client_client"
-                ).all()
-
-                for conv in client_convs:
-                    # Determine other user
-                    other_id = conv.user2_id if conv.user1_id == user_id else conv.user1_id
-                    other_user = db.query(UserORM).filter(UserORM.id == other_id).first()
-                    other_profile = db.query(ClientProfileORM).filter(ClientProfileORM.id == other_id).first()
-
-                    # Determine unread count
-                    if conv.user1_id == user_id:
-                        unread = conv.user1_unread_count or 0
+                # Client: trainer-client conversations (client_id slot) and client-client ones (user1/user2)
+                is_client_client = ConversationORM.conversation_type == "client_client"
+                other_id = case(
+                    (is_client_client, case(
+                        (ConversationORM.user1_id == user_id, ConversationORM.user2_id),
+                        else_=ConversationORM.user1_id
+                    )),
+                    else_=ConversationORM.trainer_id
+                )
+                rows = db.query(
+                    ConversationORM, other_id, other.username, other.role, other.profile_picture, other_profile.name
+                ).outerjoin(
+                    other, other.id == other_id
+                ).outerjoin(
+                    other_profile, other_profile.id == other_id
+                ).filter(or_(
+                    and_(ConversationORM.client_id == user_id, ConversationORM.conversation_type == "trainer_client"),
+                    and_(is_client_client, or_(ConversationORM.user1_id == user_id, ConversationORM.user2_id == user_id))
+                )).order_by(ConversationORM.last_message_at.desc()).all()
+
+                for conv, conv_other_id, username, role, picture, profile_name in rows:
+                    if conv.conversation_type == "client_client":
+                        unread = conv.user1_unread_count if conv.user1_id == user_id else conv.user2_unread_count
+                        # Use profile name if available, fallback to username
+                        display_name = profile_name or username or "Unknown"
                     else:
-                        unread = conv.user2_unread_count or 0
-
-                    # Use profile name if available, fallback to username
-                    display_name = (other_profile.name if other_profile and other_profile.name else None) or (other_user.username if other_user else "Unknown")
-
-                    result.append({
-                        "id": conv.id,
-                        "other_user_id": other_id,
-                        "other_user_name": display_name,
-                        "other_user_role": other_user.role if other_user else "unknown",
-                        "other_user_profile_picture": other_user.profile_picture if other_user else None,
-                        "last_message_preview": conv.last_message_preview,
-                        "last_message_at": conv.last_message_at,
-                        "unread_count": unread,
-                        "created_at": conv.created_at
-                    })
+                        unread = conv.client_unread_count
+                        # Trainers use username as display name
+                        display_name = username or "Unknown"
+                    result.append(_conversation_dict(conv, conv_other_id, display_name, role, picture, unread))
 
             # Sort all conversations by last_message_at
             result.sort(key=lambda x: x["last_message_at"] or "", reverse=True)
@@ -538,18 +575,26 @@ class MessageService:
                 "read_at": now
             })
 
-            # Reset unread count for this user
+            # Reset unread count for this user and take it off their badge total
+            user = db.query(UserORM).filter(UserORM.id == user_id).first()
+            role = user.role if user else None
             if conversation.conversation_type == "client_client":
                 if user_id == conversation.user1_id:
-                    conversation.user1_unread_count = 0
+                    column = ConversationORM.user1_unread_count
                 else:
-                    conversation.user2_unread_count = 0
+                    column = ConversationORM.user2_unread_count
+            elif role in STAFF_ROLES:
+                column = ConversationORM.trainer_unread_count
             else:
-                user = db.query(UserORM).filter(UserORM.id == user_id).first()
-                if user and user.role in ("trainer", "staff", "owner"):
-                    conversation.trainer_unread_count = 0
-                else:
-                    conversation.client_unread_count = 0
+                column = ConversationORM.client_unread_count
+
+            counter = db.query(ConversationORM).filter(ConversationORM.id == conversation_id)
+            # Lock the row first, so a message sent meanwhile is neither reset nor subtracted unseen
+            counter.update({column: func.coalesce(column, 0)}, synchronize_session=False)
+            cleared = counter.with_entities(column).scalar() or 0
+            if cleared:
+                counter.update({column: 0}, synchronize_session=False)
+                _add_to_unread_total(db, user_id, role, -cleared)
 
             db.commit()
 
@@ -568,43 +613,45 @@ class MessageService:
             db.close()
 
     def get_unread_count(self, user_id: str) -> int:
-        """Get total unread message count for a user."""
+        """Get total unread message count for a user (one primary-key read once the total exists)."""
         db = get_db_session()
         try:
+            total = db.query(UserUnreadTotalORM.unread_messages).filter(
+                UserUnreadTotalORM.user_id == user_id
+            ).scalar()
+            if total is not None:
+                return total
+
             user = db.query(UserORM).filter(UserORM.id == user_id).first()
             if not user:
                 return 0
 
-            total = 0
+            # First read: compute the total from the conversations and keep it from now on
+            _add_to_unread_total(db, user_id, user.role, 0)
+            db.commit()
+            return db.query(UserUnreadTotalORM.unread_messages).filter(
+                UserUnreadTotalORM.user_id == user_id
+            ).scalar()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
 
-            if user.role in ("trainer", "staff", "owner"):
-                # Trainer/Staff/Owner: only trainer-client conversations (uses trainer_id slot)
-                result = db.query(ConversationORM).filter(
-                    ConversationORM.trainer_id == user_id
-                ).all()
-                total = sum(c.trainer_unread_count or 0 for c in result)
-            else:
-                # Client: trainer-client + client-client conversations
-                trainer_convs = db.query(ConversationORM).filter(
-                    ConversationORM.client_id == user_id
-                ).all()
-                total = sum(c.client_unread_count or 0 for c in trainer_convs)
-
-                # Also count client-client conversations
-                client_convs = db.query(ConversationORM).filter(
-                    ((ConversationORM.user1_id == user_id) | (ConversationORM.user2_id == user_id)),
-                    ConversationORM.conversation_type == "client_client"
-                ).all()
 
-                for conv in client_convs:
-                    if conv.user1_id == user_id:
-                        total += conv.user1_unread_count or 0
-                    else:
-                        total += conv.user2_unread_count or 0
+def forget_unread_totals(db, user_ids):
+    """Drop these users' unread totals (inside the caller's transaction); they are recomputed on next read.
 
-            return total
-        finally:
-            db.close()
+    Use after changing conversation counters outside MessageService, e.g. deleting conversations.
+    """
+    db.execute(delete(_TOTALS).where(_TOTALS.c.user_id.in_(user_ids)))
+
+
+@event.listens_for(UserORM, "after_update")
+def _role_changed(mapper, connection, target):
+    # The total sums the slots the role reads: recompute it for the new role
+    if inspect(target).attrs.role.history.has_changes():
+        connection.execute(delete(_TOTALS).where(_TOTALS.c.user_id == target.id))
 
 
 # Singleton instance
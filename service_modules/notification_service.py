@@ -6,15 +6,24 @@ from .base import (
     get_db_session, NotificationORM, UserORM
 )
 from typing import List, Optional
+import os
 import uuid
 
 logger = logging.getLogger("gym_app")
 
+# Overridable so the local FCM stand-in (tests/fcm_standin.py) can be used in dev/tests
+FCM_BASE_URL = os.environ.get("FCM_BASE_URL", "https://fcm.googleapis.com").rstrip("/")
+
 
 def _get_fcm_access_token():
     """Get OAuth2 access token for FCM v1 API using service account credentials."""
     import os, time
 
+    # Static token for the local FCM stand-in (never set in production)
+    static_token = os.environ.get("FCM_ACCESS_TOKEN")
+    if static_token:
+        return static_token
+
     # Cache the token to avoid re-fetching on every push
     if hasattr(_get_fcm_access_token, '_cached'):
         token, expiry = _get_fcm_access_token._cached
@@ -106,51 +115,69 @@ def send_fcm_push(db, user_id: str, title: str, body: str, data: dict = None, im
         logger.error(f"Push notification error: {e}")
 
 
+def _fcm_v1_url(project_id: str) -> str:
+    return f"{FCM_BASE_URL}/v1/projects/{project_id}/messages:send"
+
+
+def _fcm_string_data(data: dict = None) -> dict:
+    """Serialize data values to strings (FCM v1 requires string values in data)."""
+    str_data = {}
+    if data:
+        for k, v in data.items():
+            str_data[str(k)] = str(v) if v is not None else ""
+    str_data["click_action"] = "FLUTTER_NOTIFICATION_CLICK"
+    return str_data
+
+
+def _build_fcm_v1_payload(token: str, title: str, body: str, str_data: dict, image_url: str = None) -> dict:
+    """Build the FCM v1 message body for a single device token."""
+    notification = {
+        "title": title,
+        "body": (body or "")[:200],
+    }
+    if image_url:
+        notification["image"] = image_url
+
+    return {
+        "message": {
+            "token": token,
+            "notification": notification,
+            "data": str_data,
+            "android": {
+                "notification": {"sound": "default", **({"image": image_url} if image_url else {})},
+            },
+            "apns": {
+                "payload": {
+                    "aps": {"sound": "default", "badge": 1, "mutable-content": 1},
+                },
+                **({"fcm_options": {"image": image_url}} if image_url else {}),
+            },
+        }
+    }
+
+
+def _is_unregistered_response(status_code: int, text: str) -> bool:
+    """FCM answers 404 (or 400 UNREGISTERED) for tokens of uninstalled apps."""
+    return status_code == 404 or (status_code == 400 and "UNREGISTERED" in text)
+
+
 def _send_via_fcm_v1(db, tokens, title, body, data, access_token, project_id, image_url=None):
     """Send via FCM HTTP v1 API (modern, OAuth2-based)."""
     import requests as req
     from models_orm import FCMDeviceTokenORM
 
-    url = f"https://fcm.googleapis.com/v1/projects/{project_id}/messages:send"
+    url = _fcm_v1_url(project_id)
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json",
     }
-
-    # Serialize data values to strings (FCM v1 requires string values in data)
-    str_data = {}
-    if data:
-        for k, v in data.items():
-            str_data[str(k)] = str(v) if v is not None else ""
-    str_data["click_action"] = "FLUTTER_NOTIFICATION_CLICK"
+    str_data = _fcm_string_data(data)
 
     for device in tokens:
         try:
-            notification = {
-                "title": title,
-                "body": body[:200],
-            }
-            if image_url:
-                notification["image"] = image_url
-
-            payload = {
-                "message": {
-                    "token": device.token,
-                    "notification": notification,
-                    "data": str_data,
-                    "android": {
-                        "notification": {"sound": "default", **({"image": image_url} if image_url else {})},
-                    },
-                    "apns": {
-                        "payload": {
-                            "aps": {"sound": "default", "badge": 1, "mutable-content": 1},
-                        },
-                        **({"fcm_options": {"image": image_url}} if image_url else {}),
-                    },
-                }
-            }
+            payload = _build_fcm_v1_payload(device.token, title, body, str_data, image_url)
             resp = req.post(url, json=payload, headers=headers, timeout=10)
-            if resp.status_code == 404 or (resp.status_code == 400 and "UNREGISTERED" in resp.text):
+            if _is_unregistered_response(resp.status_code, resp.text):
                 db.query(FCMDeviceTokenORM).filter(
                     FCMDeviceTokenORM.token == device.token
                 ).delete()
@@ -368,30 +395,42 @@ class NotificationService:
 notification_service = NotificationService()
 
 
-# ── SQLAlchemy event: auto-send FCM push on every new notification ──
+def enqueue_push(db, user_id: str, title: str, body: str, data: dict = None, image_url: str = None):
+    """Queue a push notification in the caller's transaction.
+
+    Nothing is sent until the caller commits; the push dispatcher then delivers it
+    in the background (see service_modules/push_dispatcher.py).
+    """
+    from models_orm import PushOutboxORM
+    db.add(PushOutboxORM(
+        user_id=user_id,
+        title=title or "",
+        body=body or "",
+        data=json.dumps(data) if data else None,
+        image_url=image_url,
+    ))
+
+
+# ── SQLAlchemy event: queue an FCM push for every new notification ──
+# The outbox row is written on the same connection, so it commits (or rolls back)
+# atomically with the notification and the insert never waits on the network.
 from sqlalchemy import event
 
 @event.listens_for(NotificationORM, "after_insert")
-def _auto_fcm_on_notification(mapper, connection, target):
-    """Automatically send an FCM push whenever a NotificationORM row is inserted."""
-    try:
-        # Parse data JSON if present
-        data = None
-        if target.data:
-            try:
-                data = json.loads(target.data) if isinstance(target.data, str) else target.data
-            except Exception as e:
-                logger.warning("Failed to parse notification data JSON: %s", e)
-                data = None
-
-        # Use a fresh session (connection is low-level, we need ORM queries)
-        db = get_db_session()
-        try:
-            send_fcm_push(db, target.user_id, target.title or "", target.message or "", data)
-        finally:
-            db.close()
-    except Exception as e:
-        logger.error(f"Auto FCM push error: {e}")
+def _enqueue_fcm_on_notification(mapper, connection, target):
+    """Write a push_outbox row whenever a NotificationORM row is inserted."""
+    from models_orm import PushOutboxORM
+    now = datetime.utcnow().isoformat()
+    connection.execute(PushOutboxORM.__table__.insert().values(
+        user_id=target.user_id,
+        title=target.title or "",
+        body=target.message or "",
+        data=target.data if isinstance(target.data, str) or target.data is None else json.dumps(target.data),
+        status="pending",
+        attempts=0,
+        next_attempt_at=now,
+        created_at=now,
+    ))
 
 
 def get_notification_service() -> NotificationService:
@@ -7,6 +7,7 @@ from .base import (
     get_db_session, UserORM, ClientProfileORM, ClientScheduleORM, NotificationORM
 )
 from models_orm import NutritionistAvailabilityORM, NutritionistAppointmentORM
+from .availability_engine import day_slots
 from models import (
     BookNutritionistAppointmentRequest,
     SetAvailabilityRequest, CancelAppointmentRequest
@@ -77,64 +78,7 @@ class NutritionistAppointmentService:
         """Get available time slots for a specific nutritionist on a specific date."""
         db = get_db_session()
         try:
-            target_date = datetime.fromisoformat(date_str)
-            day_of_week = target_date.weekday()
-
-            availability = db.query(NutritionistAvailabilityORM).filter(
-                NutritionistAvailabilityORM.nutritionist_id == nutritionist_id,
-                NutritionistAvailabilityORM.day_of_week == day_of_week,
-                NutritionistAvailabilityORM.is_available == True
-            ).all()
-
-            if not availability:
-                return []
-
-            booked = db.query(NutritionistAppointmentORM).filter(
-                NutritionistAppointmentORM.nutritionist_id == nutritionist_id,
-                NutritionistAppointmentORM.date == date_str,
-                NutritionistAppointmentORM.status.in_(["scheduled", "confirmed"])
-            ).all()
-
-            available_slots = []
-
-            for avail_block in availability:
-                start_hour, start_min = map(int, avail_block.start_time.split(':'))
-                end_hour, end_min = map(int, avail_block.end_time.split(':'))
-
-                start_time = datetime.combine(target_date.date(), datetime.min.time().replace(hour=start_hour, minute=start_min))
-                end_time = datetime.combine(target_date.date(), datetime.min.time().replace(hour=end_hour, minute=end_min))
-
-                current_time = start_time
-                while current_time < end_time:
-                    slot_end = current_time + timedelta(hours=1)
-                    if slot_end > end_time:
-                        break
-
-                    is_booked = False
-                    for appt in booked:
-                        appt_start_h, appt_start_m = map(int, appt.start_time.split(':'))
-                        appt_start = datetime.combine(target_date.date(), datetime.min.time().replace(hour=appt_start_h, minute=appt_start_m))
-                        appt_end = appt_start + timedelta(minutes=appt.duration)
-
-                        if not (slot_end <= appt_start or current_time >= appt_end):
-                            is_booked = True
-                            break
-
-                    now = datetime.now()
-                    if target_date.date() == now.date() and current_time <= now:
-                        current_time = slot_end
-                        continue
-
-                    if not is_booked:
-                        available_slots.append({
-                            "start_time": current_time.strftime("%H:%M"),
-                            "end_time": slot_end.strftime("%H:%M"),
-                            "available": True
-                        })
-
-                    current_time = slot_end
-
-            return available_slots
+            return day_slots(db, "nutritionist", nutritionist_id, date_str)
 
         except Exception as e:
             logger.error(f"Error getting available slots: {e}")
@@ -0,0 +1,310 @@
+"""
+Push Dispatcher - drains the push_outbox table and delivers FCM notifications.
+
+Notifications are queued transactionally (see notification_service.enqueue_push and
+the NotificationORM after_insert hook); this background task sends them in batches:
+one claim query per batch, one token query per batch, concurrent sends over a single
+pooled HTTP/2 client, and one bulk DELETE for UNREGISTERED tokens.
+
+Every worker runs a dispatcher. Rows are claimed with a conditional UPDATE keyed by
+a per-batch claim token, so two workers never send the same row.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import and_, or_
+
+from database import get_db_session, run_sync
+from models_orm import PushOutboxORM, FCMDeviceTokenORM
+from .notification_service import (
+    _get_fcm_access_token, _get_fcm_project_id, _fcm_v1_url, _fcm_string_data,
+    _build_fcm_v1_payload, _is_unregistered_response, _send_via_legacy_fcm,
+)
+
+logger = logging.getLogger("gym_app")
+
+PUSH_BATCH_SIZE = int(os.environ.get("PUSH_BATCH_SIZE", "500"))
+PUSH_CONCURRENCY = int(os.environ.get("PUSH_CONCURRENCY", "50"))
+PUSH_POLL_INTERVAL = float(os.environ.get("PUSH_POLL_INTERVAL", "1.0"))
+PUSH_MAX_ATTEMPTS = 5
+PUSH_CLAIM_TIMEOUT = timedelta(minutes=5)  # Rows stuck in "sending" (worker died) are retried
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _default_credentials() -> Tuple[Optional[str], Optional[str]]:
+    return _get_fcm_access_token(), _get_fcm_project_id()
+
+
+class PushDispatcher:
+    """Background sender for queued push notifications."""
+
+    def __init__(
+        self,
+        session_factory: Callable = get_db_session,
+        credentials_fn: Callable = _default_credentials,
+        http_client: Optional[httpx.AsyncClient] = None,
+        batch_size: int = PUSH_BATCH_SIZE,
+        concurrency: int = PUSH_CONCURRENCY,
+    ):
+        self.session_factory = session_factory
+        self.credentials_fn = credentials_fn
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._client = http_client
+        self._owns_client = http_client is None
+        self._task: Optional[asyncio.Task] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=_http2_available(),
+                timeout=10,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            )
+        return self._client
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Push dispatcher started")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self):
+        while True:
+            try:
+                stats = await self.drain_once()
+                if stats["claimed"] >= self.batch_size:
+                    continue  # More waiting — don't sleep between full batches
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Push dispatcher error: {e}")
+            await asyncio.sleep(PUSH_POLL_INTERVAL)
+
+    # --- DB steps (run in the DB thread pool) ---
+
+    def _claim_batch(self) -> List[dict]:
+        """Claim up to batch_size due rows for this dispatcher and return them as dicts."""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            stale_cutoff = (now - PUSH_CLAIM_TIMEOUT).isoformat()
+            due = or_(
+                and_(PushOutboxORM.status == "pending", PushOutboxORM.next_attempt_at <= now.isoformat()),
+                and_(PushOutboxORM.status == "sending", PushOutboxORM.claimed_at < stale_cutoff),
+            )
+            ids = [row[0] for row in db.query(PushOutboxORM.id).filter(due)
+                   .order_by(PushOutboxORM.id).limit(self.batch_size).all()]
+            if not ids:
+                return []
+
+            claim_token = uuid.uuid4().hex
+            db.query(PushOutboxORM).filter(PushOutboxORM.id.in_(ids), due).update({
+                "status": "sending",
+                "claim_token": claim_token,
+                "claimed_at": now.isoformat(),
+                "attempts": PushOutboxORM.attempts + 1,
+            }, synchronize_session=False)
+            db.commit()
+
+            rows = db.query(PushOutboxORM).filter(PushOutboxORM.claim_token == claim_token).all()
+            return [{
+                "id": r.id,
+                "user_id": r.user_id,
+                "title": r.title,
+                "body": r.body,
+                "data": r.data,
+                "image_url": r.image_url,
+                "attempts": r.attempts,
+            } for r in rows]
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _load_tokens(self, user_ids: List[str]) -> Dict[str, List[str]]:
+        db = self.session_factory()
+        try:
+            tokens: Dict[str, List[str]] = {}
+            for user_id, token in db.query(FCMDeviceTokenORM.user_id, FCMDeviceTokenORM.token).filter(
+                FCMDeviceTokenORM.user_id.in_(user_ids)
+            ).all():
+                tokens.setdefault(user_id, []).append(token)
+            return tokens
+        finally:
+            db.close()
+
+    def _finalize(self, outcomes: Dict[int, Tuple[str, Optional[str]]], attempts: Dict[int, int],
+                  dead_tokens: List[str]):
+        """Persist per-row outcomes and drop unregistered tokens in bulk."""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            if dead_tokens:
+                db.query(FCMDeviceTokenORM).filter(
+                    FCMDeviceTokenORM.token.in_(dead_tokens)
+                ).delete(synchronize_session=False)
+
+            by_status: Dict[str, List[int]] = {}
+            for row_id, (status, _) in outcomes.items():
+                if status != "retry":
+                    by_status.setdefault(status, []).append(row_id)
+            for status, ids in by_status.items():
+                db.query(PushOutboxORM).filter(PushOutboxORM.id.in_(ids)).update({
+                    "status": status,
+                    "sent_at": now.isoformat() if status == "sent" else None,
+                    "claim_token": None,
+                }, synchronize_session=False)
+
+            for row_id, (status, error) in outcomes.items():
+                if status != "retry":
+                    continue
+                attempt = attempts.get(row_id, 1)
+                if attempt >= PUSH_MAX_ATTEMPTS:
+                    values = {"status": "failed", "last_error": error, "claim_token": None}
+                else:
+                    backoff = timedelta(seconds=min(3600, 30 * 2 ** (attempt - 1)))
+                    values = {
+                        "status": "pending",
+                        "last_error": error,
+                        "claim_token": None,
+                        "next_attempt_at": (now + backoff).isoformat(),
+                    }
+                db.query(PushOutboxORM).filter(PushOutboxORM.id == row_id).update(
+                    values, synchronize_session=False
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _send_legacy(self, rows: List[dict]):
+        """Fallback when FCM v1 credentials are missing: per-gym legacy server keys."""
+        db = self.session_factory()
+        try:
+            for row in rows:
+                tokens = db.query(FCMDeviceTokenORM).filter(FCMDeviceTokenORM.user_id == row["user_id"]).all()
+                if tokens:
+                    _send_via_legacy_fcm(db, row["user_id"], tokens, row["title"], row["body"], _parse_data(row["data"]))
+        finally:
+            db.close()
+
+    # --- Sending ---
+
+    async def drain_once(self) -> dict:
+        """Claim one batch from the outbox and deliver it. Returns delivery stats."""
+        rows = await run_sync(self._claim_batch)
+        stats = {"claimed": len(rows), "sent": 0, "skipped": 0, "retry": 0, "unregistered": 0}
+        if not rows:
+            return stats
+
+        access_token, project_id = await run_sync(self.credentials_fn)
+        if not (access_token and project_id):
+            await run_sync(self._send_legacy, rows)
+            await run_sync(self._finalize, {r["id"]: ("sent", None) for r in rows}, {}, [])
+            stats["sent"] = len(rows)
+            return stats
+
+        tokens_by_user = await run_sync(self._load_tokens, list({r["user_id"] for r in rows}))
+
+        url = _fcm_v1_url(project_id)
+        headers = {"Authorization": f"Bearer {access_token}"}
+        client = self._get_client()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send_one(token: str, payload: dict) -> Tuple[str, Optional[str]]:
+            async with semaphore:
+                try:
+                    resp = await client.post(url, json=payload, headers=headers)
+                except httpx.HTTPError as e:
+                    return "retry", f"{type(e).__name__}: {e}"
+                if resp.status_code == 200:
+                    return "ok", None
+                if _is_unregistered_response(resp.status_code, resp.text):
+                    return "unregistered", None
+                if resp.status_code == 429 or resp.status_code >= 500:
+                    return "retry", f"HTTP {resp.status_code}"
+                logger.warning(f"FCM v1 error {resp.status_code}: {resp.text[:200]}")
+                return "rejected", f"HTTP {resp.status_code}: {resp.text[:200]}"
+
+        jobs = []  # (row_id, token, coroutine)
+        outcomes: Dict[int, Tuple[str, Optional[str]]] = {}
+        for row in rows:
+            user_tokens = tokens_by_user.get(row["user_id"], [])
+            if not user_tokens:
+                outcomes[row["id"]] = ("skipped", None)
+                continue
+            str_data = _fcm_string_data(_parse_data(row["data"]))
+            for token in user_tokens:
+                payload = _build_fcm_v1_payload(token, row["title"], row["body"], str_data, row["image_url"])
+                jobs.append((row["id"], token, send_one(token, payload)))
+
+        results = await asyncio.gather(*(job[2] for job in jobs))
+
+        dead_tokens = []
+        per_row: Dict[int, List[Tuple[str, Optional[str]]]] = {}
+        for (row_id, token, _), result in zip(jobs, results):
+            per_row.setdefault(row_id, []).append(result)
+            if result[0] == "unregistered":
+                dead_tokens.append(token)
+
+        for row_id, row_results in per_row.items():
+            kinds = {kind for kind, _ in row_results}
+            if "ok" in kinds:
+                outcomes[row_id] = ("sent", None)
+            elif "retry" in kinds:
+                # Only retry when no device got it, otherwise a retry would duplicate the push
+                outcomes[row_id] = ("retry", next(err for kind, err in row_results if kind == "retry"))
+            elif "rejected" in kinds:
+                outcomes[row_id] = ("failed", next(err for kind, err in row_results if kind == "rejected"))
+            else:
+                outcomes[row_id] = ("skipped", None)  # Every device was unregistered
+
+        attempts = {r["id"]: r["attempts"] for r in rows}
+        await run_sync(self._finalize, outcomes, attempts, dead_tokens)
+
+        for status, _ in outcomes.values():
+            stats[status] = stats.get(status, 0) + 1
+        stats["unregistered"] = len(dead_tokens)
+        return stats
+
+
+def _parse_data(raw) -> Optional[dict]:
+    if not raw:
+        return None
+    try:
+        return json.loads(raw) if isinstance(raw, str) else raw
+    except Exception as e:
+        logger.warning("Failed to parse push data JSON: %s", e)
+        return None
+
+
+# Singleton instance (started from main.startup_event)
+push_dispatcher = PushDispatcher()
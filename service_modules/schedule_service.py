@@ -6,6 +6,8 @@ from .base import (
     get_db_session, TrainerScheduleORM, ClientScheduleORM, ClientExerciseLogORM, UserORM,
     ClientProfileORM
 )
+from .activity_state_service import refresh_activity_state
+from .schedule_sync import get_schedule, schedule_version
 
 logger = logging.getLogger("gym_app")
 
@@ -487,6 +489,22 @@ class ScheduleService:
             db.close()
 
     # Client schedule methods
+    def get_trainer_schedule_version(self, trainer_id: str) -> str:
+        """Current version of the trainer's calendar (changes whenever any entry does)."""
+        db = get_db_session()
+        try:
+            return schedule_version(db.connection(), trainer_id)
+        finally:
+            db.close()
+
+    def get_trainer_schedule(self, trainer_id: str, start: str, end: str, since: str = None) -> dict:
+        """Trainer's calendar between start and end, or only what changed since a previous version."""
+        db = get_db_session()
+        try:
+            return get_schedule(db, trainer_id, start, end, since)
+        finally:
+            db.close()
+
     def get_client_schedule(self, client_id: str, date_str: str = None) -> dict:
         """Get client's schedule for a given date."""
         if not date_str:
@@ -577,6 +595,7 @@ class ScheduleService:
             # Save detailed snapshot
             item.details = json.dumps(exercises)
 
+            refresh_activity_state(db, client_id)
             db.commit()
             return {"status": "success", "message": "Workout completed!"}
         finally:
@@ -708,6 +727,8 @@ class ScheduleService:
                 if partner_profile:
                     partner_profile.gems = (partner_profile.gems or 0) + total_gems
 
+                refresh_activity_state(db, user_id)
+                refresh_activity_state(db, partner_id)
                 db.commit()
                 return {
                     "status": "success",
@@ -768,6 +789,8 @@ class ScheduleService:
                 if partner_profile:
                     partner_profile.gems = (partner_profile.gems or 0) + total_gems
 
+                refresh_activity_state(db, user_id)
+                refresh_activity_state(db, partner_id)
                 db.commit()
                 return {
                     "status": "success",
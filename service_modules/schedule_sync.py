@@ -0,0 +1,225 @@
+"""
+Schedule Sync - windowed trainer calendar and delta sync of its changes.
+
+The trainer dashboard used to ship every trainer_schedule row the trainer ever had.
+It now ships a window around today (TRAINER_SCHEDULE_DAYS_BACK / _AHEAD by default,
+any range up to MAX_WINDOW_DAYS on request) plus a version, and the front-end asks
+for what changed since that version instead of downloading the calendar again.
+
+Every insert/update/delete of a trainer_schedule row appends (trainer_id, entry_id)
+to trainer_schedule_changes in the same transaction: mapper events for ORM writes,
+a do_orm_execute hook for bulk query().update()/.delete(), and record_changes() for
+writers that insert through Core. A trainer's version is "<last seq>.<changes up to
+it>" (a trainer with nothing logged yet starts at the log's last seq). A delta
+request re-counts the changes up to the client's seq; if the count moved (a
+transaction that took an earlier seq committed late) or the seq is older than the
+oldest change kept (pruned), the client gets the full window instead of a delta that
+could miss rows.
+
+Changes older than SCHEDULE_CHANGE_RETENTION_DAYS are pruned nightly.
+"""
+import os
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.orm import Session, object_session
+
+from database import get_db_session
+from models_orm import TrainerScheduleORM, TrainerScheduleChangeORM
+from .availability_engine import attribute_values
+
+import logging
+logger = logging.getLogger("gym_app")
+
+SCHEDULE_DAYS_BACK = int(os.getenv("TRAINER_SCHEDULE_DAYS_BACK", "30"))
+SCHEDULE_DAYS_AHEAD = int(os.getenv("TRAINER_SCHEDULE_DAYS_AHEAD", "90"))
+SCHEDULE_CHANGE_RETENTION_DAYS = int(os.getenv("SCHEDULE_CHANGE_RETENTION_DAYS", "30"))
+MAX_WINDOW_DAYS = 400
+MAX_DELTA_ENTRIES = 500  # Past this many changed entries a full window is cheaper
+
+_SCHEDULE = TrainerScheduleORM.__table__
+_CHANGES = TrainerScheduleChangeORM.__table__
+
+
+def schedule_window(start: Optional[str] = None, end: Optional[str] = None) -> Tuple[str, str]:
+    """Validated (from, to) dates, inclusive; defaults to the window around today."""
+    today = date.today()
+    try:
+        first = date.fromisoformat(start) if start else today - timedelta(days=SCHEDULE_DAYS_BACK)
+        last = date.fromisoformat(end) if end else max(first, today) + timedelta(days=SCHEDULE_DAYS_AHEAD)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    if last < first:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (last - first).days > MAX_WINDOW_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_WINDOW_DAYS} days per request")
+    return first.isoformat(), last.isoformat()
+
+
+def entry_payload(s: TrainerScheduleORM) -> dict:
+    return {
+        "id": str(s.id),
+        "date": s.date,
+        "time": s.time,
+        "title": s.title,
+        "subtitle": s.subtitle or "",
+        "type": s.type,
+        "duration": s.duration if s.duration else 60,
+        "completed": s.completed,
+        "course_id": s.course_id  # Link to course for group classes
+    }
+
+
+def load_window(db, trainer_id: str, start: str, end: str) -> list:
+    rows = db.query(TrainerScheduleORM).filter(
+        TrainerScheduleORM.trainer_id == trainer_id,
+        TrainerScheduleORM.date >= start,
+        TrainerScheduleORM.date <= end,
+    ).order_by(TrainerScheduleORM.date, TrainerScheduleORM.time).all()
+    return [entry_payload(s) for s in rows]
+
+
+def schedule_version(conn, trainer_id: str) -> str:
+    last, count = conn.execute(
+        select(func.max(_CHANGES.c.seq), func.count(_CHANGES.c.seq)).where(_CHANGES.c.trainer_id == trainer_id)
+    ).one()
+    if last is None:
+        # Nothing logged for this trainer yet: anchor at the log's end, so the first change is a delta
+        last = conn.execute(select(func.max(_CHANGES.c.seq))).scalar() or 0
+    return f"{last}.{count}"
+
+
+def _parse_version(version: Optional[str]):
+    try:
+        last, count = (int(part) for part in version.split("."))
+        return (last, count) if last >= 0 and count >= 0 else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_schedule(db, trainer_id: str, start: str, end: str, since: Optional[str] = None) -> dict:
+    """The window's entries, or only the ones changed since `since` (a version from an earlier call)."""
+    conn = db.connection()
+    # Read the version first: a change committed while we read is sent again next time, never missed
+    version = schedule_version(conn, trainer_id)
+    result = {"version": version, "from": start, "to": end, "full": True, "removed": []}
+
+    parsed = _parse_version(since)
+    oldest = conn.execute(select(func.min(_CHANGES.c.seq))).scalar()
+    # Changes before the oldest one kept were pruned: a version from before then can't get a delta
+    if parsed and oldest is not None and oldest <= parsed[0] <= int(version.split(".")[0]):
+        last, count = parsed
+        still = conn.execute(select(func.count(_CHANGES.c.seq)).where(
+            _CHANGES.c.trainer_id == trainer_id, _CHANGES.c.seq <= last
+        )).scalar()
+        changed = [entry_id for (entry_id,) in conn.execute(select(_CHANGES.c.entry_id).where(
+            _CHANGES.c.trainer_id == trainer_id, _CHANGES.c.seq > last
+        ).group_by(_CHANGES.c.entry_id).limit(MAX_DELTA_ENTRIES + 1))]
+        if still == count and len(changed) <= MAX_DELTA_ENTRIES:
+            rows = db.query(TrainerScheduleORM).filter(
+                TrainerScheduleORM.id.in_(changed),
+                TrainerScheduleORM.trainer_id == trainer_id,
+                TrainerScheduleORM.date >= start,
+                TrainerScheduleORM.date <= end,
+            ).all() if changed else []
+            present = {s.id for s in rows}
+            result.update(full=False, entries=[entry_payload(s) for s in rows],
+                          removed=[str(i) for i in changed if i not in present])
+            return result
+
+    result["entries"] = load_window(db, trainer_id, start, end)
+    return result
+
+
+# --- Recording changes ---
+
+def record_changes(conn, changes: Iterable[Tuple[str, int]]):
+    """Log (trainer_id, entry_id) pairs; for code that writes trainer_schedule through Core."""
+    now = datetime.utcnow().isoformat()
+    rows = [{"trainer_id": t, "entry_id": e, "changed_at": now} for t, e in sorted(set(changes)) if t and e]
+    if rows:
+        conn.execute(_CHANGES.insert(), rows)
+
+
+def _track(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    session.info.setdefault("schedule_changes", set()).update(
+        (trainer_id, target.id) for trainer_id in attribute_values(mapper, connection, target, "trainer_id")
+    )
+
+
+def _track_update(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and session.is_modified(target, include_collections=False):
+        _track(mapper, connection, target)
+
+
+event.listen(TrainerScheduleORM, "after_insert", _track)
+event.listen(TrainerScheduleORM, "before_update", _track_update)  # before: the row still holds the old trainer
+event.listen(TrainerScheduleORM, "after_delete", _track)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk(orm_execute_state):
+    """query(TrainerScheduleORM).update()/.delete() skip the mapper events: log the rows they hit."""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not TrainerScheduleORM:
+        return None
+
+    conn = orm_execute_state.session.connection()
+    hit = select(_SCHEDULE.c.trainer_id, _SCHEDULE.c.id)
+    if isinstance(orm_execute_state.parameters, list):
+        # Bulk UPDATE by primary key: session.execute(update(TrainerScheduleORM), [{"id": ..., ...}])
+        hit = hit.where(_SCHEDULE.c.id.in_([p["id"] for p in orm_execute_state.parameters if "id" in p]))
+    elif orm_execute_state.statement.whereclause is not None:
+        hit = hit.where(orm_execute_state.statement.whereclause)
+    changes = {tuple(row) for row in conn.execute(hit)}
+
+    result = orm_execute_state.invoke_statement()
+    if orm_execute_state.is_update and changes:
+        # The update may have moved rows to another trainer
+        changes |= {tuple(row) for row in conn.execute(
+            select(_SCHEDULE.c.trainer_id, _SCHEDULE.c.id).where(_SCHEDULE.c.id.in_([e for _, e in changes]))
+        )}
+    record_changes(conn, changes)
+    return result
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _record_after_flush(session, flush_context):
+    changes = session.info.pop("schedule_changes", None)
+    if changes:
+        record_changes(session.connection(), changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("schedule_changes", None)
+
+
+def prune_schedule_changes(days: int = SCHEDULE_CHANGE_RETENTION_DAYS) -> int:
+    """Drop changes older than `days` (a prefix of the log); clients behind it get a full window.
+
+    The newest change is always kept: the oldest seq left is how get_schedule tells pruned versions apart.
+    """
+    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    db = get_db_session()
+    try:
+        horizon = db.execute(select(func.max(_CHANGES.c.seq)).where(_CHANGES.c.changed_at < cutoff)).scalar()
+        if horizon is None:
+            return 0
+        newest = db.execute(select(func.max(_CHANGES.c.seq))).scalar()
+        deleted = db.execute(delete(_CHANGES).where(_CHANGES.c.seq <= min(horizon, newest - 1))).rowcount
+        db.commit()
+        return deleted
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,280 @@
+"""
+SMTP Delivery - pooled SMTP sessions and the background email queue.
+
+Opening an SMTP session costs a TCP connect, STARTTLS and an AUTH (or XOAUTH2)
+exchange, several round trips before the first message. SmtpPool keeps
+authenticated sessions per sender account (each gym's SMTP settings, or the global
+one) and sends many messages through each session. A session is reused until it has
+been idle SMTP_POOL_IDLE_TIMEOUT seconds or has sent SMTP_SESSION_MAX_MESSAGES
+messages. If the server dropped a reused session, the message goes out on a new one.
+
+EmailQueue is a bounded asyncio queue drained by SMTP_SENDERS sender tasks, each
+sending on its own pooled session in a dedicated thread pool. Callers in worker
+threads (trigger runs, routes through run_sync) submit a batch and wait for a
+result per message, and a full queue makes them wait (back-pressure). A call made on
+the event loop itself only queues its messages. Temporary failures (network errors,
+4xx replies) are retried with exponential backoff. 5xx replies fail at once. When
+the queue isn't running (scripts, tests), messages are sent inline through the pool
+with the same retries.
+"""
+import asyncio
+import os
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import logging
+logger = logging.getLogger("gym_app")
+
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))  # Idle sessions kept per sender account
+SMTP_POOL_IDLE_TIMEOUT = float(os.getenv("SMTP_POOL_IDLE_TIMEOUT", "30"))
+SMTP_SESSION_MAX_MESSAGES = int(os.getenv("SMTP_SESSION_MAX_MESSAGES", "100"))
+SMTP_SENDERS = int(os.getenv("SMTP_SENDERS", "4"))
+SMTP_QUEUE_SIZE = int(os.getenv("SMTP_QUEUE_SIZE", "1000"))
+SMTP_MAX_ATTEMPTS = 3
+SMTP_RETRY_BACKOFF = 2.0  # Seconds before the first retry; x4 for each further one
+
+
+def is_temporary(error: Exception) -> bool:
+    """Whether a failed send is worth retrying."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, OSError)  # Connection refused/reset, timeouts
+
+
+class _Session:
+    __slots__ = ("server", "sent", "last_used")
+
+    def __init__(self, server):
+        self.server = server
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+def _quit(session: _Session):
+    try:
+        session.server.quit()
+    except Exception:
+        try:
+            session.server.close()
+        except Exception:
+            pass
+
+
+class SmtpPool:
+    """Authenticated SMTP sessions kept open per sender account (EmailService.pool_key)."""
+
+    def __init__(self, max_idle: int = SMTP_POOL_SIZE, idle_timeout: float = SMTP_POOL_IDLE_TIMEOUT,
+                 max_messages: int = SMTP_SESSION_MAX_MESSAGES):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.stats = {"sessions_opened": 0, "messages_sent": 0}
+
+    def _checkout(self, key) -> Optional[_Session]:
+        expired = []
+        session = None
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate = idle.pop()  # Most recently used first
+                if now - candidate.last_used < self.idle_timeout:
+                    session = candidate
+                    break
+                expired.append(candidate)
+        for old in expired:
+            _quit(old)
+        return session
+
+    def _checkin(self, key, session: _Session):
+        session.last_used = time.monotonic()
+        if session.sent < self.max_messages:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(session)
+                    return
+        _quit(session)
+
+    def _open(self, service) -> _Session:
+        session = _Session(service.connect())
+        with self._lock:
+            self.stats["sessions_opened"] += 1
+        return session
+
+    def send(self, service, to_email: str, message: str):
+        """Send one message on a pooled session of the service's account. Raises on failure."""
+        key = service.pool_key()
+        session = self._checkout(key)
+        reused = session is not None
+        if session is None:
+            session = self._open(service)
+        try:
+            try:
+                session.server.sendmail(service.from_email, to_email, message)
+            except smtplib.SMTPServerDisconnected:
+                if not reused:
+                    raise
+                # The server closed the idle session: not a delivery failure
+                _quit(session)
+                session = self._open(service)
+                session.server.sendmail(service.from_email, to_email, message)
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # The server answered (sendmail reset the transaction): the session is still good
+            self._checkin(key, session)
+            raise
+        except Exception:
+            _quit(session)
+            raise
+        session.sent += 1
+        with self._lock:
+            self.stats["messages_sent"] += 1
+        self._checkin(key, session)
+
+    def close_all(self):
+        with self._lock:
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle = {}
+        for session in sessions:
+            _quit(session)
+
+
+def send_with_retry(pool: SmtpPool, service, to_email: str, message: str,
+                    max_attempts: int = SMTP_MAX_ATTEMPTS, backoff: float = SMTP_RETRY_BACKOFF) -> bool:
+    """Blocking send with retries; True once the server accepted the message."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            pool.send(service, to_email, message)
+            return True
+        except Exception as e:
+            if attempt == max_attempts or not is_temporary(e):
+                logger.error(f"Failed to send email to {to_email}: {e}")
+                return False
+            logger.warning(f"Email to {to_email} failed ({e}), retry {attempt}/{max_attempts - 1}")
+            time.sleep(backoff * 4 ** (attempt - 1))
+    return False
+
+
+class EmailQueue:
+    """Bounded queue of outgoing emails, sent by background tasks over the SMTP pool."""
+
+    def __init__(self, pool: SmtpPool, senders: int = SMTP_SENDERS, maxsize: int = SMTP_QUEUE_SIZE,
+                 max_attempts: int = SMTP_MAX_ATTEMPTS, backoff: float = SMTP_RETRY_BACKOFF):
+        self.pool = pool
+        self.senders = senders
+        self.maxsize = maxsize
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._tasks: List[asyncio.Task] = []
+        self._retries = set()
+        self._handoffs = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def send_many(self, service, messages: List[Tuple[str, str]]) -> List[bool]:
+        """Send (to_email, message) pairs from a worker thread; one result per message, in order."""
+        if not self.running:
+            return [send_with_retry(self.pool, service, to, message, self.max_attempts, self.backoff)
+                    for to, message in messages]
+        if threading.get_ident() == self._loop_thread:
+            # Never block the event loop on SMTP: queue the messages and report them as accepted
+            logger.warning(f"send_many called on the event loop, {len(messages)} emails queued without waiting")
+            for to, message in messages:
+                task = self._loop.create_task(self.submit(service, to, message))
+                self._handoffs.add(task)
+                task.add_done_callback(self._handoffs.discard)
+            return [True] * len(messages)
+        futures = [asyncio.run_coroutine_threadsafe(self.submit(service, to, message), self._loop)
+                   for to, message in messages]
+        return [future.result() for future in futures]
+
+    async def submit(self, service, to_email: str, message: str) -> bool:
+        """Queue a message (waits while the queue is full) and wait for its delivery result."""
+        result = self._loop.create_future()
+        await self._queue.put((service, to_email, message, result, 1))
+        return await result
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._executor = ThreadPoolExecutor(max_workers=self.senders, thread_name_prefix="smtp-sender")
+        self._tasks = [asyncio.create_task(self._sender()) for _ in range(self.senders)]
+        logger.info(f"Email queue started ({self.senders} senders)")
+
+    async def stop(self):
+        """Finish what is queued (waiting retries are failed), then close the SMTP sessions."""
+        if not self._tasks:
+            return
+        for task in list(self._retries):
+            task.cancel()
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=30)
+        except asyncio.TimeoutError:
+            logger.warning(f"Email queue stopped with {self._queue.qsize()} messages unsent")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while not self._queue.empty():
+            *_, result, _ = self._queue.get_nowait()
+            if not result.done():
+                result.set_result(False)
+        await self._loop.run_in_executor(self._executor, self.pool.close_all)
+        self._executor.shutdown(wait=False)
+        self._loop_thread = None
+
+    async def _sender(self):
+        while True:
+            service, to_email, message, result, attempt = await self._queue.get()
+            try:
+                await self._loop.run_in_executor(self._executor, self.pool.send, service, to_email, message)
+                if not result.done():
+                    result.set_result(True)
+            except Exception as e:
+                if attempt < self.max_attempts and is_temporary(e):
+                    logger.warning(f"Email to {to_email} failed ({e}), retry {attempt}/{self.max_attempts - 1}")
+                    retry = asyncio.create_task(self._retry(
+                        (service, to_email, message, result, attempt + 1), self.backoff * 4 ** (attempt - 1)
+                    ))
+                    self._retries.add(retry)
+                    retry.add_done_callback(self._retries.discard)
+                else:
+                    logger.error(f"Failed to send email to {to_email}: {e}")
+                    if not result.done():
+                        result.set_result(False)
+            finally:
+                self._queue.task_done()
+
+    async def _retry(self, item, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            await self._queue.put(item)
+        except asyncio.CancelledError:
+            result = item[3]
+            if not result.done():
+                result.set_result(False)
+            raise
+
+
+smtp_pool = SmtpPool()
+email_queue = EmailQueue(smtp_pool)
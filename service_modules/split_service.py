@@ -4,18 +4,27 @@ Split Service - handles weekly split CRUD and assignment operations.
 from .base import (
     HTTPException, uuid, json, logging, datetime, timedelta,
     get_db_session, WeeklySplitORM, WorkoutORM, UserORM,
-    TrainerScheduleORM, ClientScheduleORM
+    TrainerScheduleORM, ClientScheduleORM, ClientProfileORM
 )
+from .calendar_materializer import materialize
 from data import SPLITS_DB
 
 logger = logging.getLogger("gym_app")
 
+SPLIT_ASSIGN_DAYS = 28  # Default horizon: 4 weeks
+MAX_ASSIGN_DAYS = 366
+MAX_ASSIGN_CLIENTS = 200  # Clients per group assignment
+
+# Columns that make an existing calendar row the one an assignment would write
+_TRAINER_COMPARE = ("workout_id", "title", "time", "subtitle", "type", "duration", "completed")
+_CLIENT_COMPARE = ("workout_id", "title", "type", "details", "completed")
+
 
 class SplitService:
     """Service for managing weekly splits."""
 
     def __init__(self, workout_service=None):
-        """Initialize with optional workout service for assignment delegation."""
+        """Initialize with optional workout service (assignments write the calendars in bulk, not through it)."""
         self._workout_service = workout_service
 
     def get_splits(self, trainer_id: str) -> list:
@@ -144,16 +153,28 @@ class SplitService:
             db.close()
 
     def assign_split(self, assignment: dict, trainer_id: str) -> dict:
-        """Assign a split to a client or trainer's own schedule for 4 weeks."""
-        client_id = assignment.get("client_id")
+        """
+        Assign a split to a client, a group of clients ("client_ids") or the trainer's own
+        schedule, for 4 weeks or "days" days from "start_date". Clients must be the trainer's
+        own or in the trainer's gym.
+
+        The whole assignment is diffed against the calendars in bulk and committed once
+        (see calendar_materializer).
+        """
         split_id = assignment.get("split_id")
         start_date_str = assignment.get("start_date")
+        client_ids = list(dict.fromkeys(assignment.get("client_ids") or [assignment.get("client_id")]))
+        try:
+            days = int(assignment.get("days") or SPLIT_ASSIGN_DAYS)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="days must be a number")
+        if not 1 <= days <= MAX_ASSIGN_DAYS:
+            raise HTTPException(status_code=400, detail=f"days must be between 1 and {MAX_ASSIGN_DAYS}")
+        if len(client_ids) > MAX_ASSIGN_CLIENTS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_ASSIGN_CLIENTS} clients per assignment")
 
         db = get_db_session()
         try:
-            # Check if trainer is assigning to themselves
-            is_self_assignment = (client_id == trainer_id)
-
             # 1. Fetch Split (DB or Memory)
             split_schedule = None
             split_orm = db.query(WeeklySplitORM).filter(WeeklySplitORM.id == split_id).first()
@@ -192,89 +213,73 @@ class SplitService:
                 start_date = datetime.utcnow().date()
             weekday_map = {0: "Monday", 1: "Tuesday", 2: "Wednesday", 3: "Thursday", 4: "Friday", 5: "Saturday", 6: "Sunday"}
 
-            logs = []
-            success_count = 0
-            fail_count = 0
-
-            # Validate user exists
-            user = db.query(UserORM).filter(UserORM.id == client_id).first()
-            if not user:
+            # Validate users exist
+            found = {uid for (uid,) in db.query(UserORM.id).filter(UserORM.id.in_(client_ids))}
+            if len(found) < len(client_ids):
                 raise HTTPException(status_code=404, detail="User not found")
+            self._check_clients(db, [c for c in client_ids if c != trainer_id], trainer_id)
 
-            for day_offset in range(28):  # 4 Weeks
+            # Which workout falls on which date
+            plan = []
+            for day_offset in range(days):
                 current_date = start_date + timedelta(days=day_offset)
-                day_name = weekday_map[current_date.weekday()]
-
-                # Lookup in normalized map
-                workout_id = schedule_map.get(day_name)
-
+                workout_id = schedule_map.get(weekday_map[current_date.weekday()])
                 # If workout_id is dict (legacy edge case), extract id
                 if isinstance(workout_id, dict):
                     workout_id = workout_id.get("id")
-
                 if workout_id and workout_id != "rest":
-                    try:
-                        if is_self_assignment:
-                            # Assign to trainer's own schedule (TrainerScheduleORM)
-                            existing_workouts = db.query(TrainerScheduleORM).filter(
-                                TrainerScheduleORM.trainer_id == trainer_id,
-                                TrainerScheduleORM.date == current_date.isoformat(),
-                                TrainerScheduleORM.workout_id != None
-                            ).all()
-
-                            for existing in existing_workouts:
-                                db.delete(existing)
-
-                            # Get workout title for the event
-                            workout = db.query(WorkoutORM).filter(WorkoutORM.id == workout_id).first()
-                            workout_title = workout.title if workout else "Workout"
-
-                            # Create new trainer event
-                            new_event = TrainerScheduleORM(
-                                trainer_id=trainer_id,
-                                date=current_date.isoformat(),
-                                time="08:00",
-                                title=workout_title,
-                                subtitle="From Split",
-                                type="workout",
-                                duration=60,
-                                workout_id=workout_id
-                            )
-                            db.add(new_event)
-                            db.commit()
-
-                            logs.append(f"Assigned {workout_title} to {current_date}")
-                        else:
-                            # Assign to client schedule (ClientScheduleORM)
-                            if self._workout_service:
-                                self._workout_service.assign_workout({
-                                    "client_id": client_id,
-                                    "workout_id": workout_id,
-                                    "date": current_date.isoformat()
-                                })
-                            else:
-                                # Fallback: direct assignment
-                                self._assign_workout_to_client(db, client_id, workout_id, current_date.isoformat())
-                            logs.append(f"Assigned {workout_id} to {current_date}")
-
-                        success_count += 1
-                    except Exception as e:
-                        print(f"Assign Error for {current_date}: {e}")
-                        logs.append(f"Failed to assign {workout_id} on {current_date}: {str(e)}")
+                    plan.append((current_date, workout_id))
+            workouts = self._load_workouts(db, {workout_id for _, workout_id in plan})
+
+            logs = []
+            success_count = 0
+            fail_count = 0
+            trainer_rows, client_rows = [], []
+            for client_id in client_ids:
+                who = f"{client_id}: " if len(client_ids) > 1 else ""
+                for current_date, workout_id in plan:
+                    if client_id == trainer_id:
+                        # Assign to trainer's own schedule (TrainerScheduleORM)
+                        workout_title = workouts.get(workout_id, ("Workout", None))[0]
+                        trainer_rows.append({
+                            "trainer_id": trainer_id, "date": current_date.isoformat(), "time": "08:00",
+                            "title": workout_title, "subtitle": "From Split", "type": "workout",
+                            "duration": 60, "completed": False, "workout_id": workout_id,
+                        })
+                        logs.append(f"{who}Assigned {workout_title} to {current_date}")
+                    elif workout_id in workouts:
+                        title, difficulty = workouts[workout_id]
+                        client_rows.append({
+                            "client_id": client_id, "date": current_date.isoformat(), "title": title,
+                            "type": "workout", "completed": False, "workout_id": workout_id, "details": difficulty,
+                        })
+                        logs.append(f"{who}Assigned {workout_id} to {current_date}")
+                    else:
+                        logs.append(f"{who}Failed to assign {workout_id} on {current_date}: 404: Workout not found")
                         fail_count += 1
+                        continue
+                    success_count += 1
+
+            if fail_count:
+                missing = sorted({workout_id for _, workout_id in plan} - workouts.keys())
+                logger.warning(f"Split {split_id}: workouts not found: {missing}")
 
             if success_count == 0 and fail_count > 0:
                 raise HTTPException(status_code=400, detail=f"Failed to assign any workouts. Errors: {logs[:3]}...")
 
+            # The trainer's other events stay; only the day's workout is replaced
+            materialize(db, TrainerScheduleORM, trainer_rows, conflicts=TrainerScheduleORM.workout_id != None,
+                        compare=_TRAINER_COMPARE)
+            materialize(db, ClientScheduleORM, client_rows, compare=_CLIENT_COMPARE)
+
             # Track the assigned split on the client profile (always, even if split has no workouts)
-            if not is_self_assignment:
-                from models_orm import ClientProfileORM
-                profile = db.query(ClientProfileORM).filter(ClientProfileORM.id == client_id).first()
-                if profile:
-                    profile.current_split_id = split_id
-                    expiry_date = start_date + timedelta(days=27)
-                    profile.split_expiry_date = expiry_date.isoformat()
-                    db.commit()
+            expiry_date = (start_date + timedelta(days=days - 1)).isoformat()
+            for profile in db.query(ClientProfileORM).filter(
+                ClientProfileORM.id.in_([c for c in client_ids if c != trainer_id])
+            ):
+                profile.current_split_id = split_id
+                profile.split_expiry_date = expiry_date
+            db.commit()
 
             return {
                 "status": "success",
@@ -282,44 +287,38 @@ class SplitService:
                 "logs": logs,
                 "warnings": fail_count > 0
             }
+        except Exception:
+            db.rollback()
+            raise
         finally:
             db.close()
 
-    def _assign_workout_to_client(self, db, client_id: str, workout_id: str, date_str: str):
-        """Internal helper to assign a workout to a client's schedule."""
+    def _check_clients(self, db, client_ids: list, trainer_id: str):
+        """Raise 403 unless every client is the trainer's own or in the trainer's gym."""
+        if not client_ids:
+            return
+        trainer = db.query(UserORM.role, UserORM.gym_owner_id).filter(UserORM.id == trainer_id).first()
+        gym_id = None
+        if trainer:
+            gym_id = trainer_id if trainer.role == "owner" else trainer.gym_owner_id
+        allowed = ClientProfileORM.trainer_id == trainer_id
+        if gym_id:
+            allowed = allowed | (ClientProfileORM.gym_id == gym_id)
+        permitted = {cid for (cid,) in db.query(ClientProfileORM.id).filter(
+            ClientProfileORM.id.in_(client_ids), allowed
+        )}
+        if len(permitted) < len(client_ids):
+            raise HTTPException(status_code=403, detail="Client is not in your gym")
+
+    def _load_workouts(self, db, workout_ids: set) -> dict:
+        """{workout_id: (title, difficulty)} for the ids found in the DB or in memory."""
         from data import WORKOUTS_DB
 
-        workout_orm = db.query(WorkoutORM).filter(WorkoutORM.id == workout_id).first()
-
-        if not workout_orm:
+        found = {w.id: (w.title, w.difficulty) for w in db.query(WorkoutORM).filter(WorkoutORM.id.in_(workout_ids))}
+        for workout_id in workout_ids - found.keys():
             if workout_id in WORKOUTS_DB:
-                workout_data = WORKOUTS_DB[workout_id]
-                title = workout_data["title"]
-                difficulty = workout_data["difficulty"]
-            else:
-                raise HTTPException(status_code=404, detail="Workout not found")
-        else:
-            title = workout_orm.title
-            difficulty = workout_orm.difficulty
-
-        # Clean existing
-        db.query(ClientScheduleORM).filter(
-            ClientScheduleORM.client_id == client_id,
-            ClientScheduleORM.date == date_str
-        ).delete(synchronize_session=False)
-
-        # Assign
-        new_event = ClientScheduleORM(
-            client_id=client_id,
-            date=date_str,
-            title=title,
-            type="workout",
-            completed=False,
-            workout_id=workout_id,
-            details=difficulty
-        )
-        db.add(new_event)
-        db.commit()
+                found[workout_id] = (WORKOUTS_DB[workout_id]["title"], WORKOUTS_DB[workout_id]["difficulty"])
+        return found
 
 
 # Singleton instance
@@ -4,9 +4,11 @@ Trigger Check Service - detects trigger conditions and queues automated messages
 from .base import (
     HTTPException, json, logging, datetime, timedelta, date,
     get_db_session, ClientScheduleORM, ClientProfileORM, UserORM,
-    AutomatedMessageTemplateORM
+    AutomatedMessageTemplateORM, AutomatedMessageLogORM
 )
 from models_orm import AppointmentORM, ClientSubscriptionORM, SubscriptionPlanORM, PlanOfferORM, PaymentORM
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
 from typing import List, Dict, Optional
 import os
 from .automated_message_service import get_automated_message_service
@@ -52,18 +54,7 @@ class TriggerCheckService:
             # Process each gym
             for gid, gym_templates in gyms_templates.items():
                 results["gyms_processed"] += 1
-
-                for template in gym_templates:
-                    results["templates_checked"] += 1
-
-                    try:
-                        sent, skipped = self._process_template(gid, template)
-                        results["messages_sent"] += sent
-                        results["messages_skipped"] += skipped
-                    except Exception as e:
-                        error_msg = f"Error processing template {template.id}: {str(e)}"
-                        logger.error(error_msg)
-                        results["errors"].append(error_msg)
+                self._process_gym(gid, gym_templates, results)
 
             logger.info(f"Trigger check complete: {results}")
             return results
@@ -71,59 +62,141 @@ class TriggerCheckService:
         finally:
             db.close()
 
-    def _process_template(self, gym_id: str, template: AutomatedMessageTemplateORM) -> tuple:
-        """Process a single template and return (sent_count, skipped_count)."""
-        sent = 0
-        skipped = 0
-
+    def _trigger_key(self, template: AutomatedMessageTemplateORM) -> Optional[tuple]:
+        """(trigger_type, parameter) - templates with the same key share one evaluation."""
         trigger_config = json.loads(template.trigger_config) if template.trigger_config else {}
 
-        # Get matches based on trigger type
-        if template.trigger_type == "missed_workout":
-            matches = self.check_missed_workouts(gym_id)
+        if template.trigger_type in ("missed_workout", "no_show_appointment"):
+            return (template.trigger_type, None)
         elif template.trigger_type == "days_inactive":
-            threshold = trigger_config.get("days_threshold", 5)
-            matches = self.check_days_inactive(gym_id, threshold)
-        elif template.trigger_type == "no_show_appointment":
-            matches = self.check_no_show_appointments(gym_id)
+            return (template.trigger_type, trigger_config.get("days_threshold", 5))
         elif template.trigger_type == "subscription_canceled":
-            days_since = trigger_config.get("days_since_cancellation", 7)
-            matches = self.check_subscription_canceled(gym_id, days_since)
+            return (template.trigger_type, trigger_config.get("days_since_cancellation", 7))
         elif template.trigger_type == "payment_failed":
-            days_window = trigger_config.get("days_threshold", 3)
-            matches = self.check_payment_failed(gym_id, days_window)
+            return (template.trigger_type, trigger_config.get("days_threshold", 3))
         elif template.trigger_type == "upcoming_appointment":
-            hours_before = trigger_config.get("hours_before", 24)
-            matches = self.check_upcoming_appointments(gym_id, hours_before)
-        else:
-            logger.warning(f"Unknown trigger type: {template.trigger_type}")
-            return 0, 0
+            return (template.trigger_type, trigger_config.get("hours_before", 24))
+        return None
+
+    def _evaluate_trigger(self, gym_id: str, trigger_type: str, param) -> List[dict]:
+        """Run the set-based check for one trigger key."""
+        if trigger_type == "missed_workout":
+            return self.check_missed_workouts(gym_id)
+        elif trigger_type == "days_inactive":
+            return self.check_days_inactive(gym_id, param)
+        elif trigger_type == "no_show_appointment":
+            return self.check_no_show_appointments(gym_id)
+        elif trigger_type == "subscription_canceled":
+            return self.check_subscription_canceled(gym_id, param)
+        elif trigger_type == "payment_failed":
+            return self.check_payment_failed(gym_id, param)
+        elif trigger_type == "upcoming_appointment":
+            return self.check_upcoming_appointments(gym_id, param)
+        return []
+
+    def _process_gym(self, gym_id: str, templates: List[AutomatedMessageTemplateORM], results: dict):
+        """
+        Evaluate and send all templates of a gym.
+        Each trigger key is computed once, deduplication uses one log lookup for all
+        templates, and message contexts come from maps prefetched once per gym.
+        """
+        matches_by_key = {}
+        template_matches = []
+        for template in templates:
+            results["templates_checked"] += 1
+            try:
+                key = self._trigger_key(template)
+                if key is None:
+                    logger.warning(f"Unknown trigger type: {template.trigger_type}")
+                    continue
+                if key not in matches_by_key:
+                    matches_by_key[key] = self._evaluate_trigger(gym_id, *key)
+                template_matches.append((template, matches_by_key[key]))
+            except Exception as e:
+                error_msg = f"Error processing template {template.id}: {str(e)}"
+                logger.error(error_msg)
+                results["errors"].append(error_msg)
+
+        if not any(matches for _, matches in template_matches):
+            return
+
+        sent_log = self._load_sent_log([t.id for t, _ in template_matches], within_hours=24)
+        context_data = self._load_context_data(
+            gym_id, offer_ids=[t.linked_offer_id for t, _ in template_matches if t.linked_offer_id]
+        )
+
+        for template, matches in template_matches:
+            try:
+                sent, skipped = self._send_matches(gym_id, template, matches, sent_log, context_data)
+                results["messages_sent"] += sent
+                results["messages_skipped"] += skipped
+            except Exception as e:
+                error_msg = f"Error processing template {template.id}: {str(e)}"
+                logger.error(error_msg)
+                results["errors"].append(error_msg)
+
+    def _load_sent_log(self, template_ids: List[str], within_hours: int = 24) -> dict:
+        """
+        Recent automated message log for the given templates, for deduplication.
+        Mirrors AutomatedMessageService.was_message_sent: a match with a trigger reference
+        is a duplicate if that reference was logged, one without if anything was logged.
+        """
+        db = get_db_session()
+        try:
+            cutoff = (datetime.utcnow() - timedelta(hours=within_hours)).isoformat()
+            rows = db.query(
+                AutomatedMessageLogORM.template_id,
+                AutomatedMessageLogORM.client_id,
+                AutomatedMessageLogORM.trigger_reference
+            ).filter(
+                AutomatedMessageLogORM.template_id.in_(template_ids),
+                AutomatedMessageLogORM.triggered_at >= cutoff
+            ).all()
+            return {
+                "refs": {(t, c, r) for t, c, r in rows},
+                "clients": {(t, c) for t, c, _ in rows},
+            }
+        finally:
+            db.close()
+
+    def _send_matches(self, gym_id: str, template: AutomatedMessageTemplateORM, matches: List[dict],
+                      sent_log: dict, context_data: dict) -> tuple:
+        """Send a template to its matches and return (sent_count, skipped_count)."""
+        sent = 0
+        skipped = 0
 
-        # Process each match
         auto_msg_service = get_automated_message_service()
         dispatch_service = get_message_dispatch_service()
 
+        # Get delivery methods
+        delivery_methods = json.loads(template.delivery_methods) if template.delivery_methods else ["in_app"]
+        pending_emails = []  # (client_id, trigger_ref, subject, message)
+
         for match in matches:
             client_id = match["client_id"]
             trigger_ref = match.get("trigger_reference")
 
             # Check deduplication
-            if auto_msg_service.was_message_sent(template.id, client_id, trigger_ref, within_hours=24):
+            if trigger_ref:
+                already_sent = (template.id, client_id, trigger_ref) in sent_log["refs"]
+            else:
+                already_sent = (template.id, client_id) in sent_log["clients"]
+            if already_sent:
                 skipped += 1
                 continue
 
             # Build context for variable substitution
-            context = self._build_context(match, gym_id=gym_id, linked_offer_id=template.linked_offer_id)
+            context = self._context_for(match, gym_id, template.linked_offer_id, context_data)
 
             # Substitute variables in message
             message = auto_msg_service.substitute_variables(template.message_template, context)
             subject = auto_msg_service.substitute_variables(template.subject, context) if template.subject else None
 
-            # Get delivery methods
-            delivery_methods = json.loads(template.delivery_methods) if template.delivery_methods else ["in_app"]
-
-            # Send via each delivery method
+            # Send via each delivery method; emails go out together after the loop
             for method in delivery_methods:
+                if method == "email":
+                    pending_emails.append((client_id, trigger_ref, subject or template.name, message))
+                    continue
                 try:
                     success = dispatch_service.send_message(
                         client_id=client_id,
@@ -170,10 +243,87 @@ class TriggerCheckService:
                     )
                     skipped += 1
 
+            # Later matches in this run see what was just logged
+            sent_log["refs"].add((template.id, client_id, trigger_ref))
+            sent_log["clients"].add((template.id, client_id))
+
+        if pending_emails:
+            # One batch over pooled SMTP sessions instead of a connection per recipient
+            try:
+                results = dispatch_service.send_emails(
+                    [(client_id, subject, message) for client_id, _, subject, message in pending_emails],
+                    gym_id=gym_id
+                )
+                errors = [None] * len(pending_emails)
+            except Exception as e:
+                logger.error(f"Error sending emails: {e}")
+                results, errors = [False] * len(pending_emails), [str(e)] * len(pending_emails)
+
+            for (client_id, trigger_ref, _, _), success, error in zip(pending_emails, results, errors):
+                auto_msg_service.log_message(
+                    template_id=template.id,
+                    client_id=client_id,
+                    gym_id=gym_id,
+                    trigger_type=template.trigger_type,
+                    trigger_ref=trigger_ref,
+                    delivery_method="email",
+                    status="sent" if success else "failed",
+                    error_message=error
+                )
+                if success:
+                    sent += 1
+                else:
+                    skipped += 1
+
         return sent, skipped
 
-    def _build_context(self, match: dict, gym_id: str = None, linked_offer_id: str = None) -> dict:
-        """Build context dictionary for variable substitution."""
+    def _load_context_data(self, gym_id: str = None, offer_ids: List[str] = None, client_ids: List[str] = None) -> dict:
+        """
+        Prefetch what message contexts need: gym name, trainer name per client and linked offers.
+        Trainer names cover the gym's clients, or just client_ids when given.
+        """
+        data = {"gym_name": "", "trainer_names": {}, "offers": {}}
+        db = get_db_session()
+        try:
+            if gym_id:
+                gym_user = db.query(UserORM.username).filter(UserORM.id == gym_id).first()
+                if gym_user:
+                    data["gym_name"] = gym_user[0] or ""
+
+            trainer_query = db.query(ClientProfileORM.id, UserORM.username).join(
+                UserORM, UserORM.id == ClientProfileORM.trainer_id
+            )
+            if client_ids is not None:
+                trainer_query = trainer_query.filter(ClientProfileORM.id.in_(client_ids))
+            elif gym_id:
+                trainer_query = trainer_query.filter(ClientProfileORM.gym_id == gym_id)
+            else:
+                trainer_query = None
+            if trainer_query is not None:
+                data["trainer_names"] = {client_id: name or "" for client_id, name in trainer_query.all()}
+
+            # Load linked offer details
+            if offer_ids:
+                offers = db.query(PlanOfferORM).filter(
+                    PlanOfferORM.id.in_(set(offer_ids)),
+                    PlanOfferORM.is_active == True
+                ).all()
+                for offer in offers:
+                    data["offers"][offer.id] = {
+                        "offer_title": offer.title or "",
+                        "discount_value": str(int(offer.discount_value) if offer.discount_value == int(offer.discount_value) else offer.discount_value),
+                        "discount_symbol": "%" if offer.discount_type == "percent" else "€",
+                        "coupon_code": offer.coupon_code or "",
+                        "offer_expires": offer.expires_at or "nessuna scadenza",
+                    }
+        except Exception as e:
+            logger.exception("Failed to build offer context for trigger check")
+        finally:
+            db.close()
+        return data
+
+    def _context_for(self, match: dict, gym_id: str, linked_offer_id: str, context_data: dict) -> dict:
+        """Build context dictionary for variable substitution from prefetched data."""
         ctx = {
             "client_name": match.get("client_name", ""),
             "days_inactive": str(match.get("days_inactive", "")),
@@ -196,47 +346,31 @@ class TriggerCheckService:
             "checkout_link": "",
         }
 
-        # Enrich with gym name, trainer name, and linked offer
-        if gym_id or match.get("client_id") or linked_offer_id:
-            db = get_db_session()
-            try:
-                if gym_id and not ctx["gym_name"]:
-                    gym_user = db.query(UserORM).filter(UserORM.id == gym_id).first()
-                    if gym_user:
-                        ctx["gym_name"] = gym_user.username or ""
-
-                if match.get("client_id") and not ctx["trainer_name"]:
-                    profile = db.query(ClientProfileORM).filter(
-                        ClientProfileORM.id == match["client_id"]
-                    ).first()
-                    if profile and profile.trainer_id:
-                        trainer = db.query(UserORM).filter(UserORM.id == str(profile.trainer_id)).first()
-                        if trainer:
-                            ctx["trainer_name"] = trainer.username or ""
-
-                # Load linked offer details
-                if linked_offer_id:
-                    offer = db.query(PlanOfferORM).filter(
-                        PlanOfferORM.id == linked_offer_id,
-                        PlanOfferORM.is_active == True
-                    ).first()
-                    if offer:
-                        ctx["offer_title"] = offer.title or ""
-                        ctx["discount_value"] = str(int(offer.discount_value) if offer.discount_value == int(offer.discount_value) else offer.discount_value)
-                        ctx["discount_symbol"] = "%" if offer.discount_type == "percent" else "€"
-                        ctx["coupon_code"] = offer.coupon_code or ""
-                        ctx["offer_expires"] = offer.expires_at or "nessuna scadenza"
-                        # Build checkout link
-                        base = os.environ.get("SERVER_BASE_URL", "http://localhost:9008")
-                        client_id = match.get("client_id", "")
-                        ctx["checkout_link"] = f"{base}/api/redeem/{linked_offer_id}?client_id={client_id}"
-            except Exception as e:
-                logger.exception("Failed to build offer context for trigger check")
-            finally:
-                db.close()
+        if gym_id:
+            ctx["gym_name"] = context_data["gym_name"]
+
+        if match.get("client_id") and not ctx["trainer_name"]:
+            ctx["trainer_name"] = context_data["trainer_names"].get(match["client_id"], "")
+
+        offer = context_data["offers"].get(linked_offer_id) if linked_offer_id else None
+        if offer:
+            ctx.update(offer)
+            # Build checkout link
+            base = os.environ.get("SERVER_BASE_URL", "http://localhost:9008")
+            client_id = match.get("client_id", "")
+            ctx["checkout_link"] = f"{base}/api/redeem/{linked_offer_id}?client_id={client_id}"
 
         return ctx
 
+    def _build_context(self, match: dict, gym_id: str = None, linked_offer_id: str = None) -> dict:
+        """Build context dictionary for variable substitution for a single match."""
+        context_data = self._load_context_data(
+            gym_id,
+            offer_ids=[linked_offer_id] if linked_offer_id else None,
+            client_ids=[match["client_id"]] if match.get("client_id") else [],
+        )
+        return self._context_for(match, gym_id, linked_offer_id, context_data)
+
     def check_missed_workouts(self, gym_id: str) -> List[dict]:
         """
         Find clients with scheduled workouts that were not completed.
@@ -246,35 +380,25 @@ class TriggerCheckService:
         try:
             today = date.today().isoformat()
 
-            # Get all clients in this gym
-            clients = db.query(ClientProfileORM).filter(
-                ClientProfileORM.gym_id == gym_id
-            ).all()
-            client_ids = [c.user_id for c in clients]
-
-            if not client_ids:
-                return []
-
-            # Find missed workouts (past date, not completed)
-            missed = db.query(ClientScheduleORM).filter(
-                ClientScheduleORM.client_id.in_(client_ids),
+            # Missed workouts (past date, not completed) of this gym's clients, with client names
+            missed = db.query(
+                ClientScheduleORM.id, ClientScheduleORM.client_id, ClientScheduleORM.title,
+                ClientScheduleORM.date, UserORM.username
+            ).join(
+                ClientProfileORM, ClientProfileORM.id == ClientScheduleORM.client_id
+            ).outerjoin(
+                UserORM, UserORM.id == ClientScheduleORM.client_id
+            ).filter(
+                ClientProfileORM.gym_id == gym_id,
                 ClientScheduleORM.date < today,
                 ClientScheduleORM.completed == False,
                 ClientScheduleORM.type == "workout"
             ).all()
 
-            # Get client names
-            client_names = {}
-            if missed:
-                users = db.query(UserORM).filter(
-                    UserORM.id.in_([m.client_id for m in missed])
-                ).all()
-                client_names = {u.id: u.username for u in users}
-
             return [
                 {
                     "client_id": m.client_id,
-                    "client_name": client_names.get(m.client_id, ""),
+                    "client_name": m.username or "",
                     "workout_title": m.title or "Workout",
                     "date": m.date,
                     "trigger_reference": f"schedule_{m.id}"
@@ -293,58 +417,73 @@ class TriggerCheckService:
         db = get_db_session()
         try:
             today = date.today()
-            cutoff_date = (today - timedelta(days=threshold_days)).isoformat()
 
-            # Get all clients in this gym
-            clients = db.query(ClientProfileORM).filter(
+            # Last completed workout per client of this gym
+            last_workouts = db.query(
+                ClientScheduleORM.client_id.label("client_id"),
+                func.max(ClientScheduleORM.date).label("last_date")
+            ).join(
+                ClientProfileORM, ClientProfileORM.id == ClientScheduleORM.client_id
+            ).filter(
+                ClientProfileORM.gym_id == gym_id,
+                ClientScheduleORM.type == "workout",
+                ClientScheduleORM.completed == True
+            ).group_by(ClientScheduleORM.client_id).subquery()
+
+            clients = db.query(
+                ClientProfileORM.id, UserORM.username, last_workouts.c.last_date
+            ).outerjoin(
+                UserORM, UserORM.id == ClientProfileORM.id
+            ).outerjoin(
+                last_workouts, last_workouts.c.client_id == ClientProfileORM.id
+            ).filter(
                 ClientProfileORM.gym_id == gym_id
             ).all()
 
-            if not clients:
-                return []
-
-            # Get client names
-            user_ids = [c.user_id for c in clients]
-            users = db.query(UserORM).filter(UserORM.id.in_(user_ids)).all()
-            client_names = {u.id: u.username for u in users}
-
             results = []
-            for client in clients:
-                # Find last completed workout
-                last_workout = db.query(ClientScheduleORM).filter(
-                    ClientScheduleORM.client_id == client.user_id,
-                    ClientScheduleORM.type == "workout",
-                    ClientScheduleORM.completed == True
-                ).order_by(ClientScheduleORM.date.desc()).first()
-
-                if last_workout:
-                    last_date = datetime.strptime(last_workout.date, "%Y-%m-%d").date()
+            for client_id, username, last_date_str in clients:
+                if last_date_str:
+                    try:
+                        last_date = datetime.strptime(last_date_str, "%Y-%m-%d").date()
+                    except ValueError:
+                        continue
                     days_inactive = (today - last_date).days
-
-                    if days_inactive >= threshold_days:
-                        results.append({
-                            "client_id": client.user_id,
-                            "client_name": client_names.get(client.user_id, ""),
-                            "days_inactive": days_inactive,
-                            "last_workout_date": last_workout.date,
-                            "trigger_reference": f"inactive_{client.user_id}_{today.isoformat()}"
-                        })
+                    if days_inactive < threshold_days:
+                        continue
                 else:
-                    # No workouts ever - check account age
-                    # For simplicity, treat as inactive if no workouts at all
-                    results.append({
-                        "client_id": client.user_id,
-                        "client_name": client_names.get(client.user_id, ""),
-                        "days_inactive": threshold_days,
-                        "last_workout_date": None,
-                        "trigger_reference": f"inactive_{client.user_id}_{today.isoformat()}"
-                    })
+                    # No workouts ever - treat as inactive
+                    days_inactive = threshold_days
+
+                results.append({
+                    "client_id": client_id,
+                    "client_name": username or "",
+                    "days_inactive": days_inactive,
+                    "last_workout_date": last_date_str,
+                    "trigger_reference": f"inactive_{client_id}_{today.isoformat()}"
+                })
 
             return results
 
         finally:
             db.close()
 
+    def _appointment_matches(self, db, gym_id: str, *filters) -> list:
+        """Appointments of this gym's clients matching filters, with client and trainer names."""
+        trainer = aliased(UserORM)
+        return db.query(
+            AppointmentORM.id, AppointmentORM.client_id, AppointmentORM.trainer_id,
+            AppointmentORM.date, AppointmentORM.start_time,
+            UserORM.username.label("client_name"), trainer.username.label("trainer_name")
+        ).join(
+            ClientProfileORM, ClientProfileORM.id == AppointmentORM.client_id
+        ).outerjoin(
+            UserORM, UserORM.id == AppointmentORM.client_id
+        ).outerjoin(
+            trainer, trainer.id == AppointmentORM.trainer_id
+        ).filter(
+            ClientProfileORM.gym_id == gym_id, *filters
+        ).all()
+
     def check_no_show_appointments(self, gym_id: str) -> List[dict]:
         """
         Find appointments where client didn't show up.
@@ -354,38 +493,18 @@ class TriggerCheckService:
         try:
             today = date.today().isoformat()
 
-            # Get all clients in this gym
-            clients = db.query(ClientProfileORM).filter(
-                ClientProfileORM.gym_id == gym_id
-            ).all()
-            client_ids = [c.user_id for c in clients]
-
-            if not client_ids:
-                return []
-
-            # Find past appointments that are still "scheduled" (not completed, not canceled)
-            no_shows = db.query(AppointmentORM).filter(
-                AppointmentORM.client_id.in_(client_ids),
+            # Past appointments that are still "scheduled" (not completed, not canceled)
+            no_shows = self._appointment_matches(
+                db, gym_id,
                 AppointmentORM.date < today,
                 AppointmentORM.status == "scheduled"
-            ).all()
-
-            if not no_shows:
-                return []
-
-            # Get client and trainer names
-            all_user_ids = list(set(
-                [a.client_id for a in no_shows] +
-                [a.trainer_id for a in no_shows if a.trainer_id]
-            ))
-            users = db.query(UserORM).filter(UserORM.id.in_(all_user_ids)).all()
-            user_names = {u.id: u.username for u in users}
+            )
 
             return [
                 {
                     "client_id": a.client_id,
-                    "client_name": user_names.get(a.client_id, ""),
-                    "trainer_name": user_names.get(a.trainer_id, "") if a.trainer_id else "",
+                    "client_name": a.client_name or "",
+                    "trainer_name": (a.trainer_name or "") if a.trainer_id else "",
                     "appointment_date": a.date,
                     "appointment_time": a.start_time,
                     "trigger_reference": f"appointment_{a.id}"
@@ -406,18 +525,19 @@ class TriggerCheckService:
         try:
             today = date.today()
 
-            clients = db.query(ClientProfileORM).filter(
-                ClientProfileORM.gym_id == gym_id
-            ).all()
-
-            if not clients:
-                return []
-
-            client_ids = [c.id for c in clients]
-
-            # Find canceled/past_due subscriptions
-            canceled_subs = db.query(ClientSubscriptionORM).filter(
-                ClientSubscriptionORM.client_id.in_(client_ids),
+            # Canceled/past_due subscriptions of this gym's clients, with client and plan names
+            canceled_subs = db.query(
+                ClientSubscriptionORM.id, ClientSubscriptionORM.client_id, ClientSubscriptionORM.canceled_at,
+                ClientSubscriptionORM.current_period_end, ClientSubscriptionORM.created_at,
+                UserORM.username, SubscriptionPlanORM.name.label("plan_name")
+            ).join(
+                ClientProfileORM, ClientProfileORM.id == ClientSubscriptionORM.client_id
+            ).outerjoin(
+                UserORM, UserORM.id == ClientSubscriptionORM.client_id
+            ).outerjoin(
+                SubscriptionPlanORM, SubscriptionPlanORM.id == ClientSubscriptionORM.plan_id
+            ).filter(
+                ClientProfileORM.gym_id == gym_id,
                 ClientSubscriptionORM.gym_id == gym_id,
                 ClientSubscriptionORM.status.in_(['canceled', 'past_due']),
             ).all()
@@ -425,9 +545,13 @@ class TriggerCheckService:
             if not canceled_subs:
                 return []
 
-            # Get user names
-            users = db.query(UserORM).filter(UserORM.id.in_(client_ids)).all()
-            user_names = {u.id: u.username for u in users}
+            # Clients that still have an active subscription here
+            active_clients = {
+                row[0] for row in db.query(ClientSubscriptionORM.client_id).filter(
+                    ClientSubscriptionORM.gym_id == gym_id,
+                    ClientSubscriptionORM.status == "active"
+                ).distinct().all()
+            }
 
             results = []
             for sub in canceled_subs:
@@ -446,27 +570,13 @@ class TriggerCheckService:
                 if days_since > days_since_threshold:
                     continue
 
-                # Verify no active subscription exists
-                active = db.query(ClientSubscriptionORM).filter(
-                    ClientSubscriptionORM.client_id == sub.client_id,
-                    ClientSubscriptionORM.gym_id == gym_id,
-                    ClientSubscriptionORM.status == "active"
-                ).first()
-                if active:
+                if sub.client_id in active_clients:
                     continue
 
-                # Get plan name
-                plan_name = ""
-                if sub.plan_id:
-                    plan = db.query(SubscriptionPlanORM).filter(
-                        SubscriptionPlanORM.id == sub.plan_id
-                    ).first()
-                    plan_name = plan.name if plan else ""
-
                 results.append({
                     "client_id": sub.client_id,
-                    "client_name": user_names.get(sub.client_id, ""),
-                    "plan_name": plan_name,
+                    "client_name": sub.username or "",
+                    "plan_name": sub.plan_name or "",
                     "canceled_at": cancel_date_str,
                     "days_since_cancellation": days_since,
                     "trigger_reference": f"sub_canceled_{sub.id}"
@@ -488,32 +598,12 @@ class TriggerCheckService:
             today = date.today()
             tomorrow = today + timedelta(days=1)
 
-            # Get all clients in this gym
-            clients = db.query(ClientProfileORM).filter(
-                ClientProfileORM.gym_id == gym_id
-            ).all()
-            client_ids = [c.user_id for c in clients]
-
-            if not client_ids:
-                return []
-
-            # Find upcoming appointments within the window (today and tomorrow)
-            upcoming = db.query(AppointmentORM).filter(
-                AppointmentORM.client_id.in_(client_ids),
+            # Upcoming appointments within the window (today and tomorrow)
+            upcoming = self._appointment_matches(
+                db, gym_id,
                 AppointmentORM.status == "scheduled",
                 AppointmentORM.date.in_([today.isoformat(), tomorrow.isoformat()])
-            ).all()
-
-            if not upcoming:
-                return []
-
-            # Get user names
-            all_user_ids = list(set(
-                [a.client_id for a in upcoming] +
-                [a.trainer_id for a in upcoming if a.trainer_id]
-            ))
-            users = db.query(UserORM).filter(UserORM.id.in_(all_user_ids)).all()
-            user_names = {u.id: u.username for u in users}
+            )
 
             results = []
             for a in upcoming:
@@ -528,8 +618,8 @@ class TriggerCheckService:
                 if 0 < hours_until <= hours_before:
                     results.append({
                         "client_id": a.client_id,
-                        "client_name": user_names.get(a.client_id, ""),
-                        "trainer_name": user_names.get(a.trainer_id, "") if a.trainer_id else "",
+                        "client_name": a.client_name or "",
+                        "trainer_name": (a.trainer_name or "") if a.trainer_id else "",
                         "appointment_date": a.date,
                         "appointment_time": a.start_time,
                         "trigger_reference": f"upcoming_appt_{a.id}_{a.date}"
@@ -549,55 +639,32 @@ class TriggerCheckService:
         try:
             cutoff = (date.today() - timedelta(days=days_window)).isoformat()
 
-            # Get all clients in this gym
-            clients = db.query(ClientProfileORM).filter(
-                ClientProfileORM.gym_id == gym_id
-            ).all()
-            client_ids = [c.user_id for c in clients]
-
-            if not client_ids:
-                return []
-
-            # Find recent failed payments
-            failed = db.query(PaymentORM).filter(
-                PaymentORM.client_id.in_(client_ids),
+            # Recent failed payments of this gym's clients, with client and plan names
+            failed = db.query(
+                PaymentORM.id, PaymentORM.client_id, PaymentORM.amount, PaymentORM.currency,
+                PaymentORM.subscription_id, UserORM.username, SubscriptionPlanORM.name.label("plan_name")
+            ).join(
+                ClientProfileORM, ClientProfileORM.id == PaymentORM.client_id
+            ).outerjoin(
+                UserORM, UserORM.id == PaymentORM.client_id
+            ).outerjoin(
+                ClientSubscriptionORM, ClientSubscriptionORM.id == PaymentORM.subscription_id
+            ).outerjoin(
+                SubscriptionPlanORM, SubscriptionPlanORM.id == ClientSubscriptionORM.plan_id
+            ).filter(
+                ClientProfileORM.gym_id == gym_id,
                 PaymentORM.gym_id == gym_id,
                 PaymentORM.status == "failed",
                 PaymentORM.created_at >= cutoff
             ).all()
 
-            if not failed:
-                return []
-
-            # Get client names
-            users = db.query(UserORM).filter(
-                UserORM.id.in_([p.client_id for p in failed])
-            ).all()
-            user_names = {u.id: u.username for u in users}
-
-            # Get plan names via subscription
-            sub_ids = [p.subscription_id for p in failed if p.subscription_id]
-            plan_names = {}
-            if sub_ids:
-                subs = db.query(ClientSubscriptionORM).filter(
-                    ClientSubscriptionORM.id.in_(sub_ids)
-                ).all()
-                plan_ids = [s.plan_id for s in subs if s.plan_id]
-                if plan_ids:
-                    plans = db.query(SubscriptionPlanORM).filter(
-                        SubscriptionPlanORM.id.in_(plan_ids)
-                    ).all()
-                    plan_map = {p.id: p.name for p in plans}
-                    for s in subs:
-                        plan_names[s.id] = plan_map.get(s.plan_id, "")
-
             return [
                 {
                     "client_id": p.client_id,
-                    "client_name": user_names.get(p.client_id, ""),
+                    "client_name": p.username or "",
                     "amount": str(p.amount or 0),
                     "currency": p.currency or "eur",
-                    "plan_name": plan_names.get(p.subscription_id, ""),
+                    "plan_name": p.plan_name or "",
                     "trigger_reference": f"payment_failed_{p.id}"
                 }
                 for p in failed
@@ -622,48 +689,16 @@ class TriggerCheckService:
             if not templates:
                 return
 
-            auto_msg_service = get_automated_message_service()
-            dispatch_service = get_message_dispatch_service()
+            match = {**match_data, "client_id": client_id}
+            sent_log = self._load_sent_log([t.id for t in templates], within_hours=24)
+            context_data = self._load_context_data(
+                gym_id,
+                offer_ids=[t.linked_offer_id for t in templates if t.linked_offer_id],
+                client_ids=[client_id],
+            )
 
             for template in templates:
-                trigger_ref = match_data.get("trigger_reference")
-
-                if auto_msg_service.was_message_sent(template.id, client_id, trigger_ref, within_hours=24):
-                    continue
-
-                context = self._build_context(match_data, gym_id=gym_id, linked_offer_id=template.linked_offer_id)
-                message = auto_msg_service.substitute_variables(template.message_template, context)
-                subject = auto_msg_service.substitute_variables(template.subject, context) if template.subject else None
-
-                delivery_methods = json.loads(template.delivery_methods) if template.delivery_methods else ["in_app"]
-
-                for method in delivery_methods:
-                    try:
-                        success = dispatch_service.send_message(
-                            client_id=client_id,
-                            delivery_method=method,
-                            title=template.name,
-                            message=message,
-                            subject=subject,
-                            data={
-                                "template_id": template.id,
-                                "trigger_type": trigger_type,
-                                "trigger_reference": trigger_ref,
-                                **({"coupon_code": context["coupon_code"], "offer_title": context["offer_title"]} if context.get("coupon_code") else {}),
-                            },
-                            gym_id=gym_id
-                        )
-                        auto_msg_service.log_message(
-                            template_id=template.id,
-                            client_id=client_id,
-                            gym_id=gym_id,
-                            trigger_type=trigger_type,
-                            trigger_ref=trigger_ref,
-                            delivery_method=method,
-                            status="sent" if success else "failed"
-                        )
-                    except Exception as e:
-                        logger.error(f"Error in fire_for_client: {e}")
+                self._send_matches(gym_id, template, [match], sent_log, context_data)
 
         except Exception as e:
             logger.error(f"Error in fire_for_client: {e}")
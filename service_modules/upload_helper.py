@@ -1,13 +1,23 @@
 """
 Upload Helper - Unified file upload for all routes.
 Priority: Supabase Storage > Cloudinary > local filesystem.
+
+Images go through save_image(): decoding, resizing and encoding run in the CPU
+process pool (cpu_tasks.process_image), which emits thumb/feed/full variants as
+WebP plus a JPEG fallback. The full JPEG URL is what routes store on their rows;
+the other variants are recorded in image_variants under that URL.
 """
 import os
 import io
+import json
+import shutil
 import uuid
+import asyncio
 import logging
 from datetime import datetime
-from typing import Tuple, Optional
+from typing import Dict, Iterable, Tuple, Optional
+
+from cpu_tasks import run_cpu, process_image
 
 logger = logging.getLogger("gym_app")
 
@@ -19,6 +29,7 @@ MAX_IMAGE_SIZE = 5 * 1024 * 1024    # 5MB
 MAX_DOC_SIZE = 10 * 1024 * 1024     # 10MB
 MAX_VIDEO_SIZE = 50 * 1024 * 1024   # 50MB (Supabase free tier limit)
 MAX_AUDIO_SIZE = 20 * 1024 * 1024   # 20MB
+STREAM_CHUNK_SIZE = 1024 * 1024      # Read size when storing from a file object
 
 # Supabase Storage config — read at call time, not import time
 def _get_supabase_url():
@@ -67,7 +78,7 @@ def _is_cloudinary_ready() -> bool:
 
 
 def _optimize_image(content: bytes, max_size: tuple = (400, 400), crop_square: bool = False) -> Tuple[bytes, str]:
-    """Optimize image with Pillow. Returns (bytes, extension)."""
+    """Optimize image with Pillow. Returns (bytes, extension). Blocking: async routes use save_image()."""
     try:
         from PIL import Image
         img = Image.open(io.BytesIO(content))
@@ -101,6 +112,32 @@ async def save_file(
     Save a file to Supabase Storage (preferred) > Cloudinary > local disk.
     Returns the URL/path to the saved file.
     """
+    return _store_file(content, folder, filename, upload_type)
+
+
+def store_stream(fileobj, folder: str, filename: str, size: int, upload_type: str = "image") -> str:
+    """
+    Like save_file, for a seekable binary file object (spooled upload, temp file)
+    that is never read into memory as a whole. Blocking: call through run_sync.
+    """
+    fileobj.seek(0)
+    if _is_supabase_ready():
+        return _upload_supabase(_iter_chunks(fileobj), folder, filename, size=size)
+    elif _is_cloudinary_ready():
+        return _upload_cloudinary(fileobj, folder, filename, upload_type, large=True)
+    else:
+        return _save_local(fileobj, folder, filename)
+
+
+def _iter_chunks(fileobj, chunk_size: int = STREAM_CHUNK_SIZE):
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _store_file(content: bytes, folder: str, filename: str, upload_type: str = "image") -> str:
     if _is_supabase_ready():
         return _upload_supabase(content, folder, filename)
     elif _is_cloudinary_ready():
@@ -109,8 +146,126 @@ async def save_file(
         return _save_local(content, folder, filename)
 
 
-def _upload_supabase(content: bytes, folder: str, filename: str) -> str:
-    """Upload to Supabase Storage and return the public/signed URL."""
+async def save_image(
+    content: bytes,
+    folder: str,
+    stem: str,
+    max_size: tuple = (1200, 1200),
+    crop_square: bool = False,
+    owner_id: Optional[str] = None,
+    upload_type: str = "image",
+) -> Tuple[str, Dict[str, dict]]:
+    """
+    Resize an uploaded image off the event loop and store its variants.
+
+    Files are named {stem}.jpg / {stem}.webp (full) and {stem}_feed.*, {stem}_thumb.*.
+    Returns (url, variants): url is the full-size JPEG, variants maps
+    thumb/feed/full to {"width", "height", "size" (JPEG bytes), "jpg", "webp"}.
+    upload_type is passed to storage as with save_file().
+    """
+    from database import run_sync
+
+    try:
+        rendered = await run_cpu(process_image, content, max_size, crop_square)
+    except ImportError:
+        # Pillow not installed: store the upload as-is, without variants
+        url = await run_sync(_store_file, content, folder, f"{stem}.jpg", upload_type)
+        return url, {}
+
+    cloudinary = not _is_supabase_ready() and _is_cloudinary_ready()
+
+    def store(name: str, fmt: str, data: bytes) -> str:
+        filename = f"{stem}.{fmt}" if name == "full" else f"{stem}_{name}.{fmt}"
+        return _store_file(data, folder, filename, upload_type)
+
+    names = list(rendered)
+    jpg_urls = await asyncio.gather(*(run_sync(store, name, "jpg", rendered[name]["jpg"]) for name in names))
+    if cloudinary:
+        # Cloudinary converts on delivery from the URL extension; a second upload
+        # would also collide with the JPEG's public_id
+        webp_urls = [url.rsplit(".", 1)[0] + ".webp" for url in jpg_urls]
+    else:
+        webp_urls = await asyncio.gather(*(run_sync(store, name, "webp", rendered[name]["webp"]) for name in names))
+
+    variants = {
+        name: {"width": rendered[name]["width"], "height": rendered[name]["height"],
+               "size": len(rendered[name]["jpg"]), "jpg": jpg, "webp": webp}
+        for name, jpg, webp in zip(names, jpg_urls, webp_urls)
+    }
+    url = variants["full"]["jpg"]
+    try:
+        await run_sync(_record_variants, url, owner_id, variants)
+    except Exception as e:
+        # The upload itself succeeded; clients fall back to the full image
+        logger.error(f"Recording image variants failed for {url}: {e}")
+    return url, variants
+
+
+def _record_variants(url: str, owner_id: Optional[str], variants: dict):
+    from database import get_db_session
+    from models_orm import ImageVariantORM
+
+    db = get_db_session()
+    try:
+        db.merge(ImageVariantORM(url=url, owner_id=owner_id, variants=json.dumps(variants),
+                                 created_at=datetime.utcnow().isoformat()))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _strip_query(url: str) -> str:
+    return url.split("?", 1)[0] if url else url
+
+
+def get_image_variants(urls: Iterable[str]) -> Dict[str, dict]:
+    """Recorded variants for the given image URLs (cache-busting query strings are ignored)."""
+    from database import get_db_session
+    from models_orm import ImageVariantORM
+
+    wanted = {_strip_query(u): u for u in urls if u}
+    if not wanted:
+        return {}
+    db = get_db_session()
+    try:
+        rows = db.query(ImageVariantORM).filter(ImageVariantORM.url.in_(list(wanted))).all()
+        return {wanted[row.url]: json.loads(row.variants) for row in rows}
+    finally:
+        db.close()
+
+
+def image_srcset(variants: dict, fmt: str = "webp") -> str:
+    """srcset attribute value ("url 160w, url 640w, ...") for a variants dict."""
+    entries = sorted(variants.values(), key=lambda v: v["width"])
+    return ", ".join(f"{v[fmt]} {v['width']}w" for v in entries if v.get(fmt))
+
+
+def _pop_variant_urls(url: str) -> list:
+    """Forget the variants recorded for url and return their other file URLs."""
+    from database import get_db_session
+    from models_orm import ImageVariantORM
+
+    db = get_db_session()
+    try:
+        row = db.get(ImageVariantORM, _strip_query(url))
+        if row is None:
+            return []
+        variants = json.loads(row.variants)
+        db.delete(row)
+        db.commit()
+    finally:
+        db.close()
+    others = []
+    for variant in variants.values():
+        for fmt in ("jpg", "webp"):
+            candidate = variant.get(fmt)
+            if candidate and candidate != _strip_query(url) and candidate not in others:
+                others.append(candidate)
+    return others
+
+
+def _upload_supabase(content, folder: str, filename: str, size: Optional[int] = None) -> str:
+    """Upload to Supabase Storage and return the public/signed URL. content: bytes or an iterator of chunks."""
     import httpx
 
     # Determine bucket from folder
@@ -137,6 +292,9 @@ def _upload_supabase(content: bytes, folder: str, filename: str) -> str:
         'Content-Type': content_type,
         'x-upsert': 'true',
     }
+    if size is not None:
+        # Streamed body: send a length instead of chunked transfer encoding
+        headers['Content-Length'] = str(size)
 
     url = f"{_get_supabase_url()}/storage/v1/object/{bucket}/{storage_path}"
     r = httpx.post(url, headers=headers, content=content, timeout=60)
@@ -151,8 +309,8 @@ def _upload_supabase(content: bytes, folder: str, filename: str) -> str:
     return public_url
 
 
-def _upload_cloudinary(content: bytes, folder: str, filename: str, upload_type: str) -> str:
-    """Upload to Cloudinary and return the secure URL."""
+def _upload_cloudinary(content, folder: str, filename: str, upload_type: str, large: bool = False) -> str:
+    """Upload to Cloudinary and return the secure URL. large: content is a file object, sent in 6MB parts."""
     import cloudinary.uploader
 
     name_without_ext = os.path.splitext(filename)[0]
@@ -164,34 +322,55 @@ def _upload_cloudinary(content: bytes, folder: str, filename: str, upload_type:
     else:
         resource_type = "image"
 
-    result = cloudinary.uploader.upload(
+    upload = cloudinary.uploader.upload_large if large else cloudinary.uploader.upload
+    result = upload(
         content,
         folder=f"fitos/{folder}",
         public_id=name_without_ext,
         resource_type=resource_type,
-        overwrite=True
+        overwrite=True,
+        **({"chunk_size": 6 * 1024 * 1024} if large else {})
     )
     logger.info(f"Cloudinary upload: fitos/{folder}/{filename}")
     return result["secure_url"]
 
 
-def _save_local(content: bytes, folder: str, filename: str) -> str:
-    """Save to local filesystem and return the relative URL."""
+def _save_local(content, folder: str, filename: str) -> str:
+    """Save to local filesystem and return the relative URL. content: bytes or a file object."""
     base_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'uploads', folder)
     os.makedirs(base_dir, exist_ok=True)
 
     file_path = os.path.join(base_dir, filename)
     with open(file_path, 'wb') as f:
-        f.write(content)
+        if isinstance(content, (bytes, bytearray)):
+            f.write(content)
+        else:
+            shutil.copyfileobj(content, f, STREAM_CHUNK_SIZE)
 
     return f"/static/uploads/{folder}/{filename}"
 
 
 async def delete_file(url: str) -> bool:
-    """Delete a file from Supabase, Cloudinary, or local disk."""
+    """Delete a file (and its recorded image variants) from Supabase, Cloudinary, or local disk."""
     if not url:
         return False
 
+    from database import run_sync
+    try:
+        others = await run_sync(_pop_variant_urls, url)
+    except Exception as e:
+        logger.error(f"Image variants lookup failed for {url}: {e}")
+        others = []
+    deleted = await run_sync(_delete_stored, url)
+    for other in others:
+        if "cloudinary.com" in other and other.endswith(".webp"):
+            continue  # Derived from the JPEG's public_id, nothing stored
+        await run_sync(_delete_stored, other)
+    return deleted
+
+
+def _delete_stored(url: str) -> bool:
+    url = _strip_query(url)
     if "supabase.co/storage" in url:
         try:
             import httpx
@@ -7,6 +7,7 @@ from datetime import date, datetime, timedelta
 from data import GYMS_DB, CLIENT_DATA, TRAINER_DATA, OWNER_DATA, LEADERBOARD_DATA, EXERCISE_LIBRARY, WORKOUTS_DB, SPLITS_DB
 from models import GymConfig, ClientData, TrainerData, OwnerData, LeaderboardData, WorkoutAssignment, AssignDietRequest, ClientProfileUpdate, ExerciseTemplate
 from database import get_db_session, Base, engine
+from sqlalchemy import case, func, select
 from models_orm import ExerciseORM, WorkoutORM, WeeklySplitORM, UserORM, ClientProfileORM, ClientScheduleORM, ClientDietSettingsORM, ClientExerciseLogORM, ClientDietLogORM, TrainerScheduleORM, ConversationORM
 from auth import verify_password, get_password_hash
 
@@ -18,6 +19,10 @@ from service_modules.notes_service import notes_service as _notes_service
 from service_modules.diet_service import diet_service as _diet_service
 from service_modules.schedule_service import schedule_service as _schedule_service
 from service_modules.client_service import client_service as _client_service
+from service_modules.gym_rollups import get_dashboard_figures, get_monthly_history
+from service_modules.schedule_sync import (
+    schedule_window, load_window as load_schedule_window, schedule_version as get_schedule_version,
+)
 
 # Create tables (ensures unified DB is initialized)
 Base.metadata.create_all(bind=engine)
@@ -233,76 +238,70 @@ class UserService:
         """Delegate to DietService."""
         return _diet_service.log_meal(client_id, meal_data)
 
-    def get_trainer(self, trainer_id: str) -> TrainerData:
+    def get_trainer(self, trainer_id: str, schedule_from: str = None, schedule_to: str = None) -> TrainerData:
+        schedule_from, schedule_to = schedule_window(schedule_from, schedule_to)
         db = get_db_session()
         try:
             # Get the trainer to find which gym they belong to
             trainer = db.query(UserORM).filter(UserORM.id == trainer_id).first()
             gym_owner_id = trainer.gym_owner_id if trainer else None
 
-            # Get only clients assigned to this trainer (1-on-1 clients)
-            clients_orm = db.query(UserORM).join(
+            # Get only clients assigned to this trainer (1-on-1 clients), with their profiles
+            roster = db.query(UserORM, ClientProfileORM).join(
                 ClientProfileORM, UserORM.id == ClientProfileORM.id
             ).filter(
                 UserORM.role == "client",
                 ClientProfileORM.trainer_id == trainer_id
             ).all()
+            roster_ids = select(ClientProfileORM.id).where(ClientProfileORM.trainer_id == trainer_id)
 
             clients = []
             active_count = 0
             at_risk_count = 0
             today = date.today()
 
-            # Fetch Trainer Schedule
-            schedule_orm = db.query(TrainerScheduleORM).filter(TrainerScheduleORM.trainer_id == trainer_id).all()
-            schedule = []
-            for s in schedule_orm:
-                schedule.append({
-                    "id": str(s.id),
-                    "date": s.date,
-                    "time": s.time,
-                    "title": s.title,
-                    "subtitle": s.subtitle or "",
-                    "type": s.type,
-                    "duration": s.duration if s.duration else 60,  # Include duration
-                    "completed": s.completed,
-                    "course_id": s.course_id  # Link to course for group classes
-                })
+            # Trainer schedule: only the requested window; the calendar syncs the rest by version
+            schedule_version = get_schedule_version(db.connection(), trainer_id)
+            schedule = load_schedule_window(db, trainer_id, schedule_from, schedule_to)
+
+            # Last completed and upcoming workouts of every client, in one grouped query
+            workout_status = {client_id: (last_date, upcoming) for client_id, last_date, upcoming in db.query(
+                ClientScheduleORM.client_id,
+                func.max(case((ClientScheduleORM.completed == True, ClientScheduleORM.date))),
+                func.count(case((ClientScheduleORM.date >= today.isoformat(), 1))),
+            ).filter(
+                ClientScheduleORM.client_id.in_(roster_ids),
+                ClientScheduleORM.type == "workout",
+            ).group_by(ClientScheduleORM.client_id)}
+
+            split_ids = {profile.current_split_id for _, profile in roster if profile.current_split_id}
+            split_names = dict(db.query(WeeklySplitORM.id, WeeklySplitORM.name).filter(
+                WeeklySplitORM.id.in_(split_ids)
+            ).all()) if split_ids else {}
+            fitness_goals = dict(db.query(ClientDietSettingsORM.id, ClientDietSettingsORM.fitness_goal).filter(
+                ClientDietSettingsORM.id.in_(roster_ids)
+            ).all())
+
+            for c, profile in roster:
+                last_workout_date, upcoming_workouts = workout_status.get(c.id, (None, 0))
 
-            for c in clients_orm:
-                # Fetch profile
-                profile = db.query(ClientProfileORM).filter(ClientProfileORM.id == c.id).first()
-                
-                # Check Last Workout Date
-                last_workout = db.query(ClientScheduleORM).filter(
-                    ClientScheduleORM.client_id == c.id,
-                    ClientScheduleORM.type == "workout",
-                    ClientScheduleORM.completed == True
-                ).order_by(ClientScheduleORM.date.desc()).first()
-                
                 last_active_date = None
                 days_inactive = 0
-                
-                if last_workout:
+
+                if last_workout_date:
                     try:
-                        last_active_date = datetime.strptime(last_workout.date, "%Y-%m-%d").date()
+                        last_active_date = datetime.strptime(last_workout_date, "%Y-%m-%d").date()
                         days_inactive = (today - last_active_date).days
                     except:
                         days_inactive = 99 # Error parsing date
                 else:
                     days_inactive = 99 # No workouts ever
-                
+
                 # Determine Status
                 status = "Attivo"
                 if days_inactive > 5:
                     status = "A Rischio"
-                
-                # Override if manually set to something specific? 
-                # For now, let's trust the calculated status as primary, 
-                # unless profile says "Injured" or something else we haven't implemented.
-                # Let's write back to profile for persistence? 
-                # It's better to calculate distinct status on read to be always up to date.
-                
+
                 # Update counters
                 if status == "A Rischio":
                     at_risk_count += 1
@@ -310,45 +309,33 @@ class UserService:
                     active_count += 1
 
                 # Client is "PRO" for this trainer if they selected this trainer as their personal trainer
-                is_my_client = profile.trainer_id == trainer_id if profile else False
+                is_my_client = profile.trainer_id == trainer_id
 
                 # Get assigned split name and expiry
                 assigned_split_name = None
                 split_expiry = None
-                if profile and profile.current_split_id:
-                    split_orm = db.query(WeeklySplitORM).filter(WeeklySplitORM.id == profile.current_split_id).first()
-                    if split_orm:
-                        assigned_split_name = split_orm.name
+                if profile.current_split_id:
+                    assigned_split_name = split_names.get(profile.current_split_id)
                     split_expiry = profile.split_expiry_date
 
-                # Count upcoming workout assignments
-                upcoming_workouts = db.query(ClientScheduleORM).filter(
-                    ClientScheduleORM.client_id == c.id,
-                    ClientScheduleORM.type == "workout",
-                    ClientScheduleORM.date >= today.isoformat(),
-                ).count()
-
-                # Get fitness goal from diet settings
-                diet_settings = db.query(ClientDietSettingsORM).filter(ClientDietSettingsORM.id == c.id).first()
-
                 clients.append({
                     "id": c.id,
-                    "name": profile.name if profile and profile.name else c.username,
+                    "name": profile.name if profile.name else c.username,
                     "status": status,
                     "days_inactive": days_inactive,
                     "last_seen": f"{days_inactive} days ago" if days_inactive < 99 else "Never",
-                    "plan": profile.plan if profile and profile.plan else "Standard",
+                    "plan": profile.plan if profile.plan else "Standard",
                     "is_premium": is_my_client,
                     "profile_picture": c.profile_picture,
                     "assigned_split": assigned_split_name,
                     "plan_expiry": split_expiry,
                     "upcoming_workouts": upcoming_workouts,
-                    "weight": profile.weight if profile else None,
-                    "height_cm": profile.height_cm if profile else None,
-                    "gender": profile.gender if profile else None,
-                    "fitness_goal": diet_settings.fitness_goal if diet_settings else None,
+                    "weight": profile.weight,
+                    "height_cm": profile.height_cm,
+                    "gender": profile.gender,
+                    "fitness_goal": fitness_goals.get(c.id),
                 })
-            
+
             # --- FETCH MY WORKOUT (TRAINER) ---
             todays_workout = None
             try:
@@ -404,33 +391,25 @@ class UserService:
             streak = 0
             try:
                 today = datetime.now().date()
-                current_date = today
-
-                # Go backwards from today, counting consecutive days
-                while True:
-                    date_str = current_date.isoformat()
-
-                    # Check if there's a workout scheduled for this day
-                    day_event = db.query(TrainerScheduleORM).filter(
-                        TrainerScheduleORM.trainer_id == trainer_id,
-                        TrainerScheduleORM.date == date_str,
-                        TrainerScheduleORM.workout_id != None
-                    ).first()
-
-                    if day_event:
-                        # There's a workout scheduled for this day
-                        if day_event.completed:
-                            streak += 1
-                        else:
-                            if current_date < today:
-                                break
-                    # No workout scheduled (rest day) - continue
-
-                    # Move to previous day
-                    current_date = current_date - timedelta(days=1)
-
-                    # Safety limit: don't go back more than 365 days
-                    if (today - current_date).days > 365:
+
+                # Workout days of the last 365 days in one query (first event of each day counts)
+                workout_days = {}
+                for day, completed in db.query(TrainerScheduleORM.date, TrainerScheduleORM.completed).filter(
+                    TrainerScheduleORM.trainer_id == trainer_id,
+                    TrainerScheduleORM.date >= (today - timedelta(days=365)).isoformat(),
+                    TrainerScheduleORM.date <= today.isoformat(),
+                    TrainerScheduleORM.workout_id != None
+                ).order_by(TrainerScheduleORM.id):
+                    workout_days.setdefault(day, completed)
+
+                # Go backwards from today, counting consecutive days; rest days don't break it
+                for offset in range(366):
+                    current_date = today - timedelta(days=offset)
+                    if current_date.isoformat() not in workout_days:
+                        continue
+                    if workout_days[current_date.isoformat()]:
+                        streak += 1
+                    elif current_date < today:
                         break
             except Exception:
                 streak = 0
@@ -449,7 +428,10 @@ class UserService:
                 todays_workout=todays_workout,
                 workouts=self.get_workouts(trainer_id),
                 splits=self.get_splits(trainer_id),
-                streak=streak
+                streak=streak,
+                schedule_version=schedule_version,
+                schedule_from=schedule_from,
+                schedule_to=schedule_to,
             )
         finally:
             db.close()
@@ -585,30 +567,99 @@ class UserService:
             db.close()
 
     def get_owner(self, owner_id: str = None) -> OwnerData:
+        if not owner_id:
+            return self._get_owner_all_gyms()
+
         db = get_db_session()
         try:
-            from models_orm import ClientProfileORM, ClientSubscriptionORM, SubscriptionPlanORM, AppointmentORM, NutritionistAppointmentORM
-            from sqlalchemy import func
+            # Members, subscriptions and this month's revenue come from the daily rollups
+            figures = get_dashboard_figures(db, owner_id)
 
-            # Get trainer/staff IDs belonging to this gym
-            gym_staff_ids = []
-            if owner_id:
-                gym_staff = db.query(UserORM.id).filter(
-                    UserORM.gym_owner_id == owner_id,
-                    UserORM.role.in_(["trainer", "staff", "nutritionist"])
-                ).all()
-                gym_staff_ids = [s[0] for s in gym_staff]
+            # Count staff for this gym
+            staff_active = db.query(UserORM).filter(
+                UserORM.gym_owner_id == owner_id,
+                UserORM.role.in_(["trainer", "staff", "nutritionist"])
+            ).count()
 
-            # Count active clients for this gym
-            if owner_id:
-                active_members = db.query(ClientProfileORM).filter(
-                    ClientProfileORM.gym_id == owner_id
-                ).count()
-            else:
-                active_members = db.query(UserORM).filter(UserORM.role == "client").count()
+            currency = "eur"
+            revenue_by_plan = {}  # plan_name -> {revenue, count}
+            for plan in figures["plans"]:
+                if plan["currency"]:
+                    currency = plan["currency"]
+                pname = plan["plan_name"] or "Sconosciuto"
+                if pname not in revenue_by_plan:
+                    revenue_by_plan[pname] = {"name": pname, "revenue": 0.0, "count": 0}
+                revenue_by_plan[pname]["revenue"] += plan["monthly_revenue"]
+                revenue_by_plan[pname]["count"] += plan["active_subscriptions"]
 
-            # Count staff for this gym
-            staff_active = len(gym_staff_ids) if owner_id else db.query(UserORM).filter(
+            subscription_revenue = figures["monthly_recurring_revenue"] or 0.0
+            appt_revenue = float(figures["appointment_revenue"])
+            nutr_appt_revenue = float(figures["nutrition_revenue"])
+            monthly_revenue = subscription_revenue + appt_revenue + nutr_appt_revenue
+
+            # Build per-plan list sorted by revenue desc
+            plan_list = sorted(revenue_by_plan.values(), key=lambda x: x["revenue"], reverse=True)
+            for p in plan_list:
+                p["revenue"] = round(p["revenue"], 2)
+
+            # Recent activity: last 5 new signups
+            recent_users = db.query(UserORM).join(
+                ClientProfileORM, ClientProfileORM.id == UserORM.id
+            ).filter(
+                ClientProfileORM.gym_id == owner_id
+            ).order_by(UserORM.created_at.desc()).limit(5).all()
+
+            return OwnerData(
+                monthly_revenue=round(monthly_revenue, 2),
+                subscription_revenue=round(subscription_revenue, 2),
+                appointment_revenue=round(appt_revenue, 2),
+                nutrition_appointment_revenue=round(nutr_appt_revenue, 2),
+                appointment_count=int(figures["appointment_count"]),
+                nutrition_appointment_count=int(figures["nutrition_count"]),
+                currency=currency,
+                active_members=figures["active_members"],
+                active_subscriptions=figures["active_subscriptions"],
+                staff_active=staff_active,
+                recent_activity=self._signup_activity(recent_users),
+                revenue_by_plan=plan_list,
+            )
+        finally:
+            db.close()
+
+    def get_owner_history(self, owner_id: str, months: int = 12) -> list:
+        """Monthly revenue, signups, check-ins and subscriptions of a gym, from the daily rollups."""
+        db = get_db_session()
+        try:
+            return get_monthly_history(db, owner_id, months)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _signup_activity(recent_users) -> list:
+        recent_activity = []
+        for u in recent_users:
+            created = u.created_at or ""
+            try:
+                dt = datetime.fromisoformat(created)
+                time_str = dt.strftime("%d/%m %H:%M")
+            except Exception:
+                time_str = created[:16] if created else "—"
+            recent_activity.append({
+                "time": time_str,
+                "text": f"Nuovo iscritto: {u.username}",
+                "type": "money"
+            })
+        return recent_activity
+
+    def _get_owner_all_gyms(self) -> OwnerData:
+        """Platform-wide figures (no gym selected), computed from the raw rows."""
+        db = get_db_session()
+        try:
+            from models_orm import ClientSubscriptionORM, SubscriptionPlanORM, AppointmentORM, NutritionistAppointmentORM
+            from sqlalchemy import func
+
+            active_members = db.query(UserORM).filter(UserORM.role == "client").count()
+            staff_active = db.query(UserORM).filter(
                 UserORM.role.in_(["trainer", "staff", "nutritionist"])
             ).count()
 
@@ -617,15 +668,11 @@ class UserService:
             currency = "eur"
             revenue_by_plan = {}  # plan_name -> {revenue, count}
 
-            # Filter subscriptions by gym
-            subs_query = db.query(ClientSubscriptionORM, SubscriptionPlanORM).join(
+            active_subs = db.query(ClientSubscriptionORM, SubscriptionPlanORM).join(
                 SubscriptionPlanORM, ClientSubscriptionORM.plan_id == SubscriptionPlanORM.id
             ).filter(
                 ClientSubscriptionORM.status.in_(["active", "trialing"])
-            )
-            if owner_id:
-                subs_query = subs_query.filter(ClientSubscriptionORM.gym_id == owner_id)
-            active_subs = subs_query.all()
+            ).all()
 
             for sub, plan in active_subs:
                 active_subscriptions += 1
@@ -643,41 +690,30 @@ class UserService:
                 revenue_by_plan[pname]["revenue"] += plan_monthly
                 revenue_by_plan[pname]["count"] += 1
 
-            # Appointment revenue for current month — only from gym's trainers
+            # Appointment revenue for current month
             now = datetime.now()
             month_start = now.strftime("%Y-%m-01")
             month_end = (now.replace(day=28) + timedelta(days=4)).replace(day=1).strftime("%Y-%m-%d")
 
-            appt_query = db.query(
+            appt_row = db.query(
                 func.coalesce(func.sum(AppointmentORM.price), 0),
                 func.count(AppointmentORM.id),
             ).filter(
                 AppointmentORM.date >= month_start,
                 AppointmentORM.date < month_end,
                 AppointmentORM.payment_status == "paid",
-            )
-            if owner_id and gym_staff_ids:
-                appt_query = appt_query.filter(AppointmentORM.trainer_id.in_(gym_staff_ids))
-            elif owner_id:
-                # No staff => no appointments
-                appt_query = appt_query.filter(AppointmentORM.trainer_id == None)
-            appt_row = appt_query.first()
+            ).first()
             appt_revenue = float(appt_row[0]) if appt_row else 0.0
             appt_count = int(appt_row[1]) if appt_row else 0
 
-            nutr_query = db.query(
+            nutr_row = db.query(
                 func.coalesce(func.sum(NutritionistAppointmentORM.price), 0),
                 func.count(NutritionistAppointmentORM.id),
             ).filter(
                 NutritionistAppointmentORM.date >= month_start,
                 NutritionistAppointmentORM.date < month_end,
                 NutritionistAppointmentORM.payment_status == "paid",
-            )
-            if owner_id and gym_staff_ids:
-                nutr_query = nutr_query.filter(NutritionistAppointmentORM.nutritionist_id.in_(gym_staff_ids))
-            elif owner_id:
-                nutr_query = nutr_query.filter(NutritionistAppointmentORM.nutritionist_id == None)
-            nutr_row = nutr_query.first()
+            ).first()
             nutr_appt_revenue = float(nutr_row[0]) if nutr_row else 0.0
             nutr_appt_count = int(nutr_row[1]) if nutr_row else 0
 
@@ -688,33 +724,9 @@ class UserService:
             for p in plan_list:
                 p["revenue"] = round(p["revenue"], 2)
 
-            # Recent activity: last 10 new signups and subscriptions
-            recent_activity = []
-            if owner_id:
-                # Get client IDs belonging to this gym
-                gym_client_ids = [c[0] for c in db.query(ClientProfileORM.id).filter(
-                    ClientProfileORM.gym_id == owner_id
-                ).all()]
-                recent_users = db.query(UserORM).filter(
-                    UserORM.id.in_(gym_client_ids) if gym_client_ids else UserORM.id == None
-                ).order_by(UserORM.created_at.desc()).limit(5).all()
-            else:
-                recent_users = db.query(UserORM).filter(
-                    UserORM.role == "client"
-                ).order_by(UserORM.created_at.desc()).limit(5).all()
-
-            for u in recent_users:
-                created = u.created_at or ""
-                try:
-                    dt = datetime.fromisoformat(created)
-                    time_str = dt.strftime("%d/%m %H:%M")
-                except Exception:
-                    time_str = created[:16] if created else "—"
-                recent_activity.append({
-                    "time": time_str,
-                    "text": f"Nuovo iscritto: {u.username}",
-                    "type": "money"
-                })
+            recent_users = db.query(UserORM).filter(
+                UserORM.role == "client"
+            ).order_by(UserORM.created_at.desc()).limit(5).all()
 
             return OwnerData(
                 monthly_revenue=round(monthly_revenue, 2),
@@ -727,7 +739,7 @@ class UserService:
                 active_members=active_members,
                 active_subscriptions=active_subscriptions,
                 staff_active=staff_active,
-                recent_activity=recent_activity,
+                recent_activity=self._signup_activity(recent_users),
                 revenue_by_plan=plan_list,
             )
         finally:
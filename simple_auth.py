@@ -11,6 +11,7 @@ from jose import jwt
 from datetime import datetime, timedelta
 import os
 from typing import Optional
+from static_assets import install_template_helpers
 
 # Rate limiting
 try:
@@ -22,6 +23,7 @@ except ImportError:
 
 # Setup
 templates = Jinja2Templates(directory="templates")
+install_template_helpers(templates)
 simple_auth_router = APIRouter()
 
 # Config
@@ -32,7 +34,7 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 8  # 8 hours — aligned with API login
 
 # Import database and models
-from database import get_db, IS_POSTGRES
+from database import get_db, IS_POSTGRES, run_sync
 from models_orm import UserORM as User
 
 # Cookie security: strict in production (HTTPS), relaxed in dev
@@ -106,9 +108,10 @@ async def do_login(request: Request, db: Session = Depends(get_db)):
     # 2. Authenticate
     user = None
     if username:
-        user = db.query(User).filter(User.username == username).first()
-    
-    if not user or not verify_password(password, user.hashed_password):
+        user = await run_sync(lambda: db.query(User).filter(User.username == username).first())
+
+    # bcrypt is deliberately slow (~250ms) — keep it off the event loop
+    if not user or not password or not await run_sync(verify_password, password, user.hashed_password):
         error_msg = "Invalid username or password"
         if is_json:
             from fastapi.responses import JSONResponse
@@ -392,7 +395,7 @@ async def _do_register(request, username, password, email, role, sub_role, secre
         id=str(uuid.uuid4()),
         username=username,
         email=email if email else None,
-        hashed_password=hash_password(password),
+        hashed_password=await run_sync(hash_password, password),
         role=role,
         sub_role=sub_role,  # Store sub-role (trainer/nutritionist/both or owner/staff)
         gym_code=generated_gym_code,  # Only set for owners
@@ -500,7 +503,7 @@ async def do_forgot_password(request: Request):
     base_url = str(request.base_url).rstrip("/")
 
     from service_modules.password_reset_service import request_password_reset
-    result = request_password_reset(email, base_url)
+    result = await run_sync(request_password_reset, email, base_url)
 
     return templates.TemplateResponse("forgot_password.html", {
         "request": request, "success": result["message"]
@@ -573,7 +576,7 @@ async def do_forgot_username(request: Request):
         })
 
     from service_modules.password_reset_service import request_username_reminder
-    result = request_username_reminder(email)
+    result = await run_sync(request_username_reminder, email)
 
     return templates.TemplateResponse("forgot_username.html", {
         "request": request, "success": result["message"]
@@ -671,7 +674,7 @@ async def do_setup_account(request: Request, db: Session = Depends(get_db)):
 
         # Update user
         user.username = new_username
-        user.hashed_password = get_password_hash(new_password)
+        user.hashed_password = await run_sync(get_password_hash, new_password)
         user.must_change_password = False
 
         # Regenerate session ID to force logout on all other devices
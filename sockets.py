@@ -1,34 +1,187 @@
 import os
 import time
+import uuid
+import socket
+import logging
 import threading
 import asyncio
-from typing import List
+from typing import List, Optional
 from fastapi import WebSocket
 
 from broadcaster import Broadcast
 import json
-import asyncio
+
+logger = logging.getLogger("gym_app")
 
 # Redis URL for production (fallback to memory for local dev)
-BROADCAST_URL = os.getenv("REDIS_URL") or "memory://"
+REDIS_URL = os.getenv("REDIS_URL")
+BROADCAST_URL = REDIS_URL or "memory://"
 broadcast = Broadcast(BROADCAST_URL)
 
-class ConnectionManager:
+# Unique id for this worker process; each worker listens on its own channel
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+GLOBAL_CHANNEL = "gym_global"
+WORKER_CHANNEL_PREFIX = "gym_worker:"
+
+# Presence keys expire unless the owning worker keeps heartbeating
+PRESENCE_HEARTBEAT_SECONDS = 20
+PRESENCE_TTL_SECONDS = 60
+
+
+class MemoryPresenceRegistry:
+    """Single-process presence registry used with the memory:// broadcaster (dev)."""
+
     def __init__(self):
+        self._users: dict = {}  # user_id -> set of worker ids
+
+    async def register(self, user_id: str, worker_id: str):
+        self._users.setdefault(user_id, set()).add(worker_id)
+
+    async def unregister(self, user_id: str, worker_id: str):
+        workers = self._users.get(user_id)
+        if workers:
+            workers.discard(worker_id)
+            if not workers:
+                del self._users[user_id]
+
+    async def workers_for(self, user_id: str) -> List[str]:
+        return list(self._users.get(user_id, ()))
+
+    async def heartbeat(self, worker_id: str, user_ids: List[str]):
+        pass
+
+    async def drop_worker(self, worker_id: str, user_ids: List[str]):
+        for user_id in user_ids:
+            await self.unregister(user_id, worker_id)
+
+
+class RedisPresenceRegistry:
+    """
+    Fleet-wide presence registry backed by Redis.
+
+    ws:presence:<user_id>  -> hash {worker_id: connected_at}
+    ws:worker:<worker_id>  -> liveness key refreshed by the worker heartbeat
+
+    Lookups are a single HKEYS + MGET per user, independent of fleet size.
+    Entries left behind by a crashed worker are ignored once its liveness key expires.
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis
+        self._redis = aioredis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _user_key(user_id: str) -> str:
+        return f"ws:presence:{user_id}"
+
+    @staticmethod
+    def _worker_key(worker_id: str) -> str:
+        return f"ws:worker:{worker_id}"
+
+    async def register(self, user_id: str, worker_id: str):
+        key = self._user_key(user_id)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, worker_id, int(time.time()))
+            pipe.expire(key, PRESENCE_TTL_SECONDS)
+            pipe.set(self._worker_key(worker_id), 1, ex=PRESENCE_TTL_SECONDS)
+            await pipe.execute()
+
+    async def unregister(self, user_id: str, worker_id: str):
+        await self._redis.hdel(self._user_key(user_id), worker_id)
+
+    async def workers_for(self, user_id: str) -> List[str]:
+        workers = await self._redis.hkeys(self._user_key(user_id))
+        if not workers:
+            return []
+        alive = await self._redis.mget([self._worker_key(w) for w in workers])
+        live_workers = [w for w, flag in zip(workers, alive) if flag]
+        stale = [w for w, flag in zip(workers, alive) if not flag]
+        if stale:
+            await self._redis.hdel(self._user_key(user_id), *stale)
+        return live_workers
+
+    async def heartbeat(self, worker_id: str, user_ids: List[str]):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.set(self._worker_key(worker_id), 1, ex=PRESENCE_TTL_SECONDS)
+            for user_id in user_ids:
+                pipe.expire(self._user_key(user_id), PRESENCE_TTL_SECONDS)
+            await pipe.execute()
+
+    async def drop_worker(self, worker_id: str, user_ids: List[str]):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.delete(self._worker_key(worker_id))
+            for user_id in user_ids:
+                pipe.hdel(self._user_key(user_id), worker_id)
+            await pipe.execute()
+
+
+_broadcast_connected = False
+_broadcast_lock: Optional[asyncio.Lock] = None
+
+
+async def _ensure_broadcast_connected():
+    """Connect the shared broadcaster once per process (publishing needs it too, not just listening)."""
+    global _broadcast_connected, _broadcast_lock
+    if _broadcast_connected:
+        return
+    if _broadcast_lock is None:
+        _broadcast_lock = asyncio.Lock()
+    async with _broadcast_lock:
+        if not _broadcast_connected:
+            await broadcast.connect()
+            _broadcast_connected = True
+
+
+def _create_presence_registry():
+    if REDIS_URL:
+        return RedisPresenceRegistry(REDIS_URL)
+    return MemoryPresenceRegistry()
+
+
+class ConnectionManager:
+    def __init__(self, worker_id: str = WORKER_ID, presence=None):
         self.active_connections: List[WebSocket] = []
-        self.user_connections: dict = {}  # user_id -> WebSocket mapping
+        self.user_connections: dict = {}  # user_id -> WebSocket mapping (this worker only)
+        self.worker_id = worker_id
+        self.worker_channel = f"{WORKER_CHANNEL_PREFIX}{worker_id}"
+        self.presence = presence or _create_presence_registry()
         self.listening = False
+        self._worker_channel_ready: Optional[asyncio.Event] = None
+        self._background_tasks: set = set()
+
+    def _spawn(self, coro):
+        """Run a coroutine in the background, keeping a reference until it finishes."""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def start(self):
+        """Start the global and per-worker listeners plus the presence heartbeat."""
+        if self.listening:
+            return
+        self.listening = True
+        self._worker_channel_ready = asyncio.Event()
+        await _ensure_broadcast_connected()
+        self._spawn(self.listen_to_channel())
+        self._spawn(self.listen_to_worker_channel())
+        self._spawn(self._heartbeat_loop())
+        # Don't advertise presence until routed messages can actually be received
+        await self._worker_channel_ready.wait()
 
     async def connect(self, websocket: WebSocket, user_id: str = None):
         await websocket.accept()
         self.active_connections.append(websocket)
+        # Verify listeners are running (lazy start)
+        if not self.listening:
+            await self.start()
         # Track user connection for targeted messaging
         if user_id:
             self.user_connections[user_id] = websocket
-        # Verify listener is running (lazy start)
-        if not self.listening:
-            asyncio.create_task(self.listen_to_channel())
-            self.listening = True
+            try:
+                await self.presence.register(user_id, self.worker_id)
+            except Exception as e:
+                logger.warning(f"Presence register failed for {user_id}: {e}")
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
@@ -37,33 +190,72 @@ class ConnectionManager:
         for user_id, ws in list(self.user_connections.items()):
             if ws == websocket:
                 del self.user_connections[user_id]
+                try:
+                    self._spawn(self._unregister(user_id))
+                except RuntimeError:
+                    pass  # No running loop (e.g. interpreter shutdown)
                 break
 
-    async def send_to_user(self, user_id: str, message: dict):
-        """Send a message to a specific user if they're connected."""
+    async def _unregister(self, user_id: str):
+        # A newer socket for the same user may have connected meanwhile
         if user_id in self.user_connections:
-            try:
-                await self.user_connections[user_id].send_json(message)
-                return True
-            except Exception:
-                self.disconnect(self.user_connections[user_id])
+            return
+        try:
+            await self.presence.unregister(user_id, self.worker_id)
+        except Exception as e:
+            logger.warning(f"Presence unregister failed for {user_id}: {e}")
+
+    async def _send_local(self, user_id: str, message: dict) -> bool:
+        ws = self.user_connections.get(user_id)
+        if ws is None:
+            return False
+        try:
+            await ws.send_json(message)
+            return True
+        except Exception:
+            self.disconnect(ws)
         return False
 
-    def is_user_online(self, user_id: str) -> bool:
-        """Check if a user is currently connected."""
-        return user_id in self.user_connections
+    async def send_to_user(self, user_id: str, message: dict):
+        """Send a message to a specific user on whichever worker holds their socket."""
+        if await self._send_local(user_id, message):
+            return True
+        try:
+            workers = await self.presence.workers_for(user_id)
+        except Exception as e:
+            logger.warning(f"Presence lookup failed for {user_id}: {e}")
+            return False
+        remote = [w for w in workers if w != self.worker_id]
+        if not remote:
+            return False
+        await _ensure_broadcast_connected()
+        payload = json.dumps({"user_id": user_id, "message": message})
+        for worker_id in remote:
+            await broadcast.publish(channel=f"{WORKER_CHANNEL_PREFIX}{worker_id}", message=payload)
+        return True
+
+    async def is_user_online(self, user_id: str) -> bool:
+        """Check if a user is currently connected to any worker."""
+        if user_id in self.user_connections:
+            return True
+        try:
+            return bool(await self.presence.workers_for(user_id))
+        except Exception as e:
+            logger.warning(f"Presence lookup failed for {user_id}: {e}")
+            return False
 
     async def broadcast(self, message: dict):
-        # Publish to Redic (or memory)
+        # Publish to Redis (or memory)
         # This sends to ALL instances subscribed to the channel
-        await broadcast.publish(channel="gym_global", message=json.dumps(message))
+        await _ensure_broadcast_connected()
+        await broadcast.publish(channel=GLOBAL_CHANNEL, message=json.dumps(message))
 
     async def listen_to_channel(self):
         """
         Background task: Listens for Redis messages and pushes them to local clients.
         """
-        await broadcast.connect()
-        async with broadcast.subscribe(channel="gym_global") as subscriber:
+        await _ensure_broadcast_connected()
+        async with broadcast.subscribe(channel=GLOBAL_CHANNEL) as subscriber:
             async for event in subscriber:
                 message = json.loads(event.message)
                 # Send to all locally connected clients
@@ -73,6 +265,37 @@ class ConnectionManager:
                     except Exception:
                         self.disconnect(connection)
 
+    async def listen_to_worker_channel(self):
+        """
+        Background task: Receives messages routed to users connected to this worker.
+        """
+        await _ensure_broadcast_connected()
+        async with broadcast.subscribe(channel=self.worker_channel) as subscriber:
+            if self._worker_channel_ready:
+                self._worker_channel_ready.set()
+            async for event in subscriber:
+                try:
+                    envelope = json.loads(event.message)
+                    await self._send_local(envelope["user_id"], envelope["message"])
+                except Exception as e:
+                    logger.warning(f"Worker channel delivery error: {e}")
+
+    async def _heartbeat_loop(self):
+        """Keep this worker's presence entries alive while it is running."""
+        while True:
+            try:
+                await self.presence.heartbeat(self.worker_id, list(self.user_connections.keys()))
+            except Exception as e:
+                logger.warning(f"Presence heartbeat failed: {e}")
+            await asyncio.sleep(PRESENCE_HEARTBEAT_SECONDS)
+
+    async def shutdown(self):
+        """Drop this worker's presence entries so peers stop routing to it."""
+        try:
+            await self.presence.drop_worker(self.worker_id, list(self.user_connections.keys()))
+        except Exception as e:
+            logger.warning(f"Presence cleanup on shutdown failed: {e}")
+
 # Global instance
 manager = ConnectionManager()
 
@@ -0,0 +1,242 @@
+"""
+Static Assets - content-hashed URLs, long-lived caching and precompressed variants.
+
+Every file under static/ is hashed at startup (or ahead of time with
+`python static_assets.py`). Templates link to assets through
+static_url('css/style.css'), which returns /static/css/style.<hash>.css. The URL
+changes whenever the content does, so those responses are cached for a year as
+immutable. Text assets also get gzip variants (and brotli, if the brotli package is
+installed) in build/static/, picked per request from Accept-Encoding.
+
+Paths built at runtime (e.g. /static/videos/<id>.mp4 in app.js) keep their plain URL
+and are revalidated with ETag / If-None-Match instead of downloaded again.
+Range requests work on both kinds of URL (video seeking) and always get the
+uncompressed file.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+import logging
+logger = logging.getLogger("gym_app")
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = "static"
+BUILD_DIR = os.path.join("build", "static")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"  # not "public": plain URLs include user uploads
+COMPRESSIBLE_EXTENSIONS = {".js", ".css", ".svg", ".json", ".map", ".txt", ".html"}
+MIN_COMPRESS_SIZE = 1024
+SKIP_DIRS = {"pi", "__pycache__", "uploads"}  # uploads: user content, not build assets
+# Development: re-hash when a file under static/ is edited while the server runs
+WATCH_ASSETS = os.getenv("STATIC_ASSETS_WATCH", "false" if os.getenv("DATABASE_URL", "").startswith("postgres") else "true").lower() == "true"
+
+_FINGERPRINT = re.compile(r"\.([0-9a-f]{12})(\.[^./]+)$")
+
+
+def _fingerprinted(path: str, digest: str) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.{digest}{ext}"
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class AssetManifest:
+    """Maps logical static paths to fingerprinted ones and knows each file's variants."""
+
+    def __init__(self, static_dir: str = STATIC_DIR, build_dir: str = BUILD_DIR, watch: bool = WATCH_ASSETS):
+        self.static_dir = static_dir
+        self.build_dir = build_dir
+        self.watch = watch
+        self.urls: Dict[str, str] = {}     # "css/style.css" -> "css/style.<hash>.css"
+        self.assets: Dict[str, dict] = {}  # "css/style.<hash>.css" -> {path, digest, media_type, variants}
+        self._mtimes: Dict[str, float] = {}
+        self._checked_at = 0.0
+        self._built = False
+        self._lock = threading.Lock()
+
+    def build(self, compress: bool = True):
+        """Hash every asset and create missing compressed variants. Safe to call from several workers."""
+        with self._lock:
+            urls, assets, mtimes, keep = {}, {}, {}, set()
+            for dirpath, dirnames, filenames in os.walk(self.static_dir):
+                dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS and not d.startswith("."))
+                for filename in sorted(filenames):
+                    if filename.startswith("."):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    mtimes[path] = os.stat(path).st_mtime
+                    logical = os.path.relpath(path, self.static_dir).replace(os.sep, "/")
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    digest = hashlib.sha256(data).hexdigest()[:12]
+                    hashed = _fingerprinted(logical, digest)
+                    variants = self._compress(hashed, data, keep) if compress else {}
+                    urls[logical] = hashed
+                    assets[hashed] = {
+                        "path": path,
+                        "digest": digest,
+                        "media_type": mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                        "variants": variants,
+                    }
+            if compress:
+                self._remove_stale(keep)
+            self.urls, self.assets, self._mtimes, self._built = urls, assets, mtimes, True
+        logger.info(f"Static assets: {len(urls)} fingerprinted, "
+                    f"{sum(1 for a in assets.values() if a['variants'])} precompressed")
+
+    def _compress(self, hashed: str, data: bytes, keep: set) -> Dict[str, str]:
+        if os.path.splitext(hashed)[1].lower() not in COMPRESSIBLE_EXTENSIONS or len(data) < MIN_COMPRESS_SIZE:
+            return {}
+        encoders = {"gzip": (".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))}
+        if brotli is not None:
+            encoders["br"] = (".br", lambda d: brotli.compress(d, quality=11))
+        variants = {}
+        for encoding, (suffix, encode) in encoders.items():
+            target = os.path.join(self.build_dir, hashed + suffix)
+            keep.add(os.path.abspath(target))
+            # Variants are content-addressed: an existing file is already up to date
+            if not os.path.exists(target):
+                encoded = encode(data)
+                if len(encoded) >= len(data):
+                    continue
+                try:
+                    _write_atomic(target, encoded)
+                except OSError as e:
+                    logger.warning(f"Static assets: cannot write {target}: {e}")
+                    continue
+            variants[encoding] = target
+        return variants
+
+    def _remove_stale(self, keep: set):
+        for dirpath, _, filenames in os.walk(self.build_dir):
+            for filename in filenames:
+                path = os.path.abspath(os.path.join(dirpath, filename))
+                if path not in keep and not filename.startswith(".tmp-"):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def _changed(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at < 1.0:
+            return False
+        self._checked_at = now
+        for path, mtime in self._mtimes.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def url(self, path: str) -> str:
+        """Public URL for a static asset; falls back to the plain path for unknown files."""
+        if not self._built or (self.watch and self._changed()):
+            self.build()
+        path = path.lstrip("/")
+        if path.startswith("static/"):
+            path = path[len("static/"):]
+        return f"/static/{self.urls.get(path, path)}"
+
+    def resolve(self, path: str) -> Optional[dict]:
+        if not _FINGERPRINT.search(path):
+            return None
+        return self.assets.get(path.replace(os.sep, "/"))
+
+
+asset_manifest = AssetManifest()
+
+
+def static_url(path: str) -> str:
+    return asset_manifest.url(path)
+
+
+def install_template_helpers(templates):
+    """Expose static_url() to a Jinja2Templates instance."""
+    templates.env.globals["static_url"] = static_url
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+class AssetStaticFiles(StaticFiles):
+    """StaticFiles that serves fingerprinted URLs as immutable, precompressed when possible."""
+
+    def __init__(self, *args, manifest: AssetManifest = asset_manifest, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope) -> Response:
+        asset = self.manifest.resolve(path)
+        if asset is None or scope["method"] not in ("GET", "HEAD"):
+            response = await super().get_response(path, scope)
+            response.headers["Cache-Control"] = REVALIDATE_CACHE
+            return response
+
+        request_headers = Headers(scope=scope)
+        file_path, encoding = asset["path"], None
+        if asset["variants"] and "range" not in request_headers:
+            accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+            for candidate in ("br", "gzip"):
+                if candidate in accepted and candidate in asset["variants"]:
+                    file_path, encoding = asset["variants"][candidate], candidate
+                    break
+
+        try:
+            stat_result = os.stat(file_path)
+        except FileNotFoundError:
+            # Variant removed under us (e.g. a concurrent rebuild): serve the original
+            file_path, encoding = asset["path"], None
+            stat_result = os.stat(file_path)
+
+        headers = {
+            "Cache-Control": IMMUTABLE_CACHE,
+            # Content hash, so every worker and instance agrees on the validator
+            "ETag": f'"{asset["digest"]}{"-" + encoding if encoding else ""}"',
+        }
+        if asset["variants"]:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        response = FileResponse(file_path, stat_result=stat_result, media_type=asset["media_type"], headers=headers)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+if __name__ == "__main__":
+    # Build step: precompress ahead of time so workers start without compressing
+    logging.basicConfig(level=logging.INFO)
+    asset_manifest.build()
+    for logical, hashed in sorted(asset_manifest.urls.items()):
+        variants = ", ".join(sorted(asset_manifest.assets[hashed]["variants"])) or "-"
+        print(f"{logical:<40} {hashed:<55} {variants}")
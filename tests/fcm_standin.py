@@ -0,0 +1,55 @@
+"""
+Local FCM stand-in - emulates the FCM HTTP v1 send endpoint for development and tests.
+
+Token conventions:
+    unregistered*  -> 404 UNREGISTERED (the dispatcher deletes the token)
+    unavailable*   -> 503 (the dispatcher retries with backoff)
+    anything else  -> 200
+
+Run it next to the app:
+    python tests/fcm_standin.py --port 9010
+    FCM_BASE_URL=http://127.0.0.1:9010 FCM_ACCESS_TOKEN=dev FIREBASE_PROJECT_ID=fitos-dev python main.py
+"""
+import asyncio
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_fcm_standin_app(latency: float = 0.0) -> FastAPI:
+    """Build the stand-in app. Received messages are kept in app.state.received."""
+    app = FastAPI(title="FCM stand-in")
+    app.state.received = []
+
+    @app.post("/v1/projects/{project_id}/messages:send")
+    async def send(project_id: str, request: Request):
+        if not request.headers.get("authorization", "").startswith("Bearer "):
+            return JSONResponse(status_code=401, content={"error": {"status": "UNAUTHENTICATED"}})
+        if latency:
+            await asyncio.sleep(latency)
+
+        message = (await request.json()).get("message", {})
+        token = message.get("token", "")
+        if token.startswith("unregistered"):
+            return JSONResponse(status_code=404, content={"error": {
+                "code": 404, "status": "NOT_FOUND",
+                "details": [{"errorCode": "UNREGISTERED"}],
+            }})
+        if token.startswith("unavailable"):
+            return JSONResponse(status_code=503, content={"error": {"code": 503, "status": "UNAVAILABLE"}})
+
+        app.state.received.append(message)
+        return {"name": f"projects/{project_id}/messages/{len(app.state.received)}"}
+
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local FCM HTTP v1 stand-in")
+    parser.add_argument("--port", type=int, default=9010)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated per-request latency (seconds)")
+    args = parser.parse_args()
+    uvicorn.run(create_fcm_standin_app(args.latency), host="127.0.0.1", port=args.port)
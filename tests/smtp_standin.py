@@ -0,0 +1,226 @@
+"""
+Local SMTP stand-in - a small ESMTP server (STARTTLS, AUTH PLAIN/XOAUTH2) for development,
+tests and benchmarks of the email pipeline.
+
+Recipient conventions:
+    reject*      -> 550 (permanent, not retried)
+    tempfail*    -> 451 on the first attempt, accepted on the next one
+    anything else -> accepted
+
+STARTTLS uses a self-signed certificate for localhost/127.0.0.1, written next to a
+temporary key. Run it next to the app and trust that certificate:
+    python tests/smtp_standin.py --port 2525
+    SSL_CERT_FILE=<printed cert path> SMTP_HOST=localhost SMTP_PORT=2525 SMTP_USER=dev SMTP_PASSWORD=dev python main.py
+"""
+import base64
+import datetime
+import ipaddress
+import os
+import socketserver
+import ssl
+import tempfile
+import threading
+import time
+
+
+def _write_self_signed_cert(directory: str):
+    """(cert_path, key_path) of a fresh self-signed certificate for localhost."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([
+            x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1")),
+        ]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = os.path.join(directory, "standin.crt"), os.path.join(directory, "standin.key")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def reply(self, line: str):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(line.encode() + b"\r\n")
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        server.count("connections")
+        server.track(self.connection, True)
+        tls = False
+        authenticated = False
+        mail_from, rcpts = None, []
+        try:
+            self.reply("220 localhost ESMTP stand-in")
+            while True:
+                raw = self.rfile.readline()
+                if not raw:
+                    return
+                line = raw.decode(errors="replace").rstrip("\r\n")
+                verb, _, arg = line.partition(" ")
+                verb = verb.upper()
+
+                if verb in ("EHLO", "HELO"):
+                    lines = ["localhost"] + ([] if tls else ["STARTTLS"]) + ["AUTH PLAIN XOAUTH2", "8BITMIME"]
+                    for extension in lines[:-1]:
+                        self.wfile.write(f"250-{extension}\r\n".encode())
+                    self.reply(f"250 {lines[-1]}")
+                elif verb == "STARTTLS" and not tls:
+                    self.reply("220 Ready to start TLS")
+                    server.track(self.connection, False)
+                    self.connection = server.tls_context.wrap_socket(self.connection, server_side=True)
+                    server.track(self.connection, True)
+                    self.rfile = self.connection.makefile("rb")
+                    self.wfile = self.connection.makefile("wb")
+                    tls = True
+                    server.count("tls_handshakes")
+                elif verb == "AUTH":
+                    mechanism, _, credentials = arg.partition(" ")
+                    if mechanism.upper() == "PLAIN":
+                        _, _, password = base64.b64decode(credentials).decode().split("\x00", 2)
+                        authenticated = server.password is None or password == server.password
+                    else:
+                        authenticated = mechanism.upper() == "XOAUTH2" and "auth=Bearer " in base64.b64decode(credentials).decode()
+                    if authenticated:
+                        server.count("logins")
+                        self.reply("235 Authentication successful")
+                    else:
+                        self.reply("535 Authentication credentials invalid")
+                elif verb == "MAIL":
+                    if not authenticated:
+                        self.reply("530 Authentication required")
+                        continue
+                    mail_from, rcpts = arg.split(":", 1)[1].strip(" <>"), []
+                    self.reply("250 OK")
+                elif verb == "RCPT":
+                    rcpt = arg.split(":", 1)[1].strip(" <>")
+                    if rcpt.startswith("reject"):
+                        self.reply("550 No such user")
+                    elif rcpt.startswith("tempfail") and server.first_attempt(rcpt):
+                        self.reply("451 Try again later")
+                    else:
+                        rcpts.append(rcpt)
+                        self.reply("250 OK")
+                elif verb == "DATA":
+                    self.reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = []
+                    while True:
+                        chunk = self.rfile.readline()
+                        if not chunk or chunk in (b".\r\n", b".\n"):
+                            break
+                        data.append(chunk)
+                    server.store(mail_from, rcpts, b"".join(data).decode(errors="replace"))
+                    self.reply("250 OK queued")
+                elif verb in ("RSET", "NOOP"):
+                    mail_from, rcpts = None, []
+                    self.reply("250 OK")
+                elif verb == "QUIT":
+                    self.reply("221 Bye")
+                    return
+                else:
+                    self.reply("502 Command not implemented")
+        except (OSError, ssl.SSLError, ValueError):
+            return
+        finally:
+            server.track(self.connection, False)
+
+
+class SmtpStandin(socketserver.ThreadingTCPServer):
+    """The stand-in server. Delivered messages are kept in .received, counters in .stats."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, password: str = None):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.password = password
+        self.cert_path, key_path = _write_self_signed_cert(tempfile.mkdtemp(prefix="smtp-standin-"))
+        self.tls_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.tls_context.load_cert_chain(self.cert_path, key_path)
+        self.received = []
+        self.stats = {"connections": 0, "tls_handshakes": 0, "logins": 0, "messages": 0}
+        self._attempted = set()
+        self._open = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def client_context(self) -> ssl.SSLContext:
+        """An SSL context that trusts the stand-in's certificate."""
+        return ssl.create_default_context(cafile=self.cert_path)
+
+    def count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def track(self, sock, opened: bool):
+        with self._lock:
+            if opened:
+                self._open.add(sock)
+            else:
+                self._open.discard(sock)
+
+    def first_attempt(self, rcpt: str) -> bool:
+        with self._lock:
+            first = rcpt not in self._attempted
+            self._attempted.add(rcpt)
+            return first
+
+    def store(self, mail_from: str, rcpts: list, data: str):
+        with self._lock:
+            self.received.append({"from": mail_from, "to": rcpts, "data": data})
+            self.stats["messages"] += 1
+
+    def drop_connections(self):
+        """Close every open session, like a server timing out idle clients."""
+        with self._lock:
+            sockets = list(self._open)
+        for sock in sockets:
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+
+    def start(self) -> "SmtpStandin":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.drop_connections()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Local SMTP stand-in")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before every reply")
+    args = parser.parse_args()
+    standin = SmtpStandin(port=args.port, latency=args.latency)
+    print(f"SMTP stand-in on 127.0.0.1:{standin.port}, certificate: {standin.cert_path}")
+    standin.serve_forever()
@@ -0,0 +1,143 @@
+import json
+import os
+import random
+import sys
+import uuid
+from datetime import date, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import (
+    UserORM, ClientProfileORM, ClientScheduleORM, ClientDailyDietSummaryORM, ClientActivityStateORM,
+)
+from service_modules.activity_state_service import (
+    compute_day_streak, get_activity_state, backfill_activity_state, health_score,
+    compute_past_week_scores, DEFAULT_TARGETS,
+)
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+def _seed_client(db):
+    client_id = str(uuid.uuid4())
+    db.add(UserORM(id=client_id, username=f"streak_{client_id[:8]}", role="client"))
+    db.add(ClientProfileORM(id=client_id, name="Streak"))
+    db.flush()
+    return client_id
+
+
+def _day_by_day_streak(db, client_id, today):
+    """Reference: the original walk-back, one query per day."""
+    streak, empty = 0, 0
+    for offset in range(365):
+        day = (today - timedelta(days=offset)).isoformat()
+        items = db.query(ClientScheduleORM).filter(
+            ClientScheduleORM.client_id == client_id,
+            ClientScheduleORM.date == day,
+            ClientScheduleORM.type == "workout"
+        ).all()
+        total, done = len(items), sum(1 for i in items if i.completed)
+        if total == 0:
+            empty += 1
+            if empty > 3:
+                break
+        elif done == total:
+            empty = 0
+            streak += 1
+        elif offset > 0:
+            break
+    return streak
+
+
+def test_streak_matches_day_by_day_walk():
+    rng = random.Random(7)
+    today = date.today()
+    db = TestingSessionLocal()
+    for _ in range(30):
+        client_id = _seed_client(db)
+        for offset in range(rng.randint(0, 60)):
+            if rng.random() < 0.25:
+                continue  # rest day
+            for _ in range(rng.randint(1, 2)):
+                db.add(ClientScheduleORM(client_id=client_id, date=(today - timedelta(days=offset)).isoformat(),
+                                         type="workout", title="W", completed=rng.random() < 0.93))
+        db.flush()
+        assert compute_day_streak(db, client_id, today) == _day_by_day_streak(db, client_id, today)
+    db.rollback()
+    db.close()
+
+
+def test_schedule_write_marks_state_dirty_and_read_refreshes():
+    today = date.today()
+    db = TestingSessionLocal()
+    client_id = _seed_client(db)
+    db.add(ClientScheduleORM(client_id=client_id, date=today.isoformat(), type="workout", title="W", completed=True))
+    db.commit()
+
+    state = get_activity_state(db, client_id)
+    db.commit()
+    assert state.day_streak == 1 and not state.dirty
+    assert db.get(ClientProfileORM, client_id).streak == 1
+
+    db.add(ClientScheduleORM(client_id=client_id, date=today.isoformat(), type="workout", title="W2", completed=False))
+    db.commit()
+    db.expire_all()
+    assert db.get(ClientActivityStateORM, client_id).dirty
+
+    # Today incomplete doesn't break the streak, but no longer counts
+    assert get_activity_state(db, client_id).day_streak == 0
+    db.close()
+
+
+def test_concurrent_first_reads_share_one_row():
+    db = TestingSessionLocal()
+    client_id = _seed_client(db)
+    db.commit()
+
+    # Another request creates the row between this read's lookup and its insert
+    raced = []
+
+    def race(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO client_activity_state") and not raced:
+            raced.append(statement)
+            cursor.connection.execute(
+                "INSERT INTO client_activity_state (client_id, dirty) VALUES (?, 1)", (client_id,))
+
+    event.listen(engine, "before_cursor_execute", race)
+    try:
+        state = get_activity_state(db, client_id)
+    finally:
+        event.remove(engine, "before_cursor_execute", race)
+    assert raced
+    db.commit()
+    assert state.client_id == client_id and not state.dirty
+    assert db.query(ClientActivityStateORM).filter(ClientActivityStateORM.client_id == client_id).count() == 1
+    db.close()
+
+
+def test_week_scores_and_backfill():
+    today = date.today()
+    db = TestingSessionLocal()
+    client_id = _seed_client(db)
+    monday = today - timedelta(days=today.weekday())
+    for i in range(today.weekday()):
+        db.add(ClientDailyDietSummaryORM(client_id=client_id, date=(monday + timedelta(days=i)).isoformat(),
+                                         total_calories=1800, total_protein=140, total_carbs=210, total_fat=60))
+    db.commit()
+
+    expected = [health_score(1800, 140, 210, 60, DEFAULT_TARGETS) if i < today.weekday() else 0 for i in range(7)]
+    assert compute_past_week_scores(db, client_id, today, DEFAULT_TARGETS) == expected
+
+    db.close()
+    assert backfill_activity_state(TestingSessionLocal) >= 1
+    db = TestingSessionLocal()
+    state = db.get(ClientActivityStateORM, client_id)
+    assert json.loads(state.week_scores) == expected and not state.dirty
+    db.close()
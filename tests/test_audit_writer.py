@@ -0,0 +1,164 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import Base, run_sync
+from models_orm import UserORM, SensitiveDataAccessLogORM
+import authorization
+import service_modules.audit_writer as writer_module
+from service_modules.audit_writer import AuditWriter
+
+
+@pytest.fixture
+def session_factory(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'audit.db'}", poolclass=NullPool,
+                           connect_args={"check_same_thread": False, "timeout": 60})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(writer_module, "get_db_session", factory)
+    db = factory()
+    db.add(UserORM(id="coach", username="coach", role="trainer"))
+    db.add(UserORM(id="anna", username="anna", role="client"))
+    db.commit()
+    db.close()
+    factory.engine = engine
+    yield factory
+    engine.dispose()
+
+
+def _logged(factory):
+    db = factory()
+    try:
+        return db.query(SensitiveDataAccessLogORM).order_by(SensitiveDataAccessLogORM.id).all()
+    finally:
+        db.close()
+
+
+def test_entry_is_written_without_committing_the_callers_session(session_factory, monkeypatch):
+    monkeypatch.setattr(authorization, "audit_writer", AuditWriter())
+    db = session_factory()
+    coach = db.query(UserORM).filter(UserORM.id == "coach").one()
+    db.add(UserORM(id="pending", username="pending", role="client"))
+
+    authorization.log_sensitive_access(coach, "anna", "weight", "view", "/api/client/{client_id}/weight", db)
+    db.rollback()
+    db.close()
+
+    [entry] = _logged(session_factory)
+    assert (entry.accessor_id, entry.accessor_role, entry.resource_type) == ("coach", "trainer", "weight")
+    check = session_factory()
+    assert check.query(UserORM).filter(UserORM.id == "pending").first() is None
+    check.close()
+
+
+def test_flusher_batches_entries_and_stop_writes_the_rest(session_factory):
+    writer = AuditWriter(interval=60, batch_size=25)
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(session_factory.engine, "before_cursor_execute", listener)
+
+    def record(i):
+        writer.record(accessor_id="coach", client_id="anna", resource_type="diet", action="view", endpoint=f"/{i}")
+
+    async def run():
+        await writer.start()
+        for i in range(10):
+            record(i)
+        await asyncio.sleep(0.1)
+        assert writer.depth == 10  # Below the batch size: waits for the interval
+
+        for i in range(10, 60):
+            record(i)
+        for _ in range(200):
+            if writer.stats["written"] == 60:
+                break
+            await asyncio.sleep(0.01)
+        assert writer.stats["written"] == 60
+
+        for i in range(60, 65):
+            record(i)
+        await writer.stop()
+
+    asyncio.run(run())
+    event.remove(session_factory.engine, "before_cursor_execute", listener)
+    entries = _logged(session_factory)
+    assert [e.endpoint for e in entries] == [f"/{i}" for i in range(65)]
+    assert all(e.accessed_at for e in entries)
+    # 25 + 25 + 10 once the batch size was reached, 5 on stop
+    assert len([s for s in statements if s.startswith("INSERT")]) == 4
+    assert writer.stats["flushes"] == 4 and writer.depth == 0
+
+
+def test_full_queue_is_written_by_the_caller_and_failed_writes_are_kept(session_factory, monkeypatch):
+    writer = AuditWriter(interval=60, batch_size=100, maxsize=5)
+
+    async def run():
+        await writer.start()
+        for i in range(12):
+            await run_sync(writer.record, accessor_id="coach", client_id="anna", endpoint=f"/{i}")
+        assert writer.stats["queue_full"] == 2 and len(_logged(session_factory)) == 10
+
+        # The database is unavailable: the entries stay queued until it's back
+        healthy = writer_module.get_db_session
+        monkeypatch.setattr(writer_module, "get_db_session", lambda: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            await run_sync(writer.flush)
+        assert writer.depth == 2 and writer.stats["failed_flushes"] == 1
+        monkeypatch.setattr(writer_module, "get_db_session", healthy)
+        await writer.stop()
+
+    asyncio.run(run())
+    assert [e.endpoint for e in _logged(session_factory)] == [f"/{i}" for i in range(12)]
+
+
+def test_entry_of_a_deleted_client_is_dropped_and_the_rest_written(session_factory):
+    event.listen(session_factory.engine, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON"))
+    writer = AuditWriter(interval=60, batch_size=100)
+
+    async def run():
+        await writer.start()
+        for i in range(8):
+            writer.record(accessor_id="coach", client_id="gone" if i == 5 else "anna", endpoint=f"/{i}")
+        await writer.stop()
+
+    asyncio.run(run())
+    assert [e.endpoint for e in _logged(session_factory)] == [f"/{i}" for i in range(8) if i != 5]
+    assert writer.stats["dropped"] == 1 and writer.stats["written"] == 7
+    assert writer.stats["failed_flushes"] == 0 and writer.depth == 0
+
+
+def test_outage_backs_off_and_caps_the_buffer(session_factory, monkeypatch):
+    writer = AuditWriter(interval=60, batch_size=5, maxsize=5, limit=20, backoff=60)
+    attempts = []
+    healthy = writer_module.get_db_session
+
+    def unavailable():
+        attempts.append(1)
+        raise ConnectionError("database is down")
+
+    async def run():
+        await writer.start()
+        monkeypatch.setattr(writer_module, "get_db_session", unavailable)
+        # On the event loop (e.g. an async route) record() never writes; the flusher tries once
+        for i in range(10):
+            writer.record(accessor_id="coach", client_id="anna", endpoint=f"/{i}")
+        assert attempts == []
+        await asyncio.sleep(0.1)
+        assert len(attempts) == 1
+        # Nothing retries during the backoff, not even requests recording into a full queue
+        for i in range(10, 30):
+            await run_sync(writer.record, accessor_id="coach", client_id="anna", endpoint=f"/{i}")
+        assert len(attempts) == 1
+        assert writer.depth == 20 and writer.stats["overflowed"] == 10
+        monkeypatch.setattr(writer_module, "get_db_session", healthy)
+        await writer.stop()
+
+    asyncio.run(run())
+    assert [e.endpoint for e in _logged(session_factory)] == [f"/{i}" for i in range(10, 30)]
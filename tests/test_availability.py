@@ -0,0 +1,153 @@
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import (
+    AvailabilityDayORM, AppointmentORM, TrainerAvailabilityORM, TrainerScheduleORM,
+    FacilityORM, FacilityAvailabilityORM, FacilityBookingORM,
+)
+import service_modules.appointment_service as appointment_module
+import service_modules.availability_engine as engine_module
+from service_modules.appointment_service import AppointmentService
+from service_modules.availability_engine import get_free_slots
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+# Next Monday, so every test day is in the future
+MONDAY = date.today() + timedelta(days=7 - date.today().weekday())
+
+
+@pytest.fixture(autouse=True)
+def session(monkeypatch):
+    monkeypatch.setattr(appointment_module, "get_db_session", TestingSessionLocal)
+    monkeypatch.setattr(engine_module, "get_db_session", TestingSessionLocal)
+    for table in reversed(Base.metadata.sorted_tables):
+        with engine.begin() as conn:
+            conn.execute(table.delete())
+    db = TestingSessionLocal()
+    yield db
+    db.close()
+
+
+def _day(offset):
+    return (MONDAY + timedelta(days=offset)).isoformat()
+
+
+def _open_weekdays(db, trainer_id, blocks=(("09:00", "12:30"), ("14:00", "18:00"))):
+    for day_of_week in range(5):
+        for start, end in blocks:
+            db.add(TrainerAvailabilityORM(trainer_id=trainer_id, day_of_week=day_of_week,
+                                          start_time=start, end_time=end))
+
+
+def _appointment(db, trainer_id, day, start, duration=60, status="scheduled"):
+    appointment = AppointmentORM(id=f"{trainer_id}-{day}-{start}", client_id="client", trainer_id=trainer_id,
+                                 date=day, start_time=start, duration=duration, status=status)
+    db.add(appointment)
+    return appointment
+
+
+def _starts(slots):
+    return [s["start_time"] for s in slots]
+
+
+def test_search_matches_per_day_slots(session):
+    trainers = [f"trainer-{i}" for i in range(5)]
+    for i, trainer_id in enumerate(trainers):
+        _open_weekdays(session, trainer_id)
+        _appointment(session, trainer_id, _day(i), "10:30", duration=45)
+        _appointment(session, trainer_id, _day(7 + i), "14:00", status="canceled")
+        session.add(TrainerScheduleORM(trainer_id=trainer_id, date=_day(i), time="04:15 PM", duration=30,
+                                       title="Consultation", type="consultation", completed=False))
+        session.add(TrainerScheduleORM(trainer_id=trainer_id, date=_day(i), time="09:00 AM", duration=60,
+                                       title="Own workout", type="workout", workout_id="w1", completed=False))
+    session.commit()
+
+    result = get_free_slots("trainer", trainers + ["nobody"], MONDAY.isoformat(), 14)
+    assert result["start"] == MONDAY.isoformat() and result["days"] == 14
+
+    service = AppointmentService()
+    for trainer_id in trainers:
+        per_day = result["slots"][trainer_id]
+        assert list(per_day) == [_day(i) for i in range(14)]
+        for day, slots in per_day.items():
+            assert slots == service.get_available_slots(trainer_id, day)
+    assert all(not slots for slots in result["slots"]["nobody"].values())
+
+    # Monday of trainer-0: 10:00 and 11:00 overlap the 10:30-11:15 appointment, 16:00 the 16:15 event,
+    # the workout note doesn't block and 12:00-13:00 doesn't fit the morning block
+    assert _starts(result["slots"]["trainer-0"][_day(0)]) == ["09:00", "14:00", "15:00", "17:00"]
+    assert _starts(result["slots"]["trainer-0"][_day(7)]) == ["09:00", "10:00", "11:00", "14:00", "15:00", "16:00", "17:00"]
+    assert result["slots"]["trainer-0"][_day(5)] == []  # Saturday
+
+    # Every day was built once and is read from the index from now on; "nobody" has no opening hours
+    assert session.query(AvailabilityDayORM).count() == 5 * 14
+
+
+def test_bookings_keep_bitmaps_current(session, monkeypatch):
+    _open_weekdays(session, "coach")
+    session.commit()
+    day = _day(2)
+
+    def free():
+        return _starts(get_free_slots("trainer", ["coach"], day, 1)["slots"]["coach"][day])
+
+    assert "15:00" in free()
+    appointment = _appointment(session, "coach", day, "15:00")
+    session.commit()
+
+    # The booking rebuilt the day's bitmap in its own transaction
+    row = session.get(AvailabilityDayORM, ("trainer", "coach", day))
+    assert row.built_version == row.version and int(row.busy, 16) == engine_module._mask(15 * 60, 60)
+    assert "15:00" not in free()
+
+    # Moving it to another day frees this one
+    appointment.date = _day(3)
+    session.commit()
+    assert "15:00" in free()
+    assert "15:00" not in _starts(get_free_slots("trainer", ["coach"], _day(3), 1)["slots"]["coach"][_day(3)])
+
+    appointment.status = "canceled"
+    session.commit()
+    assert "15:00" in _starts(get_free_slots("trainer", ["coach"], _day(3), 1)["slots"]["coach"][_day(3)])
+
+    # A bulk UPDATE bypasses the mapper events; the max age bounds how long it goes unseen
+    session.query(AppointmentORM).update({"status": "scheduled"}, synchronize_session=False)
+    session.commit()
+    assert "15:00" in _starts(get_free_slots("trainer", ["coach"], _day(3), 1)["slots"]["coach"][_day(3)])
+    monkeypatch.setattr(engine_module, "AVAILABILITY_MAX_AGE", -1)
+    assert "15:00" not in _starts(get_free_slots("trainer", ["coach"], _day(3), 1)["slots"]["coach"][_day(3)])
+
+
+def test_facility_search_uses_slot_duration(session):
+    session.add(FacilityORM(id="court", name="Court 1", slot_duration=90, is_active=True))
+    session.add(FacilityORM(id="closed", name="Court 2", slot_duration=60, is_active=False))
+    for facility_id in ("court", "closed"):
+        session.add(FacilityAvailabilityORM(facility_id=facility_id, day_of_week=0, start_time="08:00", end_time="14:00"))
+    session.add(FacilityBookingORM(id="b1", facility_id="court", date=_day(0), start_time="09:30", duration=90))
+    session.commit()
+
+    slots = get_free_slots("facility", ["court", "closed"], MONDAY.isoformat(), 7)["slots"]
+    assert _starts(slots["court"][_day(0)]) == ["08:00", "11:00", "12:30"]
+    assert slots["court"][_day(1)] == []
+    assert all(not day_slots for day_slots in slots["closed"].values())
+
+
+def test_search_limits():
+    with pytest.raises(HTTPException):
+        get_free_slots("room", ["a"])
+    with pytest.raises(HTTPException):
+        get_free_slots("trainer", [f"t{i}" for i in range(engine_module.MAX_SEARCH_RESOURCES + 1)])
+    with pytest.raises(HTTPException):
+        get_free_slots("trainer", ["a"], days=engine_module.MAX_SEARCH_DAYS + 1)
@@ -0,0 +1,90 @@
+import asyncio
+import gzip
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import BarcodeProductORM
+from off_index import OffIndex, build_index
+import service_modules.barcode_service as barcode_module
+from service_modules.barcode_service import BarcodeService
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+YOGHURT = {
+    "product_name": "Yogurt greco", "brands": "Fage", "quantity": "170 g", "serving_quantity": 170,
+    "nutriments": {"energy-kcal_100g": 54, "proteins_100g": 10.3, "carbohydrates_100g": 3, "fat_100g": 0},
+}
+
+
+def _service(monkeypatch, tmp_path, remote):
+    monkeypatch.setattr(barcode_module, "get_db_session", TestingSessionLocal)
+    service = BarcodeService(index=OffIndex(str(tmp_path / "off_index.sqlite")))
+    calls = []
+
+    async def fetch(barcode):
+        calls.append(barcode)
+        await asyncio.sleep(0.01)
+        return remote.get(barcode)
+
+    monkeypatch.setattr(service, "_fetch_remote", fetch)
+    return service, calls
+
+
+def test_tiers_cache_hits_and_misses(monkeypatch, tmp_path):
+    service, calls = _service(monkeypatch, tmp_path, {"5201054017579": YOGHURT})
+
+    async def scans():
+        # Concurrent first scans share one remote request
+        first = await asyncio.gather(*(service.lookup("5201054017579") for _ in range(5)))
+        missing = await service.lookup("8000000000001")
+        again = await service.lookup("5201054017579")
+        return first, missing, again
+
+    first, missing, again = asyncio.run(scans())
+    assert calls == ["5201054017579", "8000000000001"]
+    assert all(r["status"] == "success" and r["data"]["cals"] == 92 for r in first)
+    assert missing["status"] == "not_found"
+    assert again["tier"] == "lru"
+
+    # A fresh worker finds both answers (including the miss) in the table
+    db = TestingSessionLocal()
+    assert db.get(BarcodeProductORM, "8000000000001").found is False
+    db.close()
+    service.lru.clear()
+    assert asyncio.run(service.lookup("5201054017579"))["tier"] == "db"
+    assert asyncio.run(service.lookup("8000000000001"))["status"] == "not_found"
+    assert len(calls) == 2
+
+    stats = service.get_stats()
+    assert stats["counters"]["coalesced"] == 4 and stats["counters"]["negative_hits"] == 1
+    assert stats["db_products"] >= 1 and stats["db_not_found"] >= 1
+
+
+def test_offline_index_resolves_without_network(monkeypatch, tmp_path):
+    dump = tmp_path / "products.csv.gz"
+    header = ["code", "product_name", "brands", "quantity", "serving_size", "serving_quantity",
+              "countries_tags", "energy-kcal_100g", "energy_100g", "proteins_100g", "carbohydrates_100g", "fat_100g"]
+    rows = [
+        ["8076809513753", "Penne Rigate", "Barilla", "500 g", "80 g", "80", "en:italy,en:france", "359", "", "12.5", "70.2", "2"],
+        ["0041196910759", "Corn flakes", "Acme", "", "", "", "en:united-states", "378", "", "7", "84", "0.9"],
+        ["8001234567890", "No nutrition", "", "", "", "", "en:italy", "", "", "", "", ""],
+    ]
+    with gzip.open(dump, "wt", encoding="utf-8") as f:
+        f.write("\n".join("\t".join(r) for r in [header] + rows) + "\n")
+    assert build_index(str(dump), str(tmp_path / "off_index.sqlite")) == 1
+
+    service, calls = _service(monkeypatch, tmp_path, {})
+    result = asyncio.run(service.lookup("8076809513753"))
+    assert result["tier"] == "index" and calls == []
+    assert result["data"]["name"] == "Barilla Penne Rigate" and result["data"]["cals"] == 287
+    assert asyncio.run(service.lookup("0041196910759"))["status"] == "not_found"
+    assert calls == ["0041196910759"]
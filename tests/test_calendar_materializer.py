@@ -0,0 +1,198 @@
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import (
+    UserORM, ClientProfileORM, ClientScheduleORM, ClientActivityStateORM, TrainerScheduleORM,
+    TrainerScheduleChangeORM, WeeklySplitORM, WorkoutORM, CourseORM, AvailabilityDayORM,
+)
+from service_modules.calendar_materializer import weekly_dates
+from service_modules.course_service import CourseService
+from service_modules.split_service import SplitService
+
+# The package re-exports the service singletons under their modules' names
+split_module = sys.modules["service_modules.split_service"]
+course_module = sys.modules["service_modules.course_service"]
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+MONDAY = date(2030, 1, 7)
+
+
+@pytest.fixture
+def gym(monkeypatch):
+    monkeypatch.setattr(split_module, "get_db_session", TestingSessionLocal)
+    monkeypatch.setattr(course_module, "get_db_session", TestingSessionLocal)
+    for table in reversed(Base.metadata.sorted_tables):
+        with engine.begin() as conn:
+            conn.execute(table.delete())
+
+    db = TestingSessionLocal()
+    db.add(UserORM(id="coach", username="coach", role="trainer"))
+    db.add(WorkoutORM(id="push", title="Push Day", difficulty="Hard", owner_id="coach"))
+    db.add(WorkoutORM(id="legs", title="Leg Day", difficulty="Medium", owner_id="coach"))
+    # Mon push, Wed legs, Fri an unknown workout, Sat rest
+    db.add(WeeklySplitORM(id="split", name="Split", owner_id="coach", schedule_json=json.dumps(
+        {"1": "push", "3": {"id": "legs"}, "5": "ghost", "6": "rest"})))
+    for i in range(3):
+        db.add(UserORM(id=f"member-{i}", username=f"member_{i}", role="client"))
+        db.add(ClientProfileORM(id=f"member-{i}", trainer_id="coach"))
+        db.add(ClientActivityStateORM(client_id=f"member-{i}", dirty=False))
+    # member-0 already has something on the first Monday and Tuesday
+    db.add(ClientScheduleORM(client_id="member-0", date=MONDAY.isoformat(), title="Old", type="workout"))
+    db.add(ClientScheduleORM(client_id="member-0", date=(MONDAY + timedelta(days=1)).isoformat(), title="Walk",
+                             type="cardio"))
+    # The coach has a class and an own workout on the first Monday
+    db.add(TrainerScheduleORM(trainer_id="coach", date=MONDAY.isoformat(), time="18:00", title="Class", type="class"))
+    db.add(TrainerScheduleORM(trainer_id="coach", date=MONDAY.isoformat(), time="07:00", title="Old", type="workout",
+                              workout_id="legs"))
+    db.commit()
+    db.close()
+
+
+def client_calendar(client_id):
+    db = TestingSessionLocal()
+    rows = db.query(ClientScheduleORM).filter(ClientScheduleORM.client_id == client_id).all()
+    db.close()
+    return sorted((r.date, r.title, r.details) for r in rows)
+
+
+def test_weekly_dates():
+    assert weekly_dates(MONDAY, 14, [0, 4]) == [MONDAY, MONDAY + timedelta(days=4), MONDAY + timedelta(days=7),
+                                                MONDAY + timedelta(days=11)]
+    assert weekly_dates(MONDAY + timedelta(days=1), 7, [0]) == [MONDAY + timedelta(days=7)]
+
+
+def test_assign_split_to_a_group_in_one_pass(gym):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    result = SplitService().assign_split({"client_ids": ["member-0", "member-1", "member-2"], "split_id": "split",
+                                          "start_date": MONDAY.isoformat()}, "coach")
+    event.remove(engine, "before_cursor_execute", listener)
+
+    # 4 weeks x (push, legs) for three clients; the unknown workout fails each Friday
+    assert result["message"] == "Split assigned. 24 workouts scheduled. 12 failed."
+    assert result["warnings"] is True
+    assert len(statements) < 20
+
+    # The old Monday workout was replaced; Tuesday has nothing planned and keeps its walk
+    calendar = client_calendar("member-0")
+    assert len(calendar) == 9
+    assert calendar[0] == (MONDAY.isoformat(), "Push Day", "Hard")
+    assert ((MONDAY + timedelta(days=1)).isoformat(), "Walk", None) in calendar
+    assert ((MONDAY + timedelta(days=2)).isoformat(), "Leg Day", "Medium") in calendar
+    assert len(client_calendar("member-2")) == 8
+
+    db = TestingSessionLocal()
+    profiles = db.query(ClientProfileORM).all()
+    assert {(p.current_split_id, p.split_expiry_date) for p in profiles} == {
+        ("split", (MONDAY + timedelta(days=27)).isoformat())}
+    assert all(s.dirty for s in db.query(ClientActivityStateORM).all())
+    db.close()
+
+
+def test_reassigning_only_writes_what_changed(gym):
+    service = SplitService()
+    service.assign_split({"client_id": "member-1", "split_id": "split", "start_date": MONDAY.isoformat()}, "coach")
+    db = TestingSessionLocal()
+    before = {r.id for r in db.query(ClientScheduleORM).filter(ClientScheduleORM.client_id == "member-1")}
+    db.close()
+
+    # Same split over a longer horizon: the first 4 weeks are already there
+    result = service.assign_split({"client_id": "member-1", "split_id": "split", "start_date": MONDAY.isoformat(),
+                                   "days": 56}, "coach")
+    assert result["message"] == "Split assigned. 16 workouts scheduled. 8 failed."
+    db = TestingSessionLocal()
+    after = {r.id for r in db.query(ClientScheduleORM).filter(ClientScheduleORM.client_id == "member-1")}
+    profile = db.get(ClientProfileORM, "member-1")
+    db.close()
+    assert before < after and len(after) == 16
+    assert profile.split_expiry_date == (MONDAY + timedelta(days=55)).isoformat()
+
+    with pytest.raises(HTTPException) as exc:
+        service.assign_split({"client_id": "member-1", "split_id": "split", "days": 1000}, "coach")
+    assert exc.value.status_code == 400
+    with pytest.raises(HTTPException) as exc:
+        service.assign_split({"client_ids": ["member-1", "nobody"], "split_id": "split"}, "coach")
+    assert exc.value.status_code == 404
+    with pytest.raises(HTTPException) as exc:
+        service.assign_split({"client_ids": [f"member-{i}" for i in range(201)], "split_id": "split"}, "coach")
+    assert exc.value.status_code == 400
+
+
+def test_assignment_is_limited_to_the_trainers_clients(gym):
+    db = TestingSessionLocal()
+    db.add(UserORM(id="owner", username="owner", role="owner"))
+    db.add(UserORM(id="rival", username="rival", role="trainer", gym_owner_id="owner"))
+    db.add(UserORM(id="stranger", username="stranger", role="client"))
+    db.add(ClientProfileORM(id="stranger", trainer_id="someone-else", gym_id="other-gym"))
+    db.get(ClientProfileORM, "member-2").gym_id = "owner"
+    db.commit()
+    db.close()
+
+    service = SplitService()
+    with pytest.raises(HTTPException) as exc:
+        service.assign_split({"client_ids": ["member-0", "stranger"], "split_id": "split"}, "coach")
+    assert exc.value.status_code == 403
+    assert client_calendar("member-0")[0][1] == "Old"
+    with pytest.raises(HTTPException) as exc:
+        service.assign_split({"client_id": "member-1", "split_id": "split"}, "rival")
+    assert exc.value.status_code == 403
+    # Another trainer (or the owner) of the same gym may assign to its members
+    assert service.assign_split({"client_id": "member-2", "split_id": "split"}, "rival")["status"] == "success"
+    assert service.assign_split({"client_id": "member-2", "split_id": "split"}, "owner")["status"] == "success"
+
+
+def test_self_assignment_keeps_the_trainers_other_events(gym):
+    SplitService().assign_split({"client_id": "coach", "split_id": "split", "start_date": MONDAY.isoformat()}, "coach")
+
+    db = TestingSessionLocal()
+    monday = db.query(TrainerScheduleORM).filter(TrainerScheduleORM.date == MONDAY.isoformat()).all()
+    assert sorted((e.title, e.time) for e in monday) == [("Class", "18:00"), ("Push Day", "08:00")]
+    # Fridays get the fallback title for a workout that can't be found
+    friday = db.query(TrainerScheduleORM).filter(TrainerScheduleORM.date == (MONDAY + timedelta(days=4)).isoformat()).one()
+    assert (friday.title, friday.subtitle, friday.workout_id) == ("Workout", "From Split", "ghost")
+    assert db.query(TrainerScheduleORM).count() == 13
+    # Core writes still feed the calendar's change log and busy bitmaps
+    written = {e.id for e in db.query(TrainerScheduleORM).filter(TrainerScheduleORM.type == "workout")}
+    logged = {c.entry_id for c in db.query(TrainerScheduleChangeORM)}
+    assert written <= logged
+    assert db.query(AvailabilityDayORM).filter(AvailabilityDayORM.date == MONDAY.isoformat()).count() == 1
+    assert db.get(ClientProfileORM, "member-0").current_split_id is None
+    db.close()
+
+
+def test_course_schedule_skips_days_already_scheduled(gym):
+    db = TestingSessionLocal()
+    db.add(CourseORM(id="yoga", name="Yoga", owner_id="coach", days_of_week_json="[0, 2]", time_slot="7:00 PM"))
+    db.commit()
+    db.close()
+    today = date.today()
+    dates = weekly_dates(today, 14, [0, 2])
+
+    assert CourseService().generate_course_schedule("yoga", "coach", weeks_ahead=2)["created"] == 4
+    db = TestingSessionLocal()
+    db.query(TrainerScheduleORM).filter(TrainerScheduleORM.course_id == "yoga",
+                                        TrainerScheduleORM.date == dates[0].isoformat()).delete()
+    db.commit()
+    db.close()
+
+    assert CourseService().generate_course_schedule("yoga", "coach", weeks_ahead=3)["created"] == 3
+    db = TestingSessionLocal()
+    entries = db.query(TrainerScheduleORM).filter(TrainerScheduleORM.course_id == "yoga").all()
+    db.close()
+    assert sorted(e.date for e in entries) == [d.isoformat() for d in weekly_dates(today, 21, [0, 2])]
+    assert {(e.time, e.title, e.subtitle, e.duration) for e in entries} == {("7:00 PM", "Yoga", "Group Course", 60)}
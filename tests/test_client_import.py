@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import (
+    UserORM, ClientProfileORM, MedicalCertificateORM, ClientSubscriptionORM, SubscriptionPlanORM,
+)
+import service_modules.client_import_service as import_module
+from service_modules.client_import_service import ClientImportService
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+def _setup(monkeypatch):
+    monkeypatch.setattr(import_module, "get_db_session", TestingSessionLocal)
+    monkeypatch.setattr(import_module, "IMPORT_CHUNK_SIZE", 4)
+    monkeypatch.setattr(import_module, "BCRYPT_ROUNDS", 4)
+    owner_id = str(uuid.uuid4())
+    db = TestingSessionLocal()
+    db.add(UserORM(id=owner_id, username=f"owner_{owner_id[:8]}", role="owner"))
+    db.add(UserORM(id=str(uuid.uuid4()), username=f"taken_{owner_id[:8]}", email=f"taken_{owner_id[:8]}@x.it",
+                   role="client"))
+    db.add(SubscriptionPlanORM(id=f"plan-{owner_id}", gym_id=owner_id, name="Open Gym", price=40.0))
+    db.commit()
+    db.close()
+    return owner_id
+
+
+def _csv(owner_id):
+    tag = owner_id[:8]
+    lines = ["Nome;Email;Telefono;Abbonamento;Scadenza;Scadenza certificato"]
+    for i in range(9):
+        lines.append(f"Member {tag} {i};m{i}_{tag}@x.it;33312345{i:02d};Open Gym;31/12/2099;01/06/2099")
+    lines += [
+        f"Taken;taken_{tag}@x.it;;;;",           # email already registered
+        f"Again;m0_{tag}@x.it;;;;",              # duplicate email inside the file
+        f"taken {tag};fresh_{tag}@x.it;;Yoga;;",  # username collides, plan not in the gym
+        ";;;;;",                                  # no name, no email
+    ]
+    return "\n".join(lines).encode("utf-8")
+
+
+def test_bulk_import_creates_rows_and_reports_skips(monkeypatch):
+    owner_id = _setup(monkeypatch)
+    progress = []
+    result = ClientImportService().process_csv(_csv(owner_id), owner_id,
+                                               on_progress=lambda done, total, r: progress.append((done, total)))
+
+    assert result["created"] == 10 and result["skipped"] == 2
+    assert sorted(e["row"] for e in result["errors"]) == [11, 12, 14]
+    assert progress[0] == (0, 13) and progress[-1] == (13, 13)
+
+    db = TestingSessionLocal()
+    created = {c["username"]: c for c in result["created_clients"]}
+    assert len(created) == 10 and f"taken_{owner_id[:8]}" not in created
+    for username, client in created.items():
+        user = db.query(UserORM).filter(UserORM.username == username).one()
+        assert user.must_change_password and user.gym_owner_id == owner_id
+        assert bcrypt.checkpw(client["temp_password"].encode(), user.hashed_password.encode())
+        assert db.get(ClientProfileORM, user.id).gym_id == owner_id
+
+    member_ids = [u.id for u in db.query(UserORM).filter(UserORM.email.like(f"m%_{owner_id[:8]}@x.it")).all()]
+    subs = db.query(ClientSubscriptionORM).filter(ClientSubscriptionORM.client_id.in_(member_ids)).all()
+    assert len(subs) == 9 and {s.status for s in subs} == {"active"}
+    assert {s.current_period_end for s in subs} == {"2099-12-31"}
+    certs = db.query(MedicalCertificateORM).filter(MedicalCertificateORM.client_id.in_(member_ids)).all()
+    assert len(certs) == 9 and certs[0].expiration_date == "2099-06-01"
+    db.close()
+
+
+def test_import_job_reports_progress(monkeypatch):
+    owner_id = _setup(monkeypatch)
+    service = ClientImportService()
+    job_id = service.start_import_job(_csv(owner_id), owner_id, filename="golee.csv")
+
+    for _ in range(200):
+        job = service.get_import_job(job_id, owner_id)
+        if job["status"] in ("completed", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "completed"
+    assert job["processed_rows"] == job["total_rows"] == 13
+    assert job["created"] == 10 and job["result"]["created"] == 10
+    assert service.get_import_job(job_id, "someone-else") is None
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import Base, run_sync
+from models_orm import UserORM, CommunityPostORM, CommunityEventParticipantORM
+import service_modules.community_service as community_module
+import service_modules.community_counters as counters_module
+from service_modules.community_counters import CommunityCounters, reconcile_counters
+from service_modules.community_service import CommunityService
+
+
+@pytest.fixture
+def session_factory(monkeypatch, tmp_path):
+    # A file database with a connection per session, so requests really run concurrently
+    engine = create_engine(f"sqlite:///{tmp_path / 'community.db'}", poolclass=NullPool,
+                           connect_args={"check_same_thread": False, "timeout": 60})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(community_module, "get_db_session", factory)
+    monkeypatch.setattr(counters_module, "get_db_session", factory)
+    counters = CommunityCounters(interval=0.05)
+    monkeypatch.setattr(community_module, "community_counters", counters)
+
+    db = factory()
+    db.add(UserORM(id="coach", username="coach", role="trainer"))
+    db.add(CommunityPostORM(id="post", author_id="coach", gym_id="gym", post_type="event",
+                            content="Saturday run", max_participants=10))
+    db.commit()
+    db.close()
+    factory.engine, factory.counters = engine, counters
+    yield factory
+    engine.dispose()
+
+
+def _burst(func, args_list):
+    barrier = threading.Barrier(len(args_list))
+    results = [None] * len(args_list)
+
+    def run(i, args):
+        barrier.wait()
+        try:
+            results[i] = func(*args)
+        except HTTPException as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i, args)) for i, args in enumerate(args_list)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def _post(factory):
+    db = factory()
+    post = db.get(CommunityPostORM, "post")
+    db.close()
+    return post
+
+
+def test_concurrent_likes_are_all_counted(session_factory):
+    service = CommunityService()
+    results = _burst(service.toggle_like, [("post", f"member-{i}") for i in range(100)])
+    assert all(r["liked"] for r in results)
+    assert _post(session_factory).like_count == 100
+
+    # Double taps of the same member: the like is toggled, never counted twice
+    _burst(service.toggle_like, [("post", "member-0")] * 2)
+    assert _post(session_factory).like_count in (99, 100)
+    service.toggle_like("post", "member-0")
+    service.toggle_like("post", "member-0")
+    assert _post(session_factory).like_count in (99, 100)
+
+
+def test_flusher_coalesces_counter_writes(session_factory):
+    service = CommunityService()
+    counters = session_factory.counters
+    updates = []
+    listener = lambda conn, cursor, statement, *args: updates.append(statement) if statement.startswith("UPDATE community_posts") else None
+    event.listen(session_factory.engine, "before_cursor_execute", listener)
+
+    async def likes():
+        await counters.start()
+        await asyncio.gather(*(run_sync(service.toggle_like, "post", f"member-{i}") for i in range(60)))
+        await counters.stop()
+
+    try:
+        asyncio.run(likes())
+    finally:
+        event.remove(session_factory.engine, "before_cursor_execute", listener)
+    assert _post(session_factory).like_count == 60
+    assert 1 <= len(updates) < 60
+
+
+def test_event_capacity_is_never_exceeded(session_factory):
+    service = CommunityService()
+    results = _burst(service.toggle_event_participation, [("post", f"member-{i}") for i in range(40)])
+    assert sum(1 for r in results if isinstance(r, dict)) == 10
+    assert all(r.detail == "Event is full" for r in results if isinstance(r, HTTPException))
+
+    db = session_factory()
+    assert db.query(CommunityEventParticipantORM).count() == 10
+    db.close()
+    assert _post(session_factory).participant_count == 10
+
+    # Leaving frees the place for someone else
+    member = next(f"member-{i}" for i, r in enumerate(results) if isinstance(r, dict))
+    assert service.toggle_event_participation("post", member) == {"participating": False, "participant_count": 9}
+    assert service.toggle_event_participation("post", "late") == {"participating": True, "participant_count": 10}
+
+
+def test_reconcile_fixes_drifted_counts(session_factory):
+    service = CommunityService()
+    service.toggle_like("post", "anna")
+    comment = service.add_comment("post", "anna", "Count me in")
+    service.toggle_comment_like(comment["id"], "marco")
+
+    db = session_factory()
+    db.execute(text("UPDATE community_posts SET like_count = 7, comment_count = NULL, participant_count = 3"))
+    db.execute(text("UPDATE community_comments SET like_count = 0"))
+    db.commit()
+    db.close()
+
+    assert reconcile_counters() == {"posts": 1, "comments": 1}
+    post = _post(session_factory)
+    assert (post.like_count, post.comment_count, post.participant_count) == (1, 1, 0)
+    assert reconcile_counters() == {"posts": 0, "comments": 0}
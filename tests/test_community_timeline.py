@@ -0,0 +1,147 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import UserORM, ClientProfileORM, CommunityPostORM, CommunityTimelineORM
+import service_modules.community_counters as counters_module
+import service_modules.community_service as community_module
+import service_modules.community_timeline as timeline_module
+from service_modules.community_service import CommunityService
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def gym(monkeypatch):
+    monkeypatch.setattr(community_module, "get_db_session", TestingSessionLocal)
+    monkeypatch.setattr(counters_module, "get_db_session", TestingSessionLocal)
+    monkeypatch.setattr(timeline_module, "_built", set())
+    for table in reversed(Base.metadata.sorted_tables):
+        with engine.begin() as conn:
+            conn.execute(table.delete())
+    db = TestingSessionLocal()
+    db.add(UserORM(id="owner", username="owner", role="owner", gym_name="Iron Temple"))
+    for name in ("anna", "marco"):
+        db.add(UserORM(id=name, username=name, role="client"))
+        db.add(ClientProfileORM(id=name, gym_id="owner"))
+    db.commit()
+    db.close()
+    return CommunityService()
+
+
+def _pages(service, user_id, scope="local", limit=20):
+    posts, cursor = [], None
+    while True:
+        page = service.get_feed(user_id, scope=scope, cursor=cursor, limit=limit)
+        posts.extend(page["posts"])
+        if not page["has_more"]:
+            return posts
+        cursor = page["next_cursor"]
+
+
+def test_keyset_pages_are_stable_on_equal_timestamps(gym):
+    db = TestingSessionLocal()
+    # Posts that predate the timeline, half of them sharing one timestamp
+    for i in range(45):
+        db.add(CommunityPostORM(id=f"post-{i:02d}", author_id="anna", gym_id="owner", post_type="text",
+                                scope="global" if i % 3 == 0 else "local", content=f"#{i}",
+                                created_at="2026-10-01T10:00:00" if i < 25 else f"2026-10-02T10:00:{i:02d}"))
+    db.commit()
+    db.close()
+    gym.pin_post("post-07", "owner")
+
+    posts = _pages(gym, "marco")
+    ids = [p["id"] for p in posts]
+    assert len(ids) == 45 and len(set(ids)) == 45
+    assert ids[0] == "post-07" and posts[0]["is_pinned"]
+    assert ids[1:21] == [f"post-{i:02d}" for i in range(44, 24, -1)]
+
+    global_posts = _pages(gym, "marco", scope="global", limit=7)
+    assert [p["id"] for p in global_posts] == [f"post-{i:02d}" for i in range(44, -1, -1) if i % 3 == 0]
+    assert {p["gym_name"] for p in global_posts} == {"Iron Temple"}
+
+    # Old clients sending a bare created_at keep paging past the pinned posts
+    page = gym.get_feed("marco", cursor="2026-10-02T10:00:30", limit=100)
+    assert [p["id"] for p in page["posts"]][:2] == ["post-29", "post-28"]
+
+
+def test_writes_update_the_timeline(gym):
+    post = gym.create_post("anna", "text", scope="global", content="First PR today")
+    post_id = post["id"]
+
+    gym.toggle_like(post_id, "marco")
+    comment = gym.add_comment(post_id, "marco", "Great job!")
+    feed = gym.get_feed("marco")["posts"]
+    assert feed[0]["like_count"] == 1 and feed[0]["is_liked_by_me"]
+    assert feed[0]["comment_count"] == 1
+    assert feed[0]["first_comment"] == {"author_username": "marco", "author_profile_picture": None,
+                                        "content": "Great job!"}
+    assert gym.get_feed("anna")["posts"][0]["is_liked_by_me"] is False
+
+    # Author snapshot follows profile changes
+    db = TestingSessionLocal()
+    db.get(UserORM, "anna").username = "anna_lifts"
+    db.get(UserORM, "marco").profile_picture = "/static/marco.png"
+    db.commit()
+    db.close()
+    feed = gym.get_feed("marco", scope="global")["posts"]
+    assert feed[0]["author_username"] == "anna_lifts"
+    assert feed[0]["first_comment"]["author_profile_picture"] == "/static/marco.png"
+
+    gym.delete_comment(comment["id"], "marco")
+    feed = gym.get_feed("marco")["posts"]
+    assert feed[0]["comment_count"] == 0 and feed[0]["first_comment"] is None
+
+    gym.delete_post(post_id, "anna")
+    assert gym.get_feed("marco")["posts"] == []
+    assert gym.get_feed("marco", scope="global")["posts"] == []
+    db = TestingSessionLocal()
+    assert db.query(CommunityTimelineORM).count() == 0
+    db.close()
+
+
+def test_erased_commenter_leaves_no_trace_in_the_feed(gym):
+    post_id = gym.create_post("anna", "text", content="Leg day")["id"]
+    gym.add_comment(post_id, "anna", "Who's in?")
+    gym.add_comment(post_id, "marco", "marco private words")
+    assert gym.get_feed("anna")["posts"][0]["first_comment"]["author_username"] == "marco"
+
+    # As in gdpr_delete_account: the user row goes in a bulk delete no mapper event sees
+    db = TestingSessionLocal()
+    assert timeline_module.erase_user_comments(db, "marco") == {post_id}
+    counters_module.recount(db, [post_id])
+    db.query(ClientProfileORM).filter(ClientProfileORM.id == "marco").delete()
+    db.query(UserORM).filter(UserORM.id == "marco").delete()
+    db.commit()
+    db.close()
+
+    [post] = gym.get_feed("anna")["posts"]
+    assert post["comment_count"] == 1
+    assert post["first_comment"] == {"author_username": "anna", "author_profile_picture": None,
+                                     "content": "Who's in?"}
+
+
+def test_feed_page_query_count(gym):
+    for i in range(30):
+        gym.create_post("anna", "text", content=f"#{i}")
+    gym.get_feed("marco")  # builds the timeline state once
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        page = gym.get_feed("marco", limit=20)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert len(page["posts"]) == 20 and page["has_more"]
+    # gym id (user + profile), the page, the viewer's likes
+    assert len(statements) == 4
@@ -0,0 +1,132 @@
+import io
+import json
+import os
+import sys
+import zipfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import UserORM, ClientExerciseLogORM, MessageORM, FriendshipORM, GdprExportJobORM
+import service_modules.gdpr_export_service as export_module
+from service_modules.gdpr_export_service import GdprExportService
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    monkeypatch.setattr(export_module, "get_db_session", TestingSessionLocal)
+    monkeypatch.setattr(export_module, "GDPR_EXPORT_DIR", str(tmp_path))
+    for table in reversed(Base.metadata.sorted_tables):
+        with engine.begin() as conn:
+            conn.execute(table.delete())
+    db = TestingSessionLocal()
+    db.add(UserORM(id="anna", username="anna", email="anna@example.com", role="client", hashed_password="secret"))
+    db.add(UserORM(id="marco", username="marco", role="client"))
+    for i in range(1200):
+        db.add(ClientExerciseLogORM(client_id="anna", date=f"2026-01-{i % 28 + 1:02d}", exercise_name="Squat",
+                                    set_number=i % 5 + 1, reps=8, weight=60.0 + i % 10))
+    db.add(MessageORM(id="m1", conversation_id="c1", sender_id="anna", content="Ciao"))
+    db.add(MessageORM(id="m2", conversation_id="c1", sender_id="marco", content="Not anna's"))
+    db.add(FriendshipORM(user1_id="anna", user2_id="marco", status="accepted"))
+    db.commit()
+    db.close()
+    service = GdprExportService()
+    yield service
+    service._job_executor.shutdown(wait=True)
+
+
+def _ndjson(archive, section):
+    return [json.loads(line) for line in archive.read(f"{section}.ndjson").decode().splitlines()]
+
+
+def test_export_streams_every_section_into_the_zip(service):
+    buffer = io.BytesIO()
+    db = TestingSessionLocal()
+    counts = export_module.write_export(db, "anna", buffer)
+    db.close()
+
+    archive = zipfile.ZipFile(buffer)
+    assert set(archive.namelist()) == {f"{s}.ndjson" for s, _, _ in export_module.EXPORT_SECTIONS} | {"manifest.json"}
+    assert counts["exercise_logs"] == 1200 and counts["messages_sent"] == 1 and counts["friendships"] == 1
+    assert json.loads(archive.read("manifest.json"))["sections"] == counts
+
+    account = _ndjson(archive, "account")
+    assert account[0]["email"] == "anna@example.com" and "hashed_password" not in account[0]
+    assert [m["content"] for m in _ndjson(archive, "messages_sent")] == ["Ciao"]
+    assert len(_ndjson(archive, "exercise_logs")) == 1200
+    assert _ndjson(archive, "profile") == []
+
+
+def test_background_job_and_signed_download(service):
+    job = service.start_export("anna")
+    assert job["status"] == "queued" and job["download_url"] is None
+    # A second request while the first runs gets the same job
+    assert service.start_export("anna")["job_id"] == job["job_id"]
+    service._job_executor.submit(lambda: None).result()
+
+    job = service.get_export(job["job_id"], "anna")
+    assert job["status"] == "ready" and job["row_count"] == 1200 + 1 + 1 + 1
+    assert service.get_export(job["job_id"], "marco") is None
+    assert service.start_export("anna")["job_id"] == job["job_id"]
+
+    token = job["download_url"].split("token=")[1]
+    export = service.resolve_download(job["job_id"], token)
+    assert export["user_id"] == "anna" and zipfile.is_zipfile(export["path"])
+    assert service.resolve_download(job["job_id"], token[:-2] + "xx") is None
+    assert service.resolve_download("another-job", token) is None
+    assert service.resolve_download(job["job_id"], service.sign_download("another-job")) is None
+
+
+def test_cleanup_removes_expired_exports_and_stale_jobs(service):
+    job = service.start_export("anna")
+    service._job_executor.submit(lambda: None).result()
+    path = service.resolve_download(job["job_id"], service.sign_download(job["job_id"]))["path"]
+
+    long_ago = (datetime.utcnow() - timedelta(days=2)).isoformat()
+    db = TestingSessionLocal()
+    db.query(GdprExportJobORM).update({"expires_at": long_ago})
+    db.add(GdprExportJobORM(id="stuck", user_id="marco", status="running", created_at=long_ago))
+    db.commit()
+    db.close()
+
+    assert service.resolve_download(job["job_id"], service.sign_download(job["job_id"])) is None
+    assert service.get_export(job["job_id"], "anna")["status"] == "expired"
+    assert service.cleanup_expired() == {"expired_exports": 1, "files_removed": 1, "stale_jobs": 1,
+                                         "orphan_files": 0}
+    assert not os.path.exists(path)
+    assert service.get_export("stuck", "marco")["status"] == "failed"
+
+
+def test_export_of_a_deleted_account_leaves_no_file(service, tmp_path, monkeypatch):
+    # The account is deleted while the export is being written
+    write_export = export_module.write_export
+
+    def delete_midway(db, user_id, f):
+        counts = write_export(db, user_id, f)
+        other = TestingSessionLocal()
+        service.delete_user_exports(other, user_id)
+        other.commit()
+        other.close()
+        return counts
+
+    monkeypatch.setattr(export_module, "write_export", delete_midway)
+    service.start_export("anna")
+    service._job_executor.submit(lambda: None).result()
+    assert os.listdir(tmp_path) == []
+
+    # Files left behind by a worker that died at the wrong moment are swept
+    (tmp_path / "gone.zip").write_bytes(b"PK")
+    (tmp_path / "gone.zip.part").write_bytes(b"PK")
+    (tmp_path / "unrelated.txt").write_text("keep")
+    assert service.cleanup_expired()["orphan_files"] == 2
+    assert os.listdir(tmp_path) == ["unrelated.txt"]
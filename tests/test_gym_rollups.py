@@ -0,0 +1,178 @@
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import (
+    UserORM, ClientProfileORM, SubscriptionPlanORM, ClientSubscriptionORM, AppointmentORM,
+    NutritionistAppointmentORM, CheckInORM, PaymentORM, GymDailyStatsORM,
+)
+import services as services_module
+import service_modules.gym_rollups as rollups_module
+from services import UserService
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+TODAY = date.today()
+LAST_MONTH = (TODAY.replace(day=1) - timedelta(days=1)).isoformat()
+MONTH_END = ((TODAY.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)).isoformat()
+
+
+@pytest.fixture
+def gym(monkeypatch):
+    monkeypatch.setattr(services_module, "get_db_session", TestingSessionLocal)
+    monkeypatch.setattr(rollups_module, "get_db_session", TestingSessionLocal)
+    for table in reversed(Base.metadata.sorted_tables):
+        with engine.begin() as conn:
+            conn.execute(table.delete())
+
+    db = TestingSessionLocal()
+    db.add(UserORM(id="gym", username="owner", role="owner"))
+    db.add(UserORM(id="coach", username="coach", role="trainer", gym_owner_id="gym"))
+    db.add(UserORM(id="dietitian", username="dietitian", role="nutritionist", gym_owner_id="gym"))
+    db.add(UserORM(id="elsewhere", username="elsewhere", role="trainer", gym_owner_id="other-gym"))
+    db.add(SubscriptionPlanORM(id="monthly", gym_id="gym", name="Base", price=50.0, currency="eur",
+                               billing_interval="month"))
+    db.add(SubscriptionPlanORM(id="yearly", gym_id="gym", name="Premium", price=600.0, currency="eur",
+                               billing_interval="year"))
+    db.commit()
+    for i in range(6):
+        joined = (datetime.now() - timedelta(days=i * 20)).isoformat()
+        db.add(UserORM(id=f"member-{i}", username=f"member_{i}", role="client", created_at=joined))
+        db.add(ClientProfileORM(id=f"member-{i}", gym_id="gym"))
+        db.add(ClientSubscriptionORM(id=f"sub-{i}", client_id=f"member-{i}", gym_id="gym",
+                                     plan_id="monthly" if i < 4 else "yearly",
+                                     status="canceled" if i == 3 else "active"))
+        db.commit()
+    db.add(AppointmentORM(id="a1", trainer_id="coach", client_id="member-0", date=TODAY.isoformat(),
+                          start_time="10:00", end_time="11:00", price=40.0, payment_status="paid"))
+    db.add(AppointmentORM(id="a2", trainer_id="coach", client_id="member-1", date=TODAY.isoformat(),
+                          start_time="10:00", end_time="11:00", price=40.0, payment_status="pending"))
+    db.add(AppointmentORM(id="a3", trainer_id="coach", client_id="member-1", date=LAST_MONTH,
+                          start_time="10:00", end_time="11:00", price=40.0, payment_status="paid"))
+    db.add(AppointmentORM(id="a4", trainer_id="elsewhere", client_id="member-1", date=TODAY.isoformat(),
+                          start_time="10:00", end_time="11:00", price=99.0, payment_status="paid"))
+    db.add(NutritionistAppointmentORM(id="n1", nutritionist_id="dietitian", client_id="member-2",
+                                      date=TODAY.isoformat(), start_time="10:00", end_time="11:00", price=30.0, payment_status="paid"))
+    db.add(CheckInORM(member_id="member-0", gym_owner_id="gym"))
+    db.add(CheckInORM(member_id="member-1", gym_owner_id="gym"))
+    db.add(PaymentORM(id="p1", client_id="member-0", gym_id="gym", amount=50.0, status="succeeded",
+                      paid_at=datetime.now().isoformat()))
+    db.commit()
+    db.close()
+
+
+def _count_queries():
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    return statements, lambda: event.remove(engine, "before_cursor_execute", listener)
+
+
+def test_dashboard_reads_the_rollups(gym):
+    statements, stop = _count_queries()
+    data = UserService().get_owner("gym")
+    stop()
+
+    # 3 Base + 2 Premium (600/12) active; member-3 canceled
+    assert data.active_subscriptions == 5
+    assert data.subscription_revenue == 250.0
+    assert data.revenue_by_plan == [{"name": "Base", "revenue": 150.0, "count": 3},
+                                    {"name": "Premium", "revenue": 100.0, "count": 2}]
+    assert (data.appointment_revenue, data.appointment_count) == (40.0, 1)
+    assert (data.nutrition_appointment_revenue, data.nutrition_appointment_count) == (30.0, 1)
+    assert data.monthly_revenue == 320.0
+    assert (data.active_members, data.staff_active, data.currency) == (6, 2, "eur")
+    assert [a.text for a in data.recent_activity] == [f"Nuovo iscritto: member_{i}" for i in range(5)]
+    # Snapshot, plans, month totals, staff, signups: nothing proportional to members
+    assert len([s for s in statements if s.startswith("SELECT")]) == 5
+
+
+def test_webhook_and_booking_changes_update_the_rollups(gym):
+    UserService().get_owner("gym")
+    db = TestingSessionLocal()
+    db.query(ClientSubscriptionORM).filter(ClientSubscriptionORM.id == "sub-0").one().status = "canceled"
+    db.query(AppointmentORM).filter(AppointmentORM.id == "a2").one().payment_status = "paid"
+    db.add(CheckInORM(member_id="member-2", gym_owner_id="gym"))
+    db.commit()
+
+    data = UserService().get_owner("gym")
+    assert (data.active_subscriptions, data.subscription_revenue) == (4, 200.0)
+    assert (data.appointment_revenue, data.appointment_count) == (80.0, 2)
+    today = db.get(GymDailyStatsORM, ("gym", TODAY.isoformat()))
+    assert (today.checkins, today.subscription_payments) == (3, 50.0)
+
+    # A rolled-back change leaves the rollups alone
+    db.query(AppointmentORM).filter(AppointmentORM.id == "a1").one().price = 1000.0
+    db.flush()
+    db.rollback()
+    db.close()
+    assert UserService().get_owner("gym").appointment_revenue == 80.0
+
+
+def test_only_changes_to_the_figures_inputs_refresh_the_rollups(gym):
+    db = TestingSessionLocal()
+    profile = db.get(ClientProfileORM, "member-0")
+    subscription = db.get(ClientSubscriptionORM, "sub-0")
+    statements, stop = _count_queries()
+    profile.gems, profile.streak, profile.last_seen = 10, 3, datetime.now().isoformat()
+    subscription.stripe_subscription_id = "sub_123"
+    db.commit()
+    stop()
+    assert [s.split()[0] for s in statements] == ["UPDATE", "UPDATE"]
+
+    statements, stop = _count_queries()
+    profile.gym_id = None
+    db.commit()
+    stop()
+    assert any("gym_daily_stats" in s for s in statements)
+    db.close()
+    assert UserService().get_owner("gym").active_members == 5
+
+
+def test_reconciler_repairs_bulk_updates_and_history_reads_months(gym):
+    db = TestingSessionLocal()
+    # Bulk UPDATEs bypass the mapper events
+    db.query(AppointmentORM).filter(AppointmentORM.id == "a1").update({"price": 55.0}, synchronize_session=False)
+    db.commit()
+    db.close()
+    assert UserService().get_owner("gym").appointment_revenue == 40.0
+
+    assert rollups_module.reconcile_rollups() == {"gyms": 2, "days_fixed": 1, "failed": 0}
+    assert UserService().get_owner("gym").appointment_revenue == 55.0
+    assert rollups_module.reconcile_rollups()["days_fixed"] == 0
+
+    history = UserService().get_owner_history("gym", 12)
+    assert len(history) == 12 and history[-1]["month"] == TODAY.isoformat()[:7]
+    assert history[-2]["appointment_revenue"] == 40.0
+    assert history[-1]["revenue"] == 55.0 + 30.0 + 50.0
+    assert history[-1]["active_subscriptions"] == 5
+    assert sum(m["signups"] for m in history) == 6
+
+
+def test_gym_without_rollups_is_backfilled_on_first_load(gym):
+    with engine.begin() as conn:
+        conn.execute(GymDailyStatsORM.__table__.delete())
+        # Paid and booked for later this month (raw insert: no mapper event)
+        conn.execute(AppointmentORM.__table__.insert().values(
+            id="later", trainer_id="coach", client_id="member-0", date=MONTH_END, start_time="10:00",
+            end_time="11:00", price=25.0, payment_status="paid"))
+    data = UserService().get_owner("gym")
+    assert (data.appointment_revenue, data.appointment_count, data.active_subscriptions) == (65.0, 2, 5)
+
+    rollups_module.reconcile_rollups()  # builds the other gym's rows
+    with engine.begin() as conn:
+        conn.execute(AppointmentORM.__table__.update().where(AppointmentORM.id == "later").values(price=35.0))
+    assert rollups_module.reconcile_rollups()["days_fixed"] == 1
+    assert UserService().get_owner("gym").appointment_revenue == 75.0
+    history = UserService().get_owner_history("gym", 2)
+    assert history[0]["appointment_revenue"] == 40.0
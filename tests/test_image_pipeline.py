@@ -0,0 +1,83 @@
+import asyncio
+import io
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import database
+from database import Base
+from cpu_tasks import process_image, shutdown_cpu_pool
+import service_modules.upload_helper as upload_helper
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+def _phone_photo(size=(4032, 3024), orientation=None):
+    img = Image.new("RGB", size, (200, 80, 40))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90, exif=exif)
+    return buf.getvalue()
+
+
+def test_process_image_variants_follow_orientation_and_crop():
+    # Rotated 90° in EXIF: stored landscape, displayed portrait
+    variants = process_image(_phone_photo(orientation=6), (1200, 1600))
+    assert (variants["full"]["width"], variants["full"]["height"]) == (1200, 1600)
+    assert (variants["feed"]["width"], variants["feed"]["height"]) == (480, 640)
+    assert (variants["thumb"]["width"], variants["thumb"]["height"]) == (120, 160)
+    for variant in variants.values():
+        assert Image.open(io.BytesIO(variant["webp"])).format == "WEBP"
+        assert Image.open(io.BytesIO(variant["jpg"])).size == (variant["width"], variant["height"])
+
+    # Avatars: fit then centre-crop; no feed variant larger than the full image
+    avatar = process_image(_phone_photo(), (400, 400), crop_square=True)
+    assert sorted(avatar) == ["full", "thumb"]
+    assert (avatar["full"]["width"], avatar["full"]["height"]) == (300, 300)
+
+
+def test_save_image_records_and_deletes_variants(monkeypatch):
+    stored, deleted, types = {}, [], {}
+
+    def store(content, folder, filename, upload_type="image"):
+        stored[f"/static/uploads/{folder}/{filename}"] = content
+        types[filename] = upload_type
+        return f"/static/uploads/{folder}/{filename}"
+
+    monkeypatch.setattr(database, "get_db_session", TestingSessionLocal)
+    monkeypatch.setattr(upload_helper, "_store_file", store)
+    monkeypatch.setattr(upload_helper, "_delete_stored", lambda url: deleted.append(url) or True)
+
+    try:
+        url, variants = asyncio.run(upload_helper.save_image(_phone_photo(), "physique/u1", "photo", (1200, 1600)))
+        # Medical certificate scans keep the caller's storage type
+        asyncio.run(upload_helper.save_image(_phone_photo(), "certificates/u1", "cert", (1600, 2200),
+                                             upload_type="document"))
+    finally:
+        shutdown_cpu_pool()
+
+    assert url == "/static/uploads/physique/u1/photo.jpg"
+    assert variants["thumb"]["webp"] == "/static/uploads/physique/u1/photo_thumb.webp"
+    assert {t for name, t in types.items() if name.startswith("photo")} == {"image"}
+    assert {t for name, t in types.items() if name.startswith("cert")} == {"document"}
+    stored = {u: c for u, c in stored.items() if "/physique/" in u}
+    assert len(stored) == 6
+    assert stored[url][:2] == b"\xff\xd8"
+
+    found = upload_helper.get_image_variants([url + "?t=123"])
+    assert found[url + "?t=123"] == variants
+    assert upload_helper.image_srcset(variants).split(", ")[0] == "/static/uploads/physique/u1/photo_thumb.webp 160w"
+
+    assert asyncio.run(upload_helper.delete_file(url))
+    assert sorted(deleted) == sorted(stored)
+    assert upload_helper.get_image_variants([url]) == {}
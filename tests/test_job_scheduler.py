@@ -0,0 +1,86 @@
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import JobRunORM
+from service_modules.job_scheduler import JobScheduler, DBLeaderLock, Every, Cron
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+def test_schedules():
+    assert Every(900).next_after(datetime(2026, 3, 1, 10, 7)) == datetime(2026, 3, 1, 10, 15)
+    assert Every(900).next_after(datetime(2026, 3, 1, 10, 15)) == datetime(2026, 3, 1, 10, 30)
+    assert Cron("15 3 * * *").next_after(datetime(2026, 3, 1, 10, 7)) == datetime(2026, 3, 2, 3, 15)
+    assert Cron("*/20 * * * *").next_after(datetime(2026, 3, 1, 10, 40)) == datetime(2026, 3, 1, 11, 0)
+    # 2026-03-01 is a Sunday; next Monday 09:00
+    assert Cron("0 9 * * 1").next_after(datetime(2026, 3, 1, 10, 0)) == datetime(2026, 3, 2, 9, 0)
+    assert Cron("0 0 1 1 *").next_after(datetime(2026, 3, 1)) == datetime(2027, 1, 1)
+
+
+def _scheduler(name, calls):
+    scheduler = JobScheduler(
+        lock=DBLeaderLock("test", name, session_factory=TestingSessionLocal),
+        session_factory=TestingSessionLocal,
+        worker_id=name,
+    )
+    scheduler.add_job("count", lambda: calls.append(name) or {"ran": name}, Every(60))
+    return scheduler
+
+
+async def _settle(*schedulers):
+    for scheduler in schedulers:
+        for job in scheduler.jobs.values():
+            if job.task:
+                await job.task
+
+
+def test_only_the_leader_runs_each_slot_once():
+    async def scenario():
+        calls = []
+        a, b = _scheduler("worker-a", calls), _scheduler("worker-b", calls)
+
+        start = datetime(2026, 3, 1, 10, 0, 30)
+        await a.tick(start)
+        await b.tick(start)
+        assert a.is_leader and not b.is_leader
+
+        # Two slots later (one missed): a single catch-up run
+        await a.tick(datetime(2026, 3, 1, 10, 2, 5))
+        await b.tick(datetime(2026, 3, 1, 10, 2, 5))
+        await _settle(a, b)
+        assert calls == ["worker-a"]
+
+        # Leader goes away; b takes over and does not rerun the slot a already ran
+        await a.stop()
+        await b.tick(datetime(2026, 3, 1, 10, 2, 40))
+        await _settle(b)
+        assert b.is_leader and calls == ["worker-a"]
+
+        await b.tick(datetime(2026, 3, 1, 10, 3, 1))
+        await _settle(b)
+        assert calls == ["worker-a", "worker-b"]
+
+        # A second leader claiming the same slot is rejected by the unique run key
+        job = a.jobs["count"]
+        assert await a._execute(job, datetime(2026, 3, 1, 10, 3)) is None
+
+        history = b.get_run_history("count")
+        assert [r["scheduled_for"] for r in history] == ["2026-03-01T10:03:00", "2026-03-01T10:02:00"]
+        assert all(r["status"] == "success" for r in history)
+        await b.stop()
+
+    asyncio.run(scenario())
+    db = TestingSessionLocal()
+    assert db.query(JobRunORM).count() == 2
+    db.close()
@@ -0,0 +1,147 @@
+import os
+import sys
+import threading
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import Base
+from models_orm import CourseORM, CourseLessonORM, LessonEnrollmentORM, LessonSeatCounterORM, LessonWaitlistORM
+import service_modules.course_service as course_module
+import service_modules.lesson_seats as seats_module
+from service_modules.course_service import CourseService
+
+
+@pytest.fixture
+def session_factory(monkeypatch, tmp_path):
+    # A file database with a connection per session, so requests really run concurrently
+    engine = create_engine(f"sqlite:///{tmp_path / 'lessons.db'}", poolclass=NullPool,
+                           connect_args={"check_same_thread": False, "timeout": 60})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(course_module, "get_db_session", factory)
+    monkeypatch.setattr(seats_module, "get_db_session", factory)
+    yield factory
+    engine.dispose()
+
+
+def _lesson(factory, capacity=20):
+    db = factory()
+    db.add(CourseORM(id="spin", name="Spin", owner_id="trainer", max_capacity=capacity, waitlist_enabled=True))
+    lesson = CourseLessonORM(course_id="spin", date="2026-11-02", time="18:00", trainer_id="trainer")
+    db.add(lesson)
+    db.commit()
+    lesson_id = lesson.id
+    db.close()
+    return lesson_id
+
+
+def _burst(func, args_list):
+    """Run func(*args) for every entry at the same moment; returns results (or HTTPExceptions)."""
+    barrier = threading.Barrier(len(args_list))
+    results = [None] * len(args_list)
+
+    def run(i, args):
+        barrier.wait()
+        try:
+            results[i] = func(*args)
+        except HTTPException as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i, args)) for i, args in enumerate(args_list)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_500_concurrent_enrollments_never_oversell(session_factory):
+    lesson_id = _lesson(session_factory)
+    service = CourseService()
+
+    results = _burst(service.enroll_in_lesson, [(lesson_id, f"member-{i}") for i in range(500)])
+    assert not [r for r in results if isinstance(r, HTTPException)]
+    statuses = Counter(r["status"] for r in results)
+    assert statuses == {"enrolled": 20, "waitlisted": 480}
+    assert sorted(r["position"] for r in results if r["status"] == "waitlisted") == list(range(1, 481))
+
+    db = session_factory()
+    assert db.query(LessonEnrollmentORM).filter(LessonEnrollmentORM.status == "confirmed").count() == 20
+    assert db.get(LessonSeatCounterORM, lesson_id).seats_taken == 20
+    positions = [w.position for w in db.query(LessonWaitlistORM).all()]
+    assert len(set(positions)) == 480
+    db.close()
+
+
+def test_waitlist_promotion_holds_the_freed_seat(session_factory):
+    lesson_id = _lesson(session_factory, capacity=2)
+    service = CourseService()
+    for member in ("a", "b", "c", "d"):
+        service.enroll_in_lesson(lesson_id, member)
+
+    # Same member double-tapping: one request wins
+    results = _burst(service.enroll_in_lesson, [(lesson_id, "e")] * 10)
+    assert sum(1 for r in results if isinstance(r, dict)) == 1
+
+    service.cancel_enrollment(lesson_id, "a")
+    db = session_factory()
+    offered = db.query(LessonWaitlistORM).filter(LessonWaitlistORM.status == "notified").one()
+    assert offered.client_id == "c"
+    db.close()
+
+    # The seat is held for "c": a newcomer is waitlisted, not enrolled
+    assert service.enroll_in_lesson(lesson_id, "f")["status"] == "waitlisted"
+
+    service.decline_waitlist_spot(offered.id, "c")
+    db = session_factory()
+    offered = db.query(LessonWaitlistORM).filter(LessonWaitlistORM.status == "notified").one()
+    assert offered.client_id == "d"
+    db.close()
+
+    assert service.accept_waitlist_spot(offered.id, "d")["status"] == "enrolled"
+    with pytest.raises(HTTPException):
+        service.accept_waitlist_spot(offered.id, "d")
+
+    waitlist = service.get_lesson_waitlist(lesson_id, "trainer")
+    assert [(w["client_id"], w["position"]) for w in waitlist] == [("e", 1), ("f", 2)]
+    db = session_factory()
+    assert db.query(LessonEnrollmentORM).filter(LessonEnrollmentORM.status == "confirmed").count() == 2
+    assert db.get(LessonSeatCounterORM, lesson_id).seats_taken == 2
+    db.close()
+
+
+def test_availability_counts_held_seats_and_deleted_members_give_theirs_back(session_factory):
+    lesson_id = _lesson(session_factory, capacity=2)
+    service = CourseService()
+    for member in ("a", "b", "c"):
+        service.enroll_in_lesson(lesson_id, member)
+    service.cancel_enrollment(lesson_id, "a")
+
+    # One enrolled, one seat held for "c"'s offer: nothing is free
+    availability = service.get_lesson_availability(lesson_id)
+    assert (availability["enrolled_count"], availability["spots_available"]) == (1, 0)
+    assert service.get_upcoming_lessons_for_client("spin", "z")[0]["spots_available"] == 0
+
+    # Account deletion gives the seat back before removing the rows
+    db = session_factory()
+    seats_module.release_client_seats(db, "b")
+    db.query(LessonEnrollmentORM).filter(LessonEnrollmentORM.client_id == "b").delete()
+    db.commit()
+    db.close()
+    assert service.get_lesson_availability(lesson_id)["spots_available"] == 1
+
+    # Rows removed without releasing (foreign key cascade) are repaired by the reconcile job
+    db = session_factory()
+    db.query(LessonWaitlistORM).filter(LessonWaitlistORM.client_id == "c").delete()
+    db.commit()
+    db.close()
+    assert seats_module.reconcile_seat_counters() == {"fixed": 1}
+    assert service.get_lesson_availability(lesson_id)["spots_available"] == 2
+    assert seats_module.reconcile_seat_counters() == {"fixed": 0}
@@ -0,0 +1,126 @@
+import asyncio
+import io
+import os
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from cpu_tasks import image_dhash
+from database import Base
+from mock_meals import MOCK_MEALS
+import service_modules.meal_scan_service as scan_module
+from service_modules.meal_scan_service import MealScanService
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+def _meal(index, confidence):
+    return dict(MOCK_MEALS[index], confidence=confidence)
+
+
+def _provider(calls, method, data=None, delay=0.0, error=None):
+    def scan(file_bytes):
+        calls.append(method)
+        time.sleep(delay)
+        if error:
+            raise RuntimeError(error)
+        return data
+    return method, scan
+
+
+def _photo(size=(800, 600), fmt="JPEG", quality=90):
+    img = Image.new("RGB", (800, 600), (235, 225, 200))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((120, 80, 680, 560), fill=(250, 250, 245))
+    draw.ellipse((220, 180, 420, 380), fill=(170, 90, 40))
+    draw.rectangle((450, 260, 620, 420), fill=(60, 150, 60))
+    img = img.resize(size)
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def test_hedged_race_returns_first_high_confidence(monkeypatch):
+    monkeypatch.setattr(scan_module, "MEAL_SCAN_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(scan_module, "MEAL_SCAN_GRACE", 0.5)
+    calls = []
+    providers = [
+        _provider(calls, "broken", error="HTTP 503"),
+        _provider(calls, "slow", _meal(0, "high"), delay=2.0),
+        _provider(calls, "estimate", _meal(1, "medium"), delay=0.01),
+        _provider(calls, "label", _meal(2, "high if read from label"), delay=0.1),
+    ]
+    service = MealScanService(providers=lambda: providers)
+
+    started = time.monotonic()
+    result = asyncio.run(service.scan(b"not an image"))
+    assert time.monotonic() - started < 1.0
+    assert result == {"status": "success", "data": _meal(2, "high if read from label"),
+                      "method": "label"}
+    assert calls == ["broken", "slow", "estimate", "label"]
+
+    # Without a high-confidence answer, the best one is returned after the grace period
+    result = asyncio.run(MealScanService(providers=lambda: providers[2:3]).scan(b"not an image"))
+    assert result["method"] == "estimate" and result["data"]["confidence"] == "medium"
+
+
+def test_circuit_breaker_skips_failing_provider(monkeypatch):
+    monkeypatch.setattr(scan_module, "MEAL_SCAN_PROVIDER_TIMEOUT", 0.05)
+    monkeypatch.setattr(scan_module, "MEAL_SCAN_HEDGE_DELAY", 1.0)
+    calls = []
+    providers = [
+        _provider(calls, "hanging", _meal(3, "high"), delay=0.2),
+        _provider(calls, "backup", _meal(4, "high")),
+    ]
+    service = MealScanService(providers=lambda: providers)
+
+    for _ in range(3):
+        assert asyncio.run(service.scan(b"x"))["method"] == "backup"
+    assert calls.count("hanging") == 3 and service.breaker("hanging").state == "open"
+
+    calls.clear()
+    assert asyncio.run(service.scan(b"x"))["method"] == "backup"
+    assert calls == ["backup"]
+
+    # After the reset period one trial call goes through again
+    service.breaker("hanging").opened_at -= scan_module.BREAKER_RESET
+    assert service.breaker("hanging").state == "half_open"
+    asyncio.run(service.scan(b"x"))
+    assert calls.count("hanging") == 1 and service.breaker("hanging").state == "open"
+
+    # Nothing answers: the mock meal database is the fallback
+    result = asyncio.run(MealScanService(providers=lambda: []).scan(b"x"))
+    assert result["method"] == "mock"
+
+
+def test_near_duplicate_photo_served_from_cache(monkeypatch):
+    monkeypatch.setattr(scan_module, "get_db_session", TestingSessionLocal)
+    calls = []
+    providers = [_provider(calls, "gemini", _meal(5, "high"))]
+    service = MealScanService(providers=lambda: providers)
+    user_id = str(uuid.uuid4())
+
+    original = _photo()
+    resized = _photo(size=(400, 300), fmt="PNG")
+    recompressed = _photo(quality=40)
+    assert bin(image_dhash(original) ^ image_dhash(recompressed)).count("1") <= scan_module.MEAL_SCAN_MAX_DISTANCE
+
+    first = asyncio.run(service.scan(original, user_id))
+    assert first["method"] == "gemini" and "cached" not in first
+    for photo in (resized, recompressed):
+        again = asyncio.run(service.scan(photo, user_id))
+        assert again["cached"] is True and again["data"] == first["data"]
+    assert calls == ["gemini"]
+
+    # Another member's identical photo is analysed for them
+    asyncio.run(service.scan(original, str(uuid.uuid4())))
+    assert calls == ["gemini", "gemini"]
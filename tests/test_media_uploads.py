@@ -0,0 +1,146 @@
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import MediaUploadORM
+import service_modules.message_service as message_module
+import service_modules.media_upload_service as upload_module
+from service_modules.media_upload_service import MediaUploadService
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+class AllowAll:
+    def can_message(self, user_id, other_user_id):
+        return True
+
+
+def _setup(monkeypatch, tmp_path):
+    monkeypatch.setattr(upload_module, "get_db_session", TestingSessionLocal)
+    monkeypatch.setattr(upload_module, "MEDIA_UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(message_module, "get_message_service", lambda: AllowAll())
+    stored = {}
+
+    def store(fileobj, folder, filename, size, upload_type="image"):
+        stored["data"] = fileobj.read()
+        return f"/static/uploads/{folder}/{filename}"
+
+    monkeypatch.setattr(upload_module, "store_stream", store)
+    return stored
+
+
+async def _body(data, piece=1000):
+    for i in range(0, len(data), piece):
+        yield data[i:i + piece]
+
+
+def test_chunked_upload_resumes_and_finalizes(monkeypatch, tmp_path):
+    stored = _setup(monkeypatch, tmp_path)
+    service = MediaUploadService()
+    video = os.urandom(25_000)
+    user_id = str(uuid.uuid4())
+
+    upload = service.create_upload(user_id, "receiver", "clip.mp4", "video/mp4", len(video), 12.5)
+    upload_id = upload["upload_id"]
+    assert upload["offset"] == 0 and "temp_path" not in upload
+
+    async def flow():
+        status = await service.receive_chunk(upload_id, user_id, 0, _body(video[:10_000]))
+        assert status["offset"] == 10_000 and not status["complete"]
+
+        # Retried chunk at a stale offset: told where to resume
+        with pytest.raises(HTTPException) as exc:
+            await service.receive_chunk(upload_id, user_id, 0, _body(video[:10_000]))
+        assert exc.value.status_code == 409 and exc.value.headers["Upload-Offset"] == "10000"
+
+        # More bytes than declared: rejected while streaming, nothing recorded
+        with pytest.raises(HTTPException) as exc:
+            await service.receive_chunk(upload_id, user_id, 10_000, _body(video[10_000:] + b"extra"))
+        assert exc.value.status_code == 413
+        assert service.get_upload(upload_id, user_id)["offset"] == 10_000
+
+        # Finalizing before everything arrived is refused
+        with pytest.raises(HTTPException) as exc:
+            await service.finalize(upload_id, user_id)
+        assert exc.value.status_code == 409
+
+        status = await service.receive_chunk(upload_id, user_id, 10_000, _body(video[10_000:]))
+        assert status["complete"]
+        return await service.finalize(upload_id, user_id)
+
+    result = asyncio.run(flow())
+    assert stored["data"] == video
+    assert result["media_type"] == "video" and result["file_size"] == len(video) and result["duration"] == 12.5
+    assert result["file_url"].startswith("/static/uploads/chat_videos/") and result["file_url"].endswith(".mp4")
+    assert os.listdir(tmp_path) == []
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(service.finalize(upload_id, user_id))
+    assert exc.value.status_code == 409
+
+
+def test_concurrent_chunks_at_one_offset_write_once(monkeypatch, tmp_path):
+    _setup(monkeypatch, tmp_path)
+    service = MediaUploadService()
+    upload_id = service.create_upload("u1", "receiver", "clip.mp4", "video/mp4", 4000)["upload_id"]
+    first, second = b"a" * 2000, b"b" * 2000
+
+    async def flow():
+        streaming = asyncio.Event()
+
+        async def slow_body():
+            yield first[:1000]
+            streaming.set()
+            await asyncio.sleep(0.05)
+            yield first[1000:]
+
+        slow = asyncio.create_task(service.receive_chunk(upload_id, "u1", 0, slow_body()))
+        await streaming.wait()
+        # The offset is claimed: rejected before a byte of it is written
+        with pytest.raises(HTTPException) as exc:
+            await service.receive_chunk(upload_id, "u1", 0, _body(second))
+        assert exc.value.status_code == 409
+        assert service.get_upload(upload_id, "u1")["status"] == "receiving"
+        assert (await slow)["offset"] == 2000
+
+        # A failed chunk gives its claim back
+        with pytest.raises(HTTPException):
+            await service.receive_chunk(upload_id, "u1", 2000, _body(second + b"extra"))
+        return service.get_upload(upload_id, "u1")
+
+    status = asyncio.run(flow())
+    assert (status["offset"], status["status"]) == (2000, "uploading")
+    with open(os.path.join(tmp_path, os.listdir(tmp_path)[0]), "rb") as f:
+        assert f.read() == first
+
+
+def test_size_limits_and_expiry(monkeypatch, tmp_path):
+    _setup(monkeypatch, tmp_path)
+    service = MediaUploadService()
+
+    with pytest.raises(HTTPException) as exc:
+        service.create_upload("u1", "receiver", "clip.mp4", "video/mp4", upload_module.MAX_VIDEO_SIZE + 1)
+    assert exc.value.status_code == 413
+
+    upload = service.create_upload("u1", "receiver", "note.m4a", "audio/mp4", 4096)
+    assert upload["media_type"] == "voice"
+    db = TestingSessionLocal()
+    db.get(MediaUploadORM, upload["upload_id"]).updated_at = (datetime.utcnow() - timedelta(days=2)).isoformat()
+    db.commit()
+    db.close()
+
+    assert service.cleanup_expired() == {"expired_uploads": 1, "spool_files_removed": 1}
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,161 @@
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import Base
+from models_orm import UserORM, ClientProfileORM, ConversationORM, UserUnreadTotalORM
+import service_modules.message_service as message_module
+from service_modules.message_service import MessageService
+
+
+@pytest.fixture
+def session_factory(monkeypatch, tmp_path):
+    # A file database with a connection per session, so sends really run concurrently
+    engine = create_engine(f"sqlite:///{tmp_path / 'messages.db'}", poolclass=NullPool,
+                           connect_args={"check_same_thread": False, "timeout": 60})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(message_module, "get_db_session", factory)
+
+    db = factory()
+    db.add(UserORM(id="owner", username="owner", role="owner"))
+    db.add(UserORM(id="coach", username="coach_luca", role="trainer", gym_owner_id="owner",
+                   profile_picture="/static/luca.png"))
+    for i, name in enumerate(["anna", "marco"] + [f"member-{i}" for i in range(20)]):
+        db.add(UserORM(id=name, username=name, role="client"))
+        db.add(ClientProfileORM(id=name, gym_id="owner", trainer_id="coach",
+                                name="Anna Rossi" if name == "anna" else None))
+    db.commit()
+    db.close()
+    factory.engine = engine
+    yield factory
+    engine.dispose()
+
+
+def _counters(factory, user_id):
+    """(stored badge total, sum of the conversation counters the user reads)."""
+    db = factory()
+    try:
+        stored = db.get(UserUnreadTotalORM, user_id)
+        user = db.get(UserORM, user_id)
+        summed = db.query(message_module._unread_sum(user_id, user.role)).scalar()
+        return (stored.unread_messages if stored else None), summed
+    finally:
+        db.close()
+
+
+def test_inbox_joins_participants_in_one_query(session_factory):
+    service = MessageService()
+    service.send_message("coach", "anna", "Leg day tomorrow")
+    service.send_message("marco", "anna", "Coffee after class?")
+    service.send_message("owner", "coach", "Staff meeting at 6")
+    for i in range(10):
+        service.send_message(f"member-{i}", "coach", f"Question {i}")
+
+    inbox = service.get_conversations("anna")
+    assert [(c["other_user_id"], c["other_user_name"], c["unread_count"]) for c in inbox] == [
+        ("marco", "marco", 1), ("coach", "coach_luca", 1)
+    ]
+    assert inbox[1]["other_user_profile_picture"] == "/static/luca.png"
+    assert service.get_conversations("marco")[0]["other_user_name"] == "Anna Rossi"
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(session_factory.engine, "before_cursor_execute", listener)
+    try:
+        inbox = service.get_conversations("coach")
+    finally:
+        event.remove(session_factory.engine, "before_cursor_execute", listener)
+    assert len(inbox) == 11
+    assert inbox[0]["other_user_id"] == "member-9" and inbox[0]["other_user_role"] == "client"
+    assert inbox[-1]["other_user_name"] == "Anna Rossi" and inbox[-1]["unread_count"] == 0
+    # The user's role, then every conversation with its participant
+    assert len(statements) == 2
+    # The owner conversation is in the owner's inbox, not in the trainer's
+    assert service.get_conversations("owner")[0]["other_user_name"] == "coach_luca"
+
+
+def test_unread_totals_follow_sends_and_reads(session_factory):
+    service = MessageService()
+    for text in ("Hi", "Are you there?"):
+        service.send_message("anna", "coach", text)
+    conversation_id = service.send_message("marco", "coach", "Hello")["conversation_id"]
+    service.send_message("marco", "anna", "Hey")
+    # The owner writes into the trainer's client_id slot, which the trainer badge never counted
+    service.send_message("owner", "coach", "Staff meeting at 6")
+
+    assert service.get_unread_count("coach") == 3
+    assert service.get_unread_count("anna") == 1
+    assert _counters(session_factory, "coach") == (3, 3)
+
+    service.mark_messages_read("coach", conversation_id)
+    assert service.get_unread_count("coach") == 2
+    service.mark_messages_read("coach", conversation_id)
+    assert service.get_unread_count("coach") == 2
+
+    # The badge read is a single primary-key lookup
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(session_factory.engine, "before_cursor_execute", listener)
+    try:
+        assert service.get_unread_count("anna") == 1
+    finally:
+        event.remove(session_factory.engine, "before_cursor_execute", listener)
+    assert len(statements) == 1 and "user_unread_totals" in statements[0]
+
+
+def test_missing_totals_are_computed_from_conversations(session_factory):
+    db = session_factory()
+    db.add(ConversationORM(id="seeded", trainer_id="coach", client_id="anna", trainer_unread_count=4,
+                           client_unread_count=2, last_message_at="2026-10-01T10:00:00"))
+    db.commit()
+    db.close()
+    service = MessageService()
+
+    # A send before the first read creates the total including the new message
+    service.send_message("anna", "coach", "One more")
+    assert _counters(session_factory, "coach") == (5, 5)
+    assert service.get_unread_count("anna") == 2
+    assert service.get_unread_count("nobody") == 0
+
+    # A role change drops the total, which is recomputed for the new role
+    db = session_factory()
+    db.get(UserORM, "anna").role = "trainer"
+    db.commit()
+    db.close()
+    assert _counters(session_factory, "anna")[0] is None
+    assert service.get_unread_count("anna") == 0
+
+
+def test_concurrent_sends_and_reads_keep_totals_exact(session_factory):
+    service = MessageService()
+    senders = [f"member-{i}" for i in range(20)]
+    conversation_ids = {s: service.send_message(s, "coach", "first")["conversation_id"] for s in senders}
+
+    calls = [(service.send_message, (s, "coach", "again")) for s in senders for _ in range(2)]
+    calls += [(service.mark_messages_read, ("coach", conversation_ids[s])) for s in senders[::2]]
+    barrier = threading.Barrier(len(calls))
+
+    def run(func, args):
+        barrier.wait()
+        func(*args)
+
+    threads = [threading.Thread(target=run, args=call) for call in calls]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stored, summed = _counters(session_factory, "coach")
+    assert stored == summed
+    assert 30 <= stored <= 60
+    db = session_factory()
+    assert db.query(func.count(ConversationORM.id)).scalar() == 20
+    db.close()
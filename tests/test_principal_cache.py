@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from starlette.requests import Request
+
+from database import Base
+from models_orm import UserORM, ClientProfileORM
+from auth import get_current_user, create_access_token
+from authorization import get_user_gym_id
+from principal_cache import principal_cache
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+queries = []
+event.listen(engine, "before_cursor_execute", lambda *args: queries.append(args[2]))
+
+
+def _request(token):
+    return Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+
+
+def _authenticate(token):
+    db = TestingSessionLocal()
+    try:
+        user = asyncio.run(get_current_user(_request(token), db))
+        return db, user
+    except Exception:
+        db.close()
+        raise
+
+
+def _seed_client(gym_id):
+    user_id, username = str(uuid.uuid4()), f"member_{uuid.uuid4().hex[:8]}"
+    db = TestingSessionLocal()
+    db.add(UserORM(id=user_id, username=username, role="client", bio="Leg day", active_session_id="sid-1"))
+    db.add(ClientProfileORM(id=user_id, gym_id=gym_id))
+    db.commit()
+    db.close()
+    return user_id, username
+
+
+def test_cached_principal_skips_queries_and_stays_writable():
+    principal_cache.clear()
+    user_id, username = _seed_client("gym-1")
+    token = create_access_token({"sub": username, "sid": "sid-1"})
+
+    db, user = _authenticate(token)
+    assert get_user_gym_id(user, db) == "gym-1"
+    db.close()
+
+    queries.clear()
+    db, user = _authenticate(token)
+    assert user.id == user_id and user.role == "client"
+    assert get_user_gym_id(user, db) == "gym-1"
+    assert queries == []
+
+    # Columns outside the identity snapshot load lazily, and writes still persist
+    assert user.bio == "Leg day"
+    user.bio = "Push day"
+    db.commit()
+    db.close()
+    db = TestingSessionLocal()
+    assert db.get(UserORM, user_id).bio == "Push day"
+    db.close()
+
+
+def test_session_and_gym_changes_invalidate():
+    principal_cache.clear()
+    user_id, username = _seed_client("gym-1")
+    token = create_access_token({"sub": username, "sid": "sid-1"})
+    db, user = _authenticate(token)
+    get_user_gym_id(user, db)
+    db.close()
+
+    # Moving the client to another gym drops the cached gym id
+    db = TestingSessionLocal()
+    db.get(ClientProfileORM, user_id).gym_id = "gym-2"
+    db.commit()
+    db.close()
+    db, user = _authenticate(token)
+    assert get_user_gym_id(user, db) == "gym-2"
+    db.close()
+
+    # Logging in elsewhere (new session id) rejects the old token immediately
+    db = TestingSessionLocal()
+    db.get(UserORM, user_id).active_session_id = "sid-2"
+    db.commit()
+    db.close()
+    with pytest.raises(HTTPException) as exc:
+        _authenticate(token)
+    assert exc.value.status_code == 401
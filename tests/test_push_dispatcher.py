@@ -0,0 +1,69 @@
+import asyncio
+import os
+import sys
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import UserORM, NotificationORM, FCMDeviceTokenORM, PushOutboxORM
+from fcm_standin import create_fcm_standin_app
+from service_modules.push_dispatcher import PushDispatcher
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+def _seed_user(db, tokens):
+    user = UserORM(id=str(uuid.uuid4()), username=f"push_{uuid.uuid4().hex[:8]}", role="client")
+    db.add(user)
+    db.flush()
+    for token in tokens:
+        db.add(FCMDeviceTokenORM(user_id=user.id, token=token))
+    return user
+
+
+def test_notifications_are_queued_and_dispatched():
+    db = TestingSessionLocal()
+    ok_user = _seed_user(db, [f"device-{uuid.uuid4().hex}", f"device-{uuid.uuid4().hex}"])
+    stale_token = f"unregistered-{uuid.uuid4().hex}"
+    stale_user = _seed_user(db, [stale_token])
+    flaky_user = _seed_user(db, [f"unavailable-{uuid.uuid4().hex}"])
+    no_device_user = _seed_user(db, [])
+    for user in (ok_user, stale_user, flaky_user, no_device_user):
+        db.add(NotificationORM(user_id=user.id, type="offer", title="New offer", message="20% off", data='{"offer_id": 1}'))
+    db.commit()
+
+    # The after_insert hook only writes outbox rows; nothing has been sent yet
+    assert db.query(PushOutboxORM).filter(PushOutboxORM.status == "pending").count() == 4
+
+    standin = create_fcm_standin_app()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=standin), base_url="http://fcm")
+    dispatcher = PushDispatcher(
+        session_factory=TestingSessionLocal,
+        credentials_fn=lambda: ("test-token", "fitos-test"),
+        http_client=client,
+    )
+    stats = asyncio.run(dispatcher.drain_once())
+
+    assert stats["claimed"] == 4
+    assert len(standin.state.received) == 2
+    assert standin.state.received[0]["data"]["offer_id"] == "1"
+
+    db.expire_all()
+    statuses = {row.user_id: row.status for row in db.query(PushOutboxORM).all()}
+    assert statuses[ok_user.id] == "sent"
+    assert statuses[stale_user.id] == "skipped"
+    assert statuses[flaky_user.id] == "pending"  # Retried later with backoff
+    assert statuses[no_device_user.id] == "skipped"
+    assert db.query(FCMDeviceTokenORM).filter(FCMDeviceTokenORM.token == stale_token).count() == 0
+
+    # Nothing else is due until the backoff expires
+    assert asyncio.run(dispatcher.drain_once())["claimed"] == 0
+    db.close()
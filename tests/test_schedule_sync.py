@@ -0,0 +1,159 @@
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from starlette.requests import Request
+
+from database import Base
+from models_orm import (
+    UserORM, ClientProfileORM, ClientScheduleORM, TrainerScheduleORM, TrainerScheduleChangeORM,
+    WeeklySplitORM, ClientDietSettingsORM,
+)
+import services as services_module
+import service_modules.schedule_sync as sync_module
+from service_modules.schedule_sync import get_schedule, prune_schedule_changes
+from services import UserService
+from routes import etag_json
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+TODAY = date.today()
+
+
+def day(offset: int) -> str:
+    return (TODAY + timedelta(days=offset)).isoformat()
+
+
+@pytest.fixture
+def trainer(monkeypatch):
+    monkeypatch.setattr(services_module, "get_db_session", TestingSessionLocal)
+    monkeypatch.setattr(sync_module, "get_db_session", TestingSessionLocal)
+    monkeypatch.setattr(UserService, "get_workouts", lambda self, trainer_id: [])
+    monkeypatch.setattr(UserService, "get_splits", lambda self, trainer_id: [])
+    for table in reversed(Base.metadata.sorted_tables):
+        with engine.begin() as conn:
+            conn.execute(table.delete())
+
+    db = TestingSessionLocal()
+    db.add(UserORM(id="coach", username="coach", role="trainer"))
+    db.add(WeeklySplitORM(id="ppl", name="Push Pull Legs", owner_id="coach"))
+    for i in range(4):
+        db.add(UserORM(id=f"member-{i}", username=f"member_{i}", role="client"))
+        db.add(ClientProfileORM(id=f"member-{i}", trainer_id="coach", name=f"Member {i}",
+                                current_split_id="ppl" if i == 0 else None))
+    db.add(ClientDietSettingsORM(id="member-0", fitness_goal="cut"))
+    # member-0 trained 2 days ago and has 2 workouts ahead; member-1 last trained 10 days ago
+    db.add(ClientScheduleORM(client_id="member-0", date=day(-2), type="workout", completed=True))
+    db.add(ClientScheduleORM(client_id="member-0", date=day(1), type="workout", completed=False))
+    db.add(ClientScheduleORM(client_id="member-0", date=day(3), type="workout", completed=False))
+    db.add(ClientScheduleORM(client_id="member-1", date=day(-10), type="workout", completed=True))
+
+    # Two years of calendar, plus a workout streak: done today, -1, -3 (-2 is a rest day), missed -4
+    for offset in range(-730, 200, 5):
+        db.add(TrainerScheduleORM(trainer_id="coach", date=day(offset), time="09:00", title="Class", type="class"))
+    for offset, completed in ((0, True), (-1, True), (-3, True), (-4, False), (-6, True)):
+        db.add(TrainerScheduleORM(trainer_id="coach", date=day(offset), time="07:00", title="Me",
+                                  type="workout", workout_id="w1", completed=completed))
+    db.commit()
+    db.close()
+
+
+def test_dashboard_sends_a_window_and_groups_client_status(trainer):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    data = UserService().get_trainer("coach")
+    event.remove(engine, "before_cursor_execute", listener)
+
+    assert (data.schedule_from, data.schedule_to) == (day(-30), day(90))
+    assert data.schedule and all(day(-30) <= e.date <= day(90) for e in data.schedule)
+    assert data.schedule_version == "191.191"
+    assert data.streak == 3
+
+    clients = {c.id: c for c in data.clients}
+    assert (clients["member-0"].status, clients["member-0"].last_seen) == ("Attivo", "2 days ago")
+    assert (clients["member-0"].upcoming_workouts, clients["member-0"].assigned_split) == (2, "Push Pull Legs")
+    assert clients["member-0"].fitness_goal == "cut"
+    assert (clients["member-1"].status, clients["member-1"].last_seen) == ("A Rischio", "10 days ago")
+    assert (clients["member-2"].last_seen, clients["member-2"].upcoming_workouts) == ("Never", 0)
+    assert (data.active_clients, data.at_risk_clients) == (1, 3)
+    # Nothing per client or per day of streak
+    assert len([s for s in statements if s.startswith("SELECT")]) < 12
+
+    wider = UserService().get_trainer("coach", day(-400), day(-1))
+    assert min(e.date for e in wider.schedule) >= day(-400) and max(e.date for e in wider.schedule) <= day(-1)
+
+
+def test_delta_sync_returns_only_changed_entries(trainer):
+    db = TestingSessionLocal()
+    start, end = day(-30), day(90)
+    first = get_schedule(db, "coach", start, end)
+    assert first["full"] and len(first["entries"]) == 30
+
+    # ORM insert, update and delete, a bulk delete, and a change outside the window
+    db.add(TrainerScheduleORM(trainer_id="coach", date=day(2), time="18:00", title="New", type="class"))
+    moved = db.query(TrainerScheduleORM).filter(TrainerScheduleORM.date == day(0), TrainerScheduleORM.type == "class").one()
+    moved.time = "11:00"
+    db.delete(db.query(TrainerScheduleORM).filter(TrainerScheduleORM.date == day(5)).one())
+    db.query(TrainerScheduleORM).filter(TrainerScheduleORM.date == day(10)).delete()
+    gone = db.query(TrainerScheduleORM).filter(TrainerScheduleORM.date == day(15)).one()
+    gone.date = day(300)
+    db.commit()
+
+    delta = get_schedule(db, "coach", start, end, since=first["version"])
+    assert not delta["full"]
+    assert sorted((e["date"], e["time"]) for e in delta["entries"]) == [(day(0), "11:00"), (day(2), "18:00")]
+    assert len(delta["removed"]) == 3
+    assert get_schedule(db, "coach", start, end, since=delta["version"])["entries"] == []
+    db.close()
+
+
+def test_stale_versions_get_the_full_window(trainer):
+    db = TestingSessionLocal()
+    version = get_schedule(db, "coach", day(-30), day(90))["version"]
+
+    # A transaction that took seq 100 but committed after seq 191 was read: the version is stale
+    db.query(TrainerScheduleChangeORM).filter(TrainerScheduleChangeORM.seq == 100).delete()
+    db.commit()
+    before_late_commit = get_schedule(db, "coach", day(-30), day(90))["version"]
+    db.add(TrainerScheduleChangeORM(seq=100, trainer_id="coach", entry_id=100))
+    db.commit()
+    assert get_schedule(db, "coach", day(-30), day(90), since=before_late_commit)["full"]
+    assert not get_schedule(db, "coach", day(-30), day(90), since=version)["full"]
+    assert get_schedule(db, "coach", day(-30), day(90), since="garbage")["full"]
+
+    # Pruned history does too
+    db.query(TrainerScheduleChangeORM).update({"changed_at": "2000-01-01T00:00:00"})
+    db.commit()
+    assert prune_schedule_changes() == 190  # The newest change is kept
+    assert get_schedule(db, "coach", day(-30), day(90), since=version)["full"]
+    assert get_schedule(db, "coach", day(-30), day(90), since="0.0")["full"]
+
+    # A trainer with nothing logged starts at the log's end and gets deltas from the first change
+    db.add(UserORM(id="new-coach", username="new_coach", role="trainer"))
+    db.commit()
+    empty = get_schedule(db, "new-coach", day(-30), day(90))
+    assert (empty["version"], empty["entries"]) == ("191.0", [])
+    db.add(TrainerScheduleORM(trainer_id="new-coach", date=day(1), time="10:00", title="First", type="class"))
+    db.commit()
+    delta = get_schedule(db, "new-coach", day(-30), day(90), since=empty["version"])
+    assert not delta["full"] and [e["title"] for e in delta["entries"]] == ["First"]
+    db.close()
+
+
+def test_dashboard_etag(trainer):
+    data = UserService().get_trainer("coach")
+    first = etag_json(Request({"type": "http", "headers": []}), data)
+    etag = first.headers["etag"]
+    request = Request({"type": "http", "headers": [(b"if-none-match", etag.encode())]})
+    assert etag_json(request, data).status_code == 304
+    data.streak += 1
+    assert etag_json(request, data).status_code == 200
@@ -0,0 +1,141 @@
+import asyncio
+import email
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models_orm import UserORM
+import service_modules.email_service as email_module
+import service_modules.message_dispatch_service as dispatch_module
+import service_modules.smtp_delivery as delivery_module
+from service_modules.email_service import EmailService
+from service_modules.message_dispatch_service import MessageDispatchService
+from service_modules.smtp_delivery import EmailQueue, SmtpPool
+from smtp_standin import SmtpStandin
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def standin(monkeypatch):
+    server = SmtpStandin(password="gym-secret").start()
+    monkeypatch.setattr(email_module, "_tls_context", server.client_context)
+    monkeypatch.setattr(delivery_module, "email_queue", EmailQueue(SmtpPool(), senders=3, backoff=0.01))
+    yield server
+    delivery_module.email_queue.pool.close_all()
+    server.stop()
+
+
+def _service(standin, **kwargs):
+    return EmailService(smtp_host="127.0.0.1", smtp_port=standin.port, smtp_user="gym@example.com",
+                        smtp_password="gym-secret", from_name="Iron Temple", **kwargs)
+
+
+def test_messages_share_one_pooled_session(standin):
+    service = _service(standin)
+    results = service.send_many([(f"member{i}@example.com", f"Hi {i}", f"<p>Message {i}</p>") for i in range(30)])
+    assert results == [True] * 30
+    # A new EmailService for the same account reuses the session too
+    assert _service(standin).send_email("late@example.com", "Hi", "<p>Hello</p>")
+    assert standin.stats == {"connections": 1, "tls_handshakes": 1, "logins": 1, "messages": 31}
+    assert standin.received[0]["to"] == ["member0@example.com"]
+    assert "From: Iron Temple <gym@example.com>" in standin.received[0]["data"]
+
+    # Wrong credentials are another account: its own session, refused at login
+    assert EmailService(smtp_host="127.0.0.1", smtp_port=standin.port, smtp_user="gym@example.com",
+                        smtp_password="wrong").send_email("x@example.com", "Hi", "Hi") is False
+    assert standin.stats["logins"] == 1
+
+
+def test_temporary_failures_are_retried_and_dropped_sessions_replaced(standin):
+    service = _service(standin)
+    assert service.send_many([
+        ("tempfail@example.com", "Hi", "Hi"),
+        ("reject@example.com", "Hi", "Hi"),
+        ("ok@example.com", "Hi", "Hi"),
+    ]) == [True, False, True]
+    assert [m["to"] for m in standin.received] == [["tempfail@example.com"], ["ok@example.com"]]
+
+    # The server closed the idle session: the next message goes out on a new one
+    standin.drop_connections()
+    assert service.send_email("after-drop@example.com", "Hi", "Hi")
+    assert standin.stats["connections"] == 2
+
+
+def test_queue_sends_batches_from_worker_threads(standin):
+    service = _service(standin)
+    queue = delivery_module.email_queue
+
+    async def run():
+        await queue.start()
+        try:
+            emails = [(f"member{i}@example.com", "Hi", "Hi") for i in range(40)] + [("tempfail@example.com", "Hi", "Hi")]
+            return await asyncio.to_thread(service.send_many, emails)
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(run()) == [True] * 41
+    assert standin.stats["messages"] == 41
+    assert standin.stats["connections"] <= 3
+    assert not queue.running
+
+
+def test_queue_never_blocks_the_event_loop(standin):
+    service = _service(standin)
+    queue = delivery_module.email_queue
+
+    async def run():
+        await queue.start()
+        try:
+            # Called on the loop: the messages are queued, the loop keeps running
+            assert service.send_many([("tempfail@example.com", "Hi", "Hi"), ("anna@example.com", "Hi", "Hi")]) == [True, True]
+            assert standin.stats["messages"] == 0
+            await asyncio.sleep(0.2)
+        finally:
+            await queue.stop()
+
+    asyncio.run(run())
+    assert standin.stats["messages"] == 2
+
+
+def test_dispatch_batches_recipients_and_renders_branding(standin, monkeypatch):
+    monkeypatch.setattr(dispatch_module, "get_db_session", TestingSessionLocal)
+    for table in reversed(Base.metadata.sorted_tables):
+        with engine.begin() as conn:
+            conn.execute(table.delete())
+    db = TestingSessionLocal()
+    db.add(UserORM(id="owner", username="owner", role="owner", gym_name="Iron Temple", smtp_host="127.0.0.1",
+                   smtp_port=standin.port, smtp_user="gym@example.com", smtp_password="gym-secret"))
+    db.add(UserORM(id="anna", username="anna", role="client", email="anna@example.com"))
+    db.add(UserORM(id="marco", username="marco", role="client", email="marco@example.com"))
+    db.add(UserORM(id="no-email", username="nomail", role="client"))
+    db.commit()
+    db.close()
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        results = MessageDispatchService().send_emails([
+            ("anna", "Ci manchi!", "Torna in palestra"),
+            ("no-email", "Ci manchi!", "Torna in palestra"),
+            ("marco", "Ci manchi!", "Torna in palestra"),
+        ], gym_id="owner")
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert results == [True, False, True]
+    # Recipients and the gym owner, once for the whole batch
+    assert len(statements) == 2
+    assert [m["to"] for m in standin.received] == [["anna@example.com"], ["marco@example.com"]]
+    html = email.message_from_string(standin.received[0]["data"]).get_payload()[-1].get_payload(decode=True).decode()
+    assert "Torna in palestra" in html and "inviata automaticamente da Iron Temple" in html
+    assert standin.stats["connections"] == 1
@@ -0,0 +1,44 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sockets import ConnectionManager, MemoryPresenceRegistry
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+
+def test_send_to_user_routes_across_workers():
+    async def scenario():
+        presence = MemoryPresenceRegistry()
+        worker_a = ConnectionManager(worker_id="worker-a", presence=presence)
+        worker_b = ConnectionManager(worker_id="worker-b", presence=presence)
+
+        ws = FakeWebSocket()
+        await worker_b.connect(ws, "user-1")
+        await worker_a.start()
+
+        assert await worker_a.is_user_online("user-1")
+        assert await worker_a.send_to_user("user-1", {"type": "coop_invite"})
+        for _ in range(20):
+            if ws.sent:
+                break
+            await asyncio.sleep(0.01)
+        assert ws.sent == [{"type": "coop_invite"}]
+
+        worker_b.disconnect(ws)
+        await asyncio.sleep(0.01)
+        assert not await worker_a.is_user_online("user-1")
+        assert not await worker_a.send_to_user("user-1", {"type": "coop_invite"})
+
+    asyncio.run(scenario())
@@ -0,0 +1,63 @@
+import gzip
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from static_assets import AssetManifest, AssetStaticFiles, IMMUTABLE_CACHE, REVALIDATE_CACHE
+
+
+def _client(tmp_path):
+    static_dir = tmp_path / "static"
+    (static_dir / "js").mkdir(parents=True)
+    (static_dir / "js" / "app.js").write_text("console.log('gym');\n" * 200)
+    (static_dir / "clip.mp4").write_bytes(bytes(range(256)) * 8)
+    manifest = AssetManifest(str(static_dir), str(tmp_path / "build"), watch=False)
+    manifest.build()
+    app = FastAPI()
+    app.mount("/static", AssetStaticFiles(directory=str(static_dir), manifest=manifest), name="static")
+    return TestClient(app), manifest, static_dir
+
+
+def test_fingerprinted_assets_are_immutable_and_precompressed(tmp_path):
+    client, manifest, static_dir = _client(tmp_path)
+    url = manifest.url("js/app.js")
+    assert url.startswith("/static/js/app.") and url != "/static/js/app.js"
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < os.path.getsize(static_dir / "js" / "app.js")
+    assert response.text == (static_dir / "js" / "app.js").read_text()  # httpx decodes gzip
+
+    etag = response.headers["etag"]
+    assert client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+
+    plain = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers and plain.headers["etag"] != etag
+
+    # Editing the file changes its URL
+    (static_dir / "js" / "app.js").write_text("console.log('v2');\n" * 200)
+    manifest.build()
+    assert manifest.url("js/app.js") != url
+    assert gzip.decompress(open(manifest.assets[manifest.urls["js/app.js"]]["variants"]["gzip"], "rb").read()) \
+        == (static_dir / "js" / "app.js").read_bytes()
+
+
+def test_range_requests_and_plain_paths(tmp_path):
+    client, manifest, static_dir = _client(tmp_path)
+    data = (static_dir / "clip.mp4").read_bytes()
+
+    ranged = client.get(manifest.url("clip.mp4"), headers={"Range": "bytes=100-199"})
+    assert ranged.status_code == 206 and ranged.content == data[100:200]
+    assert ranged.headers["cache-control"] == IMMUTABLE_CACHE
+
+    plain = client.get("/static/clip.mp4")
+    assert plain.status_code == 200 and plain.headers["cache-control"] == REVALIDATE_CACHE
+    assert client.get("/static/clip.mp4", headers={"If-None-Match": plain.headers["etag"]}).status_code == 304
+    assert client.get("/static/js/app.0123456789ab.js").status_code == 404